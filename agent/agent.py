@@ -1,14 +1,21 @@
-from typing import List
+from typing import Dict, List
+from contextlib import asynccontextmanager
+from autogen_core import CancellationToken
 from autogen_agentchat.agents import AssistantAgent
 from autogen_ext.models.openai import OpenAIChatCompletionClient
+from agent.llm_cache import CachedChatCompletionClient, SQLiteResponseStore
+from agent.llm_client import RateLimitedChatCompletionClient, create_http_client
 # from autogen_ext.models.ollama import OllamaChatCompletionClient
 
 # ------------------ 智能体配置 ------------------
+# 所有智能体共享同一个keep-alive连接池；重试由RateLimitedChatCompletionClient统一处理，这里关闭SDK自带重试
 model_client = OpenAIChatCompletionClient(
     model="",
     base_url="",
     api_key="",
     parallel_tool_calls=False,
+    http_client=create_http_client(),
+    max_retries=0,
     model_info={
         "vision": False,
         "function_calling": True,
@@ -27,10 +34,45 @@ model_client = OpenAIChatCompletionClient(
 #     },
 # )
 
-logs_agent = AssistantAgent(
+# ------------------ 响应缓存配置 ------------------
+# 按智能体开关响应缓存：数据提炼类智能体的输入可复现，默认开启；诊断链路智能体默认关闭，避免重跑时复用失败的推理结果
+LLM_CACHE_ENABLED = {
+    "LogsAgent": True,
+    "MetricsAgent": True,
+    "TracesAgent": True,
+    "OrchestrationAgent": False,
+    "ADAgent": False,
+    "FTAgent": False,
+    "RCLAgent": False,
+    "ReflectionAgent": False,
+    "summarizationAgent": False,
+}
+
+response_store = SQLiteResponseStore()
+_agent_model_clients: Dict[str, CachedChatCompletionClient] = {}
+
+def get_model_client(agent_name: str) -> CachedChatCompletionClient:
+    """
+    获取指定智能体使用的model_client，所有智能体共享同一个底层client、缓存存储、限流器和并发信号量，
+    缓存命中率、延迟和token用量按智能体分别统计（缓存命中不占用限流配额）。
+    model_client本身不保存对话历史，同名智能体的不同实例复用同一个包装器
+
+    参数:
+        agent_name: 智能体名称
+
+    返回:
+        CachedChatCompletionClient: 包装后的model_client
+    """
+    if agent_name not in _agent_model_clients:
+        rate_limited_client = RateLimitedChatCompletionClient(model_client, agent_name=agent_name)
+        _agent_model_clients[agent_name] = CachedChatCompletionClient(
+            rate_limited_client, store=response_store, enabled=LLM_CACHE_ENABLED.get(agent_name, False)
+        )
+    return _agent_model_clients[agent_name]
+
+logs_agent_config = dict(
     name="LogsAgent",
     description="一个专注于处理海量日志（Logs）数据的智能体，通过自然语言理解，从日志中提炼出关键事件日志。",
-    model_client=model_client,
     system_message="""
     你是一个专注于处理微服务智能运维中Logs（日志）数据的专业智能体。 你的核心职责是： 
     1. 接收和处理传入的Logs数据流，这些Logs已经经过时间对齐，error过滤和聚类处理。 
@@ -54,10 +96,9 @@ logs_agent = AssistantAgent(
 #     """
 # )
 
-metrics_agent = AssistantAgent(
+metrics_agent_config = dict(
     name="MetricsAgent",
     description="一个专注于处理指标数据（Metrics）的智能体，负责对比分析指标数据在正常期间与异常期间的统计特征，保留指标数据中的关键条目。",
-    model_client=model_client,
     system_message="""
     你是一个专注于处理微服务智能运维中Metrics（指标）数据的专业智能体。 你的核心职责是： 
     1. 接收和处理传入的Metrics统计数据流，这些Metrics已经经过时间对齐和统计分析。 
@@ -71,10 +112,9 @@ metrics_agent = AssistantAgent(
     """
 )
 
-traces_agent = AssistantAgent(
+traces_agent_config = dict(
     name="TracesAgent",
     description="一个专注于处理分布式系统调用轨迹（Traces）数据的智能体，负责从轨迹中提取关键调用路径和异常调用。",
-    model_client=model_client,
     system_message="""
     你是一个专注于处理微服务智能运维中Traces（分布式系统调用轨迹）数据的专业智能体。 你的核心职责是： 
     1. 接收和处理传入的Traces调用轨迹数据流，这些Traces已经经过时间对齐和聚类处理。 
@@ -87,10 +127,9 @@ traces_agent = AssistantAgent(
     """
 )
 
-orchestration_agent = AssistantAgent(
+orchestration_agent_config = dict(
     name="OrchestrationAgent",
     description="整个微服务智能运维流程的核心调度者和全局控制者。负责任务编排、子智能体调用和全局状态监控。你应当是第一个发言人。",
-    model_client=model_client,
     system_message="""
     你是一个在微服务智能运维系统中扮演核心任务编排、数据融合与全局控制角色的智能体。你的主要目标是驱动整个智能运维流程，确保高效、准确地完成异常检测、故障分类和根因定位。 核心职责与工作流：
     1. 数据融合：
@@ -154,10 +193,9 @@ orchestration_agent = AssistantAgent(
 #     所有字段名建议使用 snake_case 命名风格，避免大小写混用。
 # """
 
-ad_agent = AssistantAgent(
+ad_agent_config = dict(
     name="ADAgent",
     description="负责基于提炼后的多源数据，执行精确的异常检测，判断当前系统是否处于异常状态。",
-    model_client=model_client,
     system_message="""
     你是一个专注于微服务智能运维中异常检测 (Anomaly Detection, AD) 的专业智能体。你是整个故障诊断链条的第一步执行者。核心职责与工作流：
     1.  接收输入：接收来自 Orchestration智能体融合后的 Metrics、Logs 和 Traces 关键数据。
@@ -169,10 +207,9 @@ ad_agent = AssistantAgent(
     """
 )
 
-ft_agent = AssistantAgent(
+ft_agent_config = dict(
     name="FTAgent",
     description="负责对异常检测结果进行分类，确定故障的大致范围或类型。",
-    model_client=model_client,
     system_message="""
     你是一个专注于微服务智能运维中故障分类 (Fault Triage, FT) 的专业智能体。你是诊断链条的第二步执行者，并依赖上游结果。核心职责与工作流：
     1.  接收输入：接收：    
@@ -209,10 +246,9 @@ components_list.extend(all_node_names)
 components_list.extend(all_service_names)
 components_list.extend(all_pod_names)
 
-rcl_agent = AssistantAgent(
+rcl_agent_config = dict(
     name="RCLAgent",
     description="负责接收故障分类结果，并结合所有提炼数据，精确锁定导致故障发生的具体微服务组件、资源或配置",
-    model_client=model_client,
     system_message=f"""
     你是一个专注于微服务智能运维中根因定位 (Root Cause Localization, RCL) 的专业智能体。你是诊断链条的最后一步执行者，负责给出最终的诊断结论。核心职责与工作流：
     1.  接收输入：接收：    
@@ -262,10 +298,9 @@ rcl_agent = AssistantAgent(
     """
 )
 
-reflection_agent = AssistantAgent(
+reflection_agent_config = dict(
     name="ReflectionAgent",
     description="负责对整个故障诊断流程（AD、FT、RCL）的最终结果进行反思、评估和总结，并将优化建议反馈给 Orchestration 智能体。",
-    model_client=model_client,
     system_message="""
     你是一个在微服务智能运维系统中扮演结果校验、逻辑反思与流程优化角色的专业智能体。你的核心目标是克服大模型可能存在的“幻觉”缺陷，确保整个诊断流程（AD、FT、RCL）的最终输出是准确、一致且逻辑连贯的。 核心职责与工作流：
     1. 接收输入：接收来自 AD智能体、FT智能体和 RCL智能体的所有输出，包括： 
@@ -285,10 +320,9 @@ reflection_agent = AssistantAgent(
     """
 )
 
-summarization_agent = AssistantAgent(
+summarization_agent_config = dict(
     name="summarizationAgent",
     description="负责对整个故障诊断流程（AD、FT、RCL）的最终结果进行总结，生成最终的诊断结论。",
-    model_client=model_client,
     system_message=f"""
     你是一个在微服务智能运维系统中扮演结果总结与最终输出角色的专业智能体。你的核心目标是将整个故障诊断流程（AD、FT、RCL）的最终结果进行总结，生成一个清晰、准确且逻辑连贯的诊断结论。 核心职责与工作流：
     1. 接收输入：接收来自 Reflection智能体的所有输出，包括： 
@@ -323,4 +357,72 @@ summarization_agent = AssistantAgent(
                 ]
             }} 
     """
-)
\ No newline at end of file
+)
+
+AGENT_CONFIGS = {
+    config["name"]: config
+    for config in [
+        logs_agent_config, metrics_agent_config, traces_agent_config,
+        orchestration_agent_config, ad_agent_config, ft_agent_config,
+        rcl_agent_config, reflection_agent_config, summarization_agent_config,
+    ]
+}
+
+# GraphFlow诊断链路中的智能体，按图中的顺序排列
+DIAGNOSIS_AGENT_NAMES = ["OrchestrationAgent", "ADAgent", "FTAgent", "RCLAgent", "ReflectionAgent", "summarizationAgent"]
+
+# ------------------ 智能体工厂 ------------------
+def create_agent(agent_name: str) -> AssistantAgent:
+    """
+    创建一个全新的、无历史上下文的智能体实例，每个故障/任务单独使用，避免对话上下文跨故障累积
+
+    参数:
+        agent_name: 智能体名称，必须是AGENT_CONFIGS中的键
+
+    返回:
+        AssistantAgent: 新建的智能体
+    """
+    if agent_name not in AGENT_CONFIGS:
+        raise ValueError(f"未知的智能体名称: {agent_name}")
+    return AssistantAgent(model_client=get_model_client(agent_name), **AGENT_CONFIGS[agent_name])
+
+
+def create_diagnosis_agents() -> Dict[str, AssistantAgent]:
+    """
+    为一个故障创建一组独立的诊断链路智能体
+
+    返回:
+        Dict[str, AssistantAgent]: 智能体名称到实例的映射，按DIAGNOSIS_AGENT_NAMES排序
+    """
+    return {agent_name: create_agent(agent_name) for agent_name in DIAGNOSIS_AGENT_NAMES}
+
+
+class AgentPool:
+    """
+    可选的智能体池：复用已创建的智能体实例，归还时清空其对话上下文，保证每次借出都是无状态的
+    """
+
+    def __init__(self, max_idle_per_agent: int = 4):
+        """
+        参数:
+            max_idle_per_agent: 每种智能体最多保留的空闲实例数
+        """
+        self.max_idle_per_agent = max_idle_per_agent
+        self._idle: Dict[str, List[AssistantAgent]] = {}
+
+    @asynccontextmanager
+    async def acquire(self, agent_name: str):
+        """
+        借出一个智能体实例，退出上下文时重置并归还
+
+        参数:
+            agent_name: 智能体名称
+        """
+        idle_agents = self._idle.setdefault(agent_name, [])
+        agent = idle_agents.pop() if idle_agents else create_agent(agent_name)
+        try:
+            yield agent
+        finally:
+            await agent.on_reset(CancellationToken())
+            if len(idle_agents) < self.max_idle_per_agent:
+                idle_agents.append(agent)
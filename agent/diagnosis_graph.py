@@ -0,0 +1,191 @@
+"""
+诊断团队的图拓扑定义与团队池
+
+图拓扑以声明式配置定义、只编译一次；每个故障从团队池中借出一个已构建好的GraphFlow实例，
+归还时重置其状态，支持多个故障并发处理
+"""
+import time
+import asyncio
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Callable, Dict, List, NamedTuple, Optional
+
+from autogen_agentchat.agents import AssistantAgent
+from autogen_agentchat.base import TerminationCondition
+from autogen_agentchat.conditions import MaxMessageTermination
+from autogen_agentchat.messages import BaseChatMessage
+from autogen_agentchat.teams import DiGraph, DiGraphBuilder, DiGraphEdge, DiGraphNode, GraphFlow
+
+from agent.agent import DIAGNOSIS_AGENT_NAMES, create_diagnosis_agents
+from agent.team_runner import create_termination_condition
+
+
+def _is_approved(message: BaseChatMessage) -> bool:
+    return "APPROVE" in message.to_model_text()
+
+
+def _is_not_approved(message: BaseChatMessage) -> bool:
+    return "APPROVE" not in message.to_model_text()
+
+
+# 边上可引用的条件函数
+EDGE_CONDITIONS: Dict[str, Callable[[BaseChatMessage], bool]] = {
+    "approved": _is_approved,
+    "not_approved": _is_not_approved,
+}
+
+# 诊断链路的声明式图拓扑：编排 -> AD -> FT -> RCL -> 反思 -> (编排 | 总结)
+DIAGNOSIS_GRAPH_CONFIG = {
+    "entry_point": "OrchestrationAgent",
+    "nodes": DIAGNOSIS_AGENT_NAMES,
+    "edges": [
+        {"source": "OrchestrationAgent", "target": "ADAgent"},
+        {"source": "OrchestrationAgent", "target": "FTAgent"},
+        {"source": "ADAgent", "target": "FTAgent"},
+        {"source": "OrchestrationAgent", "target": "RCLAgent"},
+        {"source": "FTAgent", "target": "RCLAgent"},
+        {"source": "ADAgent", "target": "ReflectionAgent"},
+        {"source": "FTAgent", "target": "ReflectionAgent"},
+        {"source": "RCLAgent", "target": "ReflectionAgent"},
+        {"source": "ReflectionAgent", "target": "OrchestrationAgent", "condition": "not_approved"},
+        {"source": "ReflectionAgent", "target": "summarizationAgent", "condition": "approved"},
+    ],
+}
+
+
+@lru_cache(maxsize=1)
+def compile_diagnosis_graph() -> DiGraph:
+    """
+    按DIAGNOSIS_GRAPH_CONFIG编译诊断图，整个进程只编译一次；图只按智能体名称引用节点，可被多个团队实例共享
+
+    返回:
+        DiGraph: 校验通过的诊断图
+    """
+    nodes = {name: DiGraphNode(name=name, edges=[]) for name in DIAGNOSIS_GRAPH_CONFIG["nodes"]}
+    for edge in DIAGNOSIS_GRAPH_CONFIG["edges"]:
+        condition = edge.get("condition")
+        nodes[edge["source"]].edges.append(
+            DiGraphEdge(target=edge["target"], condition=EDGE_CONDITIONS[condition] if condition else None)
+        )
+    graph = DiGraph(nodes=nodes, default_start_node=DIAGNOSIS_GRAPH_CONFIG["entry_point"])
+    graph.graph_validate()
+    return graph
+
+
+class DiagnosisTeam(NamedTuple):
+    """
+    一个可复用的诊断团队实例及其智能体
+    """
+    team: GraphFlow
+    agents: Dict[str, AssistantAgent]
+
+
+def create_diagnosis_team(termination_factory: Callable[[], TerminationCondition] = create_termination_condition) -> DiagnosisTeam:
+    """
+    使用已编译的诊断图和一组新的智能体创建团队
+
+    参数:
+        termination_factory: 终止条件工厂，终止条件有状态，每个团队单独创建
+
+    返回:
+        DiagnosisTeam: 团队实例及其智能体
+    """
+    agents = create_diagnosis_agents()
+    team = GraphFlow(
+        participants=[agents[name] for name in DIAGNOSIS_AGENT_NAMES],
+        graph=compile_diagnosis_graph(),
+        termination_condition=termination_factory(),
+    )
+    return DiagnosisTeam(team=team, agents=agents)
+
+
+class DiagnosisTeamPool:
+    """
+    诊断团队池：按需创建至多max_size个团队，借出时复用空闲团队，归还时重置团队状态和智能体上下文
+    """
+
+    def __init__(self, max_size: int = 4, termination_factory: Callable[[], TerminationCondition] = create_termination_condition):
+        """
+        参数:
+            max_size: 团队实例数上限，即最大并发故障数
+            termination_factory: 终止条件工厂
+        """
+        self.max_size = max_size
+        self.termination_factory = termination_factory
+        self._idle: List[DiagnosisTeam] = []
+        self._created = 0
+        self._condition: Optional[asyncio.Condition] = None
+
+    @asynccontextmanager
+    async def acquire(self):
+        """
+        借出一个诊断团队，退出上下文时重置并归还
+        """
+        if self._condition is None:
+            self._condition = asyncio.Condition()
+        async with self._condition:
+            while not self._idle and self._created >= self.max_size:
+                await self._condition.wait()
+            if self._idle:
+                diagnosis_team = self._idle.pop()
+            else:
+                diagnosis_team = create_diagnosis_team(self.termination_factory)
+                self._created += 1
+        try:
+            yield diagnosis_team
+        finally:
+            await diagnosis_team.team.reset()
+            async with self._condition:
+                self._idle.append(diagnosis_team)
+                self._condition.notify()
+
+
+def _build_team_per_fault() -> GraphFlow:
+    """
+    复用前的做法：每个故障都重新创建智能体、逐条添加边并编译图，仅用于开销对比
+    """
+    agents = create_diagnosis_agents()
+    builder = DiGraphBuilder()
+    for name in DIAGNOSIS_AGENT_NAMES:
+        builder.add_node(agents[name])
+    for edge in DIAGNOSIS_GRAPH_CONFIG["edges"]:
+        condition = edge.get("condition")
+        builder.add_edge(agents[edge["source"]], agents[edge["target"]], condition=EDGE_CONDITIONS[condition] if condition else None)
+    builder.set_entry_point(agents[DIAGNOSIS_GRAPH_CONFIG["entry_point"]])
+    return GraphFlow(
+        participants=[agents[name] for name in DIAGNOSIS_AGENT_NAMES],
+        graph=builder.build(),
+        termination_condition=MaxMessageTermination(max_messages=20),
+    )
+
+
+async def benchmark_team_setup(rounds: int = 50) -> Dict[str, float]:
+    """
+    对比每个故障重新构建团队与从团队池借出团队的准备开销
+
+    参数:
+        rounds: 模拟的故障数
+
+    返回:
+        Dict[str, float]: 两种方式的平均每故障准备耗时（毫秒）
+    """
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        team = _build_team_per_fault()
+        await team.reset()
+    rebuild_ms = (time.perf_counter() - start_time) * 1000 / rounds
+
+    pool = DiagnosisTeamPool(max_size=1)
+    start_time = time.perf_counter()
+    for _ in range(rounds):
+        async with pool.acquire():
+            pass
+    pooled_ms = (time.perf_counter() - start_time) * 1000 / rounds
+
+    print(f"每故障重新构建团队: {rebuild_ms:.2f}毫秒/故障")
+    print(f"从团队池借出团队: {pooled_ms:.2f}毫秒/故障")
+    return {'rebuild_ms': rebuild_ms, 'pooled_ms': pooled_ms}
+
+
+if __name__ == '__main__':
+    asyncio.run(benchmark_team_setup())
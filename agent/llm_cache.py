@@ -0,0 +1,355 @@
+"""
+LLM响应缓存与请求去重模块
+
+对model_client进行包装：相同的(模型, 系统提示, 消息内容)请求直接从SQLite持久化缓存返回，
+并发中的相同请求只向模型发起一次调用，同时统计缓存命中率
+"""
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import asyncio
+import threading
+from typing import Any, AsyncGenerator, Dict, Literal, Mapping, Optional, Sequence, Union
+
+from pydantic import BaseModel
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,
+    ModelInfo,
+    RequestUsage,
+    SystemMessage,
+)
+from autogen_core.tools import Tool, ToolSchema
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ========== 缓存配置 ==========
+CACHE_DB_PATH = os.path.join(project_root, 'cache', 'llm_response_cache.sqlite')  # 缓存数据库路径
+CACHE_TTL_SECONDS = 7 * 24 * 3600  # 缓存有效期（秒）
+CACHE_MAX_ENTRIES = 20000  # 缓存最大条目数，超过后按最近访问时间淘汰
+CACHE_MAX_BYTES = 512 * 1024 * 1024  # 缓存最大字节数，超过后按最近访问时间淘汰
+
+
+def _hash_text(text: str) -> str:
+    """
+    计算字符串的sha256摘要
+    """
+    return hashlib.sha256(text.encode('utf-8')).hexdigest()
+
+
+def _resolve_model_name(client: ChatCompletionClient) -> str:
+    """
+    沿包装链向内查找底层OpenAI client的模型名
+    """
+    while not hasattr(client, '_create_args') and hasattr(client, 'client'):
+        client = client.client
+    return getattr(client, '_create_args', {}).get('model', '')
+
+
+class SQLiteResponseStore:
+    """
+    基于SQLite的LLM响应持久化存储，支持TTL过期和按条目数/字节数的LRU淘汰
+    """
+
+    def __init__(self, db_path: str = CACHE_DB_PATH, ttl_seconds: Optional[float] = CACHE_TTL_SECONDS,
+                 max_entries: Optional[int] = CACHE_MAX_ENTRIES, max_bytes: Optional[int] = CACHE_MAX_BYTES):
+        """
+        参数:
+            db_path: SQLite数据库文件路径，传入':memory:'时使用内存数据库
+            ttl_seconds: 条目有效期（秒），为None则永不过期
+            max_entries: 最大条目数，为None则不限制
+            max_bytes: 最大字节数，为None则不限制
+        """
+        if db_path != ':memory:':
+            os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self.db_path = db_path
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(db_path, check_same_thread=False)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute("""
+            CREATE TABLE IF NOT EXISTS responses (
+                cache_key TEXT PRIMARY KEY,
+                model TEXT,
+                system_hash TEXT,
+                messages_hash TEXT,
+                value TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                created_at REAL NOT NULL,
+                last_access REAL NOT NULL
+            )
+        """)
+        self._conn.execute('CREATE INDEX IF NOT EXISTS idx_responses_last_access ON responses(last_access)')
+        self._conn.commit()
+
+    def get(self, cache_key: str) -> Optional[str]:
+        """
+        读取缓存条目，过期条目视为未命中并删除
+
+        返回:
+            str: 序列化后的CreateResult，未命中返回None
+        """
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                'SELECT value, created_at FROM responses WHERE cache_key = ?', (cache_key,)
+            ).fetchone()
+            if row is None:
+                return None
+            value, created_at = row
+            if self.ttl_seconds is not None and now - created_at > self.ttl_seconds:
+                self._conn.execute('DELETE FROM responses WHERE cache_key = ?', (cache_key,))
+                self._conn.commit()
+                return None
+            self._conn.execute('UPDATE responses SET last_access = ? WHERE cache_key = ?', (now, cache_key))
+            self._conn.commit()
+            return value
+
+    def set(self, cache_key: str, value: str, model: str = '', system_hash: str = '', messages_hash: str = '') -> None:
+        """
+        写入缓存条目并执行淘汰
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                'INSERT OR REPLACE INTO responses VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                (cache_key, model, system_hash, messages_hash, value, len(value.encode('utf-8')), now, now)
+            )
+            self._evict(now)
+            self._conn.commit()
+
+    def _evict(self, now: float) -> None:
+        """
+        删除过期条目，并按最近访问时间淘汰超出条目数/字节数上限的条目（调用方持有锁）
+        """
+        if self.ttl_seconds is not None:
+            self._conn.execute('DELETE FROM responses WHERE created_at < ?', (now - self.ttl_seconds,))
+
+        if self.max_entries is not None:
+            self._conn.execute("""
+                DELETE FROM responses WHERE cache_key IN (
+                    SELECT cache_key FROM responses ORDER BY last_access DESC LIMIT -1 OFFSET ?
+                )
+            """, (self.max_entries,))
+
+        if self.max_bytes is not None:
+            total_bytes = self._conn.execute('SELECT COALESCE(SUM(size), 0) FROM responses').fetchone()[0]
+            if total_bytes > self.max_bytes:
+                rows = self._conn.execute('SELECT cache_key, size FROM responses ORDER BY last_access ASC').fetchall()
+                to_delete = []
+                for cache_key, size in rows:
+                    if total_bytes <= self.max_bytes:
+                        break
+                    to_delete.append((cache_key,))
+                    total_bytes -= size
+                self._conn.executemany('DELETE FROM responses WHERE cache_key = ?', to_delete)
+
+    def clear(self) -> None:
+        """
+        清空缓存
+        """
+        with self._lock:
+            self._conn.execute('DELETE FROM responses')
+            self._conn.commit()
+
+    def __len__(self) -> int:
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM responses').fetchone()[0]
+
+
+class CachedChatCompletionClient(ChatCompletionClient):
+    """
+    带缓存和在途请求合并的ChatCompletionClient包装器
+
+    缓存键由模型名、系统提示摘要和其余消息摘要（以及tools/tool_choice/json_output/额外参数）组成。
+    enabled为False时直接透传到底层client，便于按智能体开关缓存。
+    """
+
+    def __init__(self, client: ChatCompletionClient, store: Optional[SQLiteResponseStore] = None,
+                 enabled: bool = True, model: Optional[str] = None):
+        """
+        参数:
+            client: 被包装的底层ChatCompletionClient
+            store: 响应存储，为None时使用默认路径的SQLite存储
+            enabled: 是否启用缓存
+            model: 参与缓存键计算的模型名，为None时从client的创建参数中读取
+        """
+        self.client = client
+        self.store = store if store is not None else SQLiteResponseStore()
+        self.enabled = enabled
+        self.model = model if model is not None else _resolve_model_name(client)
+        self._inflight: Dict[str, asyncio.Future] = {}
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    def _cache_key(self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema],
+                   tool_choice: Tool | Literal["auto", "required", "none"],
+                   json_output: Optional[bool | type[BaseModel]], extra_create_args: Mapping[str, Any]) -> Dict[str, str]:
+        """
+        计算缓存键及其组成部分
+
+        返回:
+            Dict[str, str]: 包含cache_key, model, system_hash, messages_hash的字典
+        """
+        system_text = '\n'.join(m.content for m in messages if isinstance(m, SystemMessage))
+        other_messages = [m.model_dump(mode='json') for m in messages if not isinstance(m, SystemMessage)]
+        if isinstance(json_output, type) and issubclass(json_output, BaseModel):
+            json_output_data = json.dumps(json_output.model_json_schema(), sort_keys=True)
+        else:
+            json_output_data = json_output
+        messages_hash = _hash_text(json.dumps({
+            'messages': other_messages,
+            'tools': [(tool.schema if isinstance(tool, Tool) else tool) for tool in tools],
+            'tool_choice': tool_choice.schema if isinstance(tool_choice, Tool) else tool_choice,
+            'json_output': json_output_data,
+            'extra_create_args': dict(extra_create_args),
+        }, sort_keys=True, ensure_ascii=False, default=str))
+        system_hash = _hash_text(system_text)
+        return {
+            'cache_key': _hash_text(f"{self.model}|{system_hash}|{messages_hash}"),
+            'model': self.model,
+            'system_hash': system_hash,
+            'messages_hash': messages_hash,
+        }
+
+    def _lookup(self, cache_key: str) -> Optional[CreateResult]:
+        """
+        从存储中读取并反序列化缓存结果，反序列化失败视为未命中
+        """
+        value = self.store.get(cache_key)
+        if value is None:
+            return None
+        try:
+            result = CreateResult.model_validate_json(value)
+        except ValueError:
+            return None
+        result.cached = True
+        return result
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        if not self.enabled:
+            return await self.client.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+            )
+
+        key = self._cache_key(messages, tools, tool_choice, json_output, extra_create_args)
+        cache_key = key['cache_key']
+
+        cached_result = self._lookup(cache_key)
+        if cached_result is not None:
+            self.hits += 1
+            return cached_result
+
+        # 相同请求正在进行中，等待其结果而不是重复调用
+        if cache_key in self._inflight:
+            self.coalesced += 1
+            result = await asyncio.shield(self._inflight[cache_key])
+            return result.model_copy(update={'cached': True})
+
+        self.misses += 1
+        future = asyncio.get_running_loop().create_future()
+        self._inflight[cache_key] = future
+        try:
+            result = await self.client.create(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+            )
+            self.store.set(cache_key, result.model_dump_json(), key['model'], key['system_hash'], key['messages_hash'])
+            future.set_result(result)
+            return result
+        except BaseException as e:
+            future.set_exception(e)
+            # 避免无人等待时出现"exception was never retrieved"警告
+            future.exception()
+            raise
+        finally:
+            self._inflight.pop(cache_key, None)
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+
+        async def _generator() -> AsyncGenerator[Union[str, CreateResult], None]:
+            key = self._cache_key(messages, tools, tool_choice, json_output, extra_create_args) if self.enabled else None
+            if key is not None:
+                cached_result = self._lookup(key['cache_key'])
+                if cached_result is not None:
+                    self.hits += 1
+                    if isinstance(cached_result.content, str) and cached_result.content:
+                        yield cached_result.content
+                    yield cached_result
+                    return
+                self.misses += 1
+
+            async for chunk in self.client.create_stream(
+                messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+            ):
+                if key is not None and isinstance(chunk, CreateResult):
+                    self.store.set(key['cache_key'], chunk.model_dump_json(), key['model'], key['system_hash'], key['messages_hash'])
+                yield chunk
+
+        return _generator()
+
+    def cache_stats(self) -> Dict[str, float]:
+        """
+        获取缓存统计信息
+
+        返回:
+            Dict[str, float]: 包含hits, misses, coalesced, hit_rate的字典（合并的请求计为命中）
+        """
+        total = self.hits + self.misses + self.coalesced
+        return {
+            'hits': self.hits,
+            'misses': self.misses,
+            'coalesced': self.coalesced,
+            'hit_rate': round((self.hits + self.coalesced) / total, 4) if total else 0.0,
+        }
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        return self.client.actual_usage()
+
+    def total_usage(self) -> RequestUsage:
+        return self.client.total_usage()
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return self.client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.client.model_info
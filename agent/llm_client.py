@@ -0,0 +1,397 @@
+"""
+LLM客户端限流与并发控制模块
+
+为model_client提供共享的keep-alive HTTP连接池、令牌桶限流（每分钟请求数/每分钟token数）、
+针对429/5xx的抖动重试以及全局并发信号量，并按智能体统计延迟和token用量
+"""
+import time
+import random
+import asyncio
+import weakref
+from dataclasses import dataclass, asdict
+from typing import Any, AsyncGenerator, Dict, Literal, Mapping, Optional, Sequence, Tuple, Union
+
+import httpx
+import openai
+from pydantic import BaseModel
+from autogen_core import CancellationToken
+from autogen_core.models import (
+    ChatCompletionClient,
+    CreateResult,
+    LLMMessage,
+    ModelCapabilities,
+    ModelInfo,
+    RequestUsage,
+)
+from autogen_core.tools import Tool, ToolSchema
+
+from utils.log_util import get_logger
+from utils.span_tracer import span
+
+log = get_logger('llm_client')
+
+# ========== 连接池配置 ==========
+HTTP_MAX_CONNECTIONS = 32  # 连接池最大连接数
+HTTP_MAX_KEEPALIVE_CONNECTIONS = 16  # 最大keep-alive连接数
+HTTP_KEEPALIVE_EXPIRY = 60  # keep-alive连接空闲过期时间（秒）
+HTTP_TIMEOUT_SECONDS = 300  # 单次请求超时时间（秒）
+
+# ========== 限流与重试配置 ==========
+REQUESTS_PER_MINUTE = 60  # 每分钟最大请求数
+TOKENS_PER_MINUTE = 200000  # 每分钟最大token数（提示+生成）
+MAX_CONCURRENT_REQUESTS = 8  # 全局最大并发请求数
+MAX_RETRIES = 5  # 429/5xx/连接错误的最大重试次数
+RETRY_BASE_DELAY = 1.0  # 重试基础等待时间（秒）
+RETRY_MAX_DELAY = 30.0  # 重试最大等待时间（秒）
+RETRYABLE_STATUS_CODES = {408, 409, 429, 500, 502, 503, 504}
+
+
+def create_http_client() -> httpx.AsyncClient:
+    """
+    创建所有智能体共享的keep-alive HTTP连接池
+
+    返回:
+        httpx.AsyncClient: 可传给OpenAIChatCompletionClient的http_client
+    """
+    return openai.DefaultAsyncHttpxClient(
+        limits=httpx.Limits(
+            max_connections=HTTP_MAX_CONNECTIONS,
+            max_keepalive_connections=HTTP_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=HTTP_KEEPALIVE_EXPIRY,
+        ),
+        timeout=httpx.Timeout(HTTP_TIMEOUT_SECONDS, connect=10.0),
+    )
+
+
+class TokenBucket:
+    """
+    异步令牌桶，容量为每分钟配额，按秒匀速补充
+    """
+
+    def __init__(self, per_minute: float):
+        """
+        参数:
+            per_minute: 每分钟允许消耗的令牌数
+        """
+        self.capacity = float(per_minute)
+        self.rate = float(per_minute) / 60.0
+        self.tokens = self.capacity
+        self.updated_at = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate)
+        self.updated_at = now
+
+    async def acquire(self, amount: float = 1.0) -> float:
+        """
+        消耗指定数量的令牌，不足时等待补充；超过桶容量的请求按满桶放行
+
+        返回:
+            float: 本次等待的秒数
+        """
+        amount = min(float(amount), self.capacity)
+        waited = 0.0
+        while True:
+            # 检查与扣减之间没有await，在同一事件循环内是原子的；等待补充时不持有锁，其他请求照常申请
+            self._refill()
+            if self.tokens >= amount:
+                self.tokens -= amount
+                return waited
+            delay = (amount - self.tokens) / self.rate
+            await asyncio.sleep(delay)
+            waited += delay
+
+    def adjust(self, amount: float) -> None:
+        """
+        按实际用量修正令牌余量（amount为正表示补扣，为负表示返还）
+        """
+        self._refill()
+        self.tokens = min(self.capacity, self.tokens - amount)
+
+
+class RateLimiter:
+    """
+    同时约束每分钟请求数和每分钟token数的限流器
+    """
+
+    def __init__(self, requests_per_minute: float = REQUESTS_PER_MINUTE, tokens_per_minute: float = TOKENS_PER_MINUTE):
+        self.request_bucket = TokenBucket(requests_per_minute)
+        self.token_bucket = TokenBucket(tokens_per_minute)
+
+    async def acquire(self, estimated_tokens: int) -> float:
+        """
+        申请一次请求配额和预估的token配额
+
+        返回:
+            float: 因限流等待的秒数
+        """
+        waited = await self.request_bucket.acquire(1)
+        waited += await self.token_bucket.acquire(estimated_tokens)
+        return waited
+
+    def settle(self, estimated_tokens: int, actual_tokens: int) -> None:
+        """
+        请求完成后按实际token用量修正token桶
+        """
+        self.token_bucket.adjust(actual_tokens - estimated_tokens)
+
+
+@dataclass
+class AgentCallMetrics:
+    """
+    单个智能体的调用统计
+    """
+    calls: int = 0
+    failures: int = 0
+    retries: int = 0
+    prompt_tokens: int = 0
+    completion_tokens: int = 0
+    total_latency: float = 0.0
+    max_latency: float = 0.0
+    total_wait: float = 0.0
+
+    def to_dict(self) -> Dict[str, float]:
+        result = asdict(self)
+        result['avg_latency'] = round(self.total_latency / self.calls, 3) if self.calls else 0.0
+        return result
+
+
+# 按智能体统计；限流器和并发信号量按事件循环懒创建（asyncio原语绑定首次使用它的事件循环，不能在导入时创建）
+agent_metrics: Dict[str, AgentCallMetrics] = {}
+_loop_limits: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, Tuple[RateLimiter, asyncio.Semaphore]]" = weakref.WeakKeyDictionary()
+
+
+def _current_loop_limits() -> Tuple[RateLimiter, asyncio.Semaphore]:
+    """
+    当前事件循环共享的限流器和并发信号量，首次使用时创建
+
+    异常:
+        RuntimeError: 不在运行中的事件循环内调用
+    """
+    loop = asyncio.get_running_loop()
+    limits = _loop_limits.get(loop)
+    if limits is None:
+        limits = _loop_limits[loop] = (RateLimiter(), asyncio.Semaphore(MAX_CONCURRENT_REQUESTS))
+    return limits
+
+
+def get_rate_limiter() -> RateLimiter:
+    """
+    获取当前事件循环共享的限流器
+    """
+    return _current_loop_limits()[0]
+
+
+def get_concurrency_semaphore() -> asyncio.Semaphore:
+    """
+    获取当前事件循环共享的并发信号量
+    """
+    return _current_loop_limits()[1]
+
+
+def get_agent_metrics() -> Dict[str, Dict[str, float]]:
+    """
+    获取所有智能体的延迟和token统计
+
+    返回:
+        Dict[str, Dict[str, float]]: 智能体名到统计信息的映射
+    """
+    return {name: metrics.to_dict() for name, metrics in agent_metrics.items()}
+
+
+def _is_retryable(error: Exception) -> bool:
+    """
+    判断异常是否值得重试：429、5xx、超时和连接错误
+    """
+    if isinstance(error, (openai.APITimeoutError, openai.APIConnectionError)):
+        return True
+    if isinstance(error, openai.APIStatusError):
+        return error.status_code in RETRYABLE_STATUS_CODES
+    return False
+
+
+def _retry_delay(error: Exception, attempt: int) -> float:
+    """
+    计算重试等待时间：优先使用服务端Retry-After，否则使用全抖动指数退避
+    """
+    response = getattr(error, 'response', None)
+    if response is not None:
+        retry_after = response.headers.get('retry-after')
+        if retry_after is not None:
+            try:
+                return min(float(retry_after), RETRY_MAX_DELAY)
+            except ValueError:
+                pass
+    return random.uniform(0, min(RETRY_MAX_DELAY, RETRY_BASE_DELAY * (2 ** attempt)))
+
+
+class RateLimitedChatCompletionClient(ChatCompletionClient):
+    """
+    带限流、并发控制和重试的ChatCompletionClient包装器，每个智能体一个实例，
+    共享同一个底层client、限流器和信号量
+    """
+
+    def __init__(self, client: ChatCompletionClient, agent_name: str,
+                 limiter: Optional[RateLimiter] = None, semaphore: Optional[asyncio.Semaphore] = None,
+                 max_retries: int = MAX_RETRIES):
+        """
+        参数:
+            client: 被包装的底层ChatCompletionClient
+            agent_name: 统计用的智能体名称
+            limiter: 限流器，为None时使用当前事件循环共享的限流器
+            semaphore: 并发信号量，为None时使用当前事件循环共享的信号量
+            max_retries: 最大重试次数
+        """
+        self.client = client
+        self.agent_name = agent_name
+        self._limiter = limiter
+        self._semaphore = semaphore
+        self.max_retries = max_retries
+        self.metrics = agent_metrics.setdefault(agent_name, AgentCallMetrics())
+        self._last_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+        self._total_usage = RequestUsage(prompt_tokens=0, completion_tokens=0)
+
+    @property
+    def limiter(self) -> RateLimiter:
+        return self._limiter if self._limiter is not None else get_rate_limiter()
+
+    @property
+    def semaphore(self) -> asyncio.Semaphore:
+        return self._semaphore if self._semaphore is not None else get_concurrency_semaphore()
+
+    def _estimate_tokens(self, messages: Sequence[LLMMessage], tools: Sequence[Tool | ToolSchema]) -> int:
+        """
+        预估请求的提示token数，模型未知时退化为按字符数估算
+        """
+        try:
+            return self.client.count_tokens(messages, tools=tools)
+        except Exception:
+            return sum(len(str(m.content)) for m in messages) // 2
+
+    def _record(self, result: CreateResult, estimated_tokens: int, latency: float) -> None:
+        """
+        记录一次成功调用的用量与延迟
+        """
+        self.metrics.calls += 1
+        self.metrics.prompt_tokens += result.usage.prompt_tokens
+        self.metrics.completion_tokens += result.usage.completion_tokens
+        self.metrics.total_latency += latency
+        self.metrics.max_latency = max(self.metrics.max_latency, latency)
+        self._last_usage = result.usage
+        self._total_usage = RequestUsage(
+            prompt_tokens=self._total_usage.prompt_tokens + result.usage.prompt_tokens,
+            completion_tokens=self._total_usage.completion_tokens + result.usage.completion_tokens,
+        )
+        self.limiter.settle(estimated_tokens, result.usage.prompt_tokens + result.usage.completion_tokens)
+        log.debug("[prompt tokens] {agent}: 提示{prompt}，生成{completion}，耗时{latency:.2f}秒", agent=self.agent_name,
+                  prompt=result.usage.prompt_tokens, completion=result.usage.completion_tokens, latency=latency)
+
+    async def create(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> CreateResult:
+        with span('llm.create', agent=self.agent_name) as record:
+            estimated_tokens = self._estimate_tokens(messages, tools)
+            attempt = 0
+            async with self.semaphore:
+                while True:
+                    self.metrics.total_wait += await self.limiter.acquire(estimated_tokens)
+                    start_time = time.perf_counter()
+                    try:
+                        result = await self.client.create(
+                            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                            extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+                        )
+                    except Exception as e:
+                        if not _is_retryable(e) or attempt >= self.max_retries:
+                            self.metrics.failures += 1
+                            raise
+                        delay = _retry_delay(e, attempt)
+                        attempt += 1
+                        self.metrics.retries += 1
+                        log.info("{agent} 请求失败({error})，{delay:.1f}秒后进行第{attempt}次重试", agent=self.agent_name,
+                                 error=type(e).__name__, delay=delay, attempt=attempt)
+                        await asyncio.sleep(delay)
+                        continue
+                    self._record(result, estimated_tokens, time.perf_counter() - start_time)
+                    record.set(prompt_tokens=result.usage.prompt_tokens, completion_tokens=result.usage.completion_tokens, retries=attempt)
+                    return result
+
+    def create_stream(
+        self,
+        messages: Sequence[LLMMessage],
+        *,
+        tools: Sequence[Tool | ToolSchema] = [],
+        tool_choice: Tool | Literal["auto", "required", "none"] = "auto",
+        json_output: Optional[bool | type[BaseModel]] = None,
+        extra_create_args: Mapping[str, Any] = {},
+        cancellation_token: Optional[CancellationToken] = None,
+    ) -> AsyncGenerator[Union[str, CreateResult], None]:
+
+        async def _generator() -> AsyncGenerator[Union[str, CreateResult], None]:
+            estimated_tokens = self._estimate_tokens(messages, tools)
+            attempt = 0
+            async with self.semaphore:
+                while True:
+                    self.metrics.total_wait += await self.limiter.acquire(estimated_tokens)
+                    start_time = time.perf_counter()
+                    started = False
+                    try:
+                        async for chunk in self.client.create_stream(
+                            messages, tools=tools, tool_choice=tool_choice, json_output=json_output,
+                            extra_create_args=extra_create_args, cancellation_token=cancellation_token,
+                        ):
+                            started = True
+                            if isinstance(chunk, CreateResult):
+                                self._record(chunk, estimated_tokens, time.perf_counter() - start_time)
+                            yield chunk
+                        return
+                    except Exception as e:
+                        # 已经输出过内容的流无法安全重试
+                        if started or not _is_retryable(e) or attempt >= self.max_retries:
+                            self.metrics.failures += 1
+                            raise
+                        delay = _retry_delay(e, attempt)
+                        attempt += 1
+                        self.metrics.retries += 1
+                        log.info("{agent} 流式请求失败({error})，{delay:.1f}秒后进行第{attempt}次重试", agent=self.agent_name,
+                                 error=type(e).__name__, delay=delay, attempt=attempt)
+                        await asyncio.sleep(delay)
+
+        return _generator()
+
+    async def close(self) -> None:
+        await self.client.close()
+
+    def actual_usage(self) -> RequestUsage:
+        """
+        最近一次调用的用量（ChatCompletionClient的约定）
+        """
+        return self._last_usage
+
+    def total_usage(self) -> RequestUsage:
+        """
+        本客户端的累计用量，按智能体名汇总的累计统计见get_agent_metrics()
+        """
+        return self._total_usage
+
+    def count_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.client.count_tokens(messages, tools=tools)
+
+    def remaining_tokens(self, messages: Sequence[LLMMessage], *, tools: Sequence[Tool | ToolSchema] = []) -> int:
+        return self.client.remaining_tokens(messages, tools=tools)
+
+    @property
+    def capabilities(self) -> ModelCapabilities:  # type: ignore
+        return self.client.capabilities
+
+    @property
+    def model_info(self) -> ModelInfo:
+        return self.client.model_info
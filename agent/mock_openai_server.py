@@ -0,0 +1,175 @@
+"""
+本地OpenAI兼容的模拟服务，用于在不访问真实模型的情况下验证限流、重试和并发控制
+
+支持普通请求和 stream=True 的SSE流式请求；可按概率或对前N个请求固定返回429（带Retry-After）/503，
+并记录收到的请求数和同时处理中的最大请求数，供测试断言重试次数和并发上限
+
+用法:
+    python -m agent.mock_openai_server --port 8000 --error-rate 0.2 --latency 0.5
+然后将agent/agent.py中model_client的base_url设置为 http://127.0.0.1:8000/v1
+"""
+import json
+import time
+import random
+import argparse
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import Tuple
+
+
+class MockOpenAIHandler(BaseHTTPRequestHandler):
+    """
+    处理 /v1/chat/completions 请求，按配置注入延迟和429/503错误
+    """
+    latency = 0.0  # 每次请求的模拟延迟（秒）
+    error_rate = 0.0  # 返回429/503错误的概率
+    fail_first = 0  # 前N个请求固定返回429
+    retry_after = '0.1'  # 429响应的Retry-After头
+    reply = '[]'  # 固定的回复内容
+    request_count = 0
+    in_flight = 0
+    max_in_flight = 0
+    _count_lock = threading.Lock()
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict, headers: dict = None) -> None:
+        body = json.dumps(payload).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.end_headers()
+        self.wfile.write(body)
+
+    def _send_stream(self, request: dict, request_id: str, usage: dict) -> None:
+        """
+        以SSE格式分块返回回复内容，请求带 stream_options.include_usage 时最后附加用量块
+        """
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/event-stream')
+        self.send_header('Cache-Control', 'no-cache')
+        self.end_headers()
+
+        def chunk(delta: dict, finish_reason=None) -> dict:
+            return {'id': request_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                    'model': request.get('model', 'mock'),
+                    'choices': [{'index': 0, 'delta': delta, 'finish_reason': finish_reason}]}
+
+        events = [chunk({'role': 'assistant', 'content': ''})]
+        events += [chunk({'content': self.reply[i:i + 8]}) for i in range(0, len(self.reply), 8)]
+        events.append(chunk({}, 'stop'))
+        if (request.get('stream_options') or {}).get('include_usage'):
+            events.append({'id': request_id, 'object': 'chat.completion.chunk', 'created': int(time.time()),
+                           'model': request.get('model', 'mock'), 'choices': [], 'usage': usage})
+        for event in events:
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode('utf-8'))
+            self.wfile.flush()
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def do_POST(self):
+        length = int(self.headers.get('Content-Length', 0))
+        request = json.loads(self.rfile.read(length) or b'{}')
+        cls = type(self)
+        with MockOpenAIHandler._count_lock:
+            cls.request_count += 1
+            request_number = cls.request_count
+            cls.in_flight += 1
+            cls.max_in_flight = max(cls.max_in_flight, cls.in_flight)
+        try:
+            self._handle(request, request_number)
+        finally:
+            with MockOpenAIHandler._count_lock:
+                cls.in_flight -= 1
+
+    def _handle(self, request: dict, request_number: int) -> None:
+        if not self.path.endswith('/chat/completions'):
+            self._send_json(404, {'error': {'message': 'not found'}})
+            return
+
+        time.sleep(self.latency)
+        if request_number <= self.fail_first:
+            self._send_json(429, {'error': {'message': 'rate limited', 'type': 'rate_limit_error'}}, {'Retry-After': self.retry_after})
+            return
+        if random.random() < self.error_rate:
+            if random.random() < 0.5:
+                self._send_json(429, {'error': {'message': 'rate limited', 'type': 'rate_limit_error'}}, {'Retry-After': self.retry_after})
+            else:
+                self._send_json(503, {'error': {'message': 'service unavailable'}})
+            return
+
+        prompt_tokens = sum(len(str(m.get('content', ''))) for m in request.get('messages', [])) // 2
+        completion_tokens = len(self.reply) // 2
+        usage = {
+            'prompt_tokens': prompt_tokens,
+            'completion_tokens': completion_tokens,
+            'total_tokens': prompt_tokens + completion_tokens,
+        }
+        request_id = f'chatcmpl-mock-{request_number}'
+        if request.get('stream'):
+            self._send_stream(request, request_id, usage)
+            return
+        self._send_json(200, {
+            'id': request_id,
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': request.get('model', 'mock'),
+            'choices': [{
+                'index': 0,
+                'message': {'role': 'assistant', 'content': self.reply},
+                'finish_reason': 'stop',
+            }],
+            'usage': usage,
+        })
+
+
+def start_mock_server(host: str = '127.0.0.1', port: int = 0, latency: float = 0.0,
+                      error_rate: float = 0.0, reply: str = '[]', fail_first: int = 0,
+                      retry_after: str = '0.1') -> Tuple[ThreadingHTTPServer, str]:
+    """
+    在后台线程中启动模拟服务
+
+    参数:
+        host: 监听地址
+        port: 监听端口，0表示随机端口
+        latency: 每次请求的模拟延迟（秒）
+        error_rate: 返回429/503错误的概率
+        reply: 固定的回复内容
+        fail_first: 前N个请求固定返回429
+        retry_after: 429响应的Retry-After头
+
+    返回:
+        Tuple[ThreadingHTTPServer, str]: 服务对象（调用shutdown()停止，server.RequestHandlerClass上有
+                                         request_count、max_in_flight计数）和base_url
+    """
+    handler = type('ConfiguredMockOpenAIHandler', (MockOpenAIHandler,), {
+        'latency': latency, 'error_rate': error_rate, 'reply': reply,
+        'fail_first': fail_first, 'retry_after': retry_after,
+        'request_count': 0, 'in_flight': 0, 'max_in_flight': 0,
+    })
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server, f'http://{host}:{server.server_address[1]}/v1'
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='本地OpenAI兼容模拟服务')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8000)
+    parser.add_argument('--latency', type=float, default=0.0)
+    parser.add_argument('--error-rate', type=float, default=0.0)
+    parser.add_argument('--reply', default='[]')
+    parser.add_argument('--fail-first', type=int, default=0)
+    parser.add_argument('--retry-after', default='0.1')
+    args = parser.parse_args()
+
+    server, base_url = start_mock_server(args.host, args.port, args.latency, args.error_rate, args.reply,
+                                         args.fail_first, args.retry_after)
+    print(f"模拟服务已启动: {base_url}")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
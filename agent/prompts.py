@@ -1,23 +1,276 @@
 """
 存放各种prompt模板的模块
 """
+import io
+import re
+import csv
+import json
+import math
+from typing import Dict, List, Optional, Tuple
+
+# ========== prompt token预算配置 ==========
+# 每个模态在prompt中允许占用的token数，超出时按重要性排序裁剪
+MODALITY_TOKEN_BUDGETS = {
+    'log': 3000,
+    'trace': 3000,
+    'metric': 4000,
+}
+TOKENIZER_ENCODING = 'cl100k_base'  # 本地tokenizer编码
+
+_encoding = None
+_encoding_loaded = False
+
+
+def _get_encoding():
+    """
+    惰性加载tiktoken编码，tiktoken未安装或编码文件不可用时返回None
+    """
+    global _encoding, _encoding_loaded
+    if not _encoding_loaded:
+        _encoding_loaded = True
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKENIZER_ENCODING)
+        except Exception as e:
+            print(f"tiktoken不可用，使用近似token计数: {e}")
+            _encoding = None
+    return _encoding
+
+
+def count_tokens(text: Optional[str]) -> int:
+    """
+    统计文本的token数，优先使用本地tiktoken，不可用时按中文1字1token、其他字符4字符1token近似
+
+    参数:
+        text: 待统计的文本
+
+    返回:
+        int: token数
+    """
+    if not text:
+        return 0
+    encoding = _get_encoding()
+    if encoding is not None:
+        return len(encoding.encode(text, disallowed_special=()))
+    cjk_count = len(re.findall(r'[\u4e00-\u9fff]', text))
+    return cjk_count + math.ceil((len(text) - cjk_count) / 4)
+
+
+def _parse_rank_value(value: str) -> float:
+    """
+    从排序列的取值中解析数字，兼容"出现次数:12"这类带文字的格式
+    """
+    match = re.search(r'-?\d+(?:\.\d+)?', str(value))
+    return float(match.group()) if match else 0.0
+
+
+def trim_csv_to_budget(csv_text: str, budget: int, rank_column: Optional[str] = None) -> str:
+    """
+    按重要性裁剪CSV文本，保留表头，按rank_column降序依次加入数据行直到达到token预算
+
+    参数:
+        csv_text: CSV格式字符串
+        budget: token预算
+        rank_column: 排序列名，为None或不存在时保持原有顺序
+
+    返回:
+        str: 裁剪后的CSV字符串
+    """
+    if count_tokens(csv_text) <= budget:
+        return csv_text
+    rows = list(csv.reader(io.StringIO(csv_text)))
+    if len(rows) < 2:
+        return trim_text_to_budget(csv_text, budget)
+
+    header, data_rows = rows[0], rows[1:]
+    if rank_column in header:
+        rank_idx = header.index(rank_column)
+        data_rows = sorted(data_rows, key=lambda row: _parse_rank_value(row[rank_idx]) if rank_idx < len(row) else 0.0, reverse=True)
+
+    output = io.StringIO()
+    writer = csv.writer(output, lineterminator='\n')
+    writer.writerow(header)
+    used_tokens = count_tokens(output.getvalue())
+    kept_rows = 0
+    for row in data_rows:
+        line = io.StringIO()
+        csv.writer(line, lineterminator='\n').writerow(row)
+        row_tokens = count_tokens(line.getvalue())
+        if used_tokens + row_tokens > budget:
+            break
+        output.write(line.getvalue())
+        used_tokens += row_tokens
+        kept_rows += 1
+    print(f"CSV数据超出预算，保留{kept_rows}/{len(data_rows)}行（{used_tokens}/{budget} tokens）")
+    return output.getvalue()
+
+
+def trim_text_to_budget(text: str, budget: int) -> str:
+    """
+    按行顺序裁剪任意文本到token预算内
+
+    参数:
+        text: 待裁剪文本
+        budget: token预算
+
+    返回:
+        str: 裁剪后的文本
+    """
+    if count_tokens(text) <= budget:
+        return text
+    kept_lines = []
+    used_tokens = 0
+    for line in text.splitlines():
+        line_tokens = count_tokens(line) + 1
+        if used_tokens + line_tokens > budget:
+            break
+        kept_lines.append(line)
+        used_tokens += line_tokens
+    return '\n'.join(kept_lines)
+
+
+def _collect_metric_entries(node, path: Tuple[str, ...], entries: List[Tuple[Tuple[str, ...], dict]]) -> None:
+    """
+    递归收集metric分析结果中同时包含normal_stats和fault_stats的条目
+    """
+    if not isinstance(node, dict):
+        return
+    if 'normal_stats' in node or 'fault_stats' in node:
+        entries.append((path, node))
+        return
+    for key, value in node.items():
+        _collect_metric_entries(value, path + (key,), entries)
+
+
+def _metric_entry_score(entry: dict) -> float:
+    """
+    计算metric条目的异常程度：故障期均值与正常期均值之比的对数绝对值，取条目内各指标的最大值
+    """
+    normal_stats = entry.get('normal_stats') or {}
+    fault_stats = entry.get('fault_stats') or {}
+    # 单指标条目的stats直接是describe结果，多指标条目是{指标名: describe结果}
+    if 'mean' in normal_stats or 'mean' in fault_stats:
+        normal_stats, fault_stats = {'_': normal_stats}, {'_': fault_stats}
+
+    epsilon = 1e-9
+    score = 0.0
+    for metric, fault_desc in fault_stats.items():
+        normal_desc = normal_stats.get(metric)
+        if not isinstance(fault_desc, dict) or not isinstance(normal_desc, dict):
+            # 缺少正常期对照的指标无法计算比值，给予中等优先级
+            score = max(score, 1.0)
+            continue
+        fault_mean = fault_desc.get('mean')
+        normal_mean = normal_desc.get('mean')
+        if fault_mean is None or normal_mean is None or any(isinstance(v, float) and math.isnan(v) for v in (fault_mean, normal_mean)):
+            continue
+        ratio = (abs(fault_mean) + epsilon) / (abs(normal_mean) + epsilon)
+        score = max(score, abs(math.log(ratio)))
+    return score
+
+
+def trim_metric_json_to_budget(metric_json: str, budget: int) -> str:
+    """
+    按异常程度（故障期/正常期均值比）裁剪metric分析结果JSON，保留最显著的条目直到达到token预算
+
+    参数:
+        metric_json: metric_refinement返回的JSON字符串
+        budget: token预算
+
+    返回:
+        str: 裁剪后的紧凑JSON字符串；无法解析为JSON时按行裁剪
+    """
+    try:
+        metric_data = json.loads(metric_json)
+    except (TypeError, ValueError):
+        return trim_text_to_budget(metric_json, budget)
+
+    compact_json = json.dumps(metric_data, ensure_ascii=False, separators=(',', ':'))
+    if count_tokens(compact_json) <= budget:
+        return compact_json
+
+    entries = []
+    _collect_metric_entries(metric_data, (), entries)
+    entries.sort(key=lambda item: _metric_entry_score(item[1]), reverse=True)
+
+    trimmed = {}
+    used_tokens = 2
+    kept_entries = 0
+    for path, entry in entries:
+        entry_text = json.dumps({'/'.join(path): entry}, ensure_ascii=False, separators=(',', ':'))
+        entry_tokens = count_tokens(entry_text)
+        if used_tokens + entry_tokens > budget:
+            continue
+        node = trimmed
+        for key in path[:-1]:
+            node = node.setdefault(key, {})
+        node[path[-1]] = entry
+        used_tokens += entry_tokens
+        kept_entries += 1
+    print(f"metric数据超出预算，保留{kept_entries}/{len(entries)}个条目（约{used_tokens}/{budget} tokens）")
+    return json.dumps(trimmed, ensure_ascii=False, separators=(',', ':'))
+
+
+def apply_modality_budget(modality: str, data: Optional[str], budget: Optional[int] = None) -> Optional[str]:
+    """
+    对单个模态的数据按其预算和重要性排序进行裁剪
+
+    参数:
+        modality: 'log'、'trace'或'metric'
+        data: 模态数据字符串
+        budget: token预算，为None时使用MODALITY_TOKEN_BUDGETS中的配置
+
+    返回:
+        str: 裁剪后的数据；输入为空时原样返回
+    """
+    if not data:
+        return data
+    budget = budget if budget is not None else MODALITY_TOKEN_BUDGETS[modality]
+    if modality == 'log':
+        return trim_csv_to_budget(data, budget, rank_column='occurrence_count')
+    if modality == 'trace':
+        return trim_csv_to_budget(data, budget, rank_column='anomaly_count')
+    return trim_metric_json_to_budget(data, budget)
+
+
+def report_prompt_tokens(name: str, prompt: str) -> int:
+    """
+    打印并返回prompt的token数
+
+    参数:
+        name: prompt名称
+        prompt: prompt文本
+
+    返回:
+        int: token数
+    """
+    token_count = count_tokens(prompt)
+    print(f"[prompt tokens] {name}: {token_count}")
+    return token_count
+
 
 def get_multimodal_analysis_prompt(
     log_data: str | None = None,
     trace_data: str | None = None,
-    metric_data: str | None = None
+    metric_data: str | None = None,
+    token_budgets: Optional[Dict[str, int]] = None
 ) -> str:
     """
-    获取多模态分析的prompt模板，支持缺失部分模态数据
+    获取多模态分析的prompt模板，支持缺失部分模态数据，各模态按token预算裁剪
 
     参数:
         log_data: (filtered_logs_csv, log_unique_dict) 或 None
         trace_data: (filtered_traces_csv, trace_unique_dict, status_combinations_csv) 或 None
         metric_data: 字符串类型的metric分析结果 或 None
+        token_budgets: 各模态的token预算，为None时使用MODALITY_TOKEN_BUDGETS
 
     返回:
         构建好的多模态分析prompt字符串
     """
+    token_budgets = {**MODALITY_TOKEN_BUDGETS, **(token_budgets or {})}
+    log_data = apply_modality_budget('log', log_data, token_budgets['log'])
+    trace_data = apply_modality_budget('trace', trace_data, token_budgets['trace'])
+    metric_data = apply_modality_budget('metric', metric_data, token_budgets['metric'])
 
     # 固定的组件列表，不再从数据中动态提取
     # all_node_names = ['aiops-k8s-01', 'aiops-k8s-02', 'aiops-k8s-03', 'aiops-k8s-04',
@@ -76,7 +329,7 @@ def get_multimodal_analysis_prompt(
     # components_list.extend(all_pod_names)
     modalities_text = "、".join(available_modalities)
 
-    return f"""
+    prompt = f"""
         ### Language Enforcement
         -Input may contain Chinese, **but output MUST be entirely in English** (no Chinese characters).
         请根据提供的{modalities_text}，进行综合故障分析，完成异常检测、故障分类、根因定位。
@@ -84,3 +337,5 @@ def get_multimodal_analysis_prompt(
         可用的监控数据:
         {data_content}
         """
+    report_prompt_tokens('multimodal_analysis', prompt)
+    return prompt
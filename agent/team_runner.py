@@ -0,0 +1,181 @@
+"""
+GraphFlow流式执行模块
+
+基于run_stream执行诊断团队：一旦产出有效的结果JSON立即终止，反思循环不收敛（反复给出相同反馈）时提前截断，
+并记录每个智能体的耗时和token用量
+"""
+import re
+import json
+import time
+import difflib
+from collections import defaultdict
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from autogen_agentchat.base import TaskResult, TerminatedException, TerminationCondition
+from autogen_agentchat.conditions import MaxMessageTermination
+from autogen_agentchat.messages import BaseAgentEvent, BaseChatMessage, StopMessage
+
+# ========== 流式执行配置 ==========
+MAX_MESSAGES = 20  # 单个故障最多消息数
+RESULT_SOURCES = ("summarizationAgent",)  # 产出最终结果JSON的智能体
+RESULT_REQUIRED_KEYS = ("component", "reason")  # 结果JSON必须包含的字段
+REFLECTION_SOURCE = "ReflectionAgent"  # 反思智能体名称
+MAX_REFLECTION_ROUNDS = 3  # 最多允许的反思驳回次数
+FEEDBACK_SIMILARITY_THRESHOLD = 0.9  # 两次反馈相似度超过该值视为重复反馈
+
+
+def extract_result_json(text: str) -> Optional[dict]:
+    """
+    从智能体输出中提取结果JSON（第一个'{'到最后一个'}'之间的内容）
+
+    参数:
+        text: 智能体输出文本
+
+    返回:
+        dict: 解析后的结果字典，未找到或解析失败时返回None
+    """
+    if not isinstance(text, str):
+        return None
+    match = re.search(r'(\{.*\})', text, re.DOTALL)
+    if not match:
+        return None
+    try:
+        result = json.loads(match.group(1))
+    except json.JSONDecodeError:
+        return None
+    return result if isinstance(result, dict) else None
+
+
+class ResultJsonTermination(TerminationCondition):
+    """
+    指定智能体输出包含必需字段的有效结果JSON时终止
+    """
+
+    def __init__(self, sources: Sequence[str] = RESULT_SOURCES, required_keys: Sequence[str] = RESULT_REQUIRED_KEYS):
+        self._sources = set(sources)
+        self._required_keys = tuple(required_keys)
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            if not isinstance(message, BaseChatMessage) or message.source not in self._sources:
+                continue
+            result = extract_result_json(message.to_model_text())
+            if result is not None and all(key in result for key in self._required_keys):
+                self._terminated = True
+                return StopMessage(content=f"{message.source} 已产出有效结果JSON", source="ResultJsonTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._terminated = False
+
+
+class ReflectionStallTermination(TerminationCondition):
+    """
+    反思循环不收敛时终止：反思智能体驳回次数超过上限，或给出与之前高度相似的重复反馈
+    """
+
+    def __init__(self, source: str = REFLECTION_SOURCE, max_rounds: int = MAX_REFLECTION_ROUNDS,
+                 similarity_threshold: float = FEEDBACK_SIMILARITY_THRESHOLD):
+        self._source = source
+        self._max_rounds = max_rounds
+        self._similarity_threshold = similarity_threshold
+        self._feedbacks: List[str] = []
+        self._terminated = False
+
+    @property
+    def terminated(self) -> bool:
+        return self._terminated
+
+    async def __call__(self, messages: Sequence[BaseAgentEvent | BaseChatMessage]) -> StopMessage | None:
+        if self._terminated:
+            raise TerminatedException("Termination condition has already been reached")
+        for message in messages:
+            if not isinstance(message, BaseChatMessage) or message.source != self._source:
+                continue
+            feedback = message.to_model_text()
+            if "APPROVE" in feedback:
+                continue
+            normalized = re.sub(r'\s+', ' ', feedback).strip()
+            for previous in self._feedbacks:
+                if difflib.SequenceMatcher(None, previous, normalized).ratio() >= self._similarity_threshold:
+                    self._terminated = True
+                    return StopMessage(content="反思智能体重复给出相同反馈，反思循环不收敛", source="ReflectionStallTermination")
+            self._feedbacks.append(normalized)
+            if len(self._feedbacks) >= self._max_rounds:
+                self._terminated = True
+                return StopMessage(content=f"反思驳回次数达到上限{self._max_rounds}", source="ReflectionStallTermination")
+        return None
+
+    async def reset(self) -> None:
+        self._feedbacks = []
+        self._terminated = False
+
+
+def create_termination_condition(max_messages: int = MAX_MESSAGES) -> TerminationCondition:
+    """
+    创建诊断团队的终止条件：消息数上限、产出结果JSON、反思不收敛三者任一满足即终止。
+    终止条件有状态，每个团队实例需要单独创建
+
+    参数:
+        max_messages: 最多消息数
+
+    返回:
+        TerminationCondition: 组合后的终止条件
+    """
+    return MaxMessageTermination(max_messages=max_messages) | ResultJsonTermination() | ReflectionStallTermination()
+
+
+async def run_team_streaming(team, task: str) -> Tuple[Optional[dict], TaskResult, Dict[str, Dict[str, float]]]:
+    """
+    流式执行诊断团队，记录每个智能体的耗时和token用量，并提取结果JSON
+
+    参数:
+        team: GraphFlow团队实例
+        task: 任务prompt
+
+    返回:
+        Tuple[Optional[dict], TaskResult, Dict[str, Dict[str, float]]]:
+            - 结果JSON（从后往前第一个有效结果），未产出时为None
+            - 团队执行结果
+            - 按智能体统计的 {'wall_time', 'prompt_tokens', 'completion_tokens', 'messages'}
+    """
+    agent_stats: Dict[str, Dict[str, float]] = defaultdict(lambda: {'wall_time': 0.0, 'prompt_tokens': 0, 'completion_tokens': 0, 'messages': 0})
+    task_result = None
+    run_start = last_time = time.perf_counter()
+
+    async for item in team.run_stream(task=task):
+        now = time.perf_counter()
+        if isinstance(item, TaskResult):
+            # TaskResult是最后一项，不能提前break，否则团队不会退出运行状态，无法reset复用
+            task_result = item
+            continue
+        # 两条消息之间的时间计入后一条消息的产出者
+        if isinstance(item, BaseChatMessage) and item.source != "user":
+            stats = agent_stats[item.source]
+            stats['wall_time'] += now - last_time
+            stats['messages'] += 1
+            if item.models_usage is not None:
+                stats['prompt_tokens'] += item.models_usage.prompt_tokens
+                stats['completion_tokens'] += item.models_usage.completion_tokens
+        last_time = now
+
+    print(f"团队执行结束，耗时{time.perf_counter() - run_start:.2f}秒，终止原因: {task_result.stop_reason if task_result else None}")
+    for agent_name, stats in agent_stats.items():
+        print(f"  {agent_name}: 耗时{stats['wall_time']:.2f}秒，消息{stats['messages']}条，"
+              f"提示tokens {stats['prompt_tokens']}，生成tokens {stats['completion_tokens']}")
+
+    result_json = None
+    if task_result is not None:
+        for message in reversed(task_result.messages):
+            if isinstance(message, BaseChatMessage) and message.source in RESULT_SOURCES:
+                result_json = extract_result_json(message.to_model_text())
+                if result_json is not None:
+                    break
+    return result_json, task_result, dict(agent_stats)
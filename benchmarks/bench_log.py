@@ -0,0 +1,34 @@
+"""
+日志提炼的基准测试（asv风格：setup + time_*方法）
+"""
+from benchmarks.workspace import get_workspace, load_faults
+from dataRefinement import log_refinement as lr
+from dataRefinement.window_reader import read_window
+
+
+class LogRefinementSuite:
+    """
+    故障窗口内的日志读取、过滤、模板提取和完整的log_refinement
+    """
+    timeout = 300
+
+    def setup(self):
+        root = get_workspace()
+        fault = load_faults(root).iloc[0]
+        self.start_time_hour = fault['start_time_hour']
+        self.start, self.end = int(fault['start_timestamp']), int(fault['end_timestamp'])
+        df_log = lr._filter_logs_by_timerange(self.start, self.end, read_window('log', self.start, self.end))
+        self.df_log = df_log
+        self.df_errors = lr._filter_logs_by_columns(lr._filter_logs_by_error(df_log), ['time_beijing', 'k8_pod', 'message', 'k8_node_name'])
+
+    def time_read_window(self):
+        read_window('log', self.start, self.end)
+
+    def time_filter_logs_by_error(self):
+        lr._filter_logs_by_error(self.df_log)
+
+    def time_extract_log_templates(self):
+        lr._extract_log_templates(self.df_errors.copy())
+
+    def time_log_refinement(self):
+        lr.log_refinement(self.start_time_hour, self.start, self.end)
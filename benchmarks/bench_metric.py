@@ -0,0 +1,49 @@
+"""
+指标分析器的基准测试（asv风格：setup + time_*方法），分别测量读取原始数据和使用指标预聚合两种方式
+"""
+import asyncio
+
+from benchmarks.llm_stub import install_llm_stub
+from benchmarks.workspace import get_workspace, load_faults
+from dataRefinement import metric_refinement as mr
+from dataRefinement import metric_rollup
+
+
+class MetricAnalyzerSuite:
+    """
+    service（含LLM替身）、TiDB、node、pod四个指标分析器
+    """
+    params = [False, True]
+    param_names = ['use_rollups']
+    timeout = 300
+
+    def setup(self, use_rollups):
+        root = get_workspace()
+        install_llm_stub()
+        # 预聚合需要同时开启USE_METRIC_ROLLUPS并使用允许近似结果的统计后端
+        self.use_metric_rollups = metric_rollup.USE_METRIC_ROLLUPS
+        self.stats_backend = mr.STATS_BACKEND
+        metric_rollup.USE_METRIC_ROLLUPS = use_rollups
+        metric_rollup._rollup_cache.clear()
+        mr.STATS_BACKEND = 'sketch' if use_rollups else 'exact'
+        df_faults = load_faults(root)
+        self.fault_date = df_faults.iloc[0]['date']
+        self.normal_periods = mr.get_normal_periods(df_faults, 0)
+        self.fault_period = (df_faults.iloc[0]['start_timestamp'], df_faults.iloc[0]['end_timestamp'])
+
+    def teardown(self, use_rollups):
+        metric_rollup.USE_METRIC_ROLLUPS = self.use_metric_rollups
+        metric_rollup._rollup_cache.clear()
+        mr.STATS_BACKEND = self.stats_backend
+
+    def time_analyze_service_metrics(self, use_rollups):
+        asyncio.run(mr.analyze_service_metrics(self.fault_date, self.normal_periods, self.fault_period))
+
+    def time_analyze_tidb_metrics(self, use_rollups):
+        mr.analyze_tidb_metrics(self.fault_date, self.normal_periods, self.fault_period)
+
+    def time_analyze_node_metrics(self, use_rollups):
+        mr.analyze_node_metrics(self.fault_date, self.normal_periods, self.fault_period)
+
+    def time_analyze_pod_metrics(self, use_rollups):
+        mr.analyze_pod_metrics(self.fault_date, self.normal_periods, self.fault_period)
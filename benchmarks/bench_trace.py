@@ -0,0 +1,64 @@
+"""
+trace提炼的基准测试（asv风格：setup + time_*方法）
+"""
+import pandas as pd
+
+from benchmarks.workspace import get_workspace, load_faults
+from dataRefinement import trace_refinement as tr
+from dataRefinement.span_tree import annotate_span_tree
+from dataRefinement.window_reader import read_window
+
+
+def _preprocess_traces(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    与trace_refinement中的预处理一致：提取pod/服务/节点名、父pod和出错标记
+    """
+    df = df.copy()
+    df['pod_name'] = df['process'].apply(tr._extract_pod_name)
+    df['service_name'] = df['process'].apply(tr._extract_service_name)
+    df['node_name'] = df['process'].apply(tr._extract_node_name)
+    df['parent_spanID'] = df['references'].apply(tr._extract_parent_spanid)
+    span_to_pod = dict(zip(df['spanID'].tolist(), df['pod_name'].tolist()))
+    df['parent_pod'] = df['parent_spanID'].map(lambda x: span_to_pod.get(x))
+    df['is_error'] = tr._error_flags(df)
+    return df.rename(columns={'pod_name': 'child_pod'}).sort_values(by='timestamp_ns')
+
+
+class TraceRefinementSuite:
+    """
+    trace预处理、滑动窗口特征、异常检测和完整的trace_refinement
+    """
+    timeout = 600
+
+    def setup(self):
+        root = get_workspace()
+        fault = load_faults(root).iloc[0]
+        self.start_time_hour = fault['start_time_hour']
+        self.start, self.end = int(fault['start_timestamp']), int(fault['end_timestamp'])
+        self.trace_detectors, self.normal_stats = tr._load_or_train_anomaly_detection_model()
+        self.df_trace = tr._filter_traces_by_timerange(self.start, self.end, read_window('trace', self.start, self.end))
+        self.df_traces = _preprocess_traces(self.df_trace)
+        # 滑动窗口使用数据量最多的调用组
+        groups = self.df_traces.groupby(['parent_pod', 'child_pod', 'node_name', 'operationName'])
+        self.call_df = max((group for _, group in groups), key=len)
+
+    def time_preprocess_traces(self):
+        _preprocess_traces(self.df_trace)
+
+    def time_slide_window(self):
+        tr._slide_window(self.call_df, tr.WIN_SIZE_NS)
+
+    def time_span_tree(self):
+        annotate_span_tree(self.df_traces)
+
+    def time_detect_anomalies(self):
+        tr._detect_anomalies(self.df_traces, self.trace_detectors, self.normal_stats, backend='iforest')
+
+    def time_detect_anomalies_stats(self):
+        tr._detect_anomalies(self.df_traces, self.trace_detectors, self.normal_stats, backend='stats')
+
+    def time_analyze_status_combinations(self):
+        tr._analyze_status_combinations_in_fault_period(self.df_traces)
+
+    def time_trace_refinement(self):
+        tr.trace_refinement(self.start_time_hour, self.start, self.end)
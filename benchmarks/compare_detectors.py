@@ -0,0 +1,115 @@
+"""
+统计检测器与IsolationForest的对比
+
+在故障集合上分别用两种trace检测器后端（trace_refinement.TRACE_DETECTOR_BACKEND）检测异常，报告：
+    - 窗口级标签一致率，以及以IsolationForest为参照时统计检测器的精确率/召回率
+    - 两种后端的异常事件数
+    - 打分阶段和完整检测（含滑动窗口切分）的耗时与加速比
+默认使用合成数据工作区（见workspace.py），--real 使用项目data/目录和input/input_timestamp.csv
+
+用法:
+    python -m benchmarks.compare_detectors [--real] [--limit 10]
+"""
+import os
+import sys
+import time
+import argparse
+from typing import Dict, List
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from benchmarks.bench_trace import _preprocess_traces
+from benchmarks.workspace import get_workspace, load_faults, quiet
+from dataRefinement import trace_refinement as tr
+from dataRefinement.window_reader import read_window
+
+
+def compare_fault(df_traces: pd.DataFrame, trace_detectors: Dict, normal_stats: Dict) -> Dict[str, float]:
+    """
+    在一个故障窗口上对比两种后端
+
+    返回:
+        Dict[str, float]: 窗口数、一致窗口数、两种后端的异常窗口数和同时判为异常的窗口数、各阶段耗时（秒）
+    """
+    # 只比较两种后端都能检测的组
+    known = {name for name in normal_stats if name in trace_detectors}
+    with quiet():
+        windows = tr._collect_group_windows(df_traces, known)
+
+        start = time.perf_counter()
+        iforest_labels = tr._score_isolation_forest(windows, trace_detectors)
+        iforest_score = time.perf_counter() - start
+        start = time.perf_counter()
+        stats_labels = tr._score_statistical(windows, normal_stats)
+        stats_score = time.perf_counter() - start
+
+        start = time.perf_counter()
+        iforest_events = tr._detect_anomalies(df_traces, trace_detectors, normal_stats, backend='iforest')
+        iforest_total = time.perf_counter() - start
+        start = time.perf_counter()
+        stats_events = tr._detect_anomalies(df_traces, trace_detectors, normal_stats, backend='stats')
+        stats_total = time.perf_counter() - start
+
+    iforest = np.concatenate(iforest_labels) if windows else np.array([], dtype=bool)
+    stats = np.concatenate(stats_labels) if windows else np.array([], dtype=bool)
+    return {
+        'windows': len(iforest), 'agree': int((iforest == stats).sum()),
+        'iforest_anomalies': int(iforest.sum()), 'stats_anomalies': int(stats.sum()), 'both': int((iforest & stats).sum()),
+        'iforest_events': len(iforest_events), 'stats_events': len(stats_events),
+        'iforest_score': iforest_score, 'stats_score': stats_score,
+        'iforest_total': iforest_total, 'stats_total': stats_total,
+    }
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='对比统计检测器与IsolationForest')
+    parser.add_argument('--real', action='store_true', help='使用项目data/和input/input_timestamp.csv，而不是合成数据')
+    parser.add_argument('--limit', type=int, default=None, help='最多对比的故障数')
+    args = parser.parse_args()
+
+    df_faults = pd.read_csv(os.path.join(project_root, 'input', 'input_timestamp.csv')) if args.real else load_faults(get_workspace())
+    if args.limit:
+        df_faults = df_faults.head(args.limit)
+    with quiet():
+        loaded = tr._load_or_train_anomaly_detection_model()
+    if loaded is None:
+        print("无法获取trace异常检测模型")
+        return 1
+    trace_detectors, normal_stats = loaded
+
+    results: List[Dict[str, float]] = []
+    for _, fault in df_faults.iterrows():
+        start, end = int(fault['start_timestamp']), int(fault['end_timestamp'])
+        with quiet():
+            df_trace = read_window('trace', start, end)
+        if df_trace is None or len(df_trace) == 0:
+            continue
+        result = compare_fault(_preprocess_traces(tr._filter_traces_by_timerange(start, end, df_trace)), trace_detectors, normal_stats)
+        results.append(result)
+        print(f"{fault['uuid']}: 窗口{result['windows']}，一致率{result['agree'] / max(result['windows'], 1):.3f}，"
+              f"异常窗口 IsolationForest {result['iforest_anomalies']} / 统计 {result['stats_anomalies']} / 共同 {result['both']}，"
+              f"打分耗时 {result['iforest_score'] * 1000:.1f}ms / {result['stats_score'] * 1000:.1f}ms")
+
+    if not results:
+        print("没有可对比的故障")
+        return 1
+    total = {key: sum(result[key] for result in results) for key in results[0]}
+    precision = total['both'] / total['stats_anomalies'] if total['stats_anomalies'] else float('nan')
+    recall = total['both'] / total['iforest_anomalies'] if total['iforest_anomalies'] else float('nan')
+    print(f"\n故障数: {len(results)}，窗口数: {total['windows']}")
+    print(f"窗口级一致率: {total['agree'] / max(total['windows'], 1):.4f}")
+    print(f"以IsolationForest为参照: 精确率 {precision:.3f}，召回率 {recall:.3f}")
+    print(f"异常事件数: IsolationForest {total['iforest_events']}，统计 {total['stats_events']}")
+    print(f"打分耗时: IsolationForest {total['iforest_score']:.3f}秒，统计 {total['stats_score']:.3f}秒，"
+          f"加速 {total['iforest_score'] / max(total['stats_score'], 1e-9):.1f}倍")
+    print(f"完整检测耗时: IsolationForest {total['iforest_total']:.3f}秒，统计 {total['stats_total']:.3f}秒，"
+          f"加速 {total['iforest_total'] / max(total['stats_total'], 1e-9):.1f}倍")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
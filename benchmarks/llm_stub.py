@@ -0,0 +1,57 @@
+"""
+基准测试用的LLM替身
+
+用autogen的ReplayChatCompletionClient替换agent.agent.get_model_client，每个新建的智能体得到一个
+按智能体名返回固定回复的回放客户端：不访问网络、不读写响应缓存，耗时只包含智能体本身的开销
+"""
+from typing import Callable, Dict, Optional
+
+from autogen_ext.models.replay import ReplayChatCompletionClient
+
+import agent.agent as agent_module
+
+# 智能体名 -> 固定回复；未列出的智能体返回DEFAULT_REPLY
+STUB_REPLIES = {
+    "MetricsAgent": "['rrt', 'error_ratio', 'timeout']",
+    "LogsAgent": '{"observations": []}',
+    "TracesAgent": '{"observations": []}',
+}
+DEFAULT_REPLY = "[]"
+STUB_MODEL_INFO = {
+    "vision": False,
+    "function_calling": True,
+    "json_output": True,
+    "family": "unknown",
+    "structured_output": False,
+}
+
+_original_get_model_client: Optional[Callable] = None
+
+
+def _stub_model_client(agent_name: str) -> ReplayChatCompletionClient:
+    return ReplayChatCompletionClient([STUB_REPLIES.get(agent_name, DEFAULT_REPLY)], model_info=STUB_MODEL_INFO)
+
+
+def install_llm_stub(replies: Optional[Dict[str, str]] = None) -> None:
+    """
+    安装LLM替身，之后create_agent创建的智能体都使用回放客户端
+
+    参数:
+        replies: 覆盖STUB_REPLIES中的部分回复
+    """
+    global _original_get_model_client
+    if replies:
+        STUB_REPLIES.update(replies)
+    if _original_get_model_client is None:
+        _original_get_model_client = agent_module.get_model_client
+        agent_module.get_model_client = _stub_model_client
+
+
+def uninstall_llm_stub() -> None:
+    """
+    恢复真实的model_client
+    """
+    global _original_get_model_client
+    if _original_get_model_client is not None:
+        agent_module.get_model_client = _original_get_model_client
+        _original_get_model_client = None
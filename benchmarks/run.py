@@ -0,0 +1,149 @@
+"""
+基准测试运行器
+
+发现benchmarks/bench_*.py中asv风格的基准测试类（setup/teardown、params/param_names、time_*方法），
+在合成数据工作区上逐个运行并统计耗时；可保存结果为JSON，并与基线结果对比，耗时超过基线
+REGRESSION_THRESHOLD倍的基准测试视为性能回退（退出码为1），便于离线发现回退。
+这些类同样符合asv的约定，安装asv后也可以直接用asv运行
+
+用法:
+    python -m benchmarks.run [--bench 正则] [--repeat 5] [--output results.json] [--compare baseline.json]
+"""
+import os
+import re
+import sys
+import json
+import time
+import argparse
+import importlib
+import itertools
+import contextlib
+from typing import Dict, Iterator, List, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from benchmarks.workspace import quiet
+
+# ========== 基准测试运行配置 ==========
+BENCH_MODULES = ['benchmarks.bench_log', 'benchmarks.bench_trace', 'benchmarks.bench_metric']
+DEFAULT_REPEAT = 5  # 每个基准测试的计时次数（另有一次预热）
+REGRESSION_THRESHOLD = 1.2  # 中位数耗时超过基线的倍数时视为回退
+
+
+def discover(pattern: Optional[str] = None) -> Iterator[Tuple[str, type, str, tuple]]:
+    """
+    列出全部基准测试
+
+    返回:
+        Iterator[Tuple[str, type, str, tuple]]: (名称, 类, 方法名, 参数)
+    """
+    regex = re.compile(pattern) if pattern else None
+    for module_name in BENCH_MODULES:
+        module = importlib.import_module(module_name)
+        for class_name, cls in vars(module).items():
+            if not isinstance(cls, type) or cls.__module__ != module.__name__:
+                continue
+            params = getattr(cls, 'params', None)
+            param_names = getattr(cls, 'param_names', [])
+            if params is None:
+                combinations = [()]
+            elif param_names and len(param_names) > 1:
+                combinations = list(itertools.product(*params))
+            else:
+                combinations = [(param,) for param in params]
+            for method_name in sorted(name for name in vars(cls) if name.startswith('time_')):
+                for combination in combinations:
+                    suffix = ', '.join(f'{n}={v}' for n, v in zip(param_names, combination))
+                    name = f"{module_name.rsplit('.', 1)[-1]}.{class_name}.{method_name}" + (f"({suffix})" if suffix else '')
+                    if regex is None or regex.search(name):
+                        yield name, cls, method_name, combination
+
+
+def run_benchmark(cls: type, method_name: str, params: tuple, repeat: int = DEFAULT_REPEAT,
+                  verbose: bool = False) -> Dict[str, float]:
+    """
+    运行单个基准测试：setup后预热一次，再计时repeat次
+
+    返回:
+        Dict[str, float]: {'min', 'median', 'max', 'setup'}（秒）
+    """
+    output = contextlib.nullcontext() if verbose else quiet()
+    with output:
+        instance = cls()
+        setup_start = time.perf_counter()
+        if hasattr(instance, 'setup'):
+            instance.setup(*params)
+        setup_seconds = time.perf_counter() - setup_start
+        method = getattr(instance, method_name)
+        try:
+            method(*params)
+            timings = []
+            for _ in range(repeat):
+                start = time.perf_counter()
+                method(*params)
+                timings.append(time.perf_counter() - start)
+        finally:
+            if hasattr(instance, 'teardown'):
+                instance.teardown(*params)
+    timings.sort()
+    return {'min': timings[0], 'median': timings[len(timings) // 2], 'max': timings[-1], 'setup': setup_seconds}
+
+
+def compare_results(results: Dict[str, Dict[str, float]], baseline: Dict[str, Dict[str, float]],
+                    threshold: float = REGRESSION_THRESHOLD) -> List[Tuple[str, float]]:
+    """
+    与基线对比中位数耗时
+
+    返回:
+        List[Tuple[str, float]]: 回退的基准测试及其耗时倍数
+    """
+    regressions = []
+    for name, result in results.items():
+        if name in baseline and baseline[name]['median'] > 0:
+            ratio = result['median'] / baseline[name]['median']
+            if ratio > threshold:
+                regressions.append((name, ratio))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='在合成数据上运行基准测试')
+    parser.add_argument('--bench', default=None, help='只运行名称匹配该正则的基准测试')
+    parser.add_argument('--repeat', type=int, default=DEFAULT_REPEAT, help='计时次数')
+    parser.add_argument('--output', default=None, help='结果保存路径（JSON）')
+    parser.add_argument('--compare', default=None, help='基线结果路径（JSON），用于检测性能回退')
+    parser.add_argument('--threshold', type=float, default=REGRESSION_THRESHOLD, help='回退判定倍数')
+    parser.add_argument('--verbose', action='store_true', help='显示被测函数的输出')
+    args = parser.parse_args()
+
+    results = {}
+    for name, cls, method_name, params in discover(args.bench):
+        try:
+            result = run_benchmark(cls, method_name, params, repeat=args.repeat, verbose=args.verbose)
+        except Exception as e:
+            print(f"{name:<90} 失败: {e}")
+            continue
+        results[name] = result
+        print(f"{name:<90} 中位数 {result['median'] * 1000:10.2f}ms  最小 {result['min'] * 1000:10.2f}ms")
+
+    if args.output:
+        os.makedirs(os.path.dirname(os.path.abspath(args.output)), exist_ok=True)
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, ensure_ascii=False, indent=2)
+        print(f"结果已保存至: {args.output}")
+
+    if args.compare:
+        with open(args.compare, 'r', encoding='utf-8') as f:
+            baseline = json.load(f)
+        regressions = compare_results(results, baseline, args.threshold)
+        for name, ratio in regressions:
+            print(f"性能回退: {name} 耗时为基线的 {ratio:.2f} 倍")
+        if regressions:
+            return 1
+        print(f"与基线相比没有超过 {args.threshold} 倍的性能回退")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
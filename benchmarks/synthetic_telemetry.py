@@ -0,0 +1,354 @@
+"""
+合成遥测数据生成器
+
+按data/目录的布局和字段生成与真实数据结构兼容的log、trace、metric parquet文件，以及对应的
+input/input_timestamp.csv，供基准测试在没有真实数据集的环境中离线运行：
+    data/{date}/log-parquet/log_filebeat-server_{date}_{HH}-00-00.parquet
+    data/{date}/trace-parquet/trace_jaeger-span_{date}_{HH}-00-00.parquet
+    data/{date}/metric-parquet/apm/service、apm/pod、infra/infra_node、infra/infra_pod、infra/infra_tidb、other
+
+trace包含process（serviceName与name/node_name标签）、references（父spanID）、tags（status.code/status.message）；
+文件名中的小时为北京时间，timestamp_ns为UTC纳秒时间戳。故障时间段内注入一个pod的延迟升高、错误状态和错误日志
+
+用法:
+    python -m benchmarks.synthetic_telemetry <输出目录> [--scale small|medium|large]
+"""
+import os
+import sys
+import argparse
+from typing import Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from dataRefinement.metric_refinement import (
+    key_metrics, get_target_nodes, get_target_pods, get_node_metrics_files_mapping, get_pod_metrics_files_mapping,
+    get_tidb_services_directories, get_tidb_services_files_mapping,
+)
+
+# ========== 合成数据配置 ==========
+SYNTHETIC_SEED = 42
+SYNTHETIC_DATE = '2025-06-06'
+BEIJING_OFFSET_NS = 8 * 3600 * 1_000_000_000
+MINUTE_NS = 60 * 1_000_000_000
+METRIC_INTERVAL_SECONDS = 60  # 指标采样间隔（秒）
+
+# 数据规模：生成的小时数（北京时间）、每分钟trace数、每分钟日志数
+SCALES = {
+    'small': {'hours': (0, 1), 'traces_per_minute': 20, 'logs_per_minute': 200},
+    'medium': {'hours': (0, 1, 2, 3), 'traces_per_minute': 100, 'logs_per_minute': 1000},
+    'large': {'hours': tuple(range(24)), 'traces_per_minute': 300, 'logs_per_minute': 3000},
+}
+
+# 故障时间段（北京时间的时:分:秒），与input_timestamp.csv的前两条故障一致；两次故障之间为正常时间段
+DEFAULT_FAULTS = (('00:10:02', '00:31:02'), ('01:10:04', '01:33:04'))
+FAULT_POD = 'cartservice-1'  # 故障期间注入异常的pod
+FAULT_LATENCY_FACTOR = 8.0  # 故障pod的延迟放大倍数
+FAULT_ERROR_RATE = 0.3  # 故障pod的错误状态比例
+
+# 一条trace的调用树：(span序号, 父span序号, 服务名, 操作名)，父序号为-1表示根span
+TRACE_TEMPLATE = [
+    (0, -1, 'frontend', 'hipstershop.Frontend/Recv.'),
+    (1, 0, 'productcatalogservice', 'hipstershop.ProductCatalogService/GetProduct'),
+    (2, 0, 'currencyservice', 'hipstershop.CurrencyService/Convert'),
+    (3, 0, 'cartservice', 'hipstershop.CartService/GetCart'),
+    (4, 3, 'redis-cart', 'HGET'),
+    (5, 0, 'recommendationservice', 'hipstershop.RecommendationService/ListRecommendations'),
+    (6, 5, 'productcatalogservice', 'hipstershop.ProductCatalogService/ListProducts'),
+    (7, 0, 'adservice', 'hipstershop.AdService/GetAds'),
+    (8, 0, 'checkoutservice', 'hipstershop.CheckoutService/PlaceOrder'),
+    (9, 8, 'paymentservice', 'hipstershop.PaymentService/Charge'),
+    (10, 8, 'shippingservice', 'hipstershop.ShippingService/ShipOrder'),
+    (11, 8, 'emailservice', 'hipstershop.EmailService/SendOrderConfirmation'),
+]
+# 各服务的基础延迟（微秒）
+BASE_LATENCY_US = {
+    'frontend': 20000, 'productcatalogservice': 3000, 'currencyservice': 1500, 'cartservice': 4000,
+    'redis-cart': 500, 'recommendationservice': 6000, 'adservice': 2500, 'checkoutservice': 15000,
+    'paymentservice': 2000, 'shippingservice': 2500, 'emailservice': 3000,
+}
+
+LOG_TEMPLATES = [
+    'GET /product/{id} 200 {ms}ms',
+    'request complete method=POST path=/cart status=200 latency={ms}ms',
+    'conversion request successful currency={id}',
+    'sending order confirmation email to user {id}',
+]
+ERROR_LOG_TEMPLATES = [
+    'failed to get cart: rpc error: code = Unavailable desc = connection error {id}',
+    'error retrieving product {id}: context deadline exceeded',
+    'Exception in thread "grpc-default-executor-{id}" java.lang.RuntimeException',
+]
+
+
+def _pod_nodes() -> Dict[str, str]:
+    """
+    pod到节点的固定分配
+    """
+    nodes = get_target_nodes()
+    return {pod: nodes[i % len(nodes)] for i, pod in enumerate(get_target_pods())}
+
+
+def _service_pods() -> Dict[str, List[str]]:
+    service_pods: Dict[str, List[str]] = {}
+    for pod in get_target_pods():
+        service_pods.setdefault(pod.rsplit('-', 1)[0], []).append(pod)
+    return service_pods
+
+
+def _beijing_to_ns(date: str, clock: str) -> int:
+    return int(pd.Timestamp(f'{date} {clock}').value) - BEIJING_OFFSET_NS
+
+
+def _fault_mask(timestamps: np.ndarray, faults: Sequence[Tuple[int, int]]) -> np.ndarray:
+    mask = np.zeros(len(timestamps), dtype=bool)
+    for start, end in faults:
+        mask |= (timestamps >= start) & (timestamps <= end)
+    return mask
+
+
+def _hex_ids(rng: np.random.Generator, n: int) -> List[str]:
+    return [f'{value:016x}' for value in rng.integers(0, 2 ** 63, size=n, dtype=np.int64)]
+
+
+def generate_trace_hour(rng: np.random.Generator, hour_start_ns: int, traces_per_minute: int,
+                        faults: Sequence[Tuple[int, int]]) -> pd.DataFrame:
+    """
+    生成一小时的trace span，每条trace按TRACE_TEMPLATE展开
+
+    参数:
+        rng: 随机数生成器
+        hour_start_ns: 该小时开始的UTC纳秒时间戳
+        traces_per_minute: 每分钟trace数
+        faults: 故障时间段列表 (start_ns, end_ns)
+
+    返回:
+        pd.DataFrame: trace-parquet格式的span
+    """
+    pod_nodes, service_pods = _pod_nodes(), _service_pods()
+    num_traces = traces_per_minute * 60
+    trace_starts = np.sort(hour_start_ns + rng.integers(0, 3600 * 1_000_000_000, size=num_traces))
+    trace_ids = _hex_ids(rng, num_traces)
+    in_fault = _fault_mask(trace_starts, faults)
+
+    rows = []
+    for t in range(num_traces):
+        span_ids = _hex_ids(rng, len(TRACE_TEMPLATE))
+        offset_us = 0
+        for index, parent, service, operation in TRACE_TEMPLATE:
+            pod = service_pods[service][rng.integers(len(service_pods[service]))]
+            duration = int(rng.gamma(4.0, BASE_LATENCY_US[service] / 4.0))
+            status_code = '0'
+            if in_fault[t] and pod == FAULT_POD:
+                duration = int(duration * FAULT_LATENCY_FACTOR)
+                if rng.random() < FAULT_ERROR_RATE:
+                    status_code = '14'
+            start_us = trace_starts[t] // 1000 + offset_us
+            offset_us += int(rng.integers(50, 500))
+            tags = [{'key': 'span.kind', 'type': 'string', 'value': 'server' if parent < 0 else 'client'},
+                    {'key': 'status.code', 'type': 'int64', 'value': status_code}]
+            if status_code != '0':
+                tags.append({'key': 'status.message', 'type': 'string', 'value': 'connection refused'})
+            rows.append({
+                'traceID': trace_ids[t],
+                'spanID': span_ids[index],
+                'flags': 1,
+                'operationName': operation,
+                'references': [] if parent < 0 else [{'refType': 'CHILD_OF', 'traceID': trace_ids[t], 'spanID': span_ids[parent]}],
+                'startTime': start_us,
+                'startTimeMillis': start_us // 1000,
+                'duration': duration,
+                'tags': tags,
+                'logs': [],
+                'process': {'serviceName': 'redis' if service == 'redis-cart' else service,
+                            'tags': [{'key': 'name', 'type': 'string', 'value': pod},
+                                     {'key': 'node_name', 'type': 'string', 'value': pod_nodes[pod]},
+                                     {'key': 'ip', 'type': 'string', 'value': f'10.233.{index}.{t % 250}'}]},
+                'timestamp_ns': start_us * 1000,
+            })
+    return pd.DataFrame(rows).sort_values('timestamp_ns', ignore_index=True)
+
+
+def generate_log_hour(rng: np.random.Generator, hour_start_ns: int, logs_per_minute: int,
+                      faults: Sequence[Tuple[int, int]]) -> pd.DataFrame:
+    """
+    生成一小时的日志，故障时间段内故障pod大量输出错误日志
+
+    返回:
+        pd.DataFrame: log-parquet格式的日志
+    """
+    pod_nodes = _pod_nodes()
+    pods = get_target_pods()
+    num_logs = logs_per_minute * 60
+    timestamps = np.sort(hour_start_ns + rng.integers(0, 3600 * 1_000_000_000, size=num_logs))
+    log_pods = np.array(pods, dtype=object)[rng.integers(len(pods), size=num_logs)]
+    in_fault = _fault_mask(timestamps, faults)
+    log_pods[in_fault & (rng.random(num_logs) < 0.2)] = FAULT_POD
+    is_error = (rng.random(num_logs) < 0.02) | (in_fault & (log_pods == FAULT_POD))
+
+    messages = []
+    for error, value in zip(is_error, rng.integers(1, 1000, size=num_logs)):
+        templates = ERROR_LOG_TEMPLATES if error else LOG_TEMPLATES
+        messages.append(templates[value % len(templates)].format(id=value, ms=value % 200))
+    utc = pd.to_datetime(timestamps, unit='ns')
+    return pd.DataFrame({
+        'k8_namespace': 'hipstershop',
+        '@timestamp': utc.strftime('%Y-%m-%dT%H:%M:%S.%fZ'),
+        'agent_name': 'filebeat-server',
+        'k8_pod': log_pods,
+        'message': messages,
+        'k8_node_name': [pod_nodes[pod] for pod in log_pods],
+        'time_beijing': (utc + pd.Timedelta(hours=8)).strftime('%Y-%m-%d %H:%M:%S'),
+        'timestamp_ns': timestamps,
+    })
+
+
+def _metric_series(rng: np.random.Generator, timestamps: np.ndarray, base: float, fault: np.ndarray,
+                   factor: float = 1.0) -> np.ndarray:
+    values = np.abs(rng.normal(base, base * 0.1 + 1e-3, size=len(timestamps)))
+    values[fault] *= factor
+    return values
+
+
+def generate_metric_day(rng: np.random.Generator, date: str, day_start_ns: int, faults: Sequence[Tuple[int, int]],
+                        interval_seconds: int = METRIC_INTERVAL_SECONDS) -> Dict[str, pd.DataFrame]:
+    """
+    生成一天的全部指标文件
+
+    返回:
+        Dict[str, pd.DataFrame]: 相对metric-parquet/的文件路径 -> 数据
+    """
+    timestamps = day_start_ns + np.arange(0, 86400, interval_seconds, dtype=np.int64) * 1_000_000_000
+    times = (pd.to_datetime(timestamps, unit='ns')).strftime('%Y-%m-%dT%H:%M:%SZ')
+    fault = _fault_mask(timestamps, faults)
+    pod_nodes = _pod_nodes()
+    files = {}
+
+    def apm_frame(object_id: str, object_type: str, factor: float) -> pd.DataFrame:
+        request = _metric_series(rng, timestamps, 500.0, fault, 1.0 / factor)
+        error_ratio = _metric_series(rng, timestamps, 0.5, fault, factor * 10)
+        frame = {'time': times, 'object_id': object_id, 'object_type': object_type, 'timestamp_ns': timestamps}
+        frame.update({
+            'request': request, 'response': request * 0.99, 'rrt': _metric_series(rng, timestamps, 20.0, fault, factor),
+            'rrt_max': _metric_series(rng, timestamps, 200.0, fault, factor), 'timeout': _metric_series(rng, timestamps, 0.1, fault, factor),
+            'error': request * error_ratio / 100, 'error_ratio': error_ratio,
+            'client_error': request * error_ratio / 200, 'client_error_ratio': error_ratio / 2,
+            'server_error': request * error_ratio / 200, 'server_error_ratio': error_ratio / 2,
+        })
+        return pd.DataFrame(frame)[['time', 'object_id', 'object_type', 'timestamp_ns'] + key_metrics + ['error', 'rrt_max', 'client_error', 'server_error']]
+
+    fault_service = FAULT_POD.rsplit('-', 1)[0]
+    for service in _service_pods():
+        factor = FAULT_LATENCY_FACTOR if service == fault_service else 1.0
+        files[f'apm/service/service_{service}_{date}.parquet'] = apm_frame(service, 'service', factor)
+    for pod in get_target_pods():
+        factor = FAULT_LATENCY_FACTOR if pod == FAULT_POD else 1.0
+        files[f'apm/pod/pod_{pod}_{date}.parquet'] = apm_frame(pod, 'pod', factor)
+
+    for metric_name, file_name in get_node_metrics_files_mapping(date).items():
+        frames = []
+        for node in get_target_nodes():
+            factor = 1.5 if node == pod_nodes[FAULT_POD] else 1.0
+            frames.append(pd.DataFrame({'time': times, 'instance': f'{node}:9100', 'kpi_key': metric_name, 'kubernetes_node': node,
+                                        metric_name: _metric_series(rng, timestamps, 100.0, fault, factor), 'timestamp_ns': timestamps}))
+        files[f'infra/infra_node/{file_name}'] = pd.concat(frames, ignore_index=True)
+
+    for metric_name, file_name in get_pod_metrics_files_mapping(date).items():
+        frames = []
+        for pod, node in pod_nodes.items():
+            factor = 3.0 if pod == FAULT_POD else 1.0
+            frames.append(pd.DataFrame({'time': times, 'instance': node, 'kpi_key': metric_name, 'namespace': 'hipstershop', 'pod': pod,
+                                        metric_name: _metric_series(rng, timestamps, 10.0, fault, factor), 'timestamp_ns': timestamps}))
+        files[f'infra/infra_pod/{file_name}'] = pd.concat(frames, ignore_index=True)
+
+    directories = get_tidb_services_directories()
+    for service_name, metric_files in get_tidb_services_files_mapping(date).items():
+        for metric_name, file_name in metric_files.items():
+            files[f'{directories[service_name]}/{file_name}'] = pd.DataFrame({
+                'time': times, 'instance': f'{service_name}-0', 'kpi_key': metric_name, 'namespace': 'tidb',
+                metric_name: _metric_series(rng, timestamps, 50.0, fault, 1.0), 'timestamp_ns': timestamps})
+    return files
+
+
+def _write(df: pd.DataFrame, path: str, row_group_size: Optional[int] = None) -> int:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    df.to_parquet(path, index=False, row_group_size=row_group_size)
+    return os.path.getsize(path)
+
+
+def write_input_timestamps(root: str, date: str, faults: Sequence[Tuple[str, str]]) -> str:
+    """
+    写入与input/input_timestamp.csv字段一致的故障时间表
+    """
+    rows = []
+    for i, (start_clock, end_clock) in enumerate(faults):
+        start_ns, end_ns = _beijing_to_ns(date, start_clock), _beijing_to_ns(date, end_clock)
+        start_utc, end_utc = pd.Timestamp(start_ns, tz='UTC'), pd.Timestamp(end_ns, tz='UTC')
+        start_bj, end_bj = start_utc.tz_convert('Asia/Shanghai'), end_utc.tz_convert('Asia/Shanghai')
+        rows.append({
+            'uuid': f'synthetic-{i}', 'start_time_utc': str(start_utc), 'end_time_utc': str(end_utc),
+            'start_time_beijing': str(start_bj), 'end_time_beijing': str(end_bj),
+            'start_timestamp': start_ns, 'end_timestamp': end_ns, 'date': date,
+            'hour': start_bj.strftime('%H-00-00'), 'start_time_hour': start_bj.strftime('%Y-%m-%d_%H'),
+            'duration_seconds': (end_ns - start_ns) / 1e9, 'duration_minutes': (end_ns - start_ns) / 6e10,
+            'Anomaly Description': f'The system experienced an anomaly from {start_utc.isoformat()} to {end_utc.isoformat()}.',
+        })
+    path = os.path.join(root, 'input', 'input_timestamp.csv')
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    pd.DataFrame(rows).to_csv(path, index=False)
+    return path
+
+
+def generate_dataset(root: str, date: str = SYNTHETIC_DATE, scale: str = 'small',
+                     faults: Sequence[Tuple[str, str]] = DEFAULT_FAULTS, seed: int = SYNTHETIC_SEED) -> Dict[str, int]:
+    """
+    在root下生成一天的合成数据集（root相当于项目根目录，数据写入root/data/，故障表写入root/input/）
+
+    参数:
+        root: 输出根目录
+        date: 日期（北京时间），格式如 "2025-06-06"
+        scale: SCALES中的数据规模
+        faults: 故障时间段列表，元素为北京时间的 ("HH:MM:SS", "HH:MM:SS")
+        seed: 随机种子
+
+    返回:
+        Dict[str, int]: 每种模态的 行数 与 字节数
+    """
+    config = SCALES[scale]
+    rng = np.random.default_rng(seed)
+    fault_ns = [(_beijing_to_ns(date, start), _beijing_to_ns(date, end)) for start, end in faults]
+    day_dir = os.path.join(root, 'data', date)
+    day_start_ns = _beijing_to_ns(date, '00:00:00')
+    stats = {'log_rows': 0, 'trace_rows': 0, 'metric_rows': 0, 'bytes': 0}
+
+    for hour in config['hours']:
+        hour_name = f'{date}_{hour:02d}-00-00'
+        hour_start_ns = day_start_ns + hour * 60 * MINUTE_NS
+        df_trace = generate_trace_hour(rng, hour_start_ns, config['traces_per_minute'], fault_ns)
+        stats['bytes'] += _write(df_trace, os.path.join(day_dir, 'trace-parquet', f'trace_jaeger-span_{hour_name}.parquet'), row_group_size=20000)
+        stats['trace_rows'] += len(df_trace)
+        df_log = generate_log_hour(rng, hour_start_ns, config['logs_per_minute'], fault_ns)
+        stats['bytes'] += _write(df_log, os.path.join(day_dir, 'log-parquet', f'log_filebeat-server_{hour_name}.parquet'), row_group_size=20000)
+        stats['log_rows'] += len(df_log)
+
+    for rel_path, df in generate_metric_day(rng, date, day_start_ns, fault_ns).items():
+        stats['bytes'] += _write(df, os.path.join(day_dir, 'metric-parquet', rel_path))
+        stats['metric_rows'] += len(df)
+
+    write_input_timestamps(root, date, faults)
+    print(f"合成数据集 {root} ({scale}): trace {stats['trace_rows']}行，日志 {stats['log_rows']}行，"
+          f"指标 {stats['metric_rows']}行，共{stats['bytes'] / 1024 / 1024:.1f}MB")
+    return stats
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='生成与data/结构兼容的合成遥测数据')
+    parser.add_argument('root', help='输出根目录，数据写入<root>/data/，故障表写入<root>/input/')
+    parser.add_argument('--scale', choices=list(SCALES), default='small', help='数据规模')
+    parser.add_argument('--date', default=SYNTHETIC_DATE, help='日期（北京时间）')
+    parser.add_argument('--seed', type=int, default=SYNTHETIC_SEED, help='随机种子')
+    args = parser.parse_args()
+    generate_dataset(args.root, date=args.date, scale=args.scale, seed=args.seed)
@@ -0,0 +1,101 @@
+"""
+基准测试的数据工作区
+
+工作区相当于一个独立的项目根目录（data/、input/、dataRefinement/IsolationForest/、cache/），首次使用时
+用合成数据生成器生成并训练trace异常检测器，之后复用。use_workspace把数据目录索引、trace/metric分析、
+热存储、指标预聚合和指标基线的路径都指向工作区，不会读写真实的data/和cache/
+"""
+import os
+import sys
+import time
+import contextlib
+from typing import Dict, Iterator
+
+import pandas as pd
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from benchmarks.synthetic_telemetry import SYNTHETIC_DATE, generate_dataset
+from dataRefinement import data_catalog, hot_store, metric_baseline, metric_refinement, metric_rollup, trace_refinement
+
+# ========== 基准测试工作区配置 ==========
+WORKSPACE_ROOT = os.environ.get('BENCH_WORKSPACE', os.path.join(project_root, 'cache', 'benchmarks'))
+BENCH_SCALE = os.environ.get('BENCH_SCALE', 'small')
+BENCH_DATE = SYNTHETIC_DATE
+READY_MARKER = '.ready'
+
+_active: Dict[str, str] = {}
+
+
+@contextlib.contextmanager
+def quiet() -> Iterator[None]:
+    """
+    屏蔽标准输出，退出时关闭打开的os.devnull
+    """
+    with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+        yield
+
+
+def use_workspace(root: str) -> None:
+    """
+    让各数据处理模块使用工作区中的数据
+    """
+    if _active.get('root') == root:
+        return
+    data_catalog._catalog = data_catalog.DataCatalog(os.path.join(root, 'data'), os.path.join(root, 'cache', 'data_catalog.json'))
+    with quiet():
+        data_catalog._catalog.build()
+    trace_refinement.project_root = root
+    metric_refinement.project_root = root
+    hot_store.HOT_STORE_ROOT = os.path.join(root, 'cache', 'hot_store')
+    metric_rollup.ROLLUP_ROOT = os.path.join(root, 'cache', 'metric_rollup')
+    metric_rollup._rollup_cache.clear()
+    metric_baseline.BASELINE_PATH = os.path.join(root, 'cache', 'metric_baseline.pkl')
+    metric_baseline._engine_cache.clear()
+    _active['root'] = root
+
+
+def _train_detectors() -> None:
+    """
+    按trace_refinement的流程在工作区数据上训练并保存trace异常检测器
+    """
+    detector_file = os.path.join(trace_refinement.project_root, 'dataRefinement', 'IsolationForest', 'trace_detectors.pkl')
+    normal_traces = trace_refinement._process_trace_samples(
+        sample_size=trace_refinement.SAMPLE_SIZE, random_seed=trace_refinement.RANDOM_SEED,
+        output_path=os.path.join(os.path.dirname(detector_file), 'merged_traces.parquet'),
+        minutes_after=trace_refinement.MINUTES_AFTER,
+    )
+    trace_refinement._train_anomaly_detection_model(normal_traces, output_path=detector_file)
+
+
+def get_workspace(scale: str = BENCH_SCALE) -> str:
+    """
+    获取（必要时生成）指定规模的工作区并切换到该工作区
+
+    参数:
+        scale: 合成数据规模，见synthetic_telemetry.SCALES
+
+    返回:
+        str: 工作区根目录
+    """
+    root = os.path.join(WORKSPACE_ROOT, scale)
+    if not os.path.exists(os.path.join(root, READY_MARKER)):
+        start_time = time.time()
+        with quiet():
+            generate_dataset(root, date=BENCH_DATE, scale=scale)
+            use_workspace(root)
+            _train_detectors()
+            metric_rollup.build_day_rollup(BENCH_DATE)
+        with open(os.path.join(root, READY_MARKER), 'w') as f:
+            f.write(scale)
+        print(f"已生成基准测试工作区 {root}，耗时{time.time() - start_time:.1f}秒")
+    use_workspace(root)
+    return root
+
+
+def load_faults(root: str) -> pd.DataFrame:
+    """
+    读取工作区的故障时间表（格式同input/input_timestamp.csv）
+    """
+    return pd.read_csv(os.path.join(root, 'input', 'input_timestamp.csv'))
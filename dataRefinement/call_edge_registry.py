@@ -0,0 +1,205 @@
+"""
+调用边（call edge）注册表
+
+把 (parent_pod, child_pod, node_name, operationName) 四元组分配为稳定的整数ID：trace数据帧带上紧凑的
+edge_id列后，按调用组分组和查找检测器都用整数完成，不再为每个故障的每个组重新拼接字符串。
+
+训练检测器时注册表随模型一起保存为 call_edges.json；检测器、检测器存储和正常数据统计信息以四元组的JSON编码
+（edge_key()，如 '["frontend-0", "cartservice-1", "aiops-k8s-05", "hipstershop.CartService/GetCart"]'）为键保存，
+注册表为每条边缓存一次对应的键（key()）。旧模型以 f"{parent}_{child}_{node}_{op}" 拼接字符串为键
+（operation含'_'时有歧义），加载时由migrate_legacy_keys()转换为JSON键
+"""
+import os
+import json
+import threading
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+
+from dataRefinement.model_registry import get_registry
+
+# ========== 调用边注册表配置 ==========
+CALL_EDGES_FILENAME = 'call_edges.json'  # 与trace_detectors.pkl位于同一目录
+CALL_EDGES_VERSION = 1
+EDGE_COLUMNS = ['parent_pod', 'child_pod', 'node_name', 'operationName']
+
+CallEdge = Tuple[str, str, str, str]
+
+
+def edge_key(edge: CallEdge) -> str:
+    """
+    调用边的持久化键：四元组的JSON编码，不同的调用边一定得到不同的键
+    """
+    return json.dumps(list(edge), ensure_ascii=False)
+
+
+def parse_edge_key(key: str) -> Optional[CallEdge]:
+    """
+    解析edge_key()生成的键，不是JSON键（如旧式拼接字符串）时返回None
+    """
+    if not key.startswith('['):
+        return None
+    try:
+        edge = json.loads(key)
+    except ValueError:
+        return None
+    return tuple(edge) if isinstance(edge, list) and len(edge) == len(EDGE_COLUMNS) else None
+
+
+def legacy_name(edge: CallEdge) -> str:
+    """
+    旧模型使用的拼接字符串键
+    """
+    return '_'.join(str(part) for part in edge)
+
+
+def migrate_legacy_keys(mapping: Dict[str, Any], edges: Iterable[CallEdge] = ()) -> Dict[str, Any]:
+    """
+    把以旧式拼接字符串为键的字典（检测器、正常数据统计信息）转换为以edge_key()为键，已是JSON键的项原样保留
+
+    旧式键先在已知调用边（如随模型保存的调用边注册表）中按legacy_name()反查；找不到时按前三个字段不含'_'
+    （pod名和节点名只含'-'）拆分。多条调用边拼接出同一个旧式键时无法确定对应哪条边，丢弃该项并给出警告
+
+    参数:
+        mapping: 待转换的字典
+        edges: 已知的调用边
+
+    返回:
+        Dict[str, Any]: 以edge_key()为键的字典
+    """
+    if all(parse_edge_key(key) is not None for key in mapping):
+        return mapping
+    candidates: Dict[str, List[CallEdge]] = {}
+    for edge in edges:
+        candidates.setdefault(legacy_name(edge), []).append(edge)
+    migrated = {}
+    for key, value in mapping.items():
+        if parse_edge_key(key) is not None:
+            migrated[key] = value
+            continue
+        matches = candidates.get(key) or [tuple(key.split('_', len(EDGE_COLUMNS) - 1))]
+        if len(matches) > 1 or len(matches[0]) != len(EDGE_COLUMNS):
+            print(f"警告: 旧式组名 {key} 无法唯一对应到调用边（候选: {matches}），已跳过")
+            continue
+        migrated[edge_key(matches[0])] = value
+    return migrated
+
+
+class CallEdgeRegistry:
+    """
+    四元组 <-> 整数ID 的双向映射，ID按分配顺序从0开始且不会改变
+    """
+
+    def __init__(self, edges: Iterable[CallEdge] = ()):
+        self._edges: List[CallEdge] = []
+        self._keys: List[str] = []
+        self._ids: Dict[CallEdge, int] = {}
+        self._lock = threading.Lock()
+        for edge in edges:
+            self.intern(edge)
+
+    def __len__(self) -> int:
+        return len(self._edges)
+
+    def intern(self, edge: CallEdge) -> int:
+        """
+        返回调用边的ID，未注册时分配新ID
+        """
+        edge_id = self._ids.get(edge)
+        if edge_id is not None:
+            return edge_id
+        with self._lock:
+            edge_id = self._ids.get(edge)
+            if edge_id is None:
+                edge_id = len(self._edges)
+                self._edges.append(edge)
+                self._keys.append(edge_key(edge))
+                self._ids[edge] = edge_id
+        return edge_id
+
+    def get(self, edge: CallEdge) -> Optional[int]:
+        return self._ids.get(edge)
+
+    def edge(self, edge_id: int) -> CallEdge:
+        return self._edges[edge_id]
+
+    def edges(self) -> List[CallEdge]:
+        return list(self._edges)
+
+    def key(self, edge_id: int) -> str:
+        """
+        调用边的持久化键（检测器和正常数据统计信息的键，见edge_key()）
+        """
+        return self._keys[edge_id]
+
+    def id_for_key(self, key: str) -> Optional[int]:
+        edge = parse_edge_key(key)
+        return self._ids.get(edge) if edge is not None else None
+
+    def assign(self, df: pd.DataFrame, intern: bool = True) -> np.ndarray:
+        """
+        为trace数据帧的每一行计算edge_id：只对去重后的四元组查表，再按行展开
+
+        参数:
+            df: 含 parent_pod、child_pod、node_name、operationName 列的数据
+            intern: 是否为未注册的调用边分配新ID；为False时未注册的记为-1
+
+        返回:
+            np.ndarray: 每行的edge_id，四个字段中有空值的行为-1（与groupby默认丢弃空值键一致）
+        """
+        edge_ids = np.full(len(df), -1, dtype=np.int64)
+        if len(df) == 0:
+            return edge_ids
+        keys = df[EDGE_COLUMNS]
+        valid = keys.notna().all(axis=1).to_numpy()
+        if not valid.any():
+            return edge_ids
+        codes, uniques = pd.MultiIndex.from_frame(keys[valid]).factorize()
+        if intern:
+            unique_ids = np.array([self.intern(tuple(edge)) for edge in uniques], dtype=np.int64)
+        else:
+            unique_ids = np.array([self._ids.get(tuple(edge), -1) for edge in uniques], dtype=np.int64)
+        edge_ids[valid] = unique_ids[codes]
+        return edge_ids
+
+    def save(self, path: str) -> None:
+        """
+        以临时文件+rename的方式原子保存
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CALL_EDGES_VERSION, 'edges': [list(edge) for edge in self._edges]}, f, ensure_ascii=False)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: str) -> 'CallEdgeRegistry':
+        """
+        异常:
+            ValueError: 文件格式版本不符
+        """
+        with open(path, 'r', encoding='utf-8') as f:
+            payload = json.load(f)
+        if payload.get('version') != CALL_EDGES_VERSION:
+            raise ValueError(f"调用边注册表 {path} 的格式版本为{payload.get('version')}，当前代码需要{CALL_EDGES_VERSION}")
+        return cls(tuple(edge) for edge in payload['edges'])
+
+
+_fallback_registries: Dict[str, CallEdgeRegistry] = {}
+
+
+def get_call_edges(path: str) -> CallEdgeRegistry:
+    """
+    获取进程内共享的调用边注册表：文件存在时通过模型注册表加载（文件更新后重新加载），
+    不存在（旧模型）时返回一个运行中按需分配ID的注册表
+
+    参数:
+        path: call_edges.json的路径
+    """
+    if os.path.exists(path):
+        try:
+            return get_registry().get('call_edges', [path], lambda: CallEdgeRegistry.load(path))
+        except ValueError as e:
+            print(f"{e}，改为运行中分配调用边ID")
+    return _fallback_registries.setdefault(path, CallEdgeRegistry())
@@ -0,0 +1,292 @@
+"""
+data/目录的故障窗口索引（数据目录）
+
+一次扫描data/下的log、trace、metric parquet文件，只读取parquet元数据，记录每个文件及其每个row group的
+行数和timestamp_ns最小/最大值，并按文件mtime和大小增量持久化到cache/。之后按小时或按时间范围查找文件，
+不再对每个故障、每种文件类型重复执行glob/listdir，也能找出跨小时边界的故障窗口涉及的全部文件
+"""
+import os
+import re
+import json
+import time
+import bisect
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import asdict, dataclass, field
+from typing import Dict, List, Optional, Tuple
+
+import pyarrow.parquet as pq
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ========== 数据目录配置 ==========
+DATA_ROOT = os.path.join(project_root, 'data')
+CATALOG_PATH = os.path.join(project_root, 'cache', 'data_catalog.json')
+CATALOG_VERSION = 1
+TIMESTAMP_COLUMN = 'timestamp_ns'
+SCAN_WORKERS = 8  # 读取parquet元数据的线程数
+
+# 模态 -> data/{date}/ 下的子目录
+MODALITY_DIRS = {
+    'log': 'log-parquet',
+    'trace': 'trace-parquet',
+    'metric': 'metric-parquet',
+}
+
+HOUR_PATTERN = re.compile(r'\d{4}-\d{2}-\d{2}_\d{2}')
+
+
+@dataclass
+class CatalogFile:
+    """
+    单个parquet文件的索引信息，row_groups中每项为 [行数, 最小时间戳, 最大时间戳]
+    """
+    path: str  # 相对data/的路径
+    modality: str
+    date: str
+    category: str  # 模态目录下的子目录，如metric的apm/service
+    hour: Optional[str]
+    mtime: float
+    size: int
+    num_rows: int
+    min_ts: Optional[int]
+    max_ts: Optional[int]
+    row_groups: List[List[Optional[int]]] = field(default_factory=list)
+    data_root: str = DATA_ROOT
+
+    @property
+    def abspath(self) -> str:
+        return os.path.join(self.data_root, self.path)
+
+    def overlaps(self, start_ts: int, end_ts: int) -> bool:
+        # 没有时间戳统计的文件无法排除，视为重叠
+        if self.min_ts is None or self.max_ts is None:
+            return True
+        return self.min_ts <= end_ts and self.max_ts >= start_ts
+
+    def row_groups_in_range(self, start_ts: int, end_ts: int) -> List[int]:
+        """
+        与时间范围重叠的row group序号
+        """
+        return [i for i, (_, rg_min, rg_max) in enumerate(self.row_groups)
+                if rg_min is None or rg_max is None or (rg_min <= end_ts and rg_max >= start_ts)]
+
+
+def _read_file_index(data_root: str, abspath: str, rel_path: str, modality: str, date: str, category: str) -> Optional[CatalogFile]:
+    """
+    读取parquet元数据生成文件索引；元数据中没有时间戳统计时只读取时间戳列计算
+    """
+    try:
+        stat = os.stat(abspath)
+        parquet_file = pq.ParquetFile(abspath)
+        metadata = parquet_file.metadata
+        schema_names = metadata.schema.names
+        row_groups = []
+        if TIMESTAMP_COLUMN in schema_names:
+            column_index = schema_names.index(TIMESTAMP_COLUMN)
+            for i in range(metadata.num_row_groups):
+                row_group = metadata.row_group(i)
+                statistics = row_group.column(column_index).statistics
+                if statistics is not None and statistics.has_min_max:
+                    rg_min, rg_max = int(statistics.min), int(statistics.max)
+                else:
+                    column = parquet_file.read_row_group(i, columns=[TIMESTAMP_COLUMN]).column(0)
+                    rg_min = int(column.min().as_py()) if len(column) else None
+                    rg_max = int(column.max().as_py()) if len(column) else None
+                row_groups.append([row_group.num_rows, rg_min, rg_max])
+        else:
+            row_groups = [[metadata.row_group(i).num_rows, None, None] for i in range(metadata.num_row_groups)]
+
+        mins = [rg[1] for rg in row_groups if rg[1] is not None]
+        maxs = [rg[2] for rg in row_groups if rg[2] is not None]
+        hour_match = HOUR_PATTERN.search(os.path.basename(rel_path))
+        return CatalogFile(
+            path=rel_path, modality=modality, date=date, category=category,
+            hour=hour_match.group(0) if hour_match else None,
+            mtime=stat.st_mtime, size=stat.st_size, num_rows=metadata.num_rows,
+            min_ts=min(mins) if mins else None, max_ts=max(maxs) if maxs else None,
+            row_groups=row_groups, data_root=data_root,
+        )
+    except Exception as e:
+        print(f"读取parquet元数据失败 {abspath}: {e}")
+        return None
+
+
+class DataCatalog:
+    """
+    data/目录的文件索引，支持按模态、日期、子目录、小时和时间范围查找
+    """
+
+    def __init__(self, data_root: str = DATA_ROOT, catalog_path: Optional[str] = CATALOG_PATH):
+        """
+        参数:
+            data_root: 数据根目录
+            catalog_path: 索引持久化路径，None表示不持久化
+        """
+        self.data_root = data_root
+        self.catalog_path = catalog_path
+        self._files: Dict[str, CatalogFile] = {}
+        self._by_modality: Dict[str, List[CatalogFile]] = {}
+        self._min_ts_keys: Dict[str, List[int]] = {}
+
+    def _load(self) -> None:
+        if not self.catalog_path or not os.path.exists(self.catalog_path):
+            return
+        try:
+            with open(self.catalog_path, 'r', encoding='utf-8') as f:
+                payload = json.load(f)
+            if payload.get('version') == CATALOG_VERSION and payload.get('data_root') == self.data_root:
+                self._files = {item['path']: CatalogFile(**item) for item in payload['files']}
+        except (OSError, ValueError, TypeError) as e:
+            print(f"读取数据目录索引失败，将重新构建: {e}")
+            self._files = {}
+
+    def _save(self) -> None:
+        if not self.catalog_path:
+            return
+        os.makedirs(os.path.dirname(self.catalog_path), exist_ok=True)
+        tmp_path = f"{self.catalog_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({'version': CATALOG_VERSION, 'data_root': self.data_root,
+                       'files': [asdict(item) for item in self._files.values()]}, f)
+        os.replace(tmp_path, self.catalog_path)
+
+    def _scan(self) -> List[Tuple[str, str, str, str, str]]:
+        """
+        遍历data/{date}/{模态目录}/，返回 (绝对路径, 相对路径, 模态, 日期, 子目录) 列表
+        """
+        entries = []
+        if not os.path.isdir(self.data_root):
+            return entries
+        for date in sorted(os.listdir(self.data_root)):
+            for modality, modality_dir in MODALITY_DIRS.items():
+                base_dir = os.path.join(self.data_root, date, modality_dir)
+                if not os.path.isdir(base_dir):
+                    continue
+                for dirpath, _, filenames in os.walk(base_dir):
+                    category = os.path.relpath(dirpath, base_dir).replace(os.sep, '/')
+                    category = '' if category == '.' else category
+                    for filename in filenames:
+                        if not filename.endswith('.parquet'):
+                            continue
+                        abspath = os.path.join(dirpath, filename)
+                        entries.append((abspath, os.path.relpath(abspath, self.data_root).replace(os.sep, '/'),
+                                        modality, date, category))
+        return entries
+
+    def build(self, refresh: bool = False) -> 'DataCatalog':
+        """
+        构建索引：加载已持久化的索引，只重新读取新增或mtime/大小变化的文件
+
+        参数:
+            refresh: 是否忽略已持久化的索引，全部重新读取
+
+        返回:
+            DataCatalog: self
+        """
+        start_time = time.time()
+        if not refresh:
+            self._load()
+        entries = self._scan()
+        files = {}
+        stale = []
+        for abspath, rel_path, modality, date, category in entries:
+            cached = self._files.get(rel_path)
+            stat = os.stat(abspath)
+            if cached is not None and cached.mtime == stat.st_mtime and cached.size == stat.st_size:
+                files[rel_path] = cached
+            else:
+                stale.append((abspath, rel_path, modality, date, category))
+
+        if stale:
+            with ThreadPoolExecutor(max_workers=SCAN_WORKERS) as executor:
+                for item in executor.map(lambda args: _read_file_index(self.data_root, *args), stale):
+                    if item is not None:
+                        files[item.path] = item
+
+        changed = bool(stale) or len(files) != len(self._files)
+        self._files = files
+        self._reindex()
+        if changed:
+            self._save()
+        print(f"数据目录索引: {len(files)}个文件，重新读取元数据{len(stale)}个，耗时{time.time() - start_time:.2f}秒")
+        return self
+
+    def _reindex(self) -> None:
+        self._by_modality = {}
+        for item in self._files.values():
+            self._by_modality.setdefault(item.modality, []).append(item)
+        for modality, items in self._by_modality.items():
+            # 没有时间戳统计的文件排在最前，时间范围查找时总会被检查
+            items.sort(key=lambda item: (item.min_ts is not None, item.min_ts or 0, item.path))
+            self._min_ts_keys[modality] = [item.min_ts if item.min_ts is not None else -1 for item in items]
+
+    def files(self, modality: str, date: Optional[str] = None, category: Optional[str] = None) -> List[CatalogFile]:
+        """
+        按模态列出文件，可按日期和子目录（如metric的'apm/service'）过滤，结果按路径排序
+        """
+        return sorted((item for item in self._by_modality.get(modality, [])
+                       if (date is None or item.date == date) and (category is None or item.category == category)),
+                      key=lambda item: item.path)
+
+    def find_by_hour(self, modality: str, start_time_hour: str) -> List[CatalogFile]:
+        """
+        按文件名中的小时（如'2025-06-06_00'）查找，等价于原来的 glob('data/*/{模态目录}/*{start_time_hour}*')
+        """
+        return sorted((item for item in self._by_modality.get(modality, [])
+                       if start_time_hour in os.path.basename(item.path)),
+                      key=lambda item: item.path)
+
+    def find_files(self, modality: str, start_ts: int, end_ts: int, category: Optional[str] = None) -> List[CatalogFile]:
+        """
+        查找与时间范围 [start_ts, end_ts] 重叠的全部文件，按最小时间戳排序；故障窗口跨小时时返回多个文件
+
+        参数:
+            modality: 'log'、'trace'或'metric'
+            start_ts: 开始时间戳（纳秒）
+            end_ts: 结束时间戳（纳秒）
+            category: 子目录过滤
+
+        返回:
+            List[CatalogFile]: 重叠的文件
+        """
+        items = self._by_modality.get(modality, [])
+        # 最小时间戳大于end_ts的文件不可能重叠
+        upper = bisect.bisect_right(self._min_ts_keys.get(modality, []), int(end_ts))
+        return [item for item in items[:upper]
+                if item.overlaps(int(start_ts), int(end_ts)) and (category is None or item.category == category)]
+
+    def get(self, path: str) -> Optional[CatalogFile]:
+        """
+        按绝对路径或相对data/的路径获取文件索引
+        """
+        if os.path.isabs(path):
+            path = os.path.relpath(path, self.data_root).replace(os.sep, '/')
+        return self._files.get(path)
+
+
+_catalog: Optional[DataCatalog] = None
+_catalog_lock = threading.Lock()
+
+
+def get_catalog(refresh: bool = False) -> DataCatalog:
+    """
+    获取进程内共享的数据目录索引，首次调用时构建
+
+    参数:
+        refresh: 是否重新扫描data/（只重新读取有变化的文件）
+    """
+    global _catalog
+    with _catalog_lock:
+        if _catalog is None:
+            _catalog = DataCatalog().build()
+        elif refresh:
+            _catalog.build()
+        return _catalog
+
+
+if __name__ == '__main__':
+    catalog = get_catalog()
+    for modality in MODALITY_DIRS:
+        items = catalog.files(modality)
+        print(f"{modality}: {len(items)}个文件，{sum(item.num_rows for item in items)}行")
@@ -0,0 +1,306 @@
+"""
+按调用组存储的trace异常检测器
+
+替代整体pickle的 trace_detectors.pkl：每个调用组的检测器单独保存为
+一个文件（pickle协议5），SQLite索引记录组名（调用边的edge_key()）、文件名、
+版本号和正常数据统计信息。故障分析只加载当前时间窗口中出现的调用组；单个组的更新先写新文件再在事务中
+切换索引，读取方看到的要么是旧版本要么是新版本。组文件不做内存映射，第一次访问时整体读入、反序列化后缓存在进程内。
+
+每个组文件以一个不经过pickle的文件头开始：魔数、头部长度和JSON编码的 {格式版本号, 组名}。读取时先校验文件头，
+版本或组名与索引不符时在反序列化之前就拒绝加载；索引同样带有格式版本号
+
+目录结构:
+    detector_store/index.sqlite
+    detector_store/groups/{组名哈希}-{版本}.pkl   文件头 + pickle数据
+
+用法（把已有的 trace_detectors.pkl 转换为检测器存储）:
+    python -m dataRefinement.detector_store
+"""
+import os
+import sys
+import json
+import time
+import pickle
+import shutil
+import struct
+import sqlite3
+import hashlib
+import threading
+from collections.abc import Mapping
+from typing import Any, Dict, Iterator, Optional, Set
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from dataRefinement.call_edge_registry import CALL_EDGES_FILENAME, CallEdgeRegistry, migrate_legacy_keys
+
+# ========== 检测器存储配置 ==========
+USE_DETECTOR_STORE = True  # trace异常检测时是否优先使用检测器存储（不存在时由pickle自动转换）
+DETECTOR_STORE_SCHEMA_VERSION = 3  # 2: 组名由拼接字符串改为调用边的edge_key()；3: 组文件带有pickle之前的文件头
+DETECTOR_STORE_DIRNAME = 'detector_store'  # 位于模型目录（dataRefinement/IsolationForest）下
+# 不用joblib：IsolationForest的每棵树都是若干很小的数组，joblib逐个包装后加载比pickle慢一个数量级，
+# 且sklearn反序列化树结构时本身会复制节点数组，即使用joblib的mmap_mode也省不了内存
+DETECTOR_PICKLE_PROTOCOL = 5
+GROUP_FILE_MAGIC = b'TDET'
+_HEADER_LENGTH = struct.Struct('<I')
+
+
+def _group_file_prefix(name: str) -> str:
+    return hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+
+
+def _write_group_file(f, name: str, detectors: Dict[str, Any]) -> None:
+    header = json.dumps({'schema_version': DETECTOR_STORE_SCHEMA_VERSION, 'name': name}, ensure_ascii=False).encode('utf-8')
+    f.write(GROUP_FILE_MAGIC + _HEADER_LENGTH.pack(len(header)) + header)
+    pickle.dump(detectors, f, protocol=DETECTOR_PICKLE_PROTOCOL)
+
+
+def _read_group_file(path: str, name: str) -> Dict[str, Any]:
+    """
+    读取组文件：先读取并校验文件头，通过后才反序列化检测器
+
+    异常:
+        ValueError: 不是组文件，或文件头中的格式版本、组名与索引不一致
+    """
+    with open(path, 'rb') as f:
+        prefix = f.read(len(GROUP_FILE_MAGIC) + _HEADER_LENGTH.size)
+        if len(prefix) < len(GROUP_FILE_MAGIC) + _HEADER_LENGTH.size or not prefix.startswith(GROUP_FILE_MAGIC):
+            raise ValueError(f"检测器文件 {path} 缺少文件头，可能是旧格式的存储")
+        (header_length,) = _HEADER_LENGTH.unpack_from(prefix, len(GROUP_FILE_MAGIC))
+        try:
+            header = json.loads(f.read(header_length).decode('utf-8'))
+        except ValueError:
+            raise ValueError(f"检测器文件 {path} 的文件头无法解析")
+        if header.get('schema_version') != DETECTOR_STORE_SCHEMA_VERSION or header.get('name') != name:
+            raise ValueError(f"检测器文件 {path} 与索引不一致（格式版本{header.get('schema_version')}，组 {header.get('name')}）")
+        return pickle.load(f)
+
+
+def store_schema_version(root: str) -> Optional[int]:
+    """
+    读取已有存储的格式版本，存储不存在或无法读取时返回None
+    """
+    index_path = os.path.join(root, 'index.sqlite')
+    if not os.path.exists(index_path):
+        return None
+    try:
+        conn = sqlite3.connect(index_path, timeout=60)
+        try:
+            row = conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()
+        finally:
+            conn.close()
+    except sqlite3.Error:
+        return None
+    return int(row[0]) if row else None
+
+
+class DetectorStore:
+    """
+    检测器存储：SQLite索引 + 每组一个pickle文件，按需加载并在进程内缓存
+    """
+
+    def __init__(self, root: str, create: bool = False):
+        """
+        参数:
+            root: 存储目录
+            create: 存储不存在时是否创建（已有存储的格式版本不符时删除后重建）；为False且不存在时抛出FileNotFoundError
+
+        异常:
+            ValueError: 索引的格式版本与当前代码不一致
+        """
+        self.root = root
+        self.index_path = os.path.join(root, 'index.sqlite')
+        self.groups_dir = os.path.join(root, 'groups')
+        if not create and not os.path.exists(self.index_path):
+            raise FileNotFoundError(self.index_path)
+        schema_version = store_schema_version(root)
+        if create and schema_version not in (None, DETECTOR_STORE_SCHEMA_VERSION):
+            print(f"检测器存储 {root} 的格式版本为{schema_version}，删除后重建")
+            shutil.rmtree(root)
+        os.makedirs(self.groups_dir, exist_ok=True)
+        self._conn = sqlite3.connect(self.index_path, timeout=60, isolation_level=None, check_same_thread=False)
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS meta (
+                key TEXT PRIMARY KEY,
+                value TEXT NOT NULL
+            );
+            CREATE TABLE IF NOT EXISTS groups (
+                name TEXT PRIMARY KEY,
+                file TEXT NOT NULL,
+                version INTEGER NOT NULL,
+                normal_stats TEXT,
+                updated_at REAL NOT NULL
+            );
+        """)
+        self._conn.execute("INSERT OR IGNORE INTO meta (key, value) VALUES ('schema_version', ?)",
+                           (str(DETECTOR_STORE_SCHEMA_VERSION),))
+        schema_version = int(self._conn.execute("SELECT value FROM meta WHERE key = 'schema_version'").fetchone()[0])
+        if schema_version != DETECTOR_STORE_SCHEMA_VERSION:
+            raise ValueError(f"检测器存储 {root} 的格式版本为{schema_version}，当前代码需要{DETECTOR_STORE_SCHEMA_VERSION}")
+        self._lock = threading.Lock()
+        self._cache: Dict[str, Any] = {}  # 文件名 -> 检测器
+        self._files: Dict[str, str] = {}
+        self._normal_stats: Dict[str, Dict[str, float]] = {}
+        self.refresh()
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def refresh(self) -> None:
+        """
+        重新读取索引；已缓存且文件未变的组继续复用
+        """
+        rows = self._conn.execute("SELECT name, file, normal_stats FROM groups").fetchall()
+        with self._lock:
+            self._files = {name: file for name, file, _ in rows}
+            self._normal_stats = {name: json.loads(stats) for name, _, stats in rows if stats}
+            live = set(self._files.values())
+            self._cache = {file: value for file, value in self._cache.items() if file in live}
+
+    def names(self) -> Set[str]:
+        return set(self._files)
+
+    def normal_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        全部组的正常数据统计信息（体积很小，随索引一次读入）
+        """
+        return dict(self._normal_stats)
+
+    def get(self, name: str) -> Optional[Dict[str, Any]]:
+        """
+        加载单个组的检测器（如 {'dur_detector': IsolationForest}），组不存在时返回None
+
+        异常:
+            ValueError: 文件的格式版本或组名与索引不一致
+        """
+        file = self._files.get(name)
+        if file is None:
+            return None
+        with self._lock:
+            value = self._cache.get(file)
+        if value is not None:
+            return value
+        detectors = _read_group_file(os.path.join(self.groups_dir, file), name)
+        with self._lock:
+            self._cache[file] = detectors
+        return detectors
+
+    def put(self, name: str, detectors: Dict[str, Any], normal_stats: Optional[Dict[str, float]] = None) -> None:
+        """
+        原子地新增或替换单个组：先写入新版本文件，再在事务中切换索引，最后删除旧文件
+        （已经加载旧版本的读取方使用的是进程内缓存，不受影响）
+
+        参数:
+            name: 组名
+            detectors: 该组的检测器字典
+            normal_stats: 该组的正常数据统计信息
+        """
+        row = self._conn.execute("SELECT file, version FROM groups WHERE name = ?", (name,)).fetchone()
+        version = row[1] + 1 if row else 1
+        file = f"{_group_file_prefix(name)}-{version}.pkl"
+        path = os.path.join(self.groups_dir, file)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            _write_group_file(f, name, detectors)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+        self._conn.execute(
+            "INSERT INTO groups (name, file, version, normal_stats, updated_at) VALUES (?, ?, ?, ?, ?) "
+            "ON CONFLICT(name) DO UPDATE SET file = excluded.file, version = excluded.version, "
+            "normal_stats = excluded.normal_stats, updated_at = excluded.updated_at",
+            (name, file, version, json.dumps(normal_stats) if normal_stats is not None else None, time.time()),
+        )
+        if row and row[0] != file:
+            try:
+                os.remove(os.path.join(self.groups_dir, row[0]))
+            except OSError:
+                pass
+        with self._lock:
+            self._files[name] = file
+            if normal_stats is not None:
+                self._normal_stats[name] = normal_stats
+
+    def delete(self, name: str) -> None:
+        """
+        删除单个组
+        """
+        row = self._conn.execute("SELECT file FROM groups WHERE name = ?", (name,)).fetchone()
+        if row is None:
+            return
+        self._conn.execute("DELETE FROM groups WHERE name = ?", (name,))
+        try:
+            os.remove(os.path.join(self.groups_dir, row[0]))
+        except OSError:
+            pass
+        with self._lock:
+            self._files.pop(name, None)
+            self._normal_stats.pop(name, None)
+
+    def put_many(self, trace_detectors: Dict[str, Dict[str, Any]], normal_stats: Dict[str, Dict[str, float]]) -> None:
+        """
+        批量写入全部组并删除不再存在的组（训练完成或从pickle转换时使用）
+        """
+        for name, detectors in trace_detectors.items():
+            self.put(name, detectors, normal_stats.get(name))
+        for name in self.names() - set(trace_detectors):
+            self.delete(name)
+
+
+class LazyDetectors(Mapping):
+    """
+    只读的检测器字典视图：组名列表来自索引，检测器在第一次访问时才从存储加载，
+    可以直接替代原来的 trace_detectors 字典（in、[]、get）
+    """
+
+    def __init__(self, store: DetectorStore):
+        self.store = store
+        self._names = store.names()
+
+    def __contains__(self, name: object) -> bool:
+        return name in self._names
+
+    def __getitem__(self, name: str) -> Dict[str, Any]:
+        detectors = self.store.get(name) if name in self._names else None
+        if detectors is None:
+            raise KeyError(name)
+        return detectors
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+
+def convert_pickle(detector_file: str, normal_stats_file: str, store_dir: str) -> DetectorStore:
+    """
+    把整体pickle的检测器和正常数据统计信息转换为检测器存储。旧模型以拼接字符串为组名，转换时按同目录下的
+    调用边注册表改为edge_key()
+
+    返回:
+        DetectorStore: 转换后的存储
+    """
+    start_time = time.time()
+    with open(detector_file, 'rb') as f:
+        trace_detectors = pickle.load(f)
+    normal_stats = {}
+    if os.path.exists(normal_stats_file):
+        with open(normal_stats_file, 'rb') as f:
+            normal_stats = pickle.load(f)
+    call_edges_file = os.path.join(os.path.dirname(detector_file), CALL_EDGES_FILENAME)
+    known_edges = CallEdgeRegistry.load(call_edges_file).edges() if os.path.exists(call_edges_file) else []
+    trace_detectors = migrate_legacy_keys(trace_detectors, known_edges)
+    normal_stats = migrate_legacy_keys(normal_stats, known_edges)
+    store = DetectorStore(store_dir, create=True)
+    store.put_many(trace_detectors, normal_stats)
+    print(f"已将 {len(trace_detectors)} 个组的检测器转换为检测器存储 {store_dir}，耗时{time.time() - start_time:.2f}秒")
+    return store
+
+
+if __name__ == '__main__':
+    model_dir = os.path.join(project_root, 'dataRefinement', 'IsolationForest')
+    convert_pickle(os.path.join(model_dir, 'trace_detectors.pkl'),
+                   os.path.join(model_dir, 'trace_detectors_normal_stats.pkl'),
+                   os.path.join(model_dir, DETECTOR_STORE_DIRNAME))
@@ -1,8 +1,11 @@
 import os
-from tqdm import tqdm
 from drain3 import TemplateMiner
 from drain3.template_miner_config import TemplateMinerConfig
 
+from utils.log_util import get_logger
+
+log = get_logger('drain')
+
 def init_drain():
     """
     初始化Drain3模板提取器
@@ -28,11 +31,11 @@ def extract_templates(log_list: list[str]):
     # KEEP_TOP_N_TEMPLATE = 1000 #出现次数在前1000的模板
 
     miner = init_drain()
-    for line in tqdm(log_list):
+    for line in log_list:
         log_txt = line.rstrip()
         miner.add_log_message(log_txt)
 
     template_count = len(miner.drain.clusters)
-    print(f'The number of templates: {template_count}')
+    log.info('The number of templates: {count} (from {lines} lines)', count=template_count, lines=len(log_list))
 
     return miner
\ No newline at end of file
@@ -0,0 +1,139 @@
+"""
+当天遥测数据的Arrow IPC热存储
+
+可选的转换步骤：把某一天的log、trace、metric parquet文件转换为未压缩的Arrow IPC（Feather v2）文件，
+每个parquet row group对应一个record batch。窗口读取时优先用pyarrow.memory_map打开这些文件，
+按row group直接取出batch，无需再做parquet解码、解压和嵌套结构（process/tags）的重建；
+同一天的多个故障共享操作系统页缓存，列数据零拷贝访问
+
+用法:
+    python -m dataRefinement.hot_store 2025-06-06 [2025-06-07 ...]
+"""
+import os
+import sys
+import time
+from typing import Dict, List, Optional
+
+import pyarrow as pa
+import pyarrow.ipc as ipc
+import pyarrow.parquet as pq
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from dataRefinement.data_catalog import CatalogFile, MODALITY_DIRS, get_catalog
+
+# ========== 热存储配置 ==========
+HOT_STORE_ROOT = os.path.join(project_root, 'cache', 'hot_store')
+USE_HOT_STORE = True  # 窗口读取时是否优先使用已转换的Arrow IPC文件
+HOT_STORE_COMPRESSION = None  # None表示不压缩，可零拷贝；'lz4'/'zstd'可节省磁盘但读取时需要解压
+
+
+def hot_store_path(item: CatalogFile) -> str:
+    """
+    parquet文件对应的Arrow IPC文件路径
+    """
+    return os.path.join(HOT_STORE_ROOT, os.path.splitext(item.path)[0] + '.arrow')
+
+
+def get_hot_path(item: CatalogFile) -> Optional[str]:
+    """
+    返回可用的Arrow IPC文件路径；未转换或源parquet文件在转换后被修改时返回None
+    """
+    if not USE_HOT_STORE:
+        return None
+    path = hot_store_path(item)
+    try:
+        if os.path.getmtime(path) >= item.mtime:
+            return path
+    except OSError:
+        pass
+    return None
+
+
+def _empty_batch(schema: pa.Schema) -> pa.RecordBatch:
+    return pa.RecordBatch.from_arrays([pa.array([], type=f.type) for f in schema], schema=schema)
+
+
+def convert_file(item: CatalogFile, compression: Optional[str] = HOT_STORE_COMPRESSION) -> int:
+    """
+    把单个parquet文件转换为Arrow IPC文件，每个row group写为一个record batch，以便按row group裁剪读取
+
+    参数:
+        item: 数据目录中的文件索引
+        compression: IPC压缩算法，None表示不压缩
+
+    返回:
+        int: 写入的字节数
+    """
+    output_path = hot_store_path(item)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+
+    parquet_file = pq.ParquetFile(item.abspath)
+    schema = parquet_file.schema_arrow
+    options = ipc.IpcWriteOptions(compression=compression)
+    with pa.OSFile(tmp_path, 'wb') as sink, ipc.new_file(sink, schema, options=options) as writer:
+        for i in range(parquet_file.num_row_groups):
+            batches = parquet_file.read_row_group(i).combine_chunks().to_batches()
+            writer.write_batch(batches[0] if batches else _empty_batch(schema))
+    os.replace(tmp_path, output_path)
+    return os.path.getsize(output_path)
+
+
+def convert_day(date: str, modalities: Optional[List[str]] = None, force: bool = False) -> Dict[str, float]:
+    """
+    转换某一天的遥测数据
+
+    参数:
+        date: 日期，格式如 "2025-06-06"
+        modalities: 要转换的模态，None表示log、trace、metric全部转换
+        force: 是否重新转换已是最新的文件
+
+    返回:
+        Dict[str, float]: {'files', 'skipped', 'bytes', 'seconds'}
+    """
+    start_time = time.time()
+    catalog = get_catalog()
+    stats = {'files': 0, 'skipped': 0, 'bytes': 0, 'seconds': 0.0}
+    for modality in modalities or list(MODALITY_DIRS):
+        for item in catalog.files(modality, date=date):
+            if not force and get_hot_path(item) is not None:
+                stats['skipped'] += 1
+                continue
+            try:
+                stats['bytes'] += convert_file(item)
+                stats['files'] += 1
+            except Exception as e:
+                print(f"转换文件失败 {item.path}: {e}")
+    stats['seconds'] = time.time() - start_time
+    print(f"{date}: 转换{stats['files']}个文件（{stats['bytes'] / 1024 / 1024:.1f}MB），"
+          f"跳过{stats['skipped']}个已是最新的文件，耗时{stats['seconds']:.2f}秒")
+    return stats
+
+
+def read_hot_table(path: str, row_groups: Optional[List[int]] = None, columns: Optional[List[str]] = None) -> pa.Table:
+    """
+    以内存映射方式读取Arrow IPC文件，返回的表直接引用映射的内存（未压缩时零拷贝）
+
+    参数:
+        path: Arrow IPC文件路径
+        row_groups: 需要的row group（即record batch）序号，None表示全部
+        columns: 需要的列，None表示全部列
+
+    返回:
+        pa.Table: 读取的数据
+    """
+    # 不使用with关闭映射：返回的表仍引用映射的内存，由表的生命周期管理
+    reader = ipc.open_file(pa.memory_map(path, 'r'))
+    indices = range(reader.num_record_batches) if row_groups is None else row_groups
+    table = pa.Table.from_batches([reader.get_batch(i) for i in indices], schema=reader.schema)
+    return table.select(columns) if columns is not None else table
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python -m dataRefinement.hot_store <日期> [<日期> ...]")
+        sys.exit(1)
+    for day in sys.argv[1:]:
+        convert_day(day)
@@ -1,12 +1,14 @@
 import pandas as pd
 import os
 from typing import Optional
-import glob
 from dataRefinement.drain.drain_template_extractor import extract_templates
+from dataRefinement.window_reader import read_window
+from utils.span_tracer import traced
 import re
 
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+@traced('log.filter_timerange')
 def _filter_logs_by_timerange(start_timestamp: int, end_timestanp: int, df_log: pd.DataFrame) -> Optional[pd.DataFrame]:
     """
     从匹配的日志文件中筛选出在指定时间范围内的日志记录。
@@ -28,6 +30,7 @@ def _filter_logs_by_timerange(start_timestamp: int, end_timestanp: int, df_log:
     filtered_df = df_log[(df_log['timestamp_ns'] >= start_timestamp) & (df_log['timestamp_ns'] <= end_timestanp)]
     return filtered_df
 
+@traced('log.filter_error')
 def _filter_logs_by_error(df: Optional[pd.DataFrame], column: str = 'message') -> Optional[pd.DataFrame]:
     """
     过滤包含'error'（不区分大小写）的日志数据
@@ -47,7 +50,7 @@ def _filter_logs_by_error(df: Optional[pd.DataFrame], column: str = 'message') -
         print(f"列{column}不存在")
         return None
     
-    error_logs = df[df[column].str.contains(['error', 'failed', 'exception'], case=False, na=False)]
+    error_logs = df[df[column].str.contains('error|failed|exception', case=False, na=False)]
     print(f"找到{len(error_logs)}条包含error的日志")
     return error_logs
 
@@ -83,6 +86,7 @@ def _filter_logs_by_columns(df: Optional[pd.DataFrame], columns: Optional[list[s
     # 保证返回DataFrame而不是Series
     return df.loc[:, valid_cols]
 
+@traced('log.drain')
 def _extract_log_templates(df: Optional[pd.DataFrame], column: str = 'message') -> Optional[pd.DataFrame]:
     """
     从日志数据中提取模板，添加新列模板ID和模板内容列
@@ -123,6 +127,7 @@ def _extract_log_templates(df: Optional[pd.DataFrame], column: str = 'message')
         print(f"提取模板时出错: {e}")
         return None
 
+@traced('log.deduplicate')
 def _deduplicate_pod_template_combination(df: pd.DataFrame, pod_column: str = 'k8_pod', node_column: str = 'k8_node_name',template_column: str = 'template') -> pd.DataFrame:
     """
     去重日志数据，保留每个pod和template组合的第一条日志，并添加计数列occurrence_count
@@ -181,6 +186,7 @@ def _extract_service_name(pod_name: str) -> str:
     service_name = match.group(1)
     return service_name
 
+@traced('log.refinement')
 def log_refinement(start_time_hour: str, start_timestamp: int, end_timestamp: int) -> Optional[pd.DataFrame]:
     """
     加载并过滤日志数据，返回过滤后的DataFrame
@@ -193,12 +199,12 @@ def log_refinement(start_time_hour: str, start_timestamp: int, end_timestamp: in
     返回:
         DataFrame: 过滤后的日志DataFrame；如果没有匹配文件或处理过程中出错则返回None
     """
-    matched_files = glob.glob(os.path.join(project_root, 'data', '*', 'log-parquet', f'*{start_time_hour}*'))
-    if not matched_files:
+    # 读取故障时间范围内的日志，故障窗口跨小时时合并多个文件，只读取时间范围重叠的row group
+    df_log = read_window('log', start_timestamp, end_timestamp)
+    if df_log is None:
         print(f"未找到匹配的日志文件: {start_time_hour}")
         return None
     
-    df_log = pd.read_parquet(matched_files[0])
     print("原始日志文件的数据量：", len(df_log))
 
     df_filtered_logs = _filter_logs_by_timerange(start_timestamp, end_timestamp, df_log)
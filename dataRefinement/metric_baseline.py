@@ -0,0 +1,432 @@
+"""
+指标的在线增量基线
+
+为每个 (层级, 实体, instance, 指标)（层级为service/apm_pod/tidb/node/pod）增量维护累计统计量：
+Welford均值/方差（每批数据按Chan的并行公式合并）、KLL分位数草图、非零计数、最小/最大的两个值（与get_exact_metrics_stats
+一样去掉一个最小值和一个最大值）。每个指标文件按 (实体, instance, 所属时间段) 分组后以整个数组更新。
+
+基线持久化在 cache/metric_baseline.pkl，随指标文件到达增量更新（每个文件按路径和修改时间只读取一次）：
+按故障时间表（input/input_timestamp.csv）把数据归入对应故障的故障统计，故障结束后的冷却期
+（同get_normal_periods的10分钟）不计入，其余数据计入基线。故障分析时加载持久化的基线，
+以get_metrics_stats相同的格式直接返回"正常 vs 故障"统计，不再读取parquet文件。
+注意基线是全部已读取数据中非故障时段的累计统计，比get_normal_periods只取相邻两个正常时间段覆盖的时间更长
+
+用法:
+    python -m dataRefinement.metric_baseline 2025-06-06 [2025-06-07 ...]
+"""
+import os
+import sys
+import math
+import time
+import pickle
+import threading
+from typing import Dict, Iterable, List, Optional, Set, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from dataRefinement.window_reader import read_file_window
+from dataRefinement.quantile_sketch import PERCENTILES, SKETCH_K, KLLSketch
+from utils.span_tracer import traced
+
+# ========== 在线基线配置 ==========
+QUANTILES = PERCENTILES  # 与get_metrics_stats的分位数一致
+FAULT_COOLDOWN_NS = 10 * 60 * 1_000_000_000  # 故障结束后不计入基线的冷却时间（纳秒）
+ACTIVE_SERIES_WINDOW_NS = 60 * 60 * 1_000_000_000  # 故障期间没有数据的序列，故障开始前该时间内有数据时仍参与对比
+BASELINE_PATH = os.path.join(project_root, 'cache', 'metric_baseline.pkl')
+BASELINE_FORMAT_VERSION = 3  # StreamingStats或持久化内容变化时递增，旧版本的持久化基线不再加载
+FAULT_TIMESTAMPS_PATH = os.path.join(project_root, 'input', 'input_timestamp.csv')
+
+ROUTE_BASELINE = -1  # _route的返回值：计入基线
+ROUTE_COOLDOWN = -2  # _route的返回值：冷却期，丢弃
+
+
+class StreamingStats:
+    """
+    单个指标序列的累计统计，全部字段都覆盖自创建以来的全部数据：Welford均值/方差、KLL分位数、非零计数，
+    另外保留最小/最大的两个值，to_stats时与get_exact_metrics_stats一样去掉一个最小值和一个最大值
+    """
+    __slots__ = ('count', 'mean', 'm2', 'non_zero', 'smallest', 'largest', 'sketch', 'last_ts')
+
+    def __init__(self, k: int = SKETCH_K):
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.non_zero = 0
+        self.smallest: List[float] = []  # 最小的两个值，升序
+        self.largest: List[float] = []  # 最大的两个值，降序
+        self.sketch = KLLSketch(k=k)
+        self.last_ts = 0
+
+    def update(self, values: Iterable[float], last_ts: int = 0) -> None:
+        """
+        以一批数值整体更新
+
+        参数:
+            values: 数值数组，NaN被忽略
+            last_ts: 这批数据的最大时间戳（纳秒）
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        n = len(values)
+        batch_mean = float(values.mean())
+        batch_m2 = float(np.square(values - batch_mean).sum())
+        total = self.count + n
+        delta = batch_mean - self.mean
+        self.mean += delta * n / total
+        self.m2 += batch_m2 + delta * delta * self.count * n / total
+        self.count = total
+        self.non_zero += int((values > 0).sum())
+        lows, highs = (np.partition(values, 1)[:2], -np.partition(-values, 1)[:2]) if n > 2 else (values, values)
+        self.smallest = sorted(self.smallest + lows.tolist())[:2]
+        self.largest = sorted(self.largest + highs.tolist(), reverse=True)[:2]
+        self.sketch.update(values)
+        self.last_ts = max(self.last_ts, int(last_ts))
+
+    def to_stats(self) -> Dict[str, float]:
+        """
+        与get_exact_metrics_stats相同的键和口径：超过2个值时去掉一个最小值和一个最大值后统计
+        count/mean/std（样本标准差）/min/max，非零比例按全部数据计算。
+        草图尚未压缩（少于k个值）时分位数精确，否则为KLL草图在全部数据上的估计
+        """
+        if self.count == 0:
+            return {}
+        count, mean, m2 = self.count, self.mean, self.m2
+        low, high = self.smallest[0], self.largest[0]
+        if count > 2:
+            # 逆向Welford更新，去掉最小值和最大值
+            for value in (self.smallest[0], self.largest[0]):
+                previous_mean = (count * mean - value) / (count - 1)
+                m2 -= (value - mean) * (value - previous_mean)
+                count, mean = count - 1, previous_mean
+            low, high = self.smallest[1], self.largest[1]
+        std = math.sqrt(max(m2, 0.0) / (count - 1)) if count > 1 else float('nan')
+        stats = {'count': float(count), 'mean': mean, 'std': std, 'min': low}
+
+        exact = self.sketch.exact_values()
+        if exact is not None:
+            if self.count > 2:
+                exact = exact[1:-1]
+            quantiles = np.percentile(exact, [p * 100 for p in QUANTILES]).tolist()
+        else:
+            quantiles = self.sketch.quantiles(QUANTILES)
+        for p, value in zip(QUANTILES, quantiles):
+            stats[f"{p * 100:g}%"] = min(max(value, low), high)
+        stats['max'] = high
+        stats['non_zero_ratio'] = round(self.non_zero / self.count, 3)
+        return stats
+
+
+BaselineKey = Tuple[str, str, str, str]
+
+
+class MetricBaselineEngine:
+    """
+    所有指标序列的在线基线，键为 (层级, 实体, instance, 指标)，instance只有infra pod使用（所在节点）
+    """
+
+    def __init__(self, cooldown_ns: int = FAULT_COOLDOWN_NS):
+        """
+        参数:
+            cooldown_ns: 故障结束后不计入基线的冷却时间（纳秒）
+        """
+        self.cooldown_ns = cooldown_ns
+        self.baselines: Dict[BaselineKey, StreamingStats] = {}
+        self.fault_stats: Dict[str, Dict[BaselineKey, StreamingStats]] = {}  # 故障ID -> 故障时间段的统计
+        self.faults: Dict[str, Tuple[int, int]] = {}
+        self.sources: Dict[str, Tuple[str, float]] = {}  # 已读取的指标文件 -> (日期, 修改时间)
+        self._index_faults()
+
+    def set_faults(self, faults: Dict[str, Tuple[int, int]]) -> None:
+        """
+        设置故障时间表（故障ID -> (start_ns, end_ns)），之后到达的数据按时间表归入故障统计或基线。
+        已读取的数据不会重新归类，时间表变化时由update_metric_baseline重建基线
+        """
+        self.faults = {str(fault_id): (int(start), int(end)) for fault_id, (start, end) in faults.items()}
+        self._index_faults()
+
+    def _index_faults(self) -> None:
+        ordered = sorted(self.faults.items(), key=lambda item: item[1][0])
+        self._fault_ids = [fault_id for fault_id, _ in ordered]
+        self._fault_starts = np.array([start for _, (start, _) in ordered], dtype=np.int64)
+        self._fault_ends = np.array([end for _, (_, end) in ordered], dtype=np.int64)
+
+    def _route(self, timestamps: np.ndarray) -> np.ndarray:
+        """
+        每个时间戳的归属：所在故障（按开始时间排序的序号）、ROUTE_BASELINE或ROUTE_COOLDOWN。
+        故障时间段互相重叠时归入开始时间最晚的故障
+        """
+        timestamps = np.asarray(timestamps, dtype=np.int64)
+        route = np.full(len(timestamps), ROUTE_BASELINE, dtype=np.int64)
+        if len(self._fault_starts) == 0:
+            return route
+        position = np.searchsorted(self._fault_starts, timestamps, side='right') - 1
+        started = position >= 0
+        ends = self._fault_ends[np.maximum(position, 0)]
+        in_fault = started & (timestamps <= ends)
+        in_cooldown = started & ~in_fault & (timestamps < ends + self.cooldown_ns)
+        route[in_fault] = position[in_fault]
+        route[in_cooldown] = ROUTE_COOLDOWN
+        return route
+
+    def _series(self, key: BaselineKey, route: int) -> StreamingStats:
+        table = self.baselines if route == ROUTE_BASELINE else self.fault_stats.setdefault(self._fault_ids[route], {})
+        stats = table.get(key)
+        if stats is None:
+            stats = table[key] = StreamingStats()
+        return stats
+
+    def update(self, scope: str, entity: str, metric: str, timestamp: int, value: float, instance: str = '') -> None:
+        """
+        更新单个数据点（批量数据用ingest_frame）
+
+        参数:
+            scope: 层级，service/apm_pod/tidb/node/pod
+            entity: 实体名，如服务名、pod名、节点名
+            metric: 指标名
+            timestamp: 时间戳（纳秒）
+            value: 指标值
+            instance: infra pod所在节点，其余层级为空字符串
+        """
+        route = int(self._route(np.array([timestamp]))[0])
+        if route != ROUTE_COOLDOWN:
+            self._series((scope, entity, instance, metric), route).update([value], timestamp)
+
+    def ingest_frame(self, scope: str, df: pd.DataFrame, metrics: Iterable[str],
+                     entity_column: Optional[str] = None, entity: Optional[str] = None,
+                     instance_column: Optional[str] = None) -> int:
+        """
+        批量更新一个DataFrame（如一个新到达的指标文件）：按 (实体, instance, 所属时间段) 分组，
+        每个序列的一组数据以整个数组更新
+
+        参数:
+            scope: 层级
+            df: 含timestamp_ns和指标列的数据
+            metrics: 指标列
+            entity_column: 实体列名（如kubernetes_node、pod），与entity二选一
+            entity: 整个DataFrame对应的实体名（如从文件名解析出的服务名）
+            instance_column: instance列名（infra pod为instance）
+
+        返回:
+            int: 更新的数据点数
+        """
+        if df is None or len(df) == 0:
+            return 0
+        timestamps = df['timestamp_ns'].to_numpy(dtype=np.int64)
+        route = self._route(timestamps)
+        keep = route != ROUTE_COOLDOWN
+        timestamps, route = timestamps[keep], route[keep]
+        entities = df[entity_column].astype(str).to_numpy()[keep] if entity_column else np.full(len(route), entity, dtype=object)
+        instances = df[instance_column].astype(str).to_numpy()[keep] if instance_column else np.full(len(route), '', dtype=object)
+        metric_values = {metric: df[metric].to_numpy(dtype=float)[keep] for metric in metrics if metric in df.columns}
+
+        groups = pd.DataFrame({'entity': entities, 'instance': instances, 'route': route}).groupby(
+            ['entity', 'instance', 'route'], sort=False).indices
+        updated = 0
+        for (entity_name, instance, series_route), rows in groups.items():
+            last_ts = int(timestamps[rows].max())
+            for metric, values in metric_values.items():
+                self._series((scope, entity_name, instance, metric), int(series_route)).update(values[rows], last_ts)
+                updated += len(rows)
+        return updated
+
+    def ingest_day(self, date: str) -> int:
+        """
+        读取某一天尚未读取过的指标文件（与指标预聚合相同的数据源，见metric_rollup._iter_sources），
+        每个文件整体读取一次
+
+        返回:
+            int: 新读取的文件数
+        """
+        from dataRefinement.metric_rollup import _iter_sources
+
+        start_time = time.time()
+        num_files = num_points = 0
+        for scope, entity, entity_column, instance_column, metrics, file_path in _iter_sources(date):
+            if not os.path.exists(file_path) or file_path in self.sources:
+                continue
+            mtime = os.path.getmtime(file_path)
+            try:
+                schema_names = pq.read_schema(file_path).names
+                columns = ['timestamp_ns'] + [c for c in (entity_column, instance_column) if c] + metrics
+                df = read_file_window(file_path, columns=[c for c in columns if c in schema_names])
+            except Exception as e:
+                print(f"读取指标文件失败 {file_path}: {e}")
+                continue
+            num_points += self.ingest_frame(scope, df, metrics, entity_column=entity_column, entity=entity,
+                                            instance_column=instance_column)
+            self.sources[file_path] = (date, mtime)
+            num_files += 1
+        if num_files:
+            print(f"{date}: 在线基线读取{num_files}个新指标文件，累计{num_points}个数据点，"
+                  f"共{len(self.baselines)}个基线序列，耗时{time.time() - start_time:.2f}秒")
+        return num_files
+
+    def stale_sources(self) -> List[str]:
+        """
+        读取后被修改或删除的指标文件（累计统计中无法扣除旧数据，需要重建基线）
+        """
+        return [path for path, (_, mtime) in self.sources.items()
+                if not os.path.exists(path) or os.path.getmtime(path) != mtime]
+
+    def ingested_dates(self) -> Set[str]:
+        return {date for date, _ in self.sources.values()}
+
+    def compare(self, scope: str, entity: str, metric: str, fault_id: str, instance: str = '') -> Dict[str, Dict[str, float]]:
+        """
+        返回一个序列的基线与某个故障的故障统计
+
+        返回:
+            Dict[str, Dict[str, float]]: {'normal_stats': {...}, 'fault_stats': {...}}，格式同get_metrics_stats，
+                                         没有数据的一侧为空字典
+        """
+        key = (scope, entity, instance, metric)
+        normal = self.baselines.get(key)
+        fault = self.fault_stats.get(str(fault_id), {}).get(key)
+        return {'normal_stats': normal.to_stats() if normal else {}, 'fault_stats': fault.to_stats() if fault else {}}
+
+    def compare_scope(self, scope: str, fault_id: str, min_ratio: Optional[float] = 0.95,
+                      max_ratio: Optional[float] = 1.05) -> Dict[Tuple[str, str], Dict[str, Dict]]:
+        """
+        返回某一层级在故障期间有数据、或故障开始前ACTIVE_SERIES_WINDOW_NS内有数据的全部序列的对比，
+        过滤掉正常和故障都有数据、且均值变化倍数在[min_ratio, max_ratio]之间的指标（同analyze_node_metrics的过滤规则）
+
+        参数:
+            scope: 层级
+            fault_id: 故障ID
+            min_ratio: 变化倍数下限，与max_ratio任一为None时不过滤
+            max_ratio: 变化倍数上限
+
+        返回:
+            Dict[Tuple[str, str], Dict[str, Dict]]: (实体, instance) -> 指标 -> {'normal_stats', 'fault_stats'}
+        """
+        fault_id = str(fault_id)
+        active_since = self.faults[fault_id][0] - ACTIVE_SERIES_WINDOW_NS if fault_id in self.faults else 0
+        keys = {key for key in self.fault_stats.get(fault_id, {}) if key[0] == scope}
+        keys |= {key for key, stats in self.baselines.items() if key[0] == scope and stats.last_ts >= active_since}
+
+        result: Dict[Tuple[str, str], Dict[str, Dict]] = {}
+        epsilon = 1e-9
+        for _, entity, instance, metric in sorted(keys):
+            comparison = self.compare(scope, entity, metric, fault_id, instance)
+            normal, fault = comparison['normal_stats'], comparison['fault_stats']
+            if min_ratio is not None and max_ratio is not None and normal and fault:
+                ratio = (fault['mean'] + epsilon) / (normal['mean'] + epsilon)
+                if min_ratio <= ratio <= max_ratio:
+                    continue
+            result.setdefault((entity, instance), {})[metric] = comparison
+        return result
+
+    def for_fault(self, fault_id: str) -> 'FaultBaseline':
+        return FaultBaseline(self, str(fault_id))
+
+    def save(self, path: Optional[str] = None) -> None:
+        """
+        持久化基线，之后到达的数据在此基础上继续增量更新
+        """
+        path = path or BASELINE_PATH
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp_path = f"{path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            pickle.dump({'version': BASELINE_FORMAT_VERSION, 'cooldown_ns': self.cooldown_ns, 'faults': self.faults,
+                         'sources': self.sources, 'baselines': self.baselines, 'fault_stats': self.fault_stats}, f)
+        os.replace(tmp_path, path)
+
+    @classmethod
+    def load(cls, path: Optional[str] = None) -> 'MetricBaselineEngine':
+        """
+        加载持久化的基线，文件不存在或格式版本不一致时返回空基线
+        """
+        path = path or BASELINE_PATH
+        if not os.path.exists(path):
+            return cls()
+        with open(path, 'rb') as f:
+            payload = pickle.load(f)
+        if payload.get('version') != BASELINE_FORMAT_VERSION:
+            print(f"指标基线 {path} 的格式版本为 {payload.get('version')}，当前为 {BASELINE_FORMAT_VERSION}，重新累计基线")
+            return cls()
+        engine = cls(cooldown_ns=payload['cooldown_ns'])
+        engine.set_faults(payload['faults'])
+        engine.sources = payload['sources']
+        engine.baselines = payload['baselines']
+        engine.fault_stats = payload['fault_stats']
+        print(f"成功加载指标基线，包含 {len(engine.baselines)} 个指标序列、{len(engine.sources)} 个已读取的指标文件")
+        return engine
+
+
+class FaultBaseline:
+    """
+    一个故障的基线视图，指标分析器通过它取正常/故障统计
+    """
+
+    def __init__(self, engine: MetricBaselineEngine, fault_id: str):
+        self.engine = engine
+        self.fault_id = fault_id
+
+    def compare(self, scope: str, entity: str, metric: str, instance: str = '') -> Dict[str, Dict[str, float]]:
+        return self.engine.compare(scope, entity, metric, self.fault_id, instance)
+
+    def compare_scope(self, scope: str, min_ratio: Optional[float] = 0.95,
+                      max_ratio: Optional[float] = 1.05) -> Dict[Tuple[str, str], Dict[str, Dict]]:
+        return self.engine.compare_scope(scope, self.fault_id, min_ratio, max_ratio)
+
+
+_engine_cache: Dict[str, MetricBaselineEngine] = {}
+_engine_lock = threading.Lock()
+
+
+def load_fault_schedule(df_fault_timestamps: pd.DataFrame) -> Dict[str, Tuple[int, int]]:
+    """
+    由故障时间戳表（input_timestamp.csv）得到故障时间表：uuid -> (start_ns, end_ns)
+    """
+    return {str(row.uuid): (int(row.start_timestamp), int(row.end_timestamp))
+            for row in df_fault_timestamps[['uuid', 'start_timestamp', 'end_timestamp']].itertuples(index=False)}
+
+
+@traced('metric.baseline_update')
+def update_metric_baseline(dates: Iterable[str], faults: Dict[str, Tuple[int, int]],
+                           path: Optional[str] = None) -> MetricBaselineEngine:
+    """
+    加载持久化的基线（进程内缓存），读取这些日期中新到达的指标文件，有更新时保存。
+    故障时间表变化或已读取的文件被修改时，无法从累计统计中扣除已读取的数据，清空后重新读取全部已读取过的日期
+
+    参数:
+        dates: 需要包含的日期
+        faults: 故障时间表，见load_fault_schedule
+        path: 持久化路径，None时使用BASELINE_PATH
+
+    返回:
+        MetricBaselineEngine: 已包含这些日期数据的基线
+    """
+    path = path or BASELINE_PATH
+    faults = {str(fault_id): (int(start), int(end)) for fault_id, (start, end) in faults.items()}
+    with _engine_lock:
+        engine = _engine_cache.get(path)
+        if engine is None:
+            engine = MetricBaselineEngine.load(path)
+        dates = set(dates)
+        stale = engine.stale_sources()
+        if engine.faults != faults or stale:
+            if engine.sources:
+                reason = f"{len(stale)}个已读取的指标文件被修改" if stale else "故障时间表变化"
+                print(f"{reason}，重建指标基线")
+            dates |= engine.ingested_dates()
+            engine = MetricBaselineEngine(cooldown_ns=engine.cooldown_ns)
+            engine.set_faults(faults)
+        if sum(engine.ingest_day(date) for date in sorted(dates)):
+            engine.save(path)
+        _engine_cache[path] = engine
+        return engine
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python -m dataRefinement.metric_baseline <日期> [<日期> ...]")
+        sys.exit(1)
+    update_metric_baseline(sys.argv[1:], load_fault_schedule(pd.read_csv(FAULT_TIMESTAMPS_PATH)))
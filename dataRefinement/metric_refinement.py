@@ -12,7 +12,17 @@ from scipy.integrate._ivp.dop853_coefficients import D
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 sys.path.append(project_root)
 
-from agent.agent import metrics_agent
+from agent.agent import create_agent
+from dataRefinement.data_catalog import get_catalog
+from dataRefinement.window_reader import read_file_window
+from dataRefinement.quantile_sketch import SKETCH_K, SketchStats, compare_with_exact
+from dataRefinement import metric_rollup
+from dataRefinement.metric_rollup import query_entities, query_period_stats
+from dataRefinement.metric_baseline import FaultBaseline, load_fault_schedule, update_metric_baseline
+from utils.log_util import get_logger
+from utils.span_tracer import traced
+
+log = get_logger('metric_refinement')
 
 # 定义要分析的关键指标列 
 key_metrics = ['client_error_ratio', 'error_ratio', 'request', 'response', 'rrt', 'server_error_ratio', 'timeout']
@@ -34,6 +44,17 @@ node_metrics = ['node_cpu_usage_rate',
                 'node_network_transmit_packets_total',
                 'node_sockstat_TCP_inuse']
 
+# 指标统计后端：'exact' 排序计算精确分位数；'sketch' 使用可合并的KLL草图；
+# 'compare' 两者都计算并打印草图的分位数误差，返回精确结果
+STATS_BACKEND = 'exact'
+# 指标预聚合（metric_rollup）的分位数来自KLL草图，需要同时开启metric_rollup.USE_METRIC_ROLLUPS并使用
+# 允许近似结果的统计后端（STATS_BACKEND = 'sketch'）才从预聚合计算时段统计，默认读取原始数据精确计算
+APPROXIMATE_STATS_BACKENDS = ('sketch',)
+# 是否使用持久化的在线基线（metric_baseline）：新到达的指标文件只读取一次并增量更新基线，各分析器通过compare_scope取统计。
+# 正常统计是全部已读取数据中非故障时段的累计值（而不只是get_normal_periods的相邻时间段），数据量超过草图容量时
+# 分位数为KLL估计（近似）；启用后优先于指标预聚合和逐实体读取原始数据
+USE_METRIC_BASELINE = False
+
 pod_metrics = [
     'pod_cpu_usage', 'pod_fs_reads_bytes', 'pod_fs_writes_bytes',
     'pod_memory_working_set_bytes', 'pod_network_receive_bytes',
@@ -85,9 +106,8 @@ def get_service_files(date: str) -> List[str]:
     - service_files: 包含SERVICE文件的列表
     """
 
-    # 构建service数据目录路径
-    service_dir = os.path.join(project_root, 'data', f'{date}', 'metric-parquet', 'apm', 'service')
-    service_files = os.listdir(service_dir)
+    # 从数据目录索引获取service文件，避免每个故障重复listdir
+    service_files = [os.path.basename(item.path) for item in get_catalog().files('metric', date=date, category='apm/service')]
 
     return service_files
 
@@ -119,12 +139,104 @@ def get_normal_periods(df_fault_timestamps: pd.DataFrame, current_index: int) ->
 
     return normal_periods
 
-def get_metrics_stats(df: pd.DataFrame, metrics: List[str]) -> Dict[str, Dict]:
+def get_analysis_time_range(normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str]) -> Tuple[int, int]:
+    """
+    获取覆盖所有正常时间段和故障时间段的时间范围，按天存储的指标文件只需读取这个范围内的row group
+    参数：
+    - normal_periods: 正常时间段列表
+    - fault_period: 故障时间段
+    返回：
+    - time_range: (start_ns, end_ns)
+    """
+    periods = list(normal_periods) + [fault_period]
+    return min(int(start) for start, _ in periods), max(int(end) for _, end in periods)
+
+def get_metrics_stats(df: pd.DataFrame, metrics: List[str], backend: Optional[str] = None) -> Dict[str, Dict]:
     """
     计算DataFrame中指标的统计信息
     参数：
     - df: 包含指标数据的DataFrame
     - metrics: 要分析的指标列表
+    - backend: 统计后端，None时使用STATS_BACKEND
+    返回：
+    - stats: 包含指标统计信息的字典
+    """
+    backend = backend or STATS_BACKEND
+    if backend == 'sketch':
+        return get_sketch_metrics_stats(df, metrics)
+
+    stats = get_exact_metrics_stats(df, metrics)
+    if backend == 'compare':
+        errors = compare_with_exact(stats, get_sketch_metrics_stats(df, metrics))
+        for metric, error in errors.items():
+            print(f"    指标 {metric} 草图分位数最大误差（按取值范围归一化）: {error:.4f}")
+    return stats
+
+def use_metric_rollups(backend: Optional[str] = None) -> bool:
+    """
+    是否使用指标预聚合（近似结果）：需要开启metric_rollup.USE_METRIC_ROLLUPS且统计后端允许近似结果
+    """
+    return metric_rollup.USE_METRIC_ROLLUPS and (backend or STATS_BACKEND) in APPROXIMATE_STATS_BACKENDS
+
+def get_rollup_period_stats(fault_date: str, scope: str, entity: str, metrics: List[str],
+                            normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str],
+                            instance: str = '') -> Optional[Tuple[Dict[str, Dict], Dict[str, Dict]]]:
+    """
+    统计后端允许近似结果时从指标预聚合计算正常/故障时间段的统计（参数同query_period_stats）
+    返回：
+    - (正常统计, 故障统计)；统计后端要求精确结果或当天没有可用的预聚合时返回None，由调用方读取原始数据计算
+    """
+    if not use_metric_rollups():
+        log.debug("{scope} {entity}: 时段统计由原始数据精确计算（统计后端 {backend}，指标预聚合{enabled}）", scope=scope,
+                  entity=entity, backend=STATS_BACKEND, enabled='已开启' if metric_rollup.USE_METRIC_ROLLUPS else '未开启')
+        return None
+    period_stats = query_period_stats(fault_date, scope, entity, metrics, normal_periods, fault_period, instance)
+    log.debug("{scope} {entity}: 时段统计来自{source}", scope=scope, entity=entity,
+              source='指标预聚合（近似）' if period_stats is not None else '原始数据（当天没有可用的预聚合）')
+    return period_stats
+
+def select_baseline_stats(scope_stats: Dict[Tuple[str, str], Dict[str, Dict]], entity: str, metrics: List[str],
+                          instance: str = '') -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """
+    从在线基线的compare_scope结果中取出一个实体的正常/故障时间段统计
+    参数：
+    - scope_stats: FaultBaseline.compare_scope的返回值
+    - entity: 实体名
+    - metrics: 需要的指标
+    - instance: infra pod所在节点
+    返回：
+    - (normal_stats, fault_stats): 格式同get_period_stats，没有数据的时间段为空字典
+    """
+    comparisons = scope_stats.get((entity, instance), {})
+    normal_stats, fault_stats = {}, {}
+    for metric in metrics:
+        if metric not in comparisons:
+            continue
+        if comparisons[metric]['normal_stats']:
+            normal_stats[metric] = comparisons[metric]['normal_stats']
+        if comparisons[metric]['fault_stats']:
+            fault_stats[metric] = comparisons[metric]['fault_stats']
+    return normal_stats, fault_stats
+
+def get_sketch_metrics_stats(df: pd.DataFrame, metrics: List[str], k: int = SKETCH_K) -> Dict[str, Dict]:
+    """
+    用KLL草图计算指标统计，格式与get_exact_metrics_stats相同
+    参数：
+    - df: 包含指标数据的DataFrame
+    - metrics: 要分析的指标列表
+    - k: 草图精度参数
+    返回：
+    - stats: 包含指标统计信息的字典
+    """
+    return {metric: SketchStats.from_values(df[metric].to_numpy(dtype=float), k=k).to_stats()
+            for metric in metrics if metric in df.columns and df[metric].notna().any()}
+
+def get_exact_metrics_stats(df: pd.DataFrame, metrics: List[str]) -> Dict[str, Dict]:
+    """
+    排序后计算精确统计，去掉一个最小值和一个最大值
+    参数：
+    - df: 包含指标数据的DataFrame
+    - metrics: 要分析的指标列表
     返回：
     - stats: 包含指标统计信息的字典
     """
@@ -146,6 +258,38 @@ def get_metrics_stats(df: pd.DataFrame, metrics: List[str]) -> Dict[str, Dict]:
 
     return stats
 
+def get_period_stats(df: pd.DataFrame, metrics: List[str], normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str]) -> Tuple[Dict[str, Dict], Dict[str, Dict]]:
+    """
+    从原始数据计算正常时间段（合并）和故障时间段的指标统计
+    参数：
+    - df: 包含timestamp_ns和指标列的DataFrame
+    - metrics: 需要统计的指标列
+    - normal_periods: 正常时间段列表
+    - fault_period: 故障时间段
+    返回：
+    - (normal_stats, fault_stats): 格式同get_metrics_stats，没有数据的时间段为空字典
+    """
+    normal_stats, fault_stats = {}, {}
+    all_normal_data = []
+    for start, end in normal_periods:
+        normal_data = df[(df['timestamp_ns'] >= int(start)) & (df['timestamp_ns'] <= int(end))]
+        if len(normal_data) > 0:
+            all_normal_data.append(normal_data)
+
+    # 合并正常时间段数据并统计（移除异常值）
+    if all_normal_data:
+        combined_normal_data = pd.concat(all_normal_data, ignore_index=True)
+        print(f"    合并后正常时间段总数据行数: {len(combined_normal_data)}")
+        normal_stats = get_metrics_stats(combined_normal_data, metrics)
+
+    # 故障时间段统计
+    fault_data = df[(df['timestamp_ns'] >= int(fault_period[0])) & (df['timestamp_ns'] <= int(fault_period[1]))]
+    if len(fault_data):
+        print(f"    故障时间段数据行数: {len(fault_data)}")
+        fault_stats = get_metrics_stats(fault_data, metrics)
+    return normal_stats, fault_stats
+
+@traced('metric.llm_filter')
 async def get_abnormal_metrics(normal_stats: Dict[str, Dict], fault_stats: Dict[str, Dict]) -> List[str]:
     """
     调用metrics_agent对比正常时间段和故障时间段的指标差异，返回关键异常指标
@@ -155,104 +299,75 @@ async def get_abnormal_metrics(normal_stats: Dict[str, Dict], fault_stats: Dict[
     返回：
     - abnormal_metrics: 包含异常指标的列表
     """
+    # 每次对比都使用全新的智能体，避免上一个服务的对比内容累积进上下文
+    metrics_agent = create_agent("MetricsAgent")
     refined_metrics = await metrics_agent.run(task=f"请对比正常时间段和故障时间段的指标差异，返回需要注意的异常指标列表(格式为['指标1','指标2'])，不要包含其它任何解释和文本。正常时间段指标统计信息：{normal_stats}，故障时间段指标统计信息：{fault_stats}")
     refined_metrics = refined_metrics.messages[-1].content
     abnormal_metrics = ast.literal_eval(refined_metrics.strip())
     return abnormal_metrics
 
 
-async def analyze_service_metrics(fault_date: str, normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str]) -> Dict:
+@traced('metric.service')
+async def analyze_service_metrics(fault_date: str, normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str],
+                                  baseline: Optional[FaultBaseline] = None) -> Dict:
     """
     分析SERVICE文件中的指标数据，计算正常时间段和故障时间段的指标差异
     参数：
     - service_paths: 包含SERVICE文件路径的列表
     - normal_periods: 正常时间段列表，每个元素为(start_time, end_time)
     - fault_period: 故障时间段，为(start_time, end_time)
+    - baseline: 本次故障的在线基线，None时从指标预聚合或原始数据计算
     返回：
     - service_results: 包含SERVICE级别分析结果的字典
     """
     service_files = get_service_files(fault_date)
     service_paths = [os.path.join(project_root, 'data', f'{fault_date}', 'metric-parquet', 'apm', 'service', service_file) for service_file in service_files]
     service_analysis = {}
+    time_range = get_analysis_time_range(normal_periods, fault_period)
+    service_baseline = baseline.compare_scope('service', min_ratio=None) if baseline is not None else None
+    apm_pod_baseline = baseline.compare_scope('apm_pod', min_ratio=None) if baseline is not None else None
 
     for service_path in service_paths:
         service_name = os.path.basename(service_path).split('_')[1] if '_' in os.path.basename(service_path) else os.path.basename(service_path).split('.')[0]
-        df_service = pd.read_parquet(service_path)
-
-        if len(df_service) == 0:
+        # 启用在线基线时直接取统计；否则统计后端允许近似结果时从指标预聚合计算，再否则（或没有预聚合时）读取原始数据
+        if service_baseline is not None:
+            period_stats = select_baseline_stats(service_baseline, service_name, key_metrics)
+        else:
+            period_stats = get_rollup_period_stats(fault_date, 'service', service_name, key_metrics, normal_periods, fault_period)
+        if period_stats is None:
+            df_service = read_file_window(service_path, *time_range)
+            period_stats = get_period_stats(df_service, key_metrics, normal_periods, fault_period)
+        normal_stats, fault_stats = period_stats
+
+        if not normal_stats and not fault_stats:
             print(f"服务 {service_name} 没有数据")
             continue
 
-        all_normal_data = []
-        
-        for start, end in normal_periods:
-            normal_data = df_service[(df_service['timestamp_ns'] >= int(start)) & (df_service['timestamp_ns'] <= int(end))]
-            if len(normal_data) == 0:
-                print(f"服务 {service_name} 在正常时间段 {start} 到 {end} 没有数据")
-                continue
-            all_normal_data.append(normal_data)
-        #正常时间段指标统计
-        if all_normal_data:
-            combined_normal_data = pd.concat(all_normal_data, ignore_index=True)
-            print(f"合并正常时间段总数据行数：{len(combined_normal_data)}")
-
-            # 计算正常时间段指标统计
-            normal_stats = get_metrics_stats(combined_normal_data, key_metrics)
-            # print(json.dumps(normal_stats, ensure_ascii=False, indent=4))
-            # exit()
-
-        #故障时间段指标统计
-        fault_data = df_service[(df_service['timestamp_ns'] >= int(fault_period[0])) & (df_service['timestamp_ns'] <= int(fault_period[1]))]
-        if len(fault_data):
-            # 计算故障时间段指标统计
-            print(f"故障时间段数据行数：{len(fault_data)}")
-            fault_stats = get_metrics_stats(fault_data, key_metrics)
-            # print(json.dumps(fault_stats, ensure_ascii=False, indent=4))
-            # exit()
-
         # 调用metrics_agent对比正常时间段和故障时间段的指标差异，返回关键异常指标
         abnormal_metrics = await get_abnormal_metrics(normal_stats, fault_stats)
         print(f"异常指标列表：{abnormal_metrics}")
         if len(abnormal_metrics):
             #下钻pod分析
             pod_paths = os.path.join(os.path.dirname(os.path.dirname(service_path)), 'pod')
-            pod_files = os.listdir(pod_paths)
+            pod_files = [os.path.basename(item.path) for item in get_catalog().files('metric', date=fault_date, category='apm/pod')]
             for pod_file in pod_files:
                 #获取pod名
                 pod_name = pod_file.split('_')[1] if '_' in pod_file else pod_file.split('.')[0]
                 #找到service对应pod文件
                 if pod_name.startswith(service_name):
-                    pod_path = os.path.join(pod_paths, pod_file)
-                    df_pod = pd.read_parquet(pod_path)
-
-                    if len(df_pod) == 0:
-                        print(f"服务 {service_name} 在故障时间段 {fault_period[0]} 到 {fault_period[1]} 没有数据")
+                    if apm_pod_baseline is not None:
+                        period_stats = select_baseline_stats(apm_pod_baseline, pod_name, abnormal_metrics)
+                    else:
+                        period_stats = get_rollup_period_stats(fault_date, 'apm_pod', pod_name, abnormal_metrics, normal_periods, fault_period)
+                    if period_stats is None:
+                        df_pod = read_file_window(os.path.join(pod_paths, pod_file), *time_range)
+                        period_stats = get_period_stats(df_pod, abnormal_metrics, normal_periods, fault_period)
+                    normal_stats, fault_stats = period_stats
+
+                    if not normal_stats and not fault_stats:
+                        print(f"服务 {service_name} 的Pod {pod_name} 没有数据")
                         continue
 
-                    all_normal_data = []
-                    for start, end in normal_periods:
-                        normal_data = df_pod[(df_pod['timestamp_ns'] >= int(start)) & (df_pod['timestamp_ns'] <= int(end))]
-                        if len(normal_data) == 0:
-                            print(f"服务 {service_name} 在正常时间段 {start} 到 {end} 没有数据")
-                            continue
-                        all_normal_data.append(normal_data)
-
-                    #正常时间段指标统计
-                    if all_normal_data:
-                        combined_normal_data = pd.concat(all_normal_data, ignore_index=True)
-                        print(f"合并正常时间段总数据行数：{len(combined_normal_data)}")
-                        # 计算正常时间段指标统计
-                        normal_stats = get_metrics_stats(combined_normal_data, abnormal_metrics)
-                        # print(json.dumps(normal_stats, ensure_ascii=False, indent=4))
-                        # exit()
-
-                    #故障时间段指标统计
-                    fault_data = df_pod[(df_pod['timestamp_ns'] >= int(fault_period[0])) & (df_pod['timestamp_ns'] <= int(fault_period[1]))]
-                    if len(fault_data):
-                        # 计算故障时间段指标统计
-                        print(f"故障时间段数据行数：{len(fault_data)}")
-                        fault_stats = get_metrics_stats(fault_data, abnormal_metrics)
-
                     service_analysis[service_name] = {}
                     service_analysis[service_name][pod_name] = {
                         'normal_stats': normal_stats,
@@ -311,13 +426,14 @@ def get_tidb_services_files_mapping(date: str) -> Dict[str, Dict[str, str]]:
         }
     }
 
-def load_tidb_service_data(fault_date: str, service_name: str, metric_name: str) -> pd.DataFrame:
+def load_tidb_service_data(fault_date: str, service_name: str, metric_name: str, time_range: Optional[Tuple[int, int]] = None) -> pd.DataFrame:
     """
     加载TiDB服务指标数据
     参数：
     - fault_date: 故障日期
     - service_name: 服务名称
     - metric_name: 指标名称
+    - time_range: 只读取该时间范围(start_ns, end_ns)内的数据，None表示读取整个文件
     返回：
     - df_metric: 包含指标数据的DataFrame
     """
@@ -340,7 +456,7 @@ def load_tidb_service_data(fault_date: str, service_name: str, metric_name: str)
         print(f"文件不存在: {file_path}")
         return None
 
-    df = pd.read_parquet(file_path)
+    df = read_file_window(file_path, *(time_range or (None, None)))
 
     if len(df) == 0:
         print(f"文件 {file_path} 中无数据")
@@ -348,68 +464,48 @@ def load_tidb_service_data(fault_date: str, service_name: str, metric_name: str)
 
     return df
 
-def analyze_tidb_metrics(fault_date: str, normal_periods: list[Tuple[str, str]], fault_period: Tuple[str, str]) -> Dict:
+@traced('metric.tidb')
+def analyze_tidb_metrics(fault_date: str, normal_periods: list[Tuple[str, str]], fault_period: Tuple[str, str],
+                         baseline: Optional[FaultBaseline] = None) -> Dict:
     """
     分析TiDB服务的异常指标
     参数：
     - fault_date: 故障日期
     - normal_periods: 正常时间段列表
     - fault_period: 故障时间段
+    - baseline: 本次故障的在线基线，None时从指标预聚合或原始数据计算
     返回：
     - tidb_result: 包含TiDB服务级别分析结果的字典
     """
     tidb_analysis = {}
+    time_range = get_analysis_time_range(normal_periods, fault_period)
     # 获取tidb服务和核心指标
     core_metrics = get_tidb_core_metrics()
+    tidb_baseline = baseline.compare_scope('tidb', min_ratio=None) if baseline is not None else None
     for service_name, metrics_list in core_metrics.items():
         tidb_analysis[service_name] = {}
         for metric_name in metrics_list:
-            # 加载TiDB服务指标数据
-            df_metric = load_tidb_service_data(fault_date, service_name, metric_name)
-            if len(df_metric) == 0:
+            # 启用在线基线时直接取统计；否则统计后端允许近似结果时从指标预聚合计算，再否则（或没有预聚合时）加载TiDB服务指标数据
+            if tidb_baseline is not None:
+                period_stats = select_baseline_stats(tidb_baseline, service_name, [metric_name])
+            else:
+                period_stats = get_rollup_period_stats(fault_date, 'tidb', service_name, [metric_name], normal_periods, fault_period)
+            if period_stats is None:
+                df_metric = load_tidb_service_data(fault_date, service_name, metric_name, time_range)
+                if df_metric is None or len(df_metric) == 0:
+                    print(f"服务 {service_name} 在故障日期 {fault_date} 没有指标数据")
+                    continue
+                period_stats = get_period_stats(df_metric, [metric_name], normal_periods, fault_period)
+            normal_desc, fault_desc = period_stats
+            if not normal_desc and not fault_desc:
                 print(f"服务 {service_name} 在故障日期 {fault_date} 没有指标数据")
                 continue
-            
-            # 初始化指标结构
+
             tidb_analysis[service_name][metric_name] = {
-                'normal_stats': None,
-                'fault_stats': None
+                'normal_stats': normal_desc.get(metric_name, None),
+                'fault_stats': fault_desc.get(metric_name, None)
             }
 
-            # 1. 合并所有正常时间段数据进行统计
-            all_normal_data = []
-
-            for start, end in normal_periods:
-                normal_data = df_metric[(df_metric['timestamp_ns'] >= int(start)) & (df_metric['timestamp_ns'] <= int(end))]
-
-                if len(normal_data) > 0:
-                    all_normal_data.append(normal_data)
-
-            # 合并正常时间段数据并统计
-            if all_normal_data:
-                combined_normal_data = pd.concat(all_normal_data, ignore_index=True)
-                print(f"    合并后正常时间段总数据行数: {len(combined_normal_data)}")
-
-                # 获取统计（移除异常值）
-                normal_desc = get_metrics_stats(
-                    combined_normal_data,
-                    [metric_name]
-                )
-                # print(json.dumps(normal_desc, ensure_ascii=False, indent=4))
-                # exit()
-                tidb_analysis[service_name][metric_name]['normal_stats'] = normal_desc.get(metric_name, None)
-
-            # 故障时间段统计
-            abnormal_data = df_metric[(df_metric['timestamp_ns'] >= int(fault_period[0])) &
-                                      (df_metric['timestamp_ns'] <= int(fault_period[1]))]
-            if len(abnormal_data):
-                fault_desc = get_metrics_stats(
-                    abnormal_data,
-                    [metric_name]
-                )
-                tidb_analysis[service_name][metric_name]['fault_stats'] = fault_desc.get(metric_name, None)
-                print(f"    故障时间段数据行数: {len(abnormal_data)}")
-
     # print(json.dumps(tidb_analysis, ensure_ascii=False, indent=4))
     # exit()
     return tidb_analysis
@@ -452,13 +548,14 @@ def get_node_metrics_files_mapping(date: str) -> Dict[str, str]:
         'node_sockstat_TCP_inuse': f'infra_node_node_sockstat_TCP_inuse_{date}.parquet'
     }
 
-def load_node_metric_data(date: str, metric_name: str) -> Optional[pd.DataFrame]:
+def load_node_metric_data(date: str, metric_name: str, time_range: Optional[Tuple[int, int]] = None) -> Optional[pd.DataFrame]:
     """
     加载指定日期和指标的节点数据
 
     参数:
         date: 日期，格式如 "2025-06-06"
         metric_name: 指标名称，如 "node_cpu_usage_rate"
+        time_range: 只读取该时间范围(start_ns, end_ns)内的数据，None表示读取整个文件
 
     返回:
         节点指标数据DataFrame，如果文件不存在则返回None
@@ -478,7 +575,7 @@ def load_node_metric_data(date: str, metric_name: str) -> Optional[pd.DataFrame]
             print(f"文件不存在: {file_path}")
             return None
 
-        df = pd.read_parquet(file_path)
+        df = read_file_window(file_path, *(time_range or (None, None)))
 
         # 只保留目标节点数据
         target_nodes = get_target_nodes()
@@ -494,59 +591,45 @@ def load_node_metric_data(date: str, metric_name: str) -> Optional[pd.DataFrame]
         print(f"加载文件 {file_path} 时出错: {e}")
         return None
 
-def analyze_node_metrics(fault_date: str, normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str]) -> Dict[str, List[Dict]]:
+@traced('metric.node')
+def analyze_node_metrics(fault_date: str, normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str],
+                         baseline: Optional[FaultBaseline] = None) -> Dict[str, List[Dict]]:
     """
     分析Node节点的指标异常，分析结果按 node -> pod -> metric 组织
     参数:
         fault_date: 故障日期，格式如 "2025-06-06"
         normal_periods: 正常时间段列表，每个元素为 (start_ns, end_ns)
         fault_period: 故障时间段，格式为 (start_ns, end_ns)
+        baseline: 本次故障的在线基线，None时从指标预聚合或原始数据计算
 
     返回:
         异常Node指标列表
     """
     nodes_analysis = {}
     target_nodes = get_target_nodes()
+    time_range = get_analysis_time_range(normal_periods, fault_period)
+    node_baseline = baseline.compare_scope('node', min_ratio=None) if baseline is not None else None
     for node_name in target_nodes:
         print(f"\n=== 处理节点: {node_name} ===")
         for metric_name in node_metrics:
-            df_metric = load_node_metric_data(fault_date, metric_name)
-            if df_metric is None:
-                continue
-            df_node = df_metric[df_metric['kubernetes_node'] == node_name]
-            if len(df_node) == 0:
+            # 启用在线基线时直接取统计；否则统计后端允许近似结果时从指标预聚合计算，再否则（或没有预聚合时）读取原始数据
+            if node_baseline is not None:
+                period_stats = select_baseline_stats(node_baseline, node_name, [metric_name])
+            else:
+                period_stats = get_rollup_period_stats(fault_date, 'node', node_name, [metric_name], normal_periods, fault_period)
+            if period_stats is None:
+                df_metric = load_node_metric_data(fault_date, metric_name, time_range)
+                if df_metric is None:
+                    continue
+                df_node = df_metric[df_metric['kubernetes_node'] == node_name]
+                if len(df_node) == 0:
+                    continue
+                period_stats = get_period_stats(df_node, [metric_name], normal_periods, fault_period)
+            normal_desc, fault_desc = period_stats
+            if not normal_desc and not fault_desc:
                 continue
 
-            all_normal_data = []
-
-            for start, end in normal_periods:
-                normal_data = df_node[(df_node['timestamp_ns'] >= int(start)) & (df_node['timestamp_ns'] <= int(end))]
-                if len(normal_data) > 0:
-                    all_normal_data.append(normal_data)
-
-            # 合并正常时间段数据并统计
-            if all_normal_data:
-                combined_normal_data = pd.concat(all_normal_data, ignore_index=True)
-                print(f"    合并后正常时间段总数据行数: {len(combined_normal_data)}")
-
-                # 获取统计（移除异常值）
-                normal_desc = get_metrics_stats(
-                    combined_normal_data,
-                    [metric_name]
-                )                   
-
-            # 2. 故障时间段统计
-            print(f"    故障时间段分析:")
-            abnormal_data = df_node[(df_node['timestamp_ns'] >= int(fault_period[0])) &
-                                    (df_node['timestamp_ns'] <= int(fault_period[1]))]
-            if len(abnormal_data):
-                fault_desc = get_metrics_stats(
-                    abnormal_data,
-                    [metric_name]
-                )
-                print(f"    故障时间段数据行数: {len(abnormal_data)}")
-
-            if normal_desc is not None and fault_desc is not None:#过滤掉变化倍数在 0.95 到 1.05 之间的指标
+            if normal_desc and fault_desc:#过滤掉变化倍数在 0.95 到 1.05 之间的指标
                 normal_mean = normal_desc[metric_name]['mean']
                 fault_mean = fault_desc[metric_name]['mean']
                 epsilon = 1e-9  # 极小数，防止除零
@@ -603,13 +686,14 @@ def get_pod_metrics_files_mapping(date: str) -> Dict[str, str]:
         'pod_processes': f'infra_pod_pod_processes_{date}.parquet'
     }
 
-def load_pod_metric_data(date: str, metric_name: str) -> Optional[pd.DataFrame]:
+def load_pod_metric_data(date: str, metric_name: str, time_range: Optional[Tuple[int, int]] = None) -> Optional[pd.DataFrame]:
     """
     加载指定日期和指标的 Pod 数据
 
     参数:
         date: 日期，格式如 "2025-06-06"
         metric_name: 指标名称，如 "pod_cpu_usage"
+        time_range: 只读取该时间范围(start_ns, end_ns)内的数据，None表示读取整个文件
 
     返回:
         Pod 指标数据 DataFrame，如果文件不存在则返回 None
@@ -629,7 +713,7 @@ def load_pod_metric_data(date: str, metric_name: str) -> Optional[pd.DataFrame]:
             print(f"文件不存在: {file_path}")
             return None
 
-        df = pd.read_parquet(file_path)
+        df = read_file_window(file_path, *(time_range or (None, None)))
 
         # 只保留目标 pod 数据
         target_pods = get_target_pods()
@@ -645,56 +729,44 @@ def load_pod_metric_data(date: str, metric_name: str) -> Optional[pd.DataFrame]:
         print(f"加载文件 {file_path} 时出错: {e}")
         return None
 
-def analyze_pod_metrics(fault_date: str, normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str]) -> Dict[str, List[Dict]]:
+@traced('metric.pod')
+def analyze_pod_metrics(fault_date: str, normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str],
+                        baseline: Optional[FaultBaseline] = None) -> Dict[str, List[Dict]]:
     """
     分析Pod节点的指标异常，分析结果按 node -> pod -> metric 组织
     参数:
         fault_date: 故障日期，格式如 "2025-06-06"
         normal_periods: 正常时间段列表，每个元素为 (start_ns, end_ns)
         fault_period: 故障时间段，格式为 (start_ns, end_ns)
+        baseline: 本次故障的在线基线，None时从指标预聚合或原始数据计算
     """
     pods_analysis = {}
+    time_range = get_analysis_time_range(normal_periods, fault_period)
+    pod_baseline = baseline.compare_scope('pod', min_ratio=None) if baseline is not None else None
+    target_pods = set(get_target_pods())
 
     for metric_name in pod_metrics:
         print(f"\n=== 处理指标: {metric_name} ===")
-        df_metric = load_pod_metric_data(fault_date, metric_name)
-        if df_metric is None:
-            continue
-        # 按 instance-pod 分组
-        df_metric = df_metric.groupby(['instance', 'pod'])
-        for (node, pod), group in df_metric:
-            print(f"\n=== 处理 Node: {node}, Pod: {pod} ===")
-            if len(group):
-
-                # 1. 合并所有正常时间段数据
-                print(f"    正常时间段分析:")
-                all_normal_data = []
-
-                for start, end in normal_periods:
-                    normal_data = group[(group['timestamp_ns'] >= int(start)) & (group['timestamp_ns'] <= int(end))]
-                    if len(normal_data) > 0:
-                        all_normal_data.append(normal_data)
-
-                # 合并正常时间段数据并统计
-                if all_normal_data:
-                    combined_normal_data = pd.concat(all_normal_data, ignore_index=True)
-                    print(f"    合并后正常时间段总数据行数: {len(combined_normal_data)}")
-
-                    normal_desc = get_metrics_stats(
-                        combined_normal_data,
-                        [metric_name]
-                    )
-
-                # 2. 故障时间段统计
-                print(f"    故障时间段分析:")
-                df_pod_fault = group[(group['timestamp_ns'] >= int(fault_period[0])) &
-                                    (group['timestamp_ns'] <= int(fault_period[1]))]
-                if len(df_pod_fault):
-                    fault_desc = get_metrics_stats(
-                        df_pod_fault,
-                        [metric_name]
-                    )
-                    print(f"    故障时间段数据行数: {len(df_pod_fault)}")
+        # 启用在线基线时直接取统计；否则统计后端允许近似结果时从指标预聚合计算，再否则（或没有预聚合时）读取原始数据并按 instance-pod 分组
+        entities = query_entities(fault_date, 'pod', metric_name) if pod_baseline is None and use_metric_rollups() else None
+        if pod_baseline is not None:
+            # 与按 instance-pod 分组的顺序一致
+            pod_stats = {(instance, pod): select_baseline_stats(pod_baseline, pod, [metric_name], instance)
+                         for (pod, instance), comparisons in sorted(pod_baseline.items(), key=lambda item: item[0][::-1])
+                         if pod in target_pods and metric_name in comparisons}
+        elif entities is not None:
+            pod_stats = {(instance, pod): get_rollup_period_stats(fault_date, 'pod', pod, [metric_name], normal_periods, fault_period, instance)
+                         for pod, instance in entities if pod in target_pods}
+        else:
+            df_metric = load_pod_metric_data(fault_date, metric_name, time_range)
+            if df_metric is None:
+                continue
+            pod_stats = {(node, pod): get_period_stats(group, [metric_name], normal_periods, fault_period)
+                         for (node, pod), group in df_metric.groupby(['instance', 'pod'])}
+        for (node, pod), (normal_desc, fault_desc) in pod_stats.items():
+            log.debug("\n=== 处理 Node: {node}, Pod: {pod} ===", node=node, pod=pod)
+            log.count('Pod指标序列')
+            if normal_desc or fault_desc:
                 if len(normal_desc) > 0 and len(fault_desc) > 0:#过滤掉变化倍数在 0.95 到 1.05 之间的指标
                     normal_mean = normal_desc[metric_name]['mean']
                     fault_mean = fault_desc[metric_name]['mean']
@@ -702,7 +774,8 @@ def analyze_pod_metrics(fault_date: str, normal_periods: List[Tuple[str, str]],
                     ratio = (fault_mean + epsilon) / (normal_mean + epsilon)
                 
                     if 0.95 <= ratio <= 1.05:
-                        print(f"    指标 {metric_name} 变化倍数 {ratio:.2f} 在 0.95~1.05 之间，跳过保存")
+                        log.count('变化不明显跳过')
+                        log.debug("    指标 {metric} 变化倍数 {ratio:.2f} 在 0.95~1.05 之间，跳过保存", metric=metric_name, ratio=ratio)
                         continue
 
                 if node not in pods_analysis:
@@ -711,11 +784,14 @@ def analyze_pod_metrics(fault_date: str, normal_periods: List[Tuple[str, str]],
                 pods_analysis[node][pod][metric_name] = {}
                 pods_analysis[node][pod][metric_name]['fault_stats'] = fault_desc.get(metric_name, {})
                 pods_analysis[node][pod][metric_name]['normal_stats'] = normal_desc.get(metric_name, {})
+                log.count('保存的异常指标')
+    log.summary("Pod指标分析汇总:")
     # print(json.dumps(pods_analysis, indent=2, ensure_ascii=False))
     # exit(0)
     return pods_analysis
 
 
+@traced('metric.refinement')
 async def metric_refinement(df_fault_timestamps: pd.DataFrame, index: int, fault_start: str, fault_end: str) -> str:
     """
     对指定索引的故障时间戳进行指标分析
@@ -734,31 +810,41 @@ async def metric_refinement(df_fault_timestamps: pd.DataFrame, index: int, fault
     fault_period = (fault_start, fault_end)
 
     print(f"开始分析故障索引：{index}")
+    if USE_METRIC_BASELINE:
+        print("时段统计来自持久化的在线基线（正常统计为全部已读取数据中非故障时段的累计值）")
+    else:
+        print(f"指标统计后端：{STATS_BACKEND}，时段统计来自"
+              f"{'指标预聚合（近似，当天没有预聚合时读取原始数据）' if use_metric_rollups() else '原始数据（精确）'}")
     print("=" * 80)
+    baseline = None
+    if USE_METRIC_BASELINE:
+        # 只读取当天新到达的指标文件，已读取过的直接使用持久化的基线
+        engine = update_metric_baseline([fault_date], load_fault_schedule(df_fault_timestamps))
+        baseline = engine.for_fault(df_fault_timestamps.iloc[index]['uuid'])
 
     # 分析普通微服务
-    service_result = await analyze_service_metrics(fault_date, normal_periods, fault_period)
+    service_result = await analyze_service_metrics(fault_date, normal_periods, fault_period, baseline)
     if len(service_result) == 0:
         print("无异常Service指标")
     else:
         print(f"成功分析了{len(service_result)}个异常Service指标")
 
     # 分析TiDB服务
-    tidb_result = analyze_tidb_metrics(fault_date, normal_periods, fault_period)
+    tidb_result = analyze_tidb_metrics(fault_date, normal_periods, fault_period, baseline)
     if len(tidb_result) == 0:
         print("无异常TiDB指标")
     else:
         print(f"成功分析了{len(tidb_result)}个异常TiDB指标")
 
     # 分析 infra/node
-    node_result = analyze_node_metrics(fault_date, normal_periods, fault_period)
+    node_result = analyze_node_metrics(fault_date, normal_periods, fault_period, baseline)
     if len(node_result) == 0:
         print("无异常Node指标")
     else:
         print(f"成功分析了{len(node_result)}个异常Node指标")
 
     # 分析 infra/pod
-    pod_result = analyze_pod_metrics(fault_date, normal_periods, fault_period)
+    pod_result = analyze_pod_metrics(fault_date, normal_periods, fault_period, baseline)
     if len(pod_result) == 0:
         print("无异常Pod指标")
     else:
@@ -0,0 +1,352 @@
+"""
+metric-parquet的按分钟预聚合（rollup）
+
+离线任务：对某一天的每个service、apm pod、TiDB、node、infra pod指标，按1分钟和5分钟时间桶预先计算
+count、sum、min、max、平方和、非零数（以及第二小、第二大值，用于与get_metrics_stats一致地去掉极值）
+和KLL草图，写成一个紧凑的parquet文件 cache/metric_rollup/{date}.parquet。
+
+开启USE_METRIC_ROLLUPS并使用允许近似结果的统计后端（metric_refinement.STATS_BACKEND = 'sketch'）时，
+指标分析器先查询预聚合：时间段内部完整的5分钟桶与两端的1分钟桶合并为SketchStats，
+直接给出与get_metrics_stats相同格式的统计，只需读取几KB的预聚合数据而不是逐个实体的原始文件。
+时间段边界按1分钟桶的中点对齐，误差不超过半分钟的数据；预聚合缺失或源文件更新后自动回退到原始数据
+
+用法:
+    python -m dataRefinement.metric_rollup 2025-06-06 [2025-06-07 ...]
+"""
+import os
+import sys
+import time
+import threading
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from dataRefinement.data_catalog import get_catalog
+from dataRefinement.window_reader import read_file_window
+from dataRefinement.quantile_sketch import SKETCH_K, KLLSketch, SketchStats
+from utils.span_tracer import traced
+
+# ========== 指标预聚合配置 ==========
+ROLLUP_ROOT = os.path.join(project_root, 'cache', 'metric_rollup')
+USE_METRIC_ROLLUPS = False  # 指标分析时是否优先使用预聚合（分位数为近似值，需与STATS_BACKEND = 'sketch'一起开启）
+ROLLUP_SKETCH_K = SKETCH_K
+MINUTE_NS = 60 * 1_000_000_000
+# 分辨率名 -> 时间桶宽度（纳秒），从细到粗
+ROLLUP_RESOLUTIONS = {
+    '1min': MINUTE_NS,
+    '5min': 5 * MINUTE_NS,
+}
+
+ROLLUP_COLUMNS = ['scope', 'entity', 'instance', 'metric', 'resolution', 'bucket_ns',
+                  'count', 'sum', 'sum_sq', 'non_zero', 'min', 'min2', 'max', 'max2', 'sketch']
+
+# 每个数据源：(层级, 实体名, 实体列, 实例列, 指标列, 文件路径)
+RollupSource = Tuple[str, Optional[str], Optional[str], Optional[str], List[str], str]
+RollupKey = Tuple[str, str, str, str, str]  # (层级, 实体, 实例, 指标, 分辨率)
+
+
+def rollup_path(date: str) -> str:
+    """
+    某一天的预聚合文件路径
+    """
+    return os.path.join(ROLLUP_ROOT, f'{date}.parquet')
+
+
+def _iter_sources(date: str) -> Iterator[RollupSource]:
+    """
+    列出某一天需要预聚合的指标文件，实体和指标的解析规则与各指标分析器一致
+    """
+    from dataRefinement.metric_refinement import (
+        key_metrics, get_tidb_core_metrics, get_tidb_services_directories, get_tidb_services_files_mapping,
+        get_node_metrics_files_mapping, get_pod_metrics_files_mapping,
+    )
+    catalog = get_catalog()
+    # apm服务和apm pod：每个文件对应一个实体，文件中包含key_metrics各列
+    for scope, category in (('service', 'apm/service'), ('apm_pod', 'apm/pod')):
+        for item in catalog.files('metric', date=date, category=category):
+            filename = os.path.basename(item.path)
+            entity = filename.split('_')[1] if '_' in filename else filename.split('.')[0]
+            yield scope, entity, None, None, key_metrics, item.abspath
+
+    # TiDB：每个文件对应一个服务的一个指标
+    directories = get_tidb_services_directories()
+    file_mapping = get_tidb_services_files_mapping(date)
+    for service_name, metrics_list in get_tidb_core_metrics().items():
+        for metric_name in metrics_list:
+            file_name = file_mapping.get(service_name, {}).get(metric_name)
+            if file_name is not None:
+                file_path = os.path.join(catalog.data_root, date, 'metric-parquet', directories[service_name], file_name)
+                yield 'tidb', service_name, None, None, [metric_name], file_path
+
+    # node与infra pod：每个文件对应一个指标，实体在列中
+    node_dir = os.path.join(catalog.data_root, date, 'metric-parquet', 'infra', 'infra_node')
+    for metric_name, file_name in get_node_metrics_files_mapping(date).items():
+        yield 'node', None, 'kubernetes_node', None, [metric_name], os.path.join(node_dir, file_name)
+    pod_dir = os.path.join(catalog.data_root, date, 'metric-parquet', 'infra', 'infra_pod')
+    for metric_name, file_name in get_pod_metrics_files_mapping(date).items():
+        yield 'pod', None, 'pod', 'instance', [metric_name], os.path.join(pod_dir, file_name)
+
+
+def aggregate_frame(df: pd.DataFrame, scope: str, metrics: List[str], entity: Optional[str] = None,
+                    entity_column: Optional[str] = None, instance_column: Optional[str] = None,
+                    k: int = ROLLUP_SKETCH_K) -> pd.DataFrame:
+    """
+    把一个指标DataFrame按实体和各分辨率的时间桶聚合
+
+    参数:
+        df: 含timestamp_ns和指标列的数据
+        scope: 层级，service/apm_pod/tidb/node/pod
+        metrics: 指标列
+        entity: 整个DataFrame对应的实体名（如从文件名解析出的服务名），与entity_column二选一
+        entity_column: 实体列名
+        instance_column: 实例列名（如infra pod所在的instance），None表示没有
+        k: 草图精度参数
+
+    返回:
+        pd.DataFrame: ROLLUP_COLUMNS格式的预聚合行
+    """
+    frames = []
+    entities = df[entity_column].astype(str).to_numpy() if entity_column else np.full(len(df), entity, dtype=object)
+    instances = df[instance_column].astype(str).to_numpy() if instance_column else np.full(len(df), '', dtype=object)
+    timestamps = df['timestamp_ns'].to_numpy(dtype=np.int64)
+    for metric in metrics:
+        if metric not in df.columns:
+            continue
+        values = pd.to_numeric(df[metric], errors='coerce').to_numpy(dtype=float)
+        valid = ~np.isnan(values)
+        for resolution, width in ROLLUP_RESOLUTIONS.items():
+            data = pd.DataFrame({
+                'entity': entities[valid], 'instance': instances[valid],
+                'bucket_ns': timestamps[valid] // width * width, 'value': values[valid],
+            }).sort_values(['entity', 'instance', 'bucket_ns', 'value'], kind='stable', ignore_index=True)
+            if len(data) == 0:
+                continue
+            data['square'] = np.square(data['value'])
+            data['positive'] = (data['value'] > 0).astype(np.int64)
+            grouped = data.groupby(['entity', 'instance', 'bucket_ns'], sort=False)
+            rows = grouped.agg(count=('value', 'size'), sum=('value', 'sum'), sum_sq=('square', 'sum'),
+                               non_zero=('positive', 'sum'), min=('value', 'first'), max=('value', 'last'))
+            # 组内已按数值排序，第二小、第二大值直接按位置取；只有一个值时为NaN
+            ends = np.cumsum(rows['count'].to_numpy())
+            starts = ends - rows['count'].to_numpy()
+            sorted_values = data['value'].to_numpy()
+            single = rows['count'].to_numpy() < 2
+            rows['min2'] = np.where(single, np.nan, sorted_values[np.minimum(starts + 1, ends - 1)])
+            rows['max2'] = np.where(single, np.nan, sorted_values[np.maximum(ends - 2, starts)])
+            sketches = []
+            for start, end in zip(starts, ends):
+                sketch = KLLSketch(k=k)
+                sketch.update(sorted_values[start:end])
+                sketches.append(sketch.to_bytes())
+            rows['sketch'] = sketches
+            rows = rows.reset_index()
+            rows['scope'], rows['metric'], rows['resolution'] = scope, metric, resolution
+            frames.append(rows)
+    if not frames:
+        return pd.DataFrame(columns=ROLLUP_COLUMNS)
+    return pd.concat(frames, ignore_index=True)[ROLLUP_COLUMNS]
+
+
+def build_day_rollup(date: str) -> Optional[str]:
+    """
+    生成某一天的指标预聚合文件
+
+    参数:
+        date: 日期，格式如 "2025-06-06"
+
+    返回:
+        Optional[str]: 预聚合文件路径，当天没有任何指标数据时返回None
+    """
+    start_time = time.time()
+    frames = []
+    num_files = num_rows = 0
+    for scope, entity, entity_column, instance_column, metrics, file_path in _iter_sources(date):
+        if not os.path.exists(file_path):
+            continue
+        try:
+            schema_names = pq.read_schema(file_path).names
+            columns = ['timestamp_ns'] + [c for c in (entity_column, instance_column) if c] + metrics
+            df = read_file_window(file_path, columns=[c for c in columns if c in schema_names])
+        except Exception as e:
+            print(f"读取指标文件失败 {file_path}: {e}")
+            continue
+        frames.append(aggregate_frame(df, scope, metrics, entity, entity_column, instance_column))
+        num_files += 1
+        num_rows += len(df)
+
+    if not frames:
+        print(f"{date}: 没有可预聚合的指标文件")
+        return None
+    rollup = pd.concat(frames, ignore_index=True)
+    output_path = rollup_path(date)
+    os.makedirs(os.path.dirname(output_path), exist_ok=True)
+    tmp_path = f"{output_path}.{os.getpid()}.tmp"
+    rollup.to_parquet(tmp_path, index=False, compression='zstd')
+    os.replace(tmp_path, output_path)
+    print(f"{date}: 预聚合{num_files}个指标文件（{num_rows}行）为{len(rollup)}个时间桶，"
+          f"{os.path.getsize(output_path) / 1024:.1f}KB，耗时{time.time() - start_time:.2f}秒")
+    _rollup_cache.pop(date, None)
+    return output_path
+
+
+def _row_stats(row: Dict, k: int = ROLLUP_SKETCH_K) -> SketchStats:
+    """
+    由一个时间桶的预聚合行还原可合并的SketchStats
+    """
+    stats = SketchStats(k=k)
+    stats.count = int(row['count'])
+    stats.total = float(row['sum'])
+    stats.total_sq = float(row['sum_sq'])
+    stats.non_zero = int(row['non_zero'])
+    stats.smallest = [v for v in (row['min'], row['min2']) if v == v]
+    stats.largest = [v for v in (row['max'], row['max2']) if v == v]
+    stats.sketch = KLLSketch.from_bytes(row['sketch'])
+    return stats
+
+
+class DayRollup:
+    """
+    内存中的某一天预聚合，按 (层级, 实体, 实例, 指标, 分辨率) 索引时间桶
+    """
+
+    def __init__(self, df: pd.DataFrame):
+        df = df.sort_values(['scope', 'entity', 'instance', 'metric', 'resolution', 'bucket_ns'], ignore_index=True)
+        # 按列保存，查询时只为选中的时间桶构造行（整表转成记录列表在大的一天上要数十秒）
+        self.columns = {column: df[column].to_numpy(dtype=object if column == 'sketch' else None)
+                        for column in ROLLUP_COLUMNS[ROLLUP_COLUMNS.index('bucket_ns'):]}
+        self.index: Dict[RollupKey, Tuple[np.ndarray, int]] = {}
+        keys = ['scope', 'entity', 'instance', 'metric', 'resolution']
+        for key, positions in df.groupby(keys, sort=False).indices.items():
+            self.index[key] = (df['bucket_ns'].to_numpy()[positions], int(positions[0]))
+
+    def entities(self, scope: str, metric: str) -> List[Tuple[str, str]]:
+        """
+        某一层级某个指标的全部 (实体, 实例)
+        """
+        return sorted({(entity, instance) for (s, entity, instance, m, _) in self.index if s == scope and m == metric})
+
+    def _buckets(self, key: RollupKey, start_ns: int, end_ns: int, contained: bool) -> List[Dict]:
+        """
+        时间段内的时间桶：contained为True时只取完整落在时间段内的桶，否则取中点落在时间段内的桶
+        """
+        entry = self.index.get(key)
+        if entry is None:
+            return []
+        buckets, offset = entry
+        width = ROLLUP_RESOLUTIONS[key[-1]]
+        if contained:
+            lo, hi = start_ns, end_ns - width + 1
+        else:
+            lo, hi = start_ns - width // 2, end_ns - width // 2
+        first, last = np.searchsorted(buckets, lo, side='left'), np.searchsorted(buckets, hi, side='right')
+        selected = {column: values[offset + first:offset + last] for column, values in self.columns.items()}
+        return [{column: values[i] for column, values in selected.items()} for i in range(last - first)]
+
+    def period_stats(self, scope: str, entity: str, metric: str, periods: List[Tuple[int, int]],
+                     instance: str = '') -> Optional[SketchStats]:
+        """
+        合并多个时间段的统计：完整的5分钟桶之外的部分用1分钟桶补齐
+
+        返回:
+            Optional[SketchStats]: 合并后的统计，该序列不在预聚合中时返回None
+        """
+        fine, coarse = list(ROLLUP_RESOLUTIONS)[0], list(ROLLUP_RESOLUTIONS)[-1]
+        fine_key, coarse_key = (scope, entity, instance, metric, fine), (scope, entity, instance, metric, coarse)
+        if fine_key not in self.index:
+            return None
+        coarse_width = ROLLUP_RESOLUTIONS[coarse]
+        merged = SketchStats(k=ROLLUP_SKETCH_K)
+        for start, end in periods:
+            start, end = int(start), int(end)
+            rows = self._buckets(coarse_key, start, end, contained=True)
+            covered = {row['bucket_ns'] for row in rows}
+            rows += [row for row in self._buckets(fine_key, start, end, contained=False)
+                     if row['bucket_ns'] // coarse_width * coarse_width not in covered]
+            for row in rows:
+                merged.merge(_row_stats(row))
+        return merged
+
+
+_rollup_cache: Dict[str, Optional[DayRollup]] = {}
+_rollup_lock = threading.Lock()
+
+
+@traced('metric.rollup_load')
+def load_day_rollup(date: str) -> Optional[DayRollup]:
+    """
+    加载某一天的预聚合（进程内缓存）；文件不存在或早于当天任一指标源文件时返回None
+
+    参数:
+        date: 日期，格式如 "2025-06-06"
+    """
+    if not USE_METRIC_ROLLUPS:
+        return None
+    with _rollup_lock:
+        if date not in _rollup_cache:
+            path = rollup_path(date)
+            rollup = None
+            if os.path.exists(path):
+                source_mtime = max((item.mtime for item in get_catalog().files('metric', date=date)), default=0.0)
+                if os.path.getmtime(path) >= source_mtime:
+                    rollup = DayRollup(pd.read_parquet(path))
+                else:
+                    print(f"指标预聚合 {path} 早于源文件，回退到原始数据")
+            _rollup_cache[date] = rollup
+        return _rollup_cache[date]
+
+
+def query_period_stats(date: str, scope: str, entity: str, metrics: List[str],
+                       normal_periods: List[Tuple[str, str]], fault_period: Tuple[str, str],
+                       instance: str = '') -> Optional[Tuple[Dict[str, Dict], Dict[str, Dict]]]:
+    """
+    从预聚合计算正常时间段（合并）与故障时间段的统计，格式同get_metrics_stats
+
+    参数:
+        date: 故障日期
+        scope: 层级，service/apm_pod/tidb/node/pod
+        entity: 实体名
+        metrics: 指标列表
+        normal_periods: 正常时间段列表
+        fault_period: 故障时间段
+        instance: 实例名（infra pod所在的instance）
+
+    返回:
+        Optional[Tuple[Dict, Dict]]: (正常统计, 故障统计)，没有数据时为空字典；
+        当天没有可用的预聚合时返回None，由调用方回退到原始数据
+    """
+    rollup = load_day_rollup(date)
+    if rollup is None:
+        return None
+    normal_stats, fault_stats = {}, {}
+    for metric in metrics:
+        normal = rollup.period_stats(scope, entity, metric, normal_periods, instance)
+        if normal is None:
+            # 与get_metrics_stats一致，没有数据的实体或指标列直接跳过
+            continue
+        fault = rollup.period_stats(scope, entity, metric, [fault_period], instance)
+        if normal.count:
+            normal_stats[metric] = normal.to_stats()
+        if fault.count:
+            fault_stats[metric] = fault.to_stats()
+    return normal_stats, fault_stats
+
+
+def query_entities(date: str, scope: str, metric: str) -> Optional[List[Tuple[str, str]]]:
+    """
+    预聚合中某一层级某个指标的全部 (实体, 实例)；没有可用的预聚合时返回None
+    """
+    rollup = load_day_rollup(date)
+    return rollup.entities(scope, metric) if rollup is not None else None
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python -m dataRefinement.metric_rollup <日期> [<日期> ...]")
+        sys.exit(1)
+    for day in sys.argv[1:]:
+        build_day_rollup(day)
@@ -0,0 +1,148 @@
+"""
+进程内模型注册表
+
+trace异常检测器等模型文件在每个故障中都会用到，注册表按名称缓存加载结果：同一进程内只反序列化一次，
+模型文件的mtime（或路径）变化时才重新加载。每次加载记录耗时、文件大小和进程常驻内存（RSS）的增量。
+
+多进程运行时，在fork worker之前调用 preload_for_fork() 预先加载并执行gc.freeze()，
+把已加载的对象移出垃圾回收器的扫描范围，避免子进程中的GC遍历这些对象、改写GC头而触发内存页复制
+"""
+import gc
+import os
+import time
+import threading
+from dataclasses import dataclass, field
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+
+@dataclass
+class ModelEntry:
+    """
+    一个已加载的模型及其加载信息
+    """
+    name: str
+    paths: Tuple[str, ...]
+    mtimes: Tuple[float, ...]
+    value: Any = None
+    load_seconds: float = 0.0
+    file_bytes: int = 0
+    rss_delta_bytes: Optional[int] = None
+    loads: int = 0
+    hits: int = 0
+    loaded_at: float = field(default_factory=time.time)
+
+
+def _rss_bytes() -> Optional[int]:
+    """
+    当前进程的常驻内存（字节），无法获取时返回None
+    """
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+def _mtimes(paths: Sequence[str]) -> Tuple[float, ...]:
+    return tuple(os.path.getmtime(path) for path in paths)
+
+
+class ModelRegistry:
+    """
+    按名称缓存模型，模型文件变化时自动重新加载
+    """
+
+    def __init__(self):
+        self._entries: Dict[str, ModelEntry] = {}
+        self._lock = threading.RLock()
+
+    def get(self, name: str, paths: Sequence[str], loader: Callable[[], Any]) -> Any:
+        """
+        获取模型：未加载、路径变化或任一文件的mtime变化时调用loader重新加载
+
+        参数:
+            name: 模型名称
+            paths: 模型依赖的文件，用于判断是否需要重新加载
+            loader: 无参加载函数，返回模型对象；加载失败时抛出异常
+
+        返回:
+            Any: loader的返回值
+        """
+        paths = tuple(paths)
+        mtimes = _mtimes(paths)
+        with self._lock:
+            entry = self._entries.get(name)
+            if entry is not None and entry.paths == paths and entry.mtimes == mtimes:
+                entry.hits += 1
+                return entry.value
+            reloading = entry is not None
+            rss_before = _rss_bytes()
+            start_time = time.perf_counter()
+            value = loader()
+            load_seconds = time.perf_counter() - start_time
+            rss_after = _rss_bytes()
+            new_entry = ModelEntry(
+                name=name, paths=paths, mtimes=mtimes, value=value, load_seconds=load_seconds,
+                file_bytes=sum(os.path.getsize(path) for path in paths),
+                rss_delta_bytes=rss_after - rss_before if rss_before is not None and rss_after is not None else None,
+                loads=(entry.loads if entry is not None else 0) + 1, hits=entry.hits if entry is not None else 0,
+            )
+            # 先替换条目再释放旧模型，其他线程拿到的仍是完整的旧对象或新对象
+            self._entries[name] = new_entry
+            print(f"{'重新' if reloading else ''}加载模型 {name}: {self._describe(new_entry)}")
+            return value
+
+    def invalidate(self, name: Optional[str] = None) -> None:
+        """
+        丢弃缓存的模型，下次get时重新加载
+
+        参数:
+            name: 模型名称，None表示全部
+        """
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
+
+    def report(self) -> List[Dict[str, Any]]:
+        """
+        各模型的加载耗时、文件大小、内存增量和命中次数
+        """
+        with self._lock:
+            return [{'name': entry.name, 'load_seconds': round(entry.load_seconds, 3), 'file_bytes': entry.file_bytes,
+                     'rss_delta_bytes': entry.rss_delta_bytes, 'loads': entry.loads, 'hits': entry.hits,
+                     'loaded_at': entry.loaded_at}
+                    for entry in self._entries.values()]
+
+    @staticmethod
+    def _describe(entry: ModelEntry) -> str:
+        memory = f"{entry.rss_delta_bytes / 1024 / 1024:.1f}MB" if entry.rss_delta_bytes is not None else "未知"
+        return (f"耗时{entry.load_seconds:.2f}秒，文件{entry.file_bytes / 1024 / 1024:.1f}MB，"
+                f"内存增加{memory}，第{entry.loads}次加载，已复用{entry.hits}次")
+
+
+_registry = ModelRegistry()
+
+
+def get_registry() -> ModelRegistry:
+    """
+    获取进程内共享的模型注册表
+    """
+    return _registry
+
+
+def preload_for_fork(loaders: Sequence[Callable[[], Any]]) -> None:
+    """
+    在fork worker之前预加载模型并冻结GC，使子进程以写时复制的方式只读共享已加载的模型
+
+    参数:
+        loaders: 预加载函数列表，通常是各模块通过注册表加载模型的函数
+    """
+    for loader in loaders:
+        loader()
+    gc.collect()
+    gc.freeze()
+    for item in _registry.report():
+        print(f"预加载模型 {item['name']}: 耗时{item['load_seconds']:.2f}秒，"
+              f"内存增加{(item['rss_delta_bytes'] or 0) / 1024 / 1024:.1f}MB")
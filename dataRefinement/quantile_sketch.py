@@ -0,0 +1,239 @@
+"""
+可合并的分位数草图（KLL）及基于草图的指标统计
+
+KLLSketch以O(k·log(n/k))的内存近似任意分位数，秩误差约为O(1/k)，两个草图可直接合并。
+SketchStats在草图之外精确累计count/sum/平方和/非零数以及两个最小、两个最大值，
+可按get_metrics_stats的口径（去掉一个最小值和一个最大值）给出describe()格式的统计。
+按文件或按小时构建的SketchStats可以在get_normal_periods返回的多个时间段之间合并，无需拼接原始数据再排序
+"""
+import math
+import struct
+from typing import Dict, Iterable, List, Optional
+
+import numpy as np
+
+# ========== 草图配置 ==========
+SKETCH_K = 200  # KLL精度参数，秩误差约为 1.65/k
+SKETCH_SEED = 42
+PERCENTILES = (0.25, 0.5, 0.75, 0.95, 0.99)  # 与get_metrics_stats一致
+_CAPACITY_DECAY = 2.0 / 3.0
+
+
+class KLLSketch:
+    """
+    KLL分位数草图：第h层中每个元素代表2^h个原始值
+    """
+
+    def __init__(self, k: int = SKETCH_K, seed: int = SKETCH_SEED):
+        self.k = k
+        self.levels: List[np.ndarray] = [np.empty(0)]
+        self.count = 0
+        self._rng = np.random.default_rng(seed)
+
+    def _capacity(self, level: int) -> int:
+        depth = len(self.levels) - level - 1
+        return max(2, int(math.ceil(self.k * _CAPACITY_DECAY ** depth)))
+
+    def _size(self) -> int:
+        return sum(len(level) for level in self.levels)
+
+    def _max_size(self) -> int:
+        return sum(self._capacity(h) for h in range(len(self.levels)))
+
+    def _compress(self) -> None:
+        while self._size() >= self._max_size():
+            for h in range(len(self.levels)):
+                if len(self.levels[h]) >= self._capacity(h):
+                    if h + 1 == len(self.levels):
+                        self.levels.append(np.empty(0))
+                    values = np.sort(self.levels[h])
+                    kept = values[:0]
+                    if len(values) % 2:
+                        kept, values = values[-1:], values[:-1]
+                    # 随机保留奇数位或偶数位，权重翻倍后提升到上一层
+                    promoted = values[self._rng.integers(2)::2]
+                    self.levels[h + 1] = np.concatenate([self.levels[h + 1], promoted])
+                    self.levels[h] = kept
+                    break
+
+    def update(self, values: Iterable[float]) -> None:
+        """
+        批量加入数值：整批排序一次后逐层对半压缩（等价于逐个加入后的多次压缩），放入对应层后再整体压缩
+        """
+        values = np.asarray(values, dtype=float).ravel()
+        values = np.sort(values[~np.isnan(values)])
+        self.count += len(values)
+        level = 0
+        while len(values) > self.k:
+            if len(values) % 2:
+                self._append(level, values[-1:])
+                values = values[:-1]
+            values = values[self._rng.integers(2)::2]
+            level += 1
+        self._append(level, values)
+        self._compress()
+
+    def _append(self, level: int, values: np.ndarray) -> None:
+        while len(self.levels) <= level:
+            self.levels.append(np.empty(0))
+        self.levels[level] = np.concatenate([self.levels[level], values])
+
+    def merge(self, other: 'KLLSketch') -> 'KLLSketch':
+        """
+        合并另一个草图（原地修改并返回self）
+        """
+        while len(self.levels) < len(other.levels):
+            self.levels.append(np.empty(0))
+        for h, level in enumerate(other.levels):
+            self.levels[h] = np.concatenate([self.levels[h], level])
+        self.count += other.count
+        self._compress()
+        return self
+
+    def quantiles(self, qs: Iterable[float]) -> List[float]:
+        """
+        近似分位数
+        """
+        qs = list(qs)
+        if self.count == 0:
+            return [float('nan')] * len(qs)
+        values = np.concatenate(self.levels)
+        weights = np.concatenate([np.full(len(level), 2 ** h, dtype=float) for h, level in enumerate(self.levels)])
+        order = np.argsort(values, kind='stable')
+        values, cumulative = values[order], np.cumsum(weights[order])
+        total = cumulative[-1]
+        return [float(values[min(np.searchsorted(cumulative, q * total, side='left'), len(values) - 1)]) for q in qs]
+
+    def exact_values(self) -> Optional[np.ndarray]:
+        """
+        尚未发生压缩（全部数值都在第0层）时返回排序后的全部原始值，否则返回None
+        """
+        if any(len(level) for level in self.levels[1:]):
+            return None
+        return np.sort(self.levels[0])
+
+    def to_bytes(self) -> bytes:
+        """
+        序列化：头部为 k、count、层数、各层长度，之后是各层float64数据
+        """
+        header = struct.pack(f'<qqq{len(self.levels)}q', self.k, self.count, len(self.levels),
+                             *[len(level) for level in self.levels])
+        return header + b''.join(level.astype('<f8').tobytes() for level in self.levels)
+
+    @classmethod
+    def from_bytes(cls, data: bytes) -> 'KLLSketch':
+        k, count, num_levels = struct.unpack_from('<qqq', data)
+        offset = 24
+        sizes = struct.unpack_from(f'<{num_levels}q', data, offset)
+        offset += 8 * num_levels
+        sketch = cls(k=k)
+        sketch.count = count
+        sketch.levels = []
+        for size in sizes:
+            sketch.levels.append(np.frombuffer(data, dtype='<f8', count=size, offset=offset).copy())
+            offset += 8 * size
+        return sketch
+
+
+class SketchStats:
+    """
+    可合并的指标统计：精确的计数/矩/极值 + KLL分位数
+    """
+
+    def __init__(self, k: int = SKETCH_K):
+        self.count = 0
+        self.total = 0.0
+        self.total_sq = 0.0
+        self.non_zero = 0
+        self.smallest: List[float] = []  # 最小的两个值（升序）
+        self.largest: List[float] = []  # 最大的两个值（降序）
+        self.sketch = KLLSketch(k=k)
+
+    @classmethod
+    def from_values(cls, values: Iterable[float], k: int = SKETCH_K) -> 'SketchStats':
+        stats = cls(k=k)
+        stats.update(values)
+        return stats
+
+    def update(self, values: Iterable[float]) -> None:
+        values = np.asarray(values, dtype=float).ravel()
+        values = values[~np.isnan(values)]
+        if len(values) == 0:
+            return
+        self.count += len(values)
+        self.total += float(values.sum())
+        self.total_sq += float(np.square(values).sum())
+        self.non_zero += int((values > 0).sum())
+        lows, highs = (np.partition(values, 1)[:2], -np.partition(-values, 1)[:2]) if len(values) > 2 else (values, values)
+        self.smallest = sorted(self.smallest + lows.tolist())[:2]
+        self.largest = sorted(self.largest + highs.tolist(), reverse=True)[:2]
+        self.sketch.update(values)
+
+    def merge(self, other: 'SketchStats') -> 'SketchStats':
+        self.count += other.count
+        self.total += other.total
+        self.total_sq += other.total_sq
+        self.non_zero += other.non_zero
+        self.smallest = sorted(self.smallest + other.smallest)[:2]
+        self.largest = sorted(self.largest + other.largest, reverse=True)[:2]
+        self.sketch.merge(other.sketch)
+        return self
+
+    def to_stats(self, trim: bool = True) -> Dict[str, float]:
+        """
+        与get_metrics_stats相同格式的统计；trim时与精确算法一致，超过2个值时去掉一个最小值和一个最大值
+        （分位数仍来自未去极值的草图，误差在草图精度范围内）
+        """
+        if self.count == 0:
+            return {}
+        count, total, total_sq = self.count, self.total, self.total_sq
+        minimum, maximum = self.smallest[0], self.largest[0]
+        if trim and self.count > 2:
+            count -= 2
+            total -= self.smallest[0] + self.largest[0]
+            total_sq -= self.smallest[0] ** 2 + self.largest[0] ** 2
+            minimum, maximum = self.smallest[1], self.largest[1]
+        mean = total / count
+        std = math.sqrt(max(total_sq - total * total / count, 0.0) / (count - 1)) if count > 1 else float('nan')
+        stats = {'count': float(count), 'mean': mean, 'std': std, 'min': minimum}
+        exact = self.sketch.exact_values()
+        if exact is not None:
+            # 数据量不超过草图容量时草图中保存的就是全部原始值，按describe()的线性插值给出精确分位数
+            if trim and self.count > 2:
+                exact = exact[1:-1]
+            quantiles = np.percentile(exact, [p * 100 for p in PERCENTILES]).tolist()
+        else:
+            quantiles = self.sketch.quantiles(PERCENTILES)
+        for p, value in zip(PERCENTILES, quantiles):
+            stats[f"{p * 100:g}%"] = min(max(value, minimum), maximum)
+        stats['max'] = maximum
+        stats['non_zero_ratio'] = round(self.non_zero / self.count, 3)
+        return stats
+
+
+def merge_stats(parts: Iterable[Optional[SketchStats]], k: int = SKETCH_K) -> SketchStats:
+    """
+    合并多个时间段/文件/小时的统计
+    """
+    merged = SketchStats(k=k)
+    for part in parts:
+        if part is not None:
+            merged.merge(part)
+    return merged
+
+
+def compare_with_exact(exact: Dict[str, Dict], approximate: Dict[str, Dict]) -> Dict[str, float]:
+    """
+    对比草图统计与精确统计，返回每个指标各分位数误差的最大值（按精确统计的取值范围归一化）
+    """
+    errors = {}
+    for metric, exact_stats in exact.items():
+        approx_stats = approximate.get(metric, {})
+        worst = 0.0
+        for p in PERCENTILES:
+            key = f"{p * 100:g}%"
+            if key in exact_stats and key in approx_stats:
+                scale = max(abs(exact_stats['max'] - exact_stats['min']), 1e-12)
+                worst = max(worst, abs(exact_stats[key] - approx_stats[key]) / scale)
+        errors[metric] = worst
+    return errors
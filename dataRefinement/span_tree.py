@@ -0,0 +1,140 @@
+"""
+trace调用树分析：span的自身耗时（self-time）和关键路径
+
+只看duration时，下游调用变慢会让它的所有祖先span看起来都异常。这里为每个span计算：
+    - child_time: 子span时间区间（裁剪到父span区间内）的并集长度
+    - self_time: duration - child_time，即span自身（不含等待子调用）的耗时
+    - on_critical_path: span是否在所属trace的关键路径上
+
+全部基于排序数组和按父span的分组归约完成，不做逐trace的Python递归：
+    - 父子关系用 (traceID, spanID) 的索引一次查出父span的行号
+    - 子区间并集：子span按 (父span, 开始时间) 排序后，用组内累计最大结束时间求每个子区间新增覆盖的长度，再按父span求和
+    - 关键路径（与Jaeger的定义一致的简化版）：从父span结束处往回走，先取最晚结束的子span，
+      再取在它开始之前结束的最晚的子span，依此类推；这一步对所有父span同时推进，迭代次数等于最长的串行子调用链。
+      span在关键路径上当且仅当它被父span选中且父span也在关键路径上，用指针倍增沿祖先链求与
+父span不在当前数据中（时间窗口截断）的span视为根
+"""
+import numpy as np
+import pandas as pd
+
+from utils.span_tracer import traced
+
+# ========== 调用树配置 ==========
+SPAN_TREE_MAX_JUMPS = 64  # 指针倍增的最大轮数（可处理深度2^64以内的调用树，遇到环形引用时也能结束）
+
+
+def _parent_positions(df: pd.DataFrame) -> np.ndarray:
+    """
+    每个span的父span在df中的行号，父span不在df中（或为自身）时为-1
+    """
+    trace_codes, _ = pd.factorize(df['traceID'])
+    spans = pd.MultiIndex.from_arrays([trace_codes, df['spanID'].to_numpy()])
+    parents = pd.MultiIndex.from_arrays([trace_codes, df['parent_spanID'].to_numpy()])
+    # spanID重复时以第一次出现的span为准
+    unique = ~spans.duplicated()
+    positions = np.flatnonzero(unique)
+    found = spans[unique].get_indexer(parents)
+    parent_pos = np.where(found >= 0, positions[np.maximum(found, 0)], -1)
+    parent_pos[parent_pos == np.arange(len(df))] = -1
+    return parent_pos
+
+
+def _critical_children(parent: np.ndarray, child_start: np.ndarray, child_end: np.ndarray,
+                       parent_start: np.ndarray) -> np.ndarray:
+    """
+    在每个父span的子span中选出关键路径上的子span
+
+    参数:
+        parent: 子span的父span行号（已去掉没有父span的行）
+        child_start: 裁剪到父span区间后的子span开始时间
+        child_end: 裁剪到父span区间后的子span结束时间
+        parent_start: 各子span的父span开始时间
+
+    返回:
+        np.ndarray: 与输入等长的布尔数组
+    """
+    selected = np.zeros(len(parent), dtype=bool)
+    if len(parent) == 0:
+        return selected
+    # 按 (父span, 结束时间, 开始时间) 排序，组内结束时间相对父span开始时间编码进一个int64键，便于整体searchsorted
+    order = np.lexsort((child_start, child_end, parent))
+    group_of = parent[order]
+    new_group = np.r_[True, group_of[1:] != group_of[:-1]]
+    group_rank = np.cumsum(new_group) - 1
+    group_first = np.flatnonzero(new_group)
+    group_last = np.r_[group_first[1:] - 1, len(order) - 1]
+    end_rel = child_end[order] - parent_start[order]
+    start_rel = child_start[order] - parent_start[order]
+    stride = int(end_rel.max()) + 1
+    keys = group_rank * stride + end_rel
+    # 在子span开始之前（含）结束的、组内最晚结束的子span
+    position = np.arange(len(order))
+    previous = np.searchsorted(keys, group_rank * stride + start_rel, side='right') - 1
+    previous = np.minimum(previous, position - 1)
+    previous[previous < group_first[group_rank]] = -1
+
+    # 从每组最晚结束的子span出发，所有父span同时沿previous往前走
+    chosen = np.zeros(len(order), dtype=bool)
+    current = group_last
+    while current.size:
+        chosen[current] = True
+        current = previous[current]
+        current = current[current >= 0]
+    selected[order] = chosen
+    return selected
+
+
+@traced('trace.span_tree')
+def annotate_span_tree(df: pd.DataFrame) -> pd.DataFrame:
+    """
+    为trace数据添加 child_time、self_time（与duration单位相同）和 on_critical_path 列
+
+    参数:
+        df: 含 traceID、spanID、parent_spanID、startTime、duration 列的trace数据
+
+    返回:
+        pd.DataFrame: 添加了三列的df（原地修改）
+    """
+    n = len(df)
+    if n == 0:
+        df['child_time'] = np.zeros(0, dtype=np.int64)
+        df['self_time'] = np.zeros(0, dtype=np.int64)
+        df['on_critical_path'] = np.zeros(0, dtype=bool)
+        return df
+
+    parent_pos = _parent_positions(df)
+    start = df['startTime'].to_numpy(dtype=np.int64)
+    duration = df['duration'].to_numpy(dtype=np.int64)
+    end = start + duration
+
+    # 子span区间裁剪到父span区间内（异步调用可能在父span结束后才结束）
+    child = np.flatnonzero(parent_pos >= 0)
+    parent = parent_pos[child]
+    child_start = np.clip(start[child], start[parent], end[parent])
+    child_end = np.clip(end[child], start[parent], end[parent])
+
+    # 子区间并集长度：按 (父span, 开始时间) 排序，每个子区间只计入超出此前组内最大结束时间的部分
+    order = np.lexsort((child_start, parent))
+    sorted_parent, sorted_start, sorted_end = parent[order], child_start[order], child_end[order]
+    running_end = pd.Series(sorted_end).groupby(sorted_parent, sort=False).cummax().to_numpy()
+    covered_until = np.r_[sorted_start[:1], running_end[:-1]]
+    first_in_group = np.r_[True, sorted_parent[1:] != sorted_parent[:-1]]
+    covered_until = np.where(first_in_group, sorted_start, covered_until)
+    added = np.maximum(sorted_end - np.maximum(sorted_start, covered_until), 0)
+    child_time = np.bincount(sorted_parent, weights=added, minlength=n).astype(np.int64)
+
+    # 关键路径：根span在路径上，其余span需要被父span选中，且所有祖先都在路径上
+    on_path = np.ones(n, dtype=bool)
+    on_path[child] = _critical_children(parent, child_start, child_end, start[parent])
+    ancestor = parent_pos.copy()
+    for _ in range(SPAN_TREE_MAX_JUMPS):
+        live = np.flatnonzero(ancestor >= 0)
+        if live.size == 0:
+            break
+        on_path[live] &= on_path[ancestor[live]]
+        ancestor[live] = ancestor[ancestor[live]]
+
+    df['child_time'] = child_time
+    df['self_time'] = np.maximum(duration - child_time, 0)
+    df['on_critical_path'] = on_path
+    return df
@@ -1,6 +1,5 @@
 import pandas as pd
 import os
-import glob
 import random
 import numpy as np
 import time
@@ -10,27 +9,55 @@ from typing import Optional, List, Tuple, Dict, Set
 from collections import defaultdict
 from sklearn.ensemble import IsolationForest
 
+from dataRefinement.call_edge_registry import (CALL_EDGES_FILENAME, EDGE_COLUMNS, CallEdgeRegistry, get_call_edges,
+                                               migrate_legacy_keys)
+from dataRefinement.data_catalog import get_catalog
+from dataRefinement.detector_store import (DETECTOR_STORE_DIRNAME, DETECTOR_STORE_SCHEMA_VERSION, USE_DETECTOR_STORE,
+                                           DetectorStore, LazyDetectors, convert_pickle, store_schema_version)
+from dataRefinement.model_registry import get_registry
+from dataRefinement.span_tree import annotate_span_tree
+from dataRefinement.window_reader import read_window
+from utils.log_util import get_logger
+from utils.span_tracer import span, traced
+
 # 添加项目根目录到系统路径，确保可以导入utils.io_util
 project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 
+log = get_logger('trace_refinement')
+
 
 # ========== 超参数配置 ==========
 # 训练相关参数
 SAMPLE_SIZE = 50  # 抽样数量
 RANDOM_SEED = 42  # 随机种子
 MINUTES_AFTER = 40  # 异常结束后多少分钟的数据视为正常数据
+NORMAL_TRACE_COLUMNS = EDGE_COLUMNS + ['spanID', 'service_name', 'timestamp_ns', 'duration', 'is_error']  # 正常trace数据保留的列
 N_ESTIMATORS = 100  # IsolationForest的估计器数量
 CONTAMINATION = 0.01  # IsolationForest的污染率
 
+# 检测器后端：'iforest' 每组一个IsolationForest；'stats' 用正常数据统计信息的稳健区间，全部组一次向量化判断
+TRACE_DETECTOR_BACKEND = 'iforest'
+STAT_MAD_K = 3.0  # 统计检测器：中位数±k倍稳健标准差（1.4826*MAD）
+STAT_QUANTILES = (0.005, 0.995)  # 统计检测器：正常窗口duration的分位数区间（与CONTAMINATION相当）
+
 # 滑动窗口参数
-WIN_SIZE_SECONDS = 30  # 滑动窗口大小（秒）
+WIN_SIZE_SECONDS = 30  # 滑动窗口大小（秒），即主分辨率：dur_detector、feature_detector和顶层正常数据统计信息都基于该窗口
 WIN_SIZE_NS = WIN_SIZE_SECONDS * 1000000000  # 滑动窗口大小（纳秒）
+# 多分辨率窗口：短窗口捕捉被30秒平均掉的尖峰，长窗口捕捉缓慢漂移；每种分辨率各训练一个多变量检测器
+WINDOW_RESOLUTIONS_SECONDS = (10, WIN_SIZE_SECONDS, 120)
+
+# 窗口特征：每个调用边的每个窗口一次聚合得到全部特征，多变量检测器（feature_detector）在全部特征上训练
+WINDOW_FEATURES = ('count', 'mean', 'p50', 'p99', 'error_ratio')
+MEAN_FEATURE = WINDOW_FEATURES.index('mean')
+ERROR_RATIO_FEATURE = WINDOW_FEATURES.index('error_ratio')
+USE_FEATURE_DETECTOR = True  # 组有多变量检测器时优先使用，否则用只看窗口平均duration的dur_detector（旧模型）
 
 # 统计分析参数
 TOP_N_COMBINATIONS = 10  # 取前N种异常组合进行详细分析
 BEIJING_TIMEZONE_OFFSET = 8  # 北京时间偏移（UTC+8）
 
 
+@traced('trace.filter_timerange')
 def _filter_traces_by_timerange(start_time: int, end_time: int, df_trace: Optional[pd.DataFrame] = None) -> Optional[pd.DataFrame]:
     """
     根据时间范围过滤trace数据
@@ -51,6 +78,71 @@ def _filter_traces_by_timerange(start_time: int, end_time: int, df_trace: Option
     return filtered_df
 
 
+def _detector_files() -> Tuple[str, str]:
+    """
+    trace异常检测模型文件和正常数据统计信息文件的路径
+    """
+    model_dir = os.path.join(project_root, 'dataRefinement', 'IsolationForest')
+    return os.path.join(model_dir, 'trace_detectors.pkl'), os.path.join(model_dir, 'trace_detectors_normal_stats.pkl')
+
+
+def load_call_edges() -> CallEdgeRegistry:
+    """
+    与trace异常检测模型一起保存的调用边注册表（旧模型没有时在运行中分配ID）
+    """
+    detector_file, _ = _detector_files()
+    return get_call_edges(os.path.join(os.path.dirname(detector_file), CALL_EDGES_FILENAME))
+
+
+def load_trace_detectors() -> Tuple[Dict[str, Dict[str, IsolationForest]], Dict[str, Dict[str, float]]]:
+    """
+    通过进程内模型注册表加载trace异常检测模型和正常数据统计信息：每个进程只反序列化一次，
+    模型文件更新后自动重新加载
+
+    返回:
+        Tuple: (trace_detectors, normal_stats)
+    """
+    detector_file, normal_stats_file = _detector_files()
+
+    def _load():
+        with open(detector_file, 'rb') as f:
+            trace_detectors = pickle.load(f)
+        print(f"成功加载现有trace异常检测模型，包含 {len(trace_detectors)} 个检测器")
+
+        # 加载正常数据统计信息
+        with open(normal_stats_file, 'rb') as f:
+            normal_stats = pickle.load(f)
+        print(f"成功加载现有正常数据统计信息，包含 {len(normal_stats)} 个统计项")
+
+        # 旧模型以拼接字符串为键，转换为edge_key()
+        known_edges = load_call_edges().edges()
+        return migrate_legacy_keys(trace_detectors, known_edges), migrate_legacy_keys(normal_stats, known_edges)
+
+    return get_registry().get('trace_detectors', [detector_file, normal_stats_file], _load)
+
+
+def load_detector_store() -> Tuple[LazyDetectors, Dict[str, Dict[str, float]]]:
+    """
+    从按组存储的检测器存储加载trace异常检测模型：检测器在第一次用到时才按组加载。
+    存储不存在或早于trace_detectors.pkl时先由pickle转换
+
+    返回:
+        Tuple: (按需加载的trace_detectors, normal_stats)
+
+    异常:
+        ValueError: 检测器存储的格式版本不符
+    """
+    detector_file, normal_stats_file = _detector_files()
+    store_dir = os.path.join(os.path.dirname(detector_file), DETECTOR_STORE_DIRNAME)
+    index_path = os.path.join(store_dir, 'index.sqlite')
+    if (not os.path.exists(index_path) or os.path.getmtime(index_path) < os.path.getmtime(detector_file)
+            or store_schema_version(store_dir) != DETECTOR_STORE_SCHEMA_VERSION):
+        convert_pickle(detector_file, normal_stats_file, store_dir).close()
+    store = get_registry().get('trace_detector_store', [index_path], lambda: DetectorStore(store_dir))
+    return LazyDetectors(store), store.normal_stats()
+
+
+@traced('trace.load_detectors')
 def _load_or_train_anomaly_detection_model() -> Optional[Dict[str, Dict[str, IsolationForest]]]:
     """
     加载或训练异常检测模型
@@ -58,22 +150,17 @@ def _load_or_train_anomaly_detection_model() -> Optional[Dict[str, Dict[str, Iso
     返回:
         Dict[str, Dict[str, IsolationForest]]: 异常检测模型字典，如果失败则返回None
     """
-    detector_file = os.path.join(project_root, 'dataRefinement', 'IsolationForest', 'trace_detectors.pkl')
-    normal_stats_file = os.path.join(project_root, 'dataRefinement', 'IsolationForest', 'trace_detectors_normal_stats.pkl')
+    detector_file, normal_stats_file = _detector_files()
 
-    # 如果模型文件已存在，直接加载
+    # 如果模型文件已存在，从模型注册表获取（同一进程内只加载一次），优先使用按组加载的检测器存储
     if os.path.exists(detector_file):
         try:
-            with open(detector_file, 'rb') as f:
-                trace_detectors = pickle.load(f)
-            print(f"成功加载现有trace异常检测模型，包含 {len(trace_detectors)} 个检测器")
-            
-            # 加载正常数据统计信息
-            with open(normal_stats_file, 'rb') as f:
-                normal_stats = pickle.load(f)
-            print(f"成功加载现有正常数据统计信息，包含 {len(normal_stats)} 个统计项")
-            
-            return trace_detectors, normal_stats
+            if USE_DETECTOR_STORE:
+                try:
+                    return load_detector_store()
+                except ValueError as e:
+                    print(f"检测器存储不可用（{e}），改为加载完整的pickle模型")
+            return load_trace_detectors()
         except Exception as e:
             print(f"加载现有模型失败: {e}")
             return None
@@ -173,6 +260,39 @@ def _extract_parent_spanid(ref):
     return None
 
 
+def _extract_status_code(tags):
+    """
+    从tags数组中提取'status.code'的值
+
+    参数:
+        tags: span的tags数组
+
+    返回:
+        str: status.code的值，如果没有找到则返回None
+    """
+    if not isinstance(tags, (np.ndarray, list)):
+        return None
+    for tag in tags:
+        if isinstance(tag, dict) and tag.get('key') == 'status.code':
+            return str(tag.get('value'))
+    return None
+
+
+def _error_flags(df: pd.DataFrame) -> np.ndarray:
+    """
+    每个span是否出错（status.code存在且不为0），已有is_error列时直接使用
+
+    返回:
+        np.ndarray: 布尔数组
+    """
+    if 'is_error' in df.columns:
+        return df['is_error'].to_numpy(dtype=bool)
+    if 'tags' not in df.columns:
+        return np.zeros(len(df), dtype=bool)
+    codes = df['tags'].map(_extract_status_code)
+    return (codes.notna() & (codes != '0')).to_numpy()
+
+
 def _extract_status_keys_and_values(tags_str: str) -> Tuple[Set[str], Dict[str, str]]:
     """
     从tags字符串中提取status相关的key和对应的value
@@ -199,6 +319,7 @@ def _extract_status_keys_and_values(tags_str: str) -> Tuple[Set[str], Dict[str,
         return set(), {}
 
 
+@traced('trace.status_combinations')
 def _analyze_status_combinations_in_fault_period(df_filtered_traces: pd.DataFrame) -> str:
     """
     分析故障期间status.code和status.message的组合情况，包含详细的上下文信息
@@ -211,8 +332,11 @@ def _analyze_status_combinations_in_fault_period(df_filtered_traces: pd.DataFram
     """
     print("开始分析故障期间的status组合...")
     
-    # 筛选包含status的行
-    status_logs = df_filtered_traces[df_filtered_traces['tags'].astype(str).str.contains("status", case=False, na=False)]
+    # 预处理时已按status.code标记出错的span，只需解析这些行；没有is_error列时在全部行的tags中查找status
+    if 'is_error' in df_filtered_traces.columns:
+        status_logs = df_filtered_traces[df_filtered_traces['is_error'].to_numpy(dtype=bool)]
+    else:
+        status_logs = df_filtered_traces[df_filtered_traces['tags'].astype(str).str.contains("status", case=False, na=False)]
     
     if len(status_logs) == 0:
         print("故障期间没有包含status的记录")
@@ -339,22 +463,17 @@ def _match_trace_files(sampled_df: pd.DataFrame) -> List[str]:
         List[str]: 匹配到的文件路径列表
     """
     matched_trace_files = []
-    start_time_hours = []
+    catalog = get_catalog()
 
     for index, row in sampled_df.iterrows():
-        start_time_hour = row['start_time_hour']
+        # 正常数据取自故障结束后MINUTES_AFTER分钟内，按完整时间范围查找，跨小时时匹配多个文件
+        window_end = row['end_timestamp'] + MINUTES_AFTER * 60 * 1000000000
+        matching_files = [item.abspath for item in catalog.find_files('trace', row['start_timestamp'], window_end)]
+        new_files = [path for path in matching_files if path not in matched_trace_files]
+        matched_trace_files.extend(new_files)
 
-        if start_time_hour in start_time_hours:
-            continue
-        start_time_hours.append(start_time_hour)
-        
-        # 使用os.path.join和项目根目录的相对路径
-        search_pattern = os.path.join(project_root, 'data', '*', 'trace-parquet', f'*{start_time_hour}*')
-        matching_file = glob.glob(search_pattern, recursive=True)
-        
-        if matching_file:
-            matched_trace_files.append(matching_file[0])
-            print(f"样本 {index}: 匹配到文件 {matching_file[0]}")
+        if matching_files:
+            print(f"样本 {index}: 匹配到文件 {[os.path.basename(path) for path in new_files]}")
         else:
             print(f"样本 {index}: 未找到匹配文件")
     
@@ -399,6 +518,10 @@ def _merge_trace_files(matched_trace_files: List[str]) -> pd.DataFrame:
 def _extract_normal_traces(sampled_df: pd.DataFrame, merged_df: pd.DataFrame, minutes_after: int = 40) -> Dict[str, List[pd.DataFrame]]:
     """
     从合并后的trace数据中提取正常时期的trace数据，并构建字典
+
+    用区间连接代替逐样本筛选：在按时间戳排序的数据上用一次searchsorted求出每个正常时段的行范围，
+    展开为 (行号, 时段编号)（时段重叠时同一行属于多个时段），再按 (调用边, 时段) 一次分组。
+    只保留训练需要的列（NORMAL_TRACE_COLUMNS），出错标记在分组前一次算出
     
     参数:
         sampled_df: 抽样后的DataFrame，包含end_time信息
@@ -406,47 +529,67 @@ def _extract_normal_traces(sampled_df: pd.DataFrame, merged_df: pd.DataFrame, mi
         minutes_after: 异常结束后多少分钟的数据视为正常数据，默认40分钟
         
     返回:
-        Dict[str, List[pd.DataFrame]]: 正常trace数据字典，key为parent_name-pod_name-node_name-operationName，value为对应的duration列表
+        Dict[str, List[pd.DataFrame]]: 正常trace数据字典，key为调用边 (parent_pod, child_pod, node_name, operationName) 的
+                                       edge_key()，value为该组在各正常时段（按样本顺序）的数据
     """
     print(f"\n提取正常时期的trace数据（异常结束后{minutes_after}分钟）...")
     
-    # 创建默认字典，值为列表
-    normal_traces = defaultdict(list)
-    
     # 纳秒转换为分钟的系数
     ns_to_min = 60 * 1000000000
-    
-    # 遍历每个样本
-    for _, row in sampled_df.iterrows():
-        end_time = row['end_timestamp']
-        normal_start_time = end_time  # 正常数据的开始时间是异常的结束时间
-        normal_end_time = normal_start_time + minutes_after * ns_to_min  # 正常数据的结束时间
-        
-        print(f"处理样本: 正常时间范围 {pd.to_datetime(normal_start_time, unit='ns')} 到 {pd.to_datetime(normal_end_time, unit='ns')}")
-        
-        # 筛选正常时期的数据
-        normal_df = merged_df[(merged_df['timestamp_ns'] >= normal_start_time) & (merged_df['timestamp_ns'] <= normal_end_time)]
-        
-        if normal_df.empty:
+
+    # 正常数据的开始时间是异常的结束时间
+    normal_start_times = sampled_df['end_timestamp'].to_numpy(dtype=np.int64)
+    normal_end_times = normal_start_times + minutes_after * ns_to_min
+
+    # 每个正常时段在排序后数据中的行范围（两端都包含）
+    timestamps = merged_df['timestamp_ns'].to_numpy(dtype=np.int64)
+    order = np.argsort(timestamps, kind='stable')
+    sorted_timestamps = timestamps[order]
+    lo = np.searchsorted(sorted_timestamps, normal_start_times, side='left')
+    hi = np.searchsorted(sorted_timestamps, normal_end_times, side='right')
+    counts = hi - lo
+    for normal_start_time, normal_end_time, count in zip(normal_start_times, normal_end_times, counts):
+        print(f"处理样本: 正常时间范围 {pd.to_datetime(normal_start_time, unit='ns')} 到 {pd.to_datetime(normal_end_time, unit='ns')}，"
+              f"找到 {count} 条正常时期的数据")
+        if count == 0:
             print(f"警告: 在正常时期未找到数据")
-            continue
-            
-        print(f"找到 {len(normal_df)} 条正常时期的数据")
-        
-        # 按parent_pod, child_pod, operationName分组
-        trace_gp = normal_df.groupby(['parent_pod', 'child_pod', 'node_name','operationName'])
-        
-        # 遍历每个组，构建字典
-        for (src, dst, node_name, op), call_df in trace_gp:
-            # 处理None值
-            src_str = str(src) if src is not None else "None"
-            dst_str = str(dst) if dst is not None else "None"
-            node_name_str = str(node_name) if node_name is not None else "None"
-            op_str = str(op) if op is not None else "None"
-            
-            name = f"{src_str}_{dst_str}_{node_name_str}_{op_str}"
-            normal_traces[name].append(call_df)
-            print(f"添加组 {name}: {len(call_df)} 条数据")
+
+    # 展开为 (行号, 时段编号)，时段内保持原数据的行顺序
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    rows = order[np.arange(counts.sum()) - np.repeat(offsets - lo, counts)]
+    periods = np.repeat(np.arange(len(counts)), counts)
+    if np.any(order[1:] < order[:-1]):
+        row_order = np.lexsort((rows, periods))
+        rows, periods = rows[row_order], periods[row_order]
+
+    # 先裁剪列再一次取出全部正常时期的行，出错标记由tags算出后丢弃tags
+    columns = [column for column in merged_df.columns if column in NORMAL_TRACE_COLUMNS or column == 'tags']
+    normal_df = merged_df[columns].iloc[rows]
+    normal_df = normal_df.assign(is_error=_error_flags(normal_df))
+    normal_df = normal_df[[column for column in NORMAL_TRACE_COLUMNS if column in normal_df.columns]]
+
+    # 按 (调用边, 时段) 排序一次，每个组在各时段的数据是连续的一段：四个字段中有空值的行丢弃，与按四列groupby一致
+    call_edges = CallEdgeRegistry()
+    edge_ids = call_edges.assign(normal_df)
+    valid = np.flatnonzero(edge_ids >= 0)
+    keys = edge_ids[valid] * len(counts) + periods[valid]
+    key_order = np.argsort(keys, kind='stable')
+    sorted_keys = keys[key_order]
+    normal_df = normal_df.iloc[valid[key_order]]
+    bounds = np.flatnonzero(np.r_[True, sorted_keys[1:] != sorted_keys[:-1], True])
+
+    # 组的顺序与逐样本处理时一致：先按首次出现的时段，再按调用边四元组排序；每组的数据按时段顺序排列
+    group_frames = defaultdict(list)
+    first_period = {}
+    for begin, finish in zip(bounds[:-1].tolist(), bounds[1:].tolist()):
+        edge_id, period = divmod(int(sorted_keys[begin]), len(counts))
+        group_frames[edge_id].append(normal_df.iloc[begin:finish])
+        first_period.setdefault(edge_id, period)
+    normal_traces = {}
+    for edge_id in sorted(group_frames, key=lambda edge_id: (first_period[edge_id], call_edges.edge(edge_id))):
+        normal_traces[call_edges.key(edge_id)] = group_frames[edge_id]
+        log.debug("添加组 {name}: {count} 条数据", name=call_edges.key(edge_id),
+                  count=sum(len(call_df) for call_df in group_frames[edge_id]))
     
     # 打印统计信息
     print(f"\n正常trace统计信息:")
@@ -455,6 +598,92 @@ def _extract_normal_traces(sampled_df: pd.DataFrame, merged_df: pd.DataFrame, mi
     return normal_traces
 
 
+def _sorted_quantile(values: np.ndarray, offsets: np.ndarray, counts: np.ndarray, q: float) -> np.ndarray:
+    """
+    对按段排好序的values，求每段的q分位数（与np.quantile的线性插值一致）
+
+    参数:
+        values: 各段首尾相接、段内升序的数组
+        offsets: 每段在values中的起始位置
+        counts: 每段的长度（均大于0）
+        q: 分位数
+    """
+    position = q * (counts - 1)
+    lower = np.floor(position).astype(np.int64)
+    upper = np.minimum(lower + 1, counts - 1)
+    low_values = values[offsets + lower]
+    return low_values + (position - lower) * (values[offsets + upper] - low_values)
+
+
+def _window_pyramid(df: pd.DataFrame, win_sizes) -> Dict[int, Tuple[np.ndarray, np.ndarray]]:
+    """
+    一次排序、一组前缀和，聚合出多种窗口大小的全部窗口特征（WINDOW_FEATURES：span数、平均/中位/p99 duration、出错比例）
+
+    窗口从最早的时间戳开始，每win_size一个，直到最晚的时间戳；窗口包含两端（恰好落在边界上的span同时计入相邻两个窗口），
+    空窗口跳过。各窗口大小共用排序后的时间戳和duration/出错数的前缀和：窗口边界用searchsorted求出，
+    均值和出错比例由前缀和相减得到，分位数在把各窗口的行展开后按 (窗口, duration) 整体排序一次求出
+
+    参数:
+        df: 包含时间戳、持续时间（和is_error或tags）的DataFrame
+        win_sizes: 窗口大小列表（纳秒）
+
+    返回:
+        Dict[int, Tuple[np.ndarray, np.ndarray]]: 窗口大小 -> (窗口开始时间, 形状为 (窗口数, len(WINDOW_FEATURES)) 的特征矩阵)
+    """
+    timestamps = df['timestamp_ns'].to_numpy(dtype=np.int64)
+    durations = df['duration'].to_numpy(dtype=np.float64)
+    errors = _error_flags(df)
+    if len(timestamps) and np.any(timestamps[1:] < timestamps[:-1]):
+        order = np.argsort(timestamps, kind='stable')
+        timestamps, durations, errors = timestamps[order], durations[order], errors[order]
+    if len(timestamps) == 0 or timestamps[-1] <= timestamps[0]:
+        return {win_size: (np.array([], dtype=np.int64), np.empty((0, len(WINDOW_FEATURES)))) for win_size in win_sizes}
+
+    duration_sums = np.r_[0.0, np.cumsum(durations)]
+    error_sums = np.r_[0, np.cumsum(errors, dtype=np.int64)]
+    return {win_size: _aggregate_windows(timestamps, durations, duration_sums, error_sums, win_size) for win_size in win_sizes}
+
+
+def _aggregate_windows(timestamps: np.ndarray, durations: np.ndarray, duration_sums: np.ndarray, error_sums: np.ndarray,
+                       win_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    在排序后的时间戳和前缀和上聚合一种窗口大小的窗口特征（见_window_pyramid）
+    """
+    time_min, time_max = timestamps[0], timestamps[-1]
+    n_windows = -(-(time_max - time_min) // win_size)
+    window_starts = time_min + np.arange(n_windows, dtype=np.int64) * win_size
+    lo = np.searchsorted(timestamps, window_starts, side='left')
+    hi = np.searchsorted(timestamps, window_starts + win_size, side='right')
+    non_empty = hi > lo
+    window_starts, lo, hi = window_starts[non_empty], lo[non_empty], hi[non_empty]
+    counts = hi - lo
+
+    means = (duration_sums[hi] - duration_sums[lo]) / counts
+    error_ratios = (error_sums[hi] - error_sums[lo]) / counts
+
+    # 展开每个窗口包含的行，按 (窗口, duration) 排序后取分位数
+    offsets = np.r_[0, np.cumsum(counts)[:-1]]
+    rows = np.arange(counts.sum()) - np.repeat(offsets - lo, counts)
+    window_index = np.repeat(np.arange(len(counts)), counts)
+    values = durations[rows]
+    values = values[np.lexsort((values, window_index))]
+    p50 = _sorted_quantile(values, offsets, counts, 0.5)
+    p99 = _sorted_quantile(values, offsets, counts, 0.99)
+
+    features = np.column_stack([counts.astype(np.float64), means, p50, p99, error_ratios])
+    return window_starts, features
+
+
+def _window_features(df: pd.DataFrame, win_size: int) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    按一种窗口大小聚合窗口特征
+
+    返回:
+        Tuple[np.ndarray, np.ndarray]: 窗口开始时间，以及形状为 (窗口数, len(WINDOW_FEATURES)) 的特征矩阵
+    """
+    return _window_pyramid(df, [win_size])[win_size]
+
+
 def _slide_window(df: pd.DataFrame, win_size: int) -> Tuple[np.ndarray, np.ndarray]:
     """
     使用滑动窗口计算持续时间的均值
@@ -466,32 +695,58 @@ def _slide_window(df: pd.DataFrame, win_size: int) -> Tuple[np.ndarray, np.ndarr
     返回:
         Tuple[np.ndarray, np.ndarray]: 窗口开始时间和对应的持续时间均值
     """
-    window_start_times, durations = [], []
-    
-    time_min, time_max = df['timestamp_ns'].min(), df['timestamp_ns'].max()
-    
-    # 滑动窗口
-    i = time_min
-    while i < time_max:
-        temp_df = df[(df['timestamp_ns'] >= i) & (df['timestamp_ns'] <= i + win_size)]
-        
-        if temp_df.empty:
-            i += win_size
-            continue
-        
-        window_start_times.append(i)
-        durations.append(temp_df['duration'].mean())
-        i += win_size
-    
-    return np.array(window_start_times), np.array(durations)
+    window_start_times, features = _window_features(df, win_size)
+    return window_start_times, features[:, MEAN_FEATURE]
+
+
+def _resolution_label(seconds: int) -> str:
+    return f"{seconds}s"
+
+
+def _feature_detector_key(seconds: int) -> str:
+    """
+    某分辨率的多变量检测器在每组检测器字典中的键，主分辨率沿用'feature_detector'
+    """
+    return 'feature_detector' if seconds == WIN_SIZE_SECONDS else f"feature_detector_{_resolution_label(seconds)}"
+
+
+def _resolution_stats(stats: Dict, seconds: int) -> Optional[Dict[str, float]]:
+    """
+    某分辨率的正常数据统计信息：主分辨率为顶层统计信息，其余分辨率在stats['resolutions']中，旧模型没有时返回None
+    """
+    if seconds == WIN_SIZE_SECONDS:
+        return stats
+    return stats.get('resolutions', {}).get(_resolution_label(seconds))
+
+
+def _window_stats(features: np.ndarray) -> Dict[str, float]:
+    """
+    由正常窗口的特征矩阵计算正常数据统计信息（窗口平均duration的分布和出错比例）
+    """
+    durations = features[:, MEAN_FEATURE]
+    error_ratios = features[:, ERROR_RATIO_FEATURE]
+    return {
+        'mean': float(np.mean(durations)),
+        'std': float(np.std(durations)),
+        'median': float(np.median(durations)),
+        'min': float(np.min(durations)),
+        'max': float(np.max(durations)),
+        'count': len(durations),
+        'q_low': float(np.quantile(durations, STAT_QUANTILES[0])),
+        'q_high': float(np.quantile(durations, STAT_QUANTILES[1])),
+        'mad': float(np.median(np.abs(durations - np.median(durations)))),
+        'error_ratio_mean': float(np.mean(error_ratios)),
+        'error_ratio_high': float(np.quantile(error_ratios, STAT_QUANTILES[1]))
+    }
 
 
 def _train_anomaly_detection_model(normal_traces: Dict[str, List[pd.DataFrame]], output_path: Optional[str] = None) -> Tuple[Dict[str, Dict[str, IsolationForest]], Dict[str, Dict[str, float]]]:
     """
-    训练异常检测模型，只使用duration字段
+    训练异常检测模型：每个组一个只看主分辨率窗口平均duration的dur_detector，以及每种分辨率（WINDOW_RESOLUTIONS_SECONDS）
+    一个在全部窗口特征（WINDOW_FEATURES）上训练的多变量检测器；各分辨率的窗口特征由同一次排序和前缀和得到
     
     参数:
-        normal_traces: 正常trace数据字典，key为service_name，value为对应的DataFrame列表
+        normal_traces: 正常trace数据字典，value为各调用组的DataFrame列表（组名取自数据中的调用边四元组）
         output_path: 输出文件路径，如果不为None则保存模型
         
     返回:
@@ -504,50 +759,67 @@ def _train_anomaly_detection_model(normal_traces: Dict[str, List[pd.DataFrame]],
     # 创建异常检测器字典和统计信息字典
     trace_detectors = {}
     normal_stats = {}
+
+    # 检测器和统计信息以调用边的edge_key()为键，键由数据中的四元组得到（旧的正常trace数据以拼接字符串为键）
+    call_edges = CallEdgeRegistry()
     
     # 遍历每个服务调用组
-    for name, call_dfs in normal_traces.items():
+    for call_dfs in normal_traces.values():
+        if not call_dfs or len(call_dfs[0]) == 0:
+            continue
+        name = call_edges.key(call_edges.intern(tuple(str(value) for value in call_dfs[0][EDGE_COLUMNS].iloc[0])))
         start_time = time.time()
-        print(f"处理组 {name}...")
+        log.debug("处理组 {name}...", name=name)
         
         # 为每个组创建异常检测器
         trace_detectors[name] = {
             'dur_detector': IsolationForest(random_state=RANDOM_SEED, n_estimators=N_ESTIMATORS, contamination=CONTAMINATION)
         }
         
-        # 收集训练数据
-        train_ds = []
-        for call_df in call_dfs:
-            # 使用滑动窗口提取持续时间特征
-            _, durs = _slide_window(call_df, WIN_SIZE_NS)
-            train_ds.extend(durs)
+        # 收集训练数据：每个正常时段的数据一次聚合出全部分辨率的窗口特征
+        win_sizes = {seconds: seconds * 1000000000 for seconds in WINDOW_RESOLUTIONS_SECONDS}
+        pyramids = [_window_pyramid(call_df, win_sizes.values()) for call_df in call_dfs]
+        train_features = {
+            seconds: np.vstack([pyramid[win_size][1] for pyramid in pyramids]) if pyramids else np.empty((0, len(WINDOW_FEATURES)))
+            for seconds, win_size in win_sizes.items()
+        }
+        train_ds = train_features[WIN_SIZE_SECONDS][:, MEAN_FEATURE]
         
         # 如果没有足够的训练数据，跳过
         if len(train_ds) == 0:
-            print(f"警告: 组 {name} 没有足够的训练数据")
+            log.count('训练数据不足的组')
+            log.debug("警告: 组 {name} 没有足够的训练数据", name=name)
             continue
         
-        # 计算正常数据的统计信息
+        # 计算正常数据的统计信息，非主分辨率的统计信息放在'resolutions'中
         train_ds_array = np.array(train_ds)
-        normal_stats[name] = {
-            'mean': float(np.mean(train_ds_array)),
-            'std': float(np.std(train_ds_array)),
-            'median': float(np.median(train_ds_array)),
-            'min': float(np.min(train_ds_array)),
-            'max': float(np.max(train_ds_array)),
-            'count': len(train_ds_array)
+        normal_stats[name] = _window_stats(train_features[WIN_SIZE_SECONDS])
+        normal_stats[name]['resolutions'] = {
+            _resolution_label(seconds): _window_stats(features)
+            for seconds, features in train_features.items() if seconds != WIN_SIZE_SECONDS and len(features) > 0
         }
         
         # 训练持续时间异常检测器
-        print(f"训练组 {name} 的异常检测器，使用 {len(train_ds)} 个样本")
-        print(f"  正常数据统计: 平均值={normal_stats[name]['mean']:.2f}, 标准差={normal_stats[name]['std']:.2f}")
+        log.debug("训练组 {name} 的异常检测器，使用 {count} 个样本", name=name, count=len(train_ds))
+        log.debug("  正常数据统计: 平均值={mean:.2f}, 标准差={std:.2f}", mean=normal_stats[name]['mean'], std=normal_stats[name]['std'])
         
         # 设置[name]的['dur_detector']是为了保留其他可能的检测器，比如后期添加['another_detector]
         dur_clf = trace_detectors[name]['dur_detector']
         dur_clf.fit(train_ds_array.reshape(-1, 1))
         trace_detectors[name]['dur_detector'] = dur_clf
+
+        # 每种分辨率各训练一个多变量检测器（窗口数太少的分辨率跳过）
+        for seconds, features in train_features.items():
+            if len(features) == 0:
+                continue
+            feature_clf = IsolationForest(random_state=RANDOM_SEED, n_estimators=N_ESTIMATORS, contamination=CONTAMINATION)
+            trace_detectors[name][_feature_detector_key(seconds)] = feature_clf.fit(features)
         end_time = time.time()
-        print(f"训练组 {name} 的异常检测器耗时: {end_time - start_time:.2f}秒")
+        log.count('训练的组')
+        log.count('训练样本数', len(train_ds))
+        log.debug("训练组 {name} 的异常检测器耗时: {seconds:.2f}秒", name=name, seconds=end_time - start_time)
+
+    log.summary("异常检测模型训练汇总:")
         
     # 保存模型和统计信息
     if output_path:
@@ -564,6 +836,17 @@ def _train_anomaly_detection_model(normal_traces: Dict[str, List[pd.DataFrame]],
         with open(stats_path, 'wb') as f:
             pickle.dump(normal_stats, f)
         print(f"正常数据统计信息已保存至: {stats_path}")
+
+        # 保存调用边注册表，训练数据中的每个组对应一个稳定的edge_id
+        call_edges.save(os.path.join(os.path.dirname(output_path), CALL_EDGES_FILENAME))
+        print(f"调用边注册表已保存，包含 {len(call_edges)} 条调用边")
+
+        # 同时写入按组存储的检测器存储
+        store_dir = os.path.join(os.path.dirname(output_path), DETECTOR_STORE_DIRNAME)
+        store = DetectorStore(store_dir, create=True)
+        store.put_many(trace_detectors, normal_stats)
+        store.close()
+        print(f"检测器存储已更新: {store_dir}")
     
     # 打印统计信息
     print(f"\n异常检测模型统计信息:")
@@ -573,72 +856,180 @@ def _train_anomaly_detection_model(normal_traces: Dict[str, List[pd.DataFrame]],
     return trace_detectors, normal_stats
 
 
-def _detect_anomalies(df: pd.DataFrame, trace_detectors: Dict[str, Dict[str, IsolationForest]]) -> List[List[str]]:
+def _statistical_thresholds(stats: Dict[str, float]) -> Tuple[float, float]:
     """
-    使用训练好的模型检测异常
-    
+    由正常数据统计信息计算统计检测器的正常区间：分位数区间与 中位数±k倍稳健标准差（MAD） 两者取较宽者。
+    旧模型的统计信息中没有分位数和MAD时，用最小/最大值和按正态分布由标准差换算的MAD代替
+
+    返回:
+        Tuple[float, float]: (下限, 上限)
+    """
+    median = stats['median']
+    mad = stats.get('mad', stats['std'] * 0.6745)
+    robust_std = 1.4826 * mad
+    lower = min(stats.get('q_low', stats['min']), median - STAT_MAD_K * robust_std)
+    upper = max(stats.get('q_high', stats['max']), median + STAT_MAD_K * robust_std)
+    return lower, upper
+
+
+def _collect_group_windows(df: pd.DataFrame, known_groups, resolutions=WINDOW_RESOLUTIONS_SECONDS) -> List[Tuple[str, str, str, str, pd.DataFrame, int, np.ndarray, np.ndarray]]:
+    """
+    按调用组切分各分辨率的滑动窗口，只保留有检测器（或正常统计信息）的组
+
     参数:
         df: 待检测的trace数据
-        trace_detectors: 训练好的异常检测模型字典
-        
+        known_groups: 支持 in 判断的已知组名集合
+        resolutions: 窗口大小列表（秒）
+
     返回:
-        List[List[str]]: 检测到的异常事件列表
+        List[Tuple]: (组名, parent_pod, child_pod, operation_name, 组数据, 窗口大小（秒）, 窗口开始时间, 窗口特征矩阵)，
+                     每个组每种分辨率一项
     """
-    print("\n开始检测异常...")
-    
-    # 创建事件列表
-    events = []
-    
-    # 确保数据按时间戳排序
+    windows = []
+    call_edges = load_call_edges()
+
+    # 确保数据按时间戳排序，没有edge_id列时按parent_pod, child_pod, node_name, operationName分配
     df = df.sort_values(by='timestamp_ns', ascending=True)
+    edge_ids = df['edge_id'].to_numpy() if 'edge_id' in df.columns else call_edges.assign(df)
     
-    # 按parent_pod, child_pod, node_name, operationName分组
-    gp = df.groupby(['parent_pod', 'child_pod', 'node_name','operationName'])
+    # 按整数edge_id分组（四个字段中有空值的行为-1，与按四列groupby时一样被丢弃）
+    groups = pd.Series(np.arange(len(df))).groupby(edge_ids).indices
+    groups.pop(-1, None)
     
-    # 遍历每个组，添加node_name
-    for (parent_pod, child_pod, node_name, operation_name), call_df in gp:
-        # 处理None值
-        parent_pod_str = str(parent_pod) if parent_pod is not None else "None"
-        child_pod_str = str(child_pod) if child_pod is not None else "None"
-        node_name_str = str(node_name) if node_name is not None else "None"
-        operation_name_str = str(operation_name) if operation_name is not None else "None"
-        
-        name = f"{parent_pod_str}_{child_pod_str}_{node_name_str}_{operation_name_str}"
+    # 按调用边四元组的顺序遍历每个组，与按四列groupby的顺序一致
+    for edge_id in sorted(groups, key=call_edges.edge):
+        call_df = df.iloc[groups[edge_id]]
+        parent_pod_str, child_pod_str, _, operation_name_str = (str(part) for part in call_edges.edge(edge_id))
+        name = call_edges.key(edge_id)
         
         # 检查是否有对应的检测器
-        if name not in trace_detectors:
-            print(f"警告: 组 {name} 没有对应的异常检测器")
+        if name not in known_groups:
+            log.count('无检测器的组')
+            log.debug("警告: 组 {name} 没有对应的异常检测器", name=name)
             continue
-        else:
-            print(f"检测组 {name}")
+        log.count('检测组数')
+        log.debug("检测组 {name}", name=name)
         
-        # 使用滑动窗口提取特征
-        test_window_start_times, test_durations = _slide_window(call_df, WIN_SIZE_NS)
+        # 一次提取全部分辨率的窗口特征
+        pyramid = _window_pyramid(call_df, [seconds * 1000000000 for seconds in resolutions])
         
         # 如果没有足够的测试数据，跳过
-        if len(test_durations) == 0:
-            print(f"警告: 组 {name} 没有足够的测试数据")
+        if all(len(features) == 0 for _, features in pyramid.values()):
+            log.count('数据不足的组')
+            log.debug("警告: 组 {name} 没有足够的测试数据", name=name)
             continue
+        for seconds in resolutions:
+            test_window_start_times, test_features = pyramid[seconds * 1000000000]
+            if len(test_features):
+                windows.append((name, parent_pod_str, child_pod_str, operation_name_str, call_df, seconds,
+                                test_window_start_times, test_features))
+    return windows
+
+
+def _score_isolation_forest(windows: List[tuple], trace_detectors: Dict[str, Dict[str, IsolationForest]]) -> List[np.ndarray]:
+    """
+    用每个组的IsolationForest逐组判断窗口是否异常：有该分辨率的多变量检测器时在全部窗口特征上判断，
+    主分辨率没有多变量检测器时只看窗口平均duration，其余分辨率没有检测器（旧模型）时不判为异常
+
+    返回:
+        List[np.ndarray]: 与windows对应的布尔数组，True表示异常
+    """
+    labels = []
+    for name, _, _, _, _, seconds, _, features in windows:
+        detectors = trace_detectors[name]
+        key = _feature_detector_key(seconds)
+        if USE_FEATURE_DETECTOR and key in detectors:
+            labels.append(detectors[key].predict(features) == -1)
+        elif seconds == WIN_SIZE_SECONDS:
+            labels.append(detectors['dur_detector'].predict(features[:, [MEAN_FEATURE]]) == -1)
+        else:
+            labels.append(np.zeros(len(features), dtype=bool))
+    return labels
+
+
+def _score_statistical(windows: List[tuple], normal_stats: Dict[str, Dict[str, float]]) -> List[np.ndarray]:
+    """
+    用正常数据统计信息的稳健区间判断窗口是否异常：窗口平均duration超出区间，或出错比例高于正常窗口的高分位数
+    （统计信息中有error_ratio_high时），每种分辨率使用各自的统计信息，没有时不判为异常。
+    全部组的窗口拼接后用一次向量化比较完成
+
+    返回:
+        List[np.ndarray]: 与windows对应的布尔数组，True表示异常
+    """
+    if not windows:
+        return []
+    window_stats = [_resolution_stats(normal_stats[window[0]], window[5]) for window in windows]
+    thresholds = np.array([_statistical_thresholds(stats) if stats is not None else (-np.inf, np.inf) for stats in window_stats])
+    error_highs = np.array([stats.get('error_ratio_high', np.inf) if stats is not None else np.inf for stats in window_stats])
+    lengths = [len(window[-1]) for window in windows]
+    features = np.vstack([window[-1] for window in windows])
+    durations = features[:, MEAN_FEATURE]
+    group_index = np.repeat(np.arange(len(windows)), lengths)
+    anomalous = ((durations < thresholds[group_index, 0]) | (durations > thresholds[group_index, 1])
+                 | (features[:, ERROR_RATIO_FEATURE] > error_highs[group_index]))
+    return np.split(anomalous, np.cumsum(lengths)[:-1])
+
+
+@traced('trace.detect_anomalies')
+def _detect_anomalies(df: pd.DataFrame, trace_detectors: Dict[str, Dict[str, IsolationForest]],
+                      normal_stats: Optional[Dict[str, Dict[str, float]]] = None, backend: Optional[str] = None) -> List[List[str]]:
+    """
+    使用训练好的模型检测异常
+    
+    参数:
+        df: 待检测的trace数据
+        trace_detectors: 训练好的异常检测模型字典
+        normal_stats: 正常数据统计信息，统计检测器需要
+        backend: 'iforest'或'stats'，None表示使用TRACE_DETECTOR_BACKEND
         
-        # 检测持续时间异常
-        dur_detector = trace_detectors[name]['dur_detector']
-        labels = dur_detector.predict(test_durations.reshape(-1, 1)).tolist()
-        
+    返回:
+        List[List[str]]: 检测到的异常事件列表，每个事件为
+                         [timestamp, parent_pod, child_pod, operation_name, 异常类型, duration, service_name, node_name, 检测分辨率]
+    """
+    backend = backend or TRACE_DETECTOR_BACKEND
+    if backend == 'stats' and normal_stats is None:
+        print("统计检测器需要正常数据统计信息，改用IsolationForest")
+        backend = 'iforest'
+    print(f"\n开始检测异常（{backend}）...")
+    
+    # 创建事件列表
+    events = []
+
+    if backend == 'stats':
+        windows = _collect_group_windows(df, normal_stats)
+        with span('trace.score_stats', groups=len(windows)):
+            labels = _score_statistical(windows, normal_stats)
+    else:
+        windows = _collect_group_windows(df, trace_detectors)
+        with span('trace.isolation_forest', groups=len(windows)):
+            labels = _score_isolation_forest(windows, trace_detectors)
+
+    for (name, parent_pod_str, child_pod_str, operation_name_str, call_df, seconds, test_window_start_times, test_features), anomalous in zip(windows, labels):
         # 找到所有异常点
-        anomaly_indices = [i for i, label in enumerate(labels) if label == -1]
+        anomaly_indices = np.flatnonzero(anomalous).tolist()
         
         if anomaly_indices:
-            print(f"在组 {name} 中检测到 {len(anomaly_indices)} 个持续时间异常")
+            log.count(f"有异常的组（{_resolution_label(seconds)}）")
+            log.info("在组 {name} 中检测到 {count} 个{resolution}异常窗口", name=name, count=len(anomaly_indices),
+                     resolution=_resolution_label(seconds))
             service_name = call_df['service_name'].iloc[0] if not call_df.empty and 'service_name' in call_df.columns else None
             node_name = call_df['node_name'].iloc[0] if not call_df.empty and 'node_name' in call_df.columns else None
+            # 出错比例高于正常窗口的高分位数时记为Error异常，否则为Duration异常；
+            # 没有error_ratio_high（旧模型）时与_score_statistical一致，不判为Error
+            stats = _resolution_stats(normal_stats.get(name, {}), seconds) if normal_stats is not None else None
+            error_high = (stats or {}).get('error_ratio_high', np.inf)
             for idx in anomaly_indices:
                 timestamp = test_window_start_times[idx]
-                duration = test_durations[idx]
-                events.append([timestamp, parent_pod_str, child_pod_str, operation_name_str, 'Duration', duration, service_name, node_name])
-                print(f"  异常时间戳: {pd.to_datetime(timestamp, unit='ns')}, duration: {duration}")
+                duration = test_features[idx, MEAN_FEATURE]
+                anomaly_type = 'Error' if test_features[idx, ERROR_RATIO_FEATURE] > error_high else 'Duration'
+                events.append([timestamp, parent_pod_str, child_pod_str, operation_name_str, anomaly_type, duration, service_name, node_name,
+                               _resolution_label(seconds)])
+                if log.debug_enabled:
+                    log.debug("  异常时间戳: {timestamp}, duration: {duration}", timestamp=pd.to_datetime(timestamp, unit='ns'), duration=duration)
         else:
-            print(f"组 {name} 中未检测到异常")    
+            log.debug("组 {name} 中未检测到异常", name=name)
     
+    log.summary("异常检测汇总:")
     print(f"总共检测到 {len(events)} 个异常事件")
     return events
 
@@ -759,6 +1150,7 @@ def _process_trace_samples(sample_size: int = 50, random_seed: int = 42, output_
     return normal_traces
 
 
+@traced('trace.refinement')
 def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tuple[str, dict, str]:
     """
     加载并过滤trace异常数据，返回前20个异常组合的统计CSV格式字符串、三项唯一值字典和status组合统计
@@ -781,16 +1173,13 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
         return "", {}, ""
     
     # ========== 第二部分：单独的异常检测操作 ==========
-    search_pattern = os.path.join(project_root, 'data', '*', 'trace-parquet', f'*{start_time_hour}*')
-    matching_files = glob.glob(search_pattern, recursive=True)  
-    
     try:
-        if not matching_files:
+        # 读取故障时间范围内的trace数据，故障窗口跨小时时合并多个文件，只读取时间范围重叠的row group
+        df_trace = read_window('trace', start_time, end_time)
+        if df_trace is None:
             print("未找到匹配的trace文件")
             return "", {}, ""
             
-        # 读取trace数据
-        df_trace = pd.read_parquet(matching_files[0])
         print("原始trace行数：", len(df_trace))
         
         # 过滤时间范围内的数据
@@ -804,36 +1193,47 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
         
         # 预处理trace数据
         print("预处理trace数据...")
-        start_preprocess_time = time.time()
-        
-        # 提取pod_name, service_name, node_name
-        df_filtered_traces['pod_name'] = df_filtered_traces['process'].apply(_extract_pod_name)
-        df_filtered_traces['service_name'] = df_filtered_traces['process'].apply(_extract_service_name)
-        df_filtered_traces['node_name'] = df_filtered_traces['process'].apply(_extract_node_name)
+        start_preprocess_time = time.perf_counter()
+        with span('trace.enrich', rows_in=len(df_filtered_traces)) as enrich_span:
         
-        # 提取父spanID
-        df_filtered_traces['parent_spanID'] = df_filtered_traces['references'].apply(_extract_parent_spanid)
+            # 提取pod_name, service_name, node_name
+            df_filtered_traces['pod_name'] = df_filtered_traces['process'].apply(_extract_pod_name)
+            df_filtered_traces['service_name'] = df_filtered_traces['process'].apply(_extract_service_name)
+            df_filtered_traces['node_name'] = df_filtered_traces['process'].apply(_extract_node_name)
         
-        # 创建spanID到pod_name的映射
-        span_to_pod = dict(zip(df_filtered_traces['spanID'].tolist(), df_filtered_traces['pod_name'].tolist()))
+            # 提取父spanID
+            df_filtered_traces['parent_spanID'] = df_filtered_traces['references'].apply(_extract_parent_spanid)
         
-        # 提取父spanID对应的pod_name
-        df_filtered_traces['parent_pod'] = df_filtered_traces['parent_spanID'].map(lambda x: span_to_pod.get(x))
+            # 创建spanID到pod_name的映射
+            span_to_pod = dict(zip(df_filtered_traces['spanID'].tolist(), df_filtered_traces['pod_name'].tolist()))
         
-        # 重命名pod_name为child_pod
-        df_filtered_traces = df_filtered_traces.rename(columns={'pod_name': 'child_pod'})
+            # 提取父spanID对应的pod_name
+            df_filtered_traces['parent_pod'] = df_filtered_traces['parent_spanID'].map(lambda x: span_to_pod.get(x))
         
-        # 按时间戳排序
-        df_filtered_traces = df_filtered_traces.sort_values(by='timestamp_ns')
+            # 重命名pod_name为child_pod
+            df_filtered_traces = df_filtered_traces.rename(columns={'pod_name': 'child_pod'})
+
+            # 分配整数调用边ID，后续分组和检测器查找都用edge_id
+            df_filtered_traces['edge_id'] = load_call_edges().assign(df_filtered_traces)
+
+            # 计算每个span的自身耗时和是否在关键路径上，区分自身变慢和被下游拖慢
+            annotate_span_tree(df_filtered_traces)
+
+            # 标记出错的span（status.code不为0），窗口特征和status组合分析共用
+            df_filtered_traces['is_error'] = _error_flags(df_filtered_traces)
         
-        end_preprocess_time = time.time()
-        print(f"预处理trace数据耗时: {end_preprocess_time - start_preprocess_time:.2f}秒")
+            # 按时间戳排序
+            df_filtered_traces = df_filtered_traces.sort_values(by='timestamp_ns')
+            enrich_span.set(rows_out=len(df_filtered_traces))
+
+        # 没有活动的span报告时enrich_span为空span（wall_ms恒为0），耗时单独计时
+        print(f"预处理trace数据耗时: {time.perf_counter() - start_preprocess_time:.2f}秒")
         
         # 分析故障期间的status组合（在预处理完成后）
         status_combinations_csv = _analyze_status_combinations_in_fault_period(df_filtered_traces)
         
         # 检测异常
-        anomaly_events = _detect_anomalies(df_filtered_traces, trace_detectors)
+        anomaly_events = _detect_anomalies(df_filtered_traces, trace_detectors, normal_stats)
         
         print(f"检测到 {len(anomaly_events)} 个异常事件")
         
@@ -843,7 +1243,7 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
         
         anomaly_data = []
         for event in anomaly_events:
-            timestamp, parent_pod, child_pod, operation_name, anomaly_type, duration, service_name, node_name = event
+            timestamp, parent_pod, child_pod, operation_name, anomaly_type, duration, service_name, node_name, resolution = event
             # 转换为北京时间 (UTC+8)
             beijing_time = pd.to_datetime(timestamp, unit='ns') + pd.Timedelta(hours=BEIJING_TIMEZONE_OFFSET)
             anomaly_data.append({
@@ -855,7 +1255,8 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
                 'anomaly_type': anomaly_type,
                 'duration': duration,
                 'service_name': service_name,
-                'node_name': node_name
+                'node_name': node_name,
+                'resolution': resolution
             })
         
         df_anomalies = pd.DataFrame(anomaly_data)
@@ -864,18 +1265,25 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
         # 按时间排序
         df_anomalies = df_anomalies.sort_values('timestamp_readable')
         
-        # 创建组合列
-        df_anomalies['combination'] = (df_anomalies['parent_pod'].astype(str) + '_' + 
-                                        df_anomalies['child_pod'].astype(str) + '_' + 
-                                        df_anomalies['node_name'].astype(str) + '_' +
-                                        df_anomalies['operation_name'].astype(str))
+        # 异常事件所属调用边的edge_id（检测时已在注册表中分配），按edge_id分组和查找正常数据统计信息
+        call_edges = load_call_edges()
+        df_anomalies['edge_id'] = call_edges.assign(
+            df_anomalies.rename(columns={'operation_name': 'operationName'}), intern=False)
         
         # duration信息已经在异常检测时直接提取并包含在异常数据中，无需额外匹配
+
+        # 故障期间各调用边的平均自身耗时和span处于关键路径上的比例
+        edge_span_stats = (df_filtered_traces[df_filtered_traces['edge_id'] >= 0]
+                           .groupby('edge_id')[['self_time', 'on_critical_path']].mean())
+        edge_span_stats = dict(zip(edge_span_stats.index,
+                                   zip(edge_span_stats['self_time'], edge_span_stats['on_critical_path'])))
         
-        # 按组合分组进行统计
+        # 按调用边分组进行统计（按调用边四元组的顺序）
         combination_stats = []
+        edge_groups = dict(list(df_anomalies[df_anomalies['edge_id'] >= 0].groupby('edge_id')))
         
-        for combination_name, group in df_anomalies.groupby('combination'):
+        for edge_id in sorted(edge_groups, key=call_edges.edge):
+            group = edge_groups[edge_id]
             parent_pod = group['parent_pod'].iloc[0]
             child_pod = group['child_pod'].iloc[0]
             operation_name = group['operation_name'].iloc[0]
@@ -885,13 +1293,26 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
             # 计算平均duration（如果有的话）
             if 'duration' not in group.columns or len(group['duration'].dropna()) == 0:
                 continue  # 跳过没有有效duration数据的组合
-            anomaly_avg_duration = group['duration'].mean()
+
+            # 不同分辨率的异常窗口互相重叠，出现次数和平均duration只用主分辨率的窗口；
+            # 只在其他分辨率检测到时出现次数为0，平均duration取最接近主分辨率的那一种
+            detected_seconds = [seconds for seconds in WINDOW_RESOLUTIONS_SECONDS
+                                if _resolution_label(seconds) in set(group['resolution'])]
+            reference_seconds = min(detected_seconds, key=lambda seconds: abs(seconds - WIN_SIZE_SECONDS))
+            reference_group = group[group['resolution'] == _resolution_label(reference_seconds)]
+            anomaly_avg_duration = reference_group['duration'].mean()
+            anomaly_count = len(reference_group) if reference_seconds == WIN_SIZE_SECONDS else 0
             
             # 获取正常数据的平均时间
-            normal_avg_time = 0
-            combination_key = f"{parent_pod}_{child_pod}_{node_name}_{operation_name}"
-            if combination_key in normal_stats:
-                normal_avg_time = normal_stats[combination_key].get('mean', 0)
+            normal_avg_time = normal_stats.get(call_edges.key(edge_id), {}).get('mean', 0)
+
+            avg_self_time, critical_path_ratio = edge_span_stats.get(edge_id, (None, None))
+
+            # 各检测分辨率的异常窗口数，如 "10s:3 30s:1"
+            resolution_counts = group['resolution'].value_counts()
+            detected_resolutions = ' '.join(f"{label}:{resolution_counts[label]}"
+                                            for label in map(_resolution_label, WINDOW_RESOLUTIONS_SECONDS)
+                                            if label in resolution_counts)
             
             stats = {
                 'node_name': node_name,
@@ -901,7 +1322,10 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
                 'operation_name': operation_name,
                 'normal_avg_duration': normal_avg_time,
                 'anomaly_avg_duration': anomaly_avg_duration,
-                'anomaly_count': len(group)
+                'avg_self_time': avg_self_time,
+                'critical_path_ratio': round(critical_path_ratio, 3) if critical_path_ratio is not None else None,
+                'detected_resolutions': detected_resolutions,
+                'anomaly_count': anomaly_count
             }
             combination_stats.append(stats)
         
@@ -920,7 +1344,8 @@ def trace_refinement(start_time_hour: str, start_time: int, end_time: int) -> tu
         
         # 重新排列列顺序
         desired_column_order = ['node_name', 'service_name', 'parent_pod', 'child_pod', 
-                               'operation_name', 'normal_avg_duration', 'anomaly_avg_duration', 'anomaly_count']
+                               'operation_name', 'normal_avg_duration', 'anomaly_avg_duration', 'avg_self_time',
+                               'critical_path_ratio', 'detected_resolutions', 'anomaly_count']
         # 确保只包含存在的列，并按指定顺序排列
         existing_columns = [col for col in desired_column_order if col in top_20_stats.columns]
         top_20_stats = top_20_stats[existing_columns]
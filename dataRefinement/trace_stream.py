@@ -0,0 +1,300 @@
+"""
+trace流式异常检测
+
+增量消费span（来自持续追加文件的parquet目录，或本地队列），按 parent_pod/child_pod/node_name/operationName
+分组，增量维护每组当前WIN_SIZE_SECONDS窗口的duration累加值，窗口关闭时用已训练的trace_detectors.pkl打分，
+立即产出与_detect_anomalies格式相同的异常事件。内存有界：
+    - spanID -> pod 映射为定长FIFO，用于解析父span所在pod
+    - span先在等待缓冲中停留PARENT_WAIT_SECONDS（事件时间），等父span到达后再归入分组
+    - 分组数超过MAX_GROUPS时淘汰最久未活跃的分组，每组只保留最近RING_SIZE个窗口的结果
+
+用法:
+    python -m dataRefinement.trace_stream <parquet目录>
+"""
+import os
+import sys
+import time
+import queue
+import threading
+from collections import OrderedDict, deque
+from typing import Callable, Deque, Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import pyarrow.parquet as pq
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+from dataRefinement.trace_refinement import (WIN_SIZE_NS, _extract_node_name, _extract_parent_spanid,
+                                             _extract_pod_name, _extract_service_name,
+                                             _load_or_train_anomaly_detection_model, load_call_edges)
+
+# ========== 流式检测配置 ==========
+PARENT_WAIT_SECONDS = 5  # span等待父span到达的事件时间（秒）
+PARENT_WAIT_NS = PARENT_WAIT_SECONDS * 1000000000
+ALLOWED_LATENESS_SECONDS = 5  # 窗口结束后再等待迟到span的事件时间（秒）
+ALLOWED_LATENESS_NS = ALLOWED_LATENESS_SECONDS * 1000000000
+SPAN_MAP_SIZE = 200000  # spanID -> pod 映射的最大条数
+MAX_PENDING_SPANS = 100000  # 等待缓冲的最大span数，超过后不再等待父span
+MAX_GROUPS = 10000  # 同时维护的分组数上限
+RING_SIZE = 120  # 每组保留的最近窗口数（30秒窗口即1小时）
+POLL_INTERVAL_SECONDS = 5  # 轮询parquet目录的间隔（秒）
+
+SPAN_COLUMNS = ['spanID', 'operationName', 'references', 'timestamp_ns', 'duration', 'process']
+
+
+class _GroupState:
+    """
+    单个调用组的窗口状态
+    """
+    __slots__ = ('window_start', 'duration_sum', 'count', 'parent_pod', 'child_pod', 'operation_name',
+                 'service_name', 'node_name', 'history')
+
+    def __init__(self, window_start: int, parent_pod: str, child_pod: str, operation_name: str,
+                 service_name: Optional[str], node_name: Optional[str]):
+        self.window_start = window_start
+        self.duration_sum = 0.0
+        self.count = 0
+        self.parent_pod = parent_pod
+        self.child_pod = child_pod
+        self.operation_name = operation_name
+        self.service_name = service_name
+        self.node_name = node_name
+        self.history: Deque[Tuple[int, float, int]] = deque(maxlen=RING_SIZE)  # (窗口开始时间, 均值, 标签)
+
+
+class TraceStreamDetector:
+    """
+    增量trace异常检测器
+    """
+
+    def __init__(self, trace_detectors: Optional[Dict] = None, win_size_ns: int = WIN_SIZE_NS,
+                 on_event: Optional[Callable[[list], None]] = None):
+        """
+        参数:
+            trace_detectors: 异常检测模型字典，None时加载dataRefinement/IsolationForest/trace_detectors.pkl
+            win_size_ns: 窗口大小（纳秒）
+            on_event: 每产出一个异常事件时的回调
+        """
+        if trace_detectors is None:
+            loaded = _load_or_train_anomaly_detection_model()
+            if loaded is None:
+                raise RuntimeError("无法获取trace异常检测模型")
+            trace_detectors = loaded[0]
+        self.trace_detectors = trace_detectors
+        self.call_edges = load_call_edges()
+        self.win_size_ns = win_size_ns
+        self.on_event = on_event
+
+        self._span_to_pod: "OrderedDict[str, Optional[str]]" = OrderedDict()
+        self._pending: Deque[tuple] = deque()
+        self._groups: "OrderedDict[int, _GroupState]" = OrderedDict()  # edge_id -> 窗口状态
+        self._closed: List[Tuple[int, _GroupState, int, float]] = []
+        self._max_ts = 0
+        self.stats = {'spans': 0, 'late_spans': 0, 'windows': 0, 'events': 0, 'evicted_groups': 0}
+
+    # ---------- span输入 ----------
+    def process_batch(self, df: pd.DataFrame) -> List[list]:
+        """
+        处理一批span（列同trace parquet文件），返回本批次触发的异常事件
+
+        参数:
+            df: span数据
+
+        返回:
+            List[list]: 异常事件 [timestamp, parent_pod, child_pod, operation_name, 'Duration', duration, service_name, node_name, 窗口大小]
+        """
+        if df is None or len(df) == 0:
+            return []
+        df = df.sort_values(by='timestamp_ns')
+        pods = df['process'].map(_extract_pod_name).tolist()
+        services = df['process'].map(_extract_service_name).tolist()
+        nodes = df['process'].map(_extract_node_name).tolist()
+        parents = df['references'].map(_extract_parent_spanid).tolist()
+
+        for span_id, operation_name, timestamp, duration, pod, service, node, parent in zip(
+                df['spanID'].tolist(), df['operationName'].tolist(), df['timestamp_ns'].tolist(),
+                df['duration'].tolist(), pods, services, nodes, parents):
+            self._span_to_pod[span_id] = pod
+            if len(self._span_to_pod) > SPAN_MAP_SIZE:
+                self._span_to_pod.popitem(last=False)
+            self._pending.append((timestamp, parent, pod, node, operation_name, duration, service))
+            if timestamp > self._max_ts:
+                self._max_ts = timestamp
+        self.stats['spans'] += len(df)
+
+        self._drain_pending(self._max_ts - PARENT_WAIT_NS)
+        self._close_windows(self._max_ts - PARENT_WAIT_NS - ALLOWED_LATENESS_NS)
+        return self._score_closed()
+
+    def flush(self) -> List[list]:
+        """
+        数据流结束时处理所有等待中的span并关闭全部窗口
+        """
+        self._drain_pending(None)
+        self._close_windows(None)
+        return self._score_closed()
+
+    # ---------- 窗口维护 ----------
+    def _drain_pending(self, watermark: Optional[int]) -> None:
+        while self._pending and (watermark is None or self._pending[0][0] <= watermark
+                                 or len(self._pending) > MAX_PENDING_SPANS):
+            timestamp, parent, pod, node, operation_name, duration, service = self._pending.popleft()
+            parent_pod = self._span_to_pod.get(parent) if parent is not None else None
+            self._add_span(timestamp, parent_pod, pod, node, operation_name, duration, service)
+
+    def _add_span(self, timestamp: int, parent_pod, child_pod, node_name, operation_name, duration, service_name) -> None:
+        edge_id = self.call_edges.intern((parent_pod, child_pod, node_name, operation_name))
+        state = self._groups.get(edge_id)
+        if state is None:
+            state = _GroupState(timestamp, str(parent_pod), str(child_pod), str(operation_name), service_name, node_name)
+            self._groups[edge_id] = state
+            if len(self._groups) > MAX_GROUPS:
+                evicted_edge_id, evicted_state = self._groups.popitem(last=False)
+                self._close_group(evicted_edge_id, evicted_state)
+                self.stats['evicted_groups'] += 1
+        else:
+            self._groups.move_to_end(edge_id)
+
+        if timestamp < state.window_start:
+            self.stats['late_spans'] += 1
+            return
+        if timestamp >= state.window_start + self.win_size_ns:
+            self._close_group(edge_id, state)
+            # 与离线滑动窗口一致：窗口从组内首个span开始按固定步长对齐，跳过空窗口
+            state.window_start += (timestamp - state.window_start) // self.win_size_ns * self.win_size_ns
+        state.duration_sum += duration
+        state.count += 1
+
+    def _close_group(self, edge_id: int, state: _GroupState) -> None:
+        if state.count == 0:
+            return
+        self._closed.append((edge_id, state, state.window_start, state.duration_sum / state.count))
+        state.duration_sum = 0.0
+        state.count = 0
+
+    def _close_windows(self, watermark: Optional[int]) -> None:
+        for edge_id, state in self._groups.items():
+            if state.count and (watermark is None or state.window_start + self.win_size_ns <= watermark):
+                self._close_group(edge_id, state)
+                state.window_start += self.win_size_ns
+
+    def _score_closed(self) -> List[list]:
+        """
+        对已关闭的窗口按组批量打分
+        """
+        if not self._closed:
+            return []
+        by_group: Dict[int, List[Tuple[_GroupState, int, float]]] = {}
+        for edge_id, state, window_start, mean in self._closed:
+            by_group.setdefault(edge_id, []).append((state, window_start, mean))
+        self._closed = []
+        self.stats['windows'] += sum(len(windows) for windows in by_group.values())
+
+        events = []
+        for edge_id, windows in by_group.items():
+            detector = self.trace_detectors.get(self.call_edges.key(edge_id), {}).get('dur_detector')
+            if detector is None:
+                continue
+            means = np.array([mean for _, _, mean in windows]).reshape(-1, 1)
+            labels = detector.predict(means).tolist()
+            for (state, window_start, mean), label in zip(windows, labels):
+                state.history.append((window_start, mean, label))
+                if label == -1:
+                    event = [window_start, state.parent_pod, state.child_pod, state.operation_name, 'Duration', mean,
+                             state.service_name, state.node_name, f"{self.win_size_ns // 1000000000}s"]
+                    events.append(event)
+                    if self.on_event is not None:
+                        self.on_event(event)
+        self.stats['events'] += len(events)
+        return events
+
+    def memory_stats(self) -> Dict[str, int]:
+        """
+        当前占用的各缓冲区大小
+        """
+        return {'span_map': len(self._span_to_pod), 'pending_spans': len(self._pending), 'groups': len(self._groups)}
+
+
+# ---------- 数据源 ----------
+def tail_parquet_directory(directory: str, poll_interval: float = POLL_INTERVAL_SECONDS,
+                           stop_event: Optional[threading.Event] = None, max_idle_polls: Optional[int] = None) -> Iterator[pd.DataFrame]:
+    """
+    持续跟踪目录中新出现（或被重写）的parquet文件，按row group逐批产出span
+
+    参数:
+        directory: parquet文件目录
+        poll_interval: 轮询间隔（秒）
+        stop_event: 设置后停止跟踪
+        max_idle_polls: 连续多少次轮询没有新文件后停止，None表示一直跟踪
+
+    返回:
+        Iterator[pd.DataFrame]: span批次
+    """
+    seen: Dict[str, Tuple[float, int]] = {}
+    idle_polls = 0
+    while stop_event is None or not stop_event.is_set():
+        new_files = []
+        for filename in sorted(os.listdir(directory)):
+            if not filename.endswith('.parquet'):
+                continue
+            path = os.path.join(directory, filename)
+            stat = os.stat(path)
+            if seen.get(path) != (stat.st_mtime, stat.st_size):
+                seen[path] = (stat.st_mtime, stat.st_size)
+                new_files.append(path)
+
+        for path in new_files:
+            parquet_file = pq.ParquetFile(path)
+            columns = [column for column in SPAN_COLUMNS if column in parquet_file.schema_arrow.names]
+            for i in range(parquet_file.num_row_groups):
+                yield parquet_file.read_row_group(i, columns=columns).to_pandas()
+
+        idle_polls = 0 if new_files else idle_polls + 1
+        if max_idle_polls is not None and idle_polls >= max_idle_polls:
+            return
+        time.sleep(poll_interval)
+
+
+def iterate_queue(span_queue: "queue.Queue[Optional[pd.DataFrame]]") -> Iterator[pd.DataFrame]:
+    """
+    从本地队列消费span批次（socket/消息队列的本地替代），收到None时结束
+    """
+    while True:
+        batch = span_queue.get()
+        if batch is None:
+            return
+        yield batch
+
+
+def run_stream_detection(source: Iterator[pd.DataFrame], detector: Optional[TraceStreamDetector] = None) -> List[list]:
+    """
+    持续消费数据源并检测，数据源结束时关闭全部窗口
+
+    参数:
+        source: span批次迭代器
+        detector: 流式检测器，None时使用默认配置创建
+
+    返回:
+        List[list]: 全部异常事件
+    """
+    detector = detector or TraceStreamDetector()
+    events = []
+    for batch in source:
+        start_time = time.perf_counter()
+        batch_events = detector.process_batch(batch)
+        events.extend(batch_events)
+        if batch_events:
+            print(f"批次{len(batch)}条span，检测到{len(batch_events)}个异常事件，处理耗时{(time.perf_counter() - start_time) * 1000:.1f}毫秒")
+    events.extend(detector.flush())
+    print(f"流式检测结束: {detector.stats}，缓冲区: {detector.memory_stats()}")
+    return events
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("用法: python -m dataRefinement.trace_stream <parquet目录>")
+        sys.exit(1)
+    run_stream_detection(tail_parquet_directory(sys.argv[1]),
+                         TraceStreamDetector(on_event=lambda event: print(f"异常事件: {event}")))
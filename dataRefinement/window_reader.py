@@ -0,0 +1,151 @@
+"""
+故障时间窗口读取
+
+根据数据目录索引找出与 [start_ts, end_ts] 重叠的全部文件（包括跨小时边界的多个文件），
+只读取时间范围重叠的row group，多文件并行读取后按时间戳过滤并拼接成一张Arrow表（不额外复制列数据），
+需要时再转换为DataFrame。log、trace、metric三种模态共用；文件已转换到Arrow IPC热存储时以内存映射方式读取
+"""
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+
+from dataRefinement.data_catalog import CatalogFile, TIMESTAMP_COLUMN, get_catalog
+from dataRefinement.hot_store import get_hot_path, read_hot_table
+from utils.span_tracer import bind_context, span
+
+# ========== 窗口读取配置 ==========
+WINDOW_READ_WORKERS = 8  # 并行读取文件的线程数
+
+
+def _filter_table_by_timerange(table: pa.Table, start_ts: Optional[int], end_ts: Optional[int]) -> pa.Table:
+    if TIMESTAMP_COLUMN not in table.column_names or (start_ts is None and end_ts is None):
+        return table
+    timestamps = table.column(TIMESTAMP_COLUMN)
+    mask = None
+    if start_ts is not None:
+        mask = pc.greater_equal(timestamps, pa.scalar(int(start_ts), timestamps.type))
+    if end_ts is not None:
+        upper = pc.less_equal(timestamps, pa.scalar(int(end_ts), timestamps.type))
+        mask = upper if mask is None else pc.and_(mask, upper)
+    return table.filter(mask)
+
+
+def _read_table(path: str, item: Optional[CatalogFile], start_ts: Optional[int], end_ts: Optional[int],
+                columns: Optional[List[str]]) -> Optional[pa.Table]:
+    """
+    读取单个文件中时间范围内的数据；文件在索引中时只读取重叠的row group，有热存储文件时从热存储读取
+    """
+    # 需要按时间戳过滤时，即使调用方没要求也要读取时间戳列，过滤后再去掉
+    read_columns = columns
+    if columns is not None and TIMESTAMP_COLUMN not in columns and (start_ts is not None or end_ts is not None):
+        read_columns = list(columns) + [TIMESTAMP_COLUMN]
+
+    row_groups = None
+    if item is not None and start_ts is not None and end_ts is not None:
+        row_groups = item.row_groups_in_range(int(start_ts), int(end_ts))
+        if not row_groups:
+            return None
+
+    hot_path = get_hot_path(item) if item is not None else None
+    with span('data.read_hot' if hot_path is not None else 'data.read_parquet', file=os.path.basename(path)) as record:
+        if hot_path is not None:
+            table = read_hot_table(hot_path, row_groups, read_columns)
+        elif row_groups is not None:
+            table = pq.ParquetFile(path).read_row_groups(row_groups, columns=read_columns)
+        else:
+            table = pq.ParquetFile(path).read(columns=read_columns)
+        # 读取字节数按选中的row group占比估算（热存储为映射的数据量）
+        if item is not None and row_groups is not None and item.row_groups:
+            record.set(bytes_read=item.size * len(row_groups) // len(item.row_groups), row_groups=len(row_groups))
+        elif item is not None:
+            record.set(bytes_read=item.size)
+        record.set(rows_in=table.num_rows)
+
+        table = _filter_table_by_timerange(table, start_ts, end_ts)
+        if read_columns is not columns:
+            table = table.select(columns)
+        record.set(rows_out=table.num_rows)
+    return table
+
+
+def _concat_tables(tables: List[pa.Table]) -> Optional[pa.Table]:
+    tables = [table for table in tables if table is not None]
+    if not tables:
+        return None
+    if len(tables) == 1:
+        return tables[0]
+    # 不同小时的文件schema可能略有差异（如新增列），按列名合并
+    return pa.concat_tables(tables, promote_options='default')
+
+
+def read_window_table(modality: str, start_ts: int, end_ts: int, columns: Optional[List[str]] = None,
+                      category: Optional[str] = None) -> Optional[pa.Table]:
+    """
+    读取某个模态在时间范围内的全部数据
+
+    参数:
+        modality: 'log'、'trace'或'metric'
+        start_ts: 开始时间戳（纳秒）
+        end_ts: 结束时间戳（纳秒）
+        columns: 需要的列，None表示全部列
+        category: 子目录过滤，如metric的'apm/service'
+
+    返回:
+        pa.Table: 按文件时间顺序拼接的数据，没有重叠文件时返回None
+    """
+    with span('data.resolve_files', modality=modality) as record:
+        files = get_catalog().find_files(modality, start_ts, end_ts, category=category)
+        record.set(files=len(files))
+    if not files:
+        return None
+    if len(files) == 1:
+        return _read_table(files[0].abspath, files[0], start_ts, end_ts, columns)
+    with ThreadPoolExecutor(max_workers=min(WINDOW_READ_WORKERS, len(files))) as executor:
+        read = bind_context(lambda item: _read_table(item.abspath, item, start_ts, end_ts, columns))
+        tables = list(executor.map(read, files))
+    print(f"{modality}时间窗口跨{len(files)}个文件")
+    return _concat_tables(tables)
+
+
+def read_window(modality: str, start_ts: int, end_ts: int, columns: Optional[List[str]] = None,
+                category: Optional[str] = None) -> Optional[pd.DataFrame]:
+    """
+    与read_window_table相同，返回DataFrame
+
+    返回:
+        pd.DataFrame: 时间范围内的数据，没有重叠文件时返回None
+    """
+    with span('data.read_window', modality=modality) as record:
+        table = read_window_table(modality, start_ts, end_ts, columns=columns, category=category)
+        if table is None:
+            return None
+        df = table.to_pandas()
+        record.set(rows_out=len(df))
+    return df
+
+
+def read_file_window(path: str, start_ts: Optional[int] = None, end_ts: Optional[int] = None,
+                     columns: Optional[List[str]] = None) -> pd.DataFrame:
+    """
+    读取单个已知路径的文件（如按天存储的metric文件）在时间范围内的数据
+
+    参数:
+        path: 文件路径
+        start_ts: 开始时间戳（纳秒），None表示不限
+        end_ts: 结束时间戳（纳秒），None表示不限
+        columns: 需要的列，None表示全部列
+
+    返回:
+        pd.DataFrame: 时间范围内的数据
+    """
+    table = _read_table(path, get_catalog().get(path), start_ts, end_ts, columns)
+    if table is None:
+        # 没有与时间范围重叠的row group，返回保留列结构的空表
+        schema = pq.read_schema(path)
+        table = schema.empty_table() if columns is None else schema.empty_table().select(columns)
+    return table.to_pandas()
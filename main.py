@@ -4,23 +4,40 @@ import pandas as pd
 from typing import Sequence, OrderedDict
 import asyncio
 import json
+import time
+import argparse
+import traceback
 
 from dataRefinement.log_refinement import log_refinement
 from dataRefinement.trace_refinement import trace_refinement
 from dataRefinement.metric_refinement import metric_refinement
 
-from agent.agent import *
-from agent.prompts import get_multimodal_analysis_prompt
-from autogen_agentchat.teams import SelectorGroupChat, DiGraphBuilder, GraphFlow
+from utils.run_journal import RunJournal, RUN_JOURNAL_PATH, default_worker_id
+from dataRefinement.model_registry import get_registry
+from utils.span_tracer import format_summary, span, span_report
+from agent.agent import AgentPool
+from agent.diagnosis_graph import DiagnosisTeamPool
+from agent.team_runner import create_termination_condition, extract_result_json, run_team_streaming
+from agent.prompts import (get_multimodal_analysis_prompt, apply_modality_budget, trim_csv_to_budget,
+                           report_prompt_tokens, MODALITY_TOKEN_BUDGETS)
+from autogen_agentchat.teams import SelectorGroupChat
 from autogen_agentchat.conditions import TextMentionTermination, MaxMessageTermination
 from autogen_agentchat.ui import Console
-from autogen_agentchat.messages import AgentEvent, ChatMessage
+from autogen_agentchat.messages import AgentEvent, ChatMessage, BaseChatMessage
 
 
 project_root = os.path.dirname(os.path.abspath(__file__))
 
-max_messages_termination = MaxMessageTermination(max_messages=20)
-termination = max_messages_termination
+# 数据提炼智能体池，每次借出的智能体都没有历史上下文
+agent_pool = AgentPool()
+
+# 流式执行：产出有效结果JSON即停止，反思循环不收敛时提前截断；关闭时使用team.run并仅受消息数上限约束
+USE_STREAMING_RUN = True
+
+# 诊断团队池：图拓扑只编译一次，每个故障借出一个团队实例，归还时重置
+team_pool = DiagnosisTeamPool(
+    termination_factory=create_termination_condition if USE_STREAMING_RUN else (lambda: MaxMessageTermination(max_messages=20))
+)
 
 # def custom_selector_function(messages: Sequence[AgentEvent | ChatMessage]) -> str | None:
 #     if len(messages) <= 1:
@@ -36,116 +53,183 @@ termination = max_messages_termination
 #     elif messages[-1].source == reflection_agent.name:
 #         return orchestration_agent.name
 
-async def main():
-    input_path = os.path.join(project_root, 'input', 'input_timestamp.csv')
-    df_input_timestamp = pd.read_csv(input_path, encoding='utf-8')
-    
-    for index, row in df_input_timestamp.iterrows():
-
-        if index < 32:
-            continue
-
-        print(">>" * 100)
-        print(f"index: {index}")
-
-        start_timestamp = row['start_timestamp']
-        end_timestamp = row['end_timestamp']
-        start_time_hour = row['start_time_hour']
-        uuid = row['uuid']
-    
+async def diagnose_fault(df_input_timestamp: pd.DataFrame, index: int, row: pd.Series, journal: RunJournal,
+                         worker: str) -> OrderedDict:
+    """
+    处理单个故障：三个模态的数据提炼和多智能体诊断。各提炼阶段的产出记录到运行日志（同时续约），重试时直接复用
+
+    参数:
+        df_input_timestamp: 全部故障的输入数据
+        index: 故障序号
+        row: 故障对应的输入行
+        journal: 运行日志
+        worker: 持有该故障的worker标识
+
+    返回:
+        OrderedDict: 诊断结果
+    """
+    start_timestamp = row['start_timestamp']
+    end_timestamp = row['end_timestamp']
+    start_time_hour = row['start_time_hour']
+    uuid = row['uuid']
+
+    logs_done, refined_logs = journal.get_stage(uuid, 'logs')
+    if not logs_done:
         refined_logs = log_refinement(start_time_hour, start_timestamp, end_timestamp)
         if refined_logs is not None:
             print('//' * 20)
-            refined_logs = await logs_agent.run(task=f"请提炼出以下日志中对故障诊断最关键、最有价值的日志：\n{refined_logs}")
+            logs_task = f"请提炼出以下日志中对故障诊断最关键、最有价值的日志：\n{apply_modality_budget('log', refined_logs)}"
+            report_prompt_tokens('LogsAgent', logs_task)
+            async with agent_pool.acquire("LogsAgent") as logs_agent:
+                with span('agent.LogsAgent'):
+                    refined_logs = await logs_agent.run(task=logs_task)
             refined_logs = refined_logs.messages[-1].content
         else:
             refined_logs = None
-        print('logs refinement completed!')
+        if not journal.record_stage(uuid, 'logs', refined_logs, worker):
+            raise RuntimeError(f"故障 {uuid} 的租约已被其他worker接管，停止处理")
+    print('logs refinement completed!')
 
+    traces_done, refined_traces = journal.get_stage(uuid, 'traces')
+    if not traces_done:
         refined_traces, trace_unique_dict, status_combinations_csv = trace_refinement(start_time_hour, start_timestamp, end_timestamp)
         if refined_traces is not None or status_combinations_csv is not None:
             print('//' * 20)
-            refined_traces = await traces_agent.run(task=f"请提炼出以下trace中对故障诊断最关键、最有价值的traces：\n{refined_traces}\n{status_combinations_csv}")
+            # status组合与异常调用共享trace模态的预算，各占一半
+            trace_budget = MODALITY_TOKEN_BUDGETS['trace'] // 2
+            traces_task = (f"请提炼出以下trace中对故障诊断最关键、最有价值的traces：\n"
+                           f"{apply_modality_budget('trace', refined_traces, trace_budget)}\n"
+                           f"{trim_csv_to_budget(status_combinations_csv, trace_budget, rank_column='occurrence_count') if status_combinations_csv else status_combinations_csv}")
+            report_prompt_tokens('TracesAgent', traces_task)
+            async with agent_pool.acquire("TracesAgent") as traces_agent:
+                with span('agent.TracesAgent'):
+                    refined_traces = await traces_agent.run(task=traces_task)
             refined_traces = refined_traces.messages[-1].content
         else:
             refined_traces = None
-        print('traces refinement completed!')
+        if not journal.record_stage(uuid, 'traces', refined_traces, worker):
+            raise RuntimeError(f"故障 {uuid} 的租约已被其他worker接管，停止处理")
+    print('traces refinement completed!')
 
+    metrics_done, refined_metrics = journal.get_stage(uuid, 'metrics')
+    if not metrics_done:
         refined_metrics = await metric_refinement(df_input_timestamp, index, start_timestamp, end_timestamp)
         if refined_metrics is not None:
             print('//' * 20)
-            refined_metrics = await metrics_agent.run(task=f"请提炼出以下metrics中对故障诊断最关键、最有价值的metrics：{refined_metrics}")
+            metrics_task = f"请提炼出以下metrics中对故障诊断最关键、最有价值的metrics：{apply_modality_budget('metric', refined_metrics)}"
+            report_prompt_tokens('MetricsAgent', metrics_task)
+            async with agent_pool.acquire("MetricsAgent") as metrics_agent:
+                with span('agent.MetricsAgent'):
+                    refined_metrics = await metrics_agent.run(task=metrics_task)
             refined_metrics = refined_metrics.messages[-1].content
         else:
             refined_metrics = None
             # node_analysis_result = None
-        print('metrics refinement completed!')
-
-        multimodal_prompt = get_multimodal_analysis_prompt(
-            log_data=refined_logs ,
-            trace_data=refined_traces ,
-            metric_data=refined_metrics
-        )
-
-        builder = DiGraphBuilder()
-        builder.add_node(orchestration_agent)
-        builder.add_node(ad_agent).add_node(ft_agent).add_node(rcl_agent)
-        builder.add_node(reflection_agent).add_node(summarization_agent)
-
-        builder.add_edge(orchestration_agent, ad_agent)
-        builder.add_edge(orchestration_agent, ft_agent).add_edge(ad_agent, ft_agent)
-        builder.add_edge(orchestration_agent, rcl_agent).add_edge(ft_agent, rcl_agent)
-        builder.add_edge(ad_agent, reflection_agent).add_edge(ft_agent, reflection_agent).add_edge(rcl_agent, reflection_agent)
-        builder.add_edge(reflection_agent, orchestration_agent, condition=lambda msg: "APPROVE" not in msg.to_model_text())
-        builder.add_edge(reflection_agent, summarization_agent, condition=lambda msg: "APPROVE" in msg.to_model_text())
-
-        builder.set_entry_point(orchestration_agent)
-        graph = builder.build()
-
-        team = GraphFlow(
-            participants = [orchestration_agent, ad_agent, ft_agent, rcl_agent, reflection_agent, summarization_agent],
-            graph = graph,
-            termination_condition=termination,
-        )
-        await team.reset()
+        if not journal.record_stage(uuid, 'metrics', refined_metrics, worker):
+            raise RuntimeError(f"故障 {uuid} 的租约已被其他worker接管，停止处理")
+    print('metrics refinement completed!')
+
+    multimodal_prompt = get_multimodal_analysis_prompt(
+        log_data=refined_logs ,
+        trace_data=refined_traces ,
+        metric_data=refined_metrics
+    )
+
+    # 从团队池借出诊断团队，归还时重置，避免上下文跨故障累积
+    setup_start = time.perf_counter()
+    async with team_pool.acquire() as (team, agents):
+        print(f"诊断团队准备耗时: {(time.perf_counter() - setup_start) * 1000:.2f}毫秒")
+        summarization_agent = agents["summarizationAgent"]
 
         # await Console(team.run_stream(task=f"{multimodal_prompt}"))
-        respose = await team.run(task=f"{multimodal_prompt}")
+        with span('diagnosis.graphflow'):
+            if USE_STREAMING_RUN:
+                json_result, task_result, agent_stats = await run_team_streaming(team, f"{multimodal_prompt}")
+                if json_result is None:
+                    # 反思循环被截断或未走到总结节点时，由总结智能体基于最近的诊断结论直接给出结果
+                    print(f"未产出结果JSON（{task_result.stop_reason}），调用总结智能体生成结果")
+                    recent_messages = [m.to_model_text() for m in task_result.messages if isinstance(m, BaseChatMessage)][-3:]
+                    summary = await summarization_agent.run(task="\n".join(recent_messages))
+                    json_result = extract_result_json(summary.messages[-1].content)
+            else:
+                respose = await team.run(task=f"{multimodal_prompt}")
+                json_result = extract_result_json(respose.messages[-1].content)
+
+    # groupchat = SelectorGroupChat(
+    #     participants=[orchestration_agent, ad_agent, ft_agent, rcl_agent, reflection_agent],
+    #     model_client=model_client,
+    #     termination_condition=termination,
+    #     selector_func=custom_selector_function
+    # )
+    # groupchat.reset()
+    # await Console(groupchat.run_stream(task=f"{multimodal_prompt}"))
+
+    if json_result is None:
+        print("未能解析出结果JSON，输出空结果")
+        json_result = {}
+    result_data = OrderedDict()
+    result_data["component"] = json_result.get("component", "")
+    result_data["uuid"] = uuid
+    result_data["reason"] = json_result.get("reason", "")
+    result_data["reasoning_trace"] = json_result.get("reasoning_trace", [])
+    return result_data
 
-        result = re.search(r'(\{.*\})', respose.messages[-1].content, re.DOTALL)
-        if result:
-            result = result.group(1)
-        else:
-            result = None
-    
-        json_result = json.loads(result)
-        result_data = OrderedDict()
-        result_data["component"] = json_result.get("component", "")
-        result_data["uuid"] = uuid
-        result_data["reason"] = json_result.get("reason", "")
-        result_data["reasoning_trace"] = json_result.get("reasoning_trace", [])
-
-        result_list_path = os.path.join(project_root, 'output', 'results_list.json')
-        with open(result_list_path, 'a', encoding='utf-8') as f:
-            json.dump(result_data, f)   
-            f.write('\n')   
-        print(f"第{index+1}条数据处理完成")
-        # if counter != 0:
-        #     counter += 1
-        #     continue
-        # break
-
-        # groupchat = SelectorGroupChat(
-        #     participants=[orchestration_agent, ad_agent, ft_agent, rcl_agent, reflection_agent],
-        #     model_client=model_client,
-        #     termination_condition=termination,
-        #     selector_func=custom_selector_function
-        # )
-        # groupchat.reset()
-        # await Console(groupchat.run_stream(task=f"{multimodal_prompt}"))
 
+async def main():
+    parser = argparse.ArgumentParser(description='多智能体故障诊断批处理')
+    parser.add_argument('--journal', default=RUN_JOURNAL_PATH, help='运行日志路径，多个worker共享同一个日志即可分片协作')
+    parser.add_argument('--shard-index', type=int, default=0, help='当前worker的分片号')
+    parser.add_argument('--num-shards', type=int, default=1, help='分片总数')
+    args = parser.parse_args()
+
+    input_path = os.path.join(project_root, 'input', 'input_timestamp.csv')
+    df_input_timestamp = pd.read_csv(input_path, encoding='utf-8')
+    result_list_path = os.path.join(project_root, 'output', 'results_list.json')
+
+    # 运行日志记录每个故障的状态，崩溃后重新启动即可从断点续跑
+    journal = RunJournal(args.journal)
+    journal.register_faults(zip(df_input_timestamp.index, df_input_timestamp['uuid']))
+    imported = journal.import_results(result_list_path)
+    worker = default_worker_id(args.shard_index)
+    recovered = journal.recover_worker(worker)
+    print(f"运行日志: {journal.summary()}，导入已有结果{imported}条，恢复未完成故障{recovered}条")
+
+    while True:
+        claimed = journal.claim_next(worker, args.shard_index, args.num_shards)
+        if claimed is None:
+            wait_seconds = journal.seconds_until_retry(args.shard_index, args.num_shards)
+            if wait_seconds is None:
+                break
+            print(f"暂无可处理的故障，{wait_seconds:.0f}秒后重试")
+            await asyncio.sleep(wait_seconds)
+            continue
+
+        index, uuid = claimed
+        row = df_input_timestamp.loc[index]
+        print(">>" * 100)
+        print(f"index: {index}")
+
+        try:
+            with span_report(uuid) as report:
+                result_data = await diagnose_fault(df_input_timestamp, index, row, journal, worker)
+            print(format_summary(report))
+        except Exception as e:
+            status = journal.fail(uuid, worker, traceback.format_exc())
+            print(f"第{index+1}条数据处理失败（{status or '租约已被其他worker接管'}）: {e}")
+            continue
+
+        if not journal.complete(uuid, worker, result_data):
+            print(f"第{index+1}条数据的租约已被其他worker接管，本次结果未写入")
+            continue
+        journal.export_results(result_list_path)
+        print(f"第{index+1}条数据处理完成")
         print("<<" * 100)
 
+    print(f"运行结束: {journal.summary()}")
+    for item in get_registry().report():
+        print(f"模型 {item['name']}: 加载{item['loads']}次（最近一次耗时{item['load_seconds']:.2f}秒），复用{item['hits']}次")
+    journal.close()
+
 
 if __name__ == "__main__":
     asyncio.run(main())
\ No newline at end of file
@@ -0,0 +1,16 @@
+import os
+import sys
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.append(project_root)
+
+import pytest
+
+
+@pytest.fixture(scope='session')
+def workspace() -> str:
+    """
+    基准测试的合成数据工作区（首次使用时生成，之后复用），各数据处理模块在测试期间指向该工作区
+    """
+    from benchmarks.workspace import get_workspace
+    return get_workspace()
@@ -0,0 +1,47 @@
+"""
+dataRefinement/call_edge_registry.py 的调用边键和旧式键迁移
+"""
+import pandas as pd
+
+from dataRefinement.call_edge_registry import (CallEdgeRegistry, edge_key, legacy_name, migrate_legacy_keys,
+                                               parse_edge_key)
+
+# 两条不同的调用边拼接出相同的旧式键
+COLLIDING = [('a', 'b', 'n_1', 'op'), ('a', 'b', 'n', '1_op')]
+
+
+def test_colliding_edges_get_distinct_keys():
+    registry = CallEdgeRegistry(COLLIDING)
+    assert legacy_name(COLLIDING[0]) == legacy_name(COLLIDING[1])
+    keys = [registry.key(edge_id) for edge_id in range(len(registry))]
+    assert len(set(keys)) == 2
+    for edge_id, key in enumerate(keys):
+        assert parse_edge_key(key) == COLLIDING[edge_id]
+        assert registry.id_for_key(key) == edge_id
+
+
+def test_assign_skips_null_keys(tmp_path):
+    df = pd.DataFrame({'parent_pod': ['a', None, 'a'], 'child_pod': ['b', 'b', 'b'],
+                       'node_name': ['n', 'n', 'n'], 'operationName': ['op', 'op', 'op']})
+    registry = CallEdgeRegistry()
+    assert registry.assign(df).tolist() == [0, -1, 0]
+    path = str(tmp_path / 'call_edges.json')
+    registry.save(path)
+    assert CallEdgeRegistry.load(path).edges() == [('a', 'b', 'n', 'op')]
+
+
+def test_migrate_legacy_keys():
+    known = [('frontend-0', 'cartservice-1', 'aiops-k8s-05', 'hipstershop.CartService/GetCart')] + COLLIDING
+    mapping = {
+        legacy_name(known[0]): 1,
+        'frontend-1_adservice-0_aiops-k8s-01_get_ads': 2,  # 不在已知调用边中，按前三个字段拆分
+        legacy_name(COLLIDING[0]): 3,  # 有歧义，丢弃
+        edge_key(('x', 'y', 'z', 'w')): 4,
+    }
+    migrated = migrate_legacy_keys(mapping, known)
+    assert migrated == {
+        edge_key(known[0]): 1,
+        edge_key(('frontend-1', 'adservice-0', 'aiops-k8s-01', 'get_ads')): 2,
+        edge_key(('x', 'y', 'z', 'w')): 4,
+    }
+    assert migrate_legacy_keys(migrated, known) is migrated
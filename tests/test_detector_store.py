@@ -0,0 +1,63 @@
+"""
+dataRefinement/detector_store.py 的按组存储和文件头校验
+"""
+import os
+import pickle
+
+import pytest
+
+from dataRefinement import detector_store
+from dataRefinement.detector_store import DetectorStore, LazyDetectors
+
+
+class _Unpicklable:
+    """
+    反序列化时抛出异常，用于确认文件头不符时不会反序列化数据
+    """
+
+    def __reduce__(self):
+        return (_fail, ())
+
+
+def _fail():
+    raise AssertionError('不应反序列化')
+
+
+def test_put_get_and_replace(tmp_path):
+    store = DetectorStore(str(tmp_path / 'store'), create=True)
+    store.put('g1', {'dur_detector': [1, 2]}, {'mean': 1.0})
+    store.put('g1', {'dur_detector': [3]}, {'mean': 2.0})
+    assert store.get('g1') == {'dur_detector': [3]}
+    assert store.normal_stats() == {'g1': {'mean': 2.0}}
+    assert len(os.listdir(store.groups_dir)) == 1
+    assert store.get('missing') is None
+    detectors = LazyDetectors(store)
+    assert 'g1' in detectors and detectors['g1'] == {'dur_detector': [3]}
+    store.close()
+
+
+def test_header_checked_before_unpickling(tmp_path):
+    store = DetectorStore(str(tmp_path / 'store'), create=True)
+    store.put('g1', {'dur_detector': _Unpicklable()})
+    file = os.path.join(store.groups_dir, store._files['g1'])
+    with pytest.raises(ValueError):
+        detector_store._read_group_file(file, 'other')
+
+    # 旧格式（没有文件头）的文件同样在反序列化之前被拒绝
+    with open(file, 'wb') as f:
+        pickle.dump({'schema_version': 1, 'name': 'g1', 'detectors': _Unpicklable()}, f)
+    with pytest.raises(ValueError):
+        store.get('g1')
+    store.close()
+
+
+def test_incompatible_store_is_rebuilt(tmp_path, monkeypatch):
+    root = str(tmp_path / 'store')
+    monkeypatch.setattr(detector_store, 'DETECTOR_STORE_SCHEMA_VERSION', 1)
+    DetectorStore(root, create=True).close()
+    monkeypatch.undo()
+    with pytest.raises(ValueError):
+        DetectorStore(root)
+    assert detector_store.store_schema_version(root) == 1
+    DetectorStore(root, create=True).close()
+    assert detector_store.store_schema_version(root) == detector_store.DETECTOR_STORE_SCHEMA_VERSION
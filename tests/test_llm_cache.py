@@ -0,0 +1,111 @@
+"""
+agent/llm_cache.py 的响应存储（TTL过期、按条目数/字节数的LRU淘汰）和缓存包装器（命中、缓存键、在途请求合并）
+"""
+import asyncio
+
+import pytest
+from autogen_core.models import UserMessage
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+from agent import llm_cache
+from agent.llm_cache import CachedChatCompletionClient, SQLiteResponseStore
+from agent.mock_openai_server import start_mock_server
+
+MODEL_INFO = {"vision": False, "function_calling": True, "json_output": True, "family": "unknown", "structured_output": False}
+
+
+class _Clock:
+    def __init__(self, now: float = 1000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = _Clock()
+    monkeypatch.setattr(llm_cache.time, 'time', clock.time)
+    return clock
+
+
+@pytest.fixture
+def mock_server():
+    server, base_url = start_mock_server(latency=0.2, reply='ok')
+    yield server.RequestHandlerClass, base_url
+    server.shutdown()
+    server.server_close()
+
+
+def _client(base_url: str) -> CachedChatCompletionClient:
+    model_client = OpenAIChatCompletionClient(model="mock", base_url=base_url, api_key="test", max_retries=0,
+                                              model_info=MODEL_INFO)
+    return CachedChatCompletionClient(model_client, store=SQLiteResponseStore(':memory:'))
+
+
+def _messages(text: str = "hello"):
+    return [UserMessage(content=text, source="user")]
+
+
+def test_ttl_expiry(clock):
+    store = SQLiteResponseStore(':memory:', ttl_seconds=10, max_entries=None, max_bytes=None)
+    store.set('a', 'value')
+    clock.now += 5
+    assert store.get('a') == 'value'
+    clock.now += 6
+    assert store.get('a') is None
+    assert len(store) == 0
+
+
+def test_lru_eviction_by_entries(clock):
+    store = SQLiteResponseStore(':memory:', ttl_seconds=None, max_entries=2, max_bytes=None)
+    store.set('a', 'x')
+    clock.now += 1
+    store.set('b', 'x')
+    clock.now += 1
+    assert store.get('a') == 'x'  # a比b更近被访问
+    clock.now += 1
+    store.set('c', 'x')
+    assert store.get('b') is None
+    assert store.get('a') == 'x' and store.get('c') == 'x'
+
+
+def test_lru_eviction_by_bytes(clock):
+    store = SQLiteResponseStore(':memory:', ttl_seconds=None, max_entries=None, max_bytes=25)
+    for key in ('a', 'b', 'c'):
+        store.set(key, key * 10)
+        clock.now += 1
+    assert store.get('a') is None
+    assert store.get('b') == 'b' * 10 and store.get('c') == 'c' * 10
+
+
+def test_cache_hit_and_key(mock_server):
+    handler, base_url = mock_server
+
+    async def run():
+        client = _client(base_url)
+        first = await client.create(_messages())
+        second = await client.create(_messages())
+        await client.create(_messages(), tool_choice='none')
+        await client.create(_messages('other'))
+        return client, first, second
+
+    client, first, second = asyncio.run(run())
+    assert not first.cached and second.cached and second.content == 'ok'
+    # tool_choice和消息内容不同的请求不共用缓存
+    assert handler.request_count == 3
+    assert client.cache_stats()['hits'] == 1
+
+
+def test_inflight_requests_coalesced(mock_server):
+    handler, base_url = mock_server
+
+    async def run():
+        client = _client(base_url)
+        results = await asyncio.gather(*(client.create(_messages()) for _ in range(5)))
+        return client, results
+
+    client, results = asyncio.run(run())
+    assert handler.request_count == 1
+    assert all(result.content == 'ok' for result in results)
+    assert client.cache_stats()['coalesced'] == 4
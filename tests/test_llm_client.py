@@ -0,0 +1,153 @@
+"""
+agent/llm_client.py 在本地模拟服务（agent/mock_openai_server.py）上的限流、重试和并发测试
+"""
+import time
+import asyncio
+
+import openai
+import pytest
+from autogen_core.models import CreateResult, UserMessage
+from autogen_ext.models.openai import OpenAIChatCompletionClient
+
+from agent import llm_client
+from agent.llm_client import RateLimitedChatCompletionClient, RateLimiter, TokenBucket
+from agent.mock_openai_server import start_mock_server
+
+MODEL_INFO = {"vision": False, "function_calling": True, "json_output": True, "family": "unknown", "structured_output": False}
+
+
+@pytest.fixture
+def mock_server(request):
+    servers = []
+
+    def start(**kwargs):
+        server, base_url = start_mock_server(**kwargs)
+        servers.append(server)
+        return server.RequestHandlerClass, base_url
+
+    yield start
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+def _client(base_url: str, agent_name: str, **kwargs) -> RateLimitedChatCompletionClient:
+    model_client = OpenAIChatCompletionClient(model="mock", base_url=base_url, api_key="test", max_retries=0,
+                                              model_info=MODEL_INFO)
+    return RateLimitedChatCompletionClient(model_client, agent_name=agent_name, **kwargs)
+
+
+def _messages(text: str = "hello"):
+    return [UserMessage(content=text, source="user")]
+
+
+def test_retries_429_with_retry_after(mock_server):
+    handler, base_url = mock_server(fail_first=2, retry_after='0.2', reply='ok')
+
+    async def run():
+        client = _client(base_url, 'test_retry_after')
+        start = time.perf_counter()
+        result = await client.create(_messages())
+        return client, result, time.perf_counter() - start
+
+    client, result, elapsed = asyncio.run(run())
+    assert result.content == 'ok'
+    assert handler.request_count == 3
+    assert client.metrics.retries == 2
+    assert elapsed >= 0.4  # 两次重试都按Retry-After等待
+
+
+def test_gives_up_after_max_retries(mock_server):
+    handler, base_url = mock_server(fail_first=100, retry_after='0')
+    client = _client(base_url, 'test_give_up', max_retries=2)
+
+    with pytest.raises(openai.RateLimitError):
+        asyncio.run(client.create(_messages()))
+    assert handler.request_count == 3
+    assert client.metrics.retries == 2
+    assert client.metrics.failures == 1
+
+
+def test_concurrency_limit(mock_server):
+    handler, base_url = mock_server(latency=0.2)
+
+    async def run():
+        client = _client(base_url, 'test_concurrency', semaphore=asyncio.Semaphore(2))
+        await asyncio.gather(*(client.create(_messages()) for _ in range(6)))
+
+    asyncio.run(run())
+    assert handler.request_count == 6
+    assert handler.max_in_flight == 2
+
+
+def test_limiter_waits_when_bucket_is_empty(mock_server):
+    _, base_url = mock_server()
+
+    async def run():
+        limiter = RateLimiter(requests_per_minute=600)  # 每0.1秒补充一个请求令牌
+        client = _client(base_url, 'test_limiter_wait', limiter=limiter)
+        limiter.request_bucket.tokens = 0
+        limiter.request_bucket.updated_at = time.monotonic()
+        start = time.perf_counter()
+        for _ in range(3):
+            await client.create(_messages())
+        return client, time.perf_counter() - start
+
+    client, elapsed = asyncio.run(run())
+    # 3个请求令牌从空桶补充至少需要0.3秒，其中一部分与请求本身的耗时重叠
+    assert elapsed >= 0.28
+    assert client.metrics.total_wait >= 0.1
+
+
+def test_large_token_request_does_not_block_small_ones():
+    async def run():
+        bucket = TokenBucket(per_minute=600)
+        bucket.tokens = 5
+        large = asyncio.create_task(bucket.acquire(100))
+        await asyncio.sleep(0.01)
+        waited = await asyncio.wait_for(bucket.acquire(1), timeout=0.5)
+        large.cancel()
+        return waited
+
+    assert asyncio.run(run()) == 0.0
+
+
+def test_create_stream_over_sse(mock_server):
+    handler, base_url = mock_server(fail_first=1, retry_after='0', reply='streamed reply text')
+
+    async def run():
+        client = _client(base_url, 'test_stream')
+        chunks = [chunk async for chunk in client.create_stream(_messages())]
+        return client, chunks
+
+    client, chunks = asyncio.run(run())
+    assert isinstance(chunks[-1], CreateResult)
+    assert chunks[-1].content == 'streamed reply text'
+    assert ''.join(chunk for chunk in chunks[:-1] if isinstance(chunk, str)) == 'streamed reply text'
+    assert handler.request_count == 2
+    assert client.metrics.retries == 1
+
+
+def test_actual_usage_is_last_call(mock_server):
+    _, base_url = mock_server(reply='ok')
+
+    async def run():
+        client = _client(base_url, 'test_usage')
+        first = await client.create(_messages('a' * 10))
+        second = await client.create(_messages('b' * 40))
+        return client, first, second
+
+    client, first, second = asyncio.run(run())
+    assert client.actual_usage() == second.usage
+    assert client.total_usage().prompt_tokens == first.usage.prompt_tokens + second.usage.prompt_tokens
+    assert llm_client.get_agent_metrics()['test_usage']['prompt_tokens'] == client.total_usage().prompt_tokens
+
+
+def test_limits_are_created_per_event_loop():
+    assert not hasattr(llm_client, 'rate_limiter')
+
+    async def limits():
+        return llm_client.get_rate_limiter(), llm_client.get_concurrency_semaphore()
+
+    first, second = asyncio.run(limits()), asyncio.run(limits())
+    assert first[0] is not second[0] and first[1] is not second[1]
@@ -0,0 +1,142 @@
+"""
+dataRefinement/metric_baseline.py 的持久化在线基线与get_exact_metrics_stats在相同数据上的一致性
+"""
+import os
+
+import numpy as np
+import pandas as pd
+
+from dataRefinement import metric_baseline, metric_refinement
+from dataRefinement.metric_baseline import (
+    FAULT_COOLDOWN_NS, QUANTILES, MetricBaselineEngine, StreamingStats, load_fault_schedule, update_metric_baseline,
+)
+from dataRefinement.metric_rollup import _iter_sources
+from dataRefinement.quantile_sketch import SKETCH_K
+from dataRefinement.metric_refinement import get_exact_metrics_stats
+
+KLL_RANK_ERROR_BOUND = 3 * 1.65 / SKETCH_K
+MINUTE_NS = 60 * 1_000_000_000
+
+
+def _streaming_stats(values: np.ndarray, chunk_size: int) -> dict:
+    stats = StreamingStats()
+    for start in range(0, len(values), chunk_size):
+        stats.update(values[start:start + chunk_size])
+    return stats.to_stats()
+
+
+def _assert_stats_equal(actual: dict, expected: dict) -> None:
+    assert set(actual) == set(expected)
+    for key, value in expected.items():
+        assert np.isclose(actual[key], value, rtol=1e-9, atol=1e-12, equal_nan=True), (key, actual[key], value)
+
+
+def _assert_stats_close(actual: dict, values: np.ndarray) -> None:
+    """
+    矩统计精确一致，分位数在KLL秩误差范围内
+    """
+    expected = get_exact_metrics_stats(pd.DataFrame({'m': values}), ['m'])['m']
+    assert set(actual) == set(expected)
+    for key in ('count', 'mean', 'std', 'min', 'max', 'non_zero_ratio'):
+        assert np.isclose(actual[key], expected[key], rtol=1e-9, atol=1e-12, equal_nan=True), key
+    trimmed = np.sort(values)[1:-1] if len(values) > 2 else np.sort(values)
+    for q in QUANTILES:
+        rank = np.searchsorted(trimmed, actual[f"{q * 100:g}%"], side='right') / len(trimmed)
+        assert rank >= q - KLL_RANK_ERROR_BOUND - 1 / len(trimmed) and rank <= q + KLL_RANK_ERROR_BOUND + 1 / len(trimmed)
+
+
+def test_small_series_match_exact_stats():
+    rng = np.random.default_rng(0)
+    for size in (1, 2, 3, 5, 6, 50, SKETCH_K - 1):
+        values = np.where(rng.random(size) < 0.2, 0.0, rng.lognormal(size=size))
+        expected = get_exact_metrics_stats(pd.DataFrame({'m': values}), ['m'])['m']
+        for chunk_size in (1, 7, size):
+            _assert_stats_equal(_streaming_stats(values, chunk_size), expected)
+
+
+def test_large_series_moments_exact_quantiles_within_rank_error():
+    values = np.random.default_rng(1).gamma(2.0, size=20000)
+    _assert_stats_close(_streaming_stats(values, 997), values)
+
+
+def test_engine_routes_rows_to_baseline_and_fault():
+    rng = np.random.default_rng(2)
+    timestamps = np.arange(0, 120 * MINUTE_NS, 30 * 1_000_000_000)
+    df = pd.DataFrame({'timestamp_ns': timestamps, 'cpu': rng.normal(50, 5, len(timestamps)),
+                       'kubernetes_node': np.where(rng.random(len(timestamps)) < 0.5, 'node-1', 'node-2')})
+    fault_period = (45 * MINUTE_NS, 60 * MINUTE_NS)
+    in_fault = df['timestamp_ns'].between(*fault_period)
+    df.loc[in_fault, 'cpu'] += 30
+    in_cooldown = (df['timestamp_ns'] > fault_period[1]) & (df['timestamp_ns'] < fault_period[1] + FAULT_COOLDOWN_NS)
+
+    engine = MetricBaselineEngine()
+    engine.set_faults({'f': fault_period})
+    # 数据分多批、乱序到达
+    shuffled = df.sample(frac=1, random_state=0)
+    for rows in np.array_split(np.arange(len(shuffled)), 3):
+        engine.ingest_frame('node', shuffled.iloc[rows], ['cpu'], entity_column='kubernetes_node')
+
+    for node in ('node-1', 'node-2'):
+        rows = df['kubernetes_node'] == node
+        comparison = engine.compare('node', node, 'cpu', 'f')
+        _assert_stats_close(comparison['normal_stats'], df.loc[rows & ~in_fault & ~in_cooldown, 'cpu'].to_numpy())
+        _assert_stats_close(comparison['fault_stats'], df.loc[rows & in_fault, 'cpu'].to_numpy())
+        assert engine.for_fault('f').compare_scope('node')[(node, '')]['cpu'] == comparison
+
+
+def test_pod_analyzer_keeps_only_target_pods():
+    target_pod = metric_refinement.get_target_pods()[0]
+    engine = MetricBaselineEngine()
+    engine.set_faults({'f': (45 * MINUTE_NS, 60 * MINUTE_NS)})
+    for pod in (target_pod, 'kube-proxy-abcde'):
+        for minute, value in ((10, 1.0), (20, 1.0), (50, 5.0), (55, 5.0)):
+            engine.update('pod', pod, 'pod_cpu_usage', minute * MINUTE_NS, value, instance='node-1')
+    result = metric_refinement.analyze_pod_metrics('2025-06-06', [(0, 40 * MINUTE_NS)], (45 * MINUTE_NS, 60 * MINUTE_NS),
+                                                   engine.for_fault('f'))
+    assert list(result['node-1']) == [target_pod]
+
+
+def test_workspace_baseline_persisted_and_incremental(workspace, tmp_path):
+    faults = pd.read_csv(f"{workspace}/input/input_timestamp.csv")
+    schedule = load_fault_schedule(faults)
+    date = faults.iloc[1]['date']
+    fault_id = str(faults.iloc[1]['uuid'])
+    path = str(tmp_path / 'metric_baseline.pkl')
+
+    engine = update_metric_baseline([date], schedule, path=path)
+    assert engine.sources and os.path.exists(path)
+    saved_mtime = os.path.getmtime(path)
+    # 没有新到达的文件时不重新读取，也不重新保存
+    assert update_metric_baseline([date], schedule, path=path) is engine
+    assert engine.ingest_day(date) == 0
+    assert os.path.getmtime(path) == saved_mtime
+
+    # 从持久化文件加载后与内存中的基线一致
+    metric_baseline._engine_cache.clear()
+    loaded = update_metric_baseline([date], schedule, path=path)
+    assert loaded is not engine
+    for scope in ('service', 'tidb', 'node', 'pod'):
+        assert loaded.compare_scope(scope, fault_id) == engine.compare_scope(scope, fault_id)
+
+    # node基线等于当天全部非故障、非冷却期数据上的精确统计
+    scope, _, entity_column, _, (metric,), file_path = next(source for source in _iter_sources(date) if source[0] == 'node')
+    df = pd.read_parquet(file_path, columns=['timestamp_ns', entity_column, metric])
+    in_fault = np.zeros(len(df), dtype=bool)
+    excluded = np.zeros(len(df), dtype=bool)
+    for uuid, (start, end) in schedule.items():
+        in_period = df['timestamp_ns'].between(start, end).to_numpy()
+        excluded |= in_period | df['timestamp_ns'].between(end, end + FAULT_COOLDOWN_NS - 1).to_numpy()
+        if uuid == fault_id:
+            in_fault = in_period
+    for node, rows in df.groupby(entity_column).indices.items():
+        comparison = loaded.compare(scope, node, metric, fault_id)
+        values = df[metric].to_numpy(dtype=float)
+        _assert_stats_close(comparison['normal_stats'], values[np.setdiff1d(rows, np.flatnonzero(excluded))])
+        _assert_stats_close(comparison['fault_stats'], values[np.intersect1d(rows, np.flatnonzero(in_fault))])
+
+    # 故障时间表变化时重建
+    reduced = {uuid: period for uuid, period in schedule.items() if uuid != fault_id}
+    rebuilt = update_metric_baseline([date], reduced, path=path)
+    assert rebuilt is not loaded and rebuilt.faults == reduced
+    assert set(rebuilt.sources) == set(loaded.sources)
+    assert fault_id not in rebuilt.fault_stats
@@ -0,0 +1,57 @@
+"""
+dataRefinement/quantile_sketch.py 中KLL草图的秩误差
+"""
+import numpy as np
+
+from dataRefinement.quantile_sketch import PERCENTILES, SKETCH_K, KLLSketch, SketchStats
+
+QUANTILES = np.linspace(0.01, 0.99, 99)
+RANK_ERROR_BOUND = 3 * 1.65 / SKETCH_K  # 单次估计的秩误差约为1.65/k，取3倍留出余量
+
+
+def _rank_errors(sketch: KLLSketch, values: np.ndarray) -> np.ndarray:
+    sorted_values = np.sort(values)
+    estimates = sketch.quantiles(QUANTILES)
+    ranks = np.searchsorted(sorted_values, estimates, side='right') / len(values)
+    return np.abs(ranks - QUANTILES)
+
+
+def test_small_input_is_exact():
+    values = np.random.default_rng(0).normal(size=SKETCH_K - 1)
+    sketch = KLLSketch()
+    sketch.update(values)
+    np.testing.assert_array_equal(sketch.exact_values(), np.sort(values))
+
+
+def test_rank_error_bound():
+    rng = np.random.default_rng(1)
+    for values in (rng.normal(size=200000), rng.lognormal(sigma=2.0, size=200000), rng.integers(0, 50, size=200000).astype(float)):
+        sketch = KLLSketch()
+        for chunk in np.array_split(values, 37):
+            sketch.update(chunk)
+        assert sketch.count == len(values)
+        assert _rank_errors(sketch, values).max() <= RANK_ERROR_BOUND
+
+
+def test_merge_and_serialization_keep_bound():
+    rng = np.random.default_rng(2)
+    parts = [rng.exponential(scale=i + 1, size=30000) for i in range(8)]
+    merged = KLLSketch(seed=0)
+    for i, part in enumerate(parts):
+        sketch = KLLSketch(seed=i)
+        sketch.update(part)
+        merged.merge(KLLSketch.from_bytes(sketch.to_bytes()))
+    values = np.concatenate(parts)
+    assert merged.count == len(values)
+    assert _rank_errors(merged, values).max() <= RANK_ERROR_BOUND
+
+
+def test_sketch_stats_percentiles():
+    values = np.random.default_rng(3).gamma(2.0, size=100000)
+    stats = SketchStats.from_values(values).to_stats(trim=False)
+    assert stats['count'] == len(values)
+    assert np.isclose(stats['mean'], values.mean())
+    sorted_values = np.sort(values)
+    for q in PERCENTILES:
+        rank = np.searchsorted(sorted_values, stats[f"{q * 100:g}%"], side='right') / len(values)
+        assert abs(rank - q) <= RANK_ERROR_BOUND
@@ -0,0 +1,118 @@
+"""
+utils/run_journal.py 的领取、续跑和失败重试
+"""
+import time
+
+import pytest
+
+from utils import run_journal
+from utils.run_journal import RunJournal
+
+
+@pytest.fixture
+def journal(tmp_path):
+    journal = RunJournal(str(tmp_path / 'run_journal.sqlite'), max_attempts=2, retry_base_delay=0.2,
+                         retry_max_delay=0.2, lease_seconds=60)
+    journal.register_faults([(0, 'a'), (1, 'b'), (2, 'c')])
+    yield journal
+    journal.close()
+
+
+def test_claim_in_order_and_complete(journal):
+    assert journal.claim_next('w1') == (0, 'a')
+    assert journal.claim_next('w2') == (1, 'b')
+    assert journal.complete('a', 'w1', {'uuid': 'a'})
+    assert journal.claim_next('w1') == (2, 'c')
+    assert journal.claim_next('w1') is None
+    assert journal.summary() == {run_journal.STATUS_DONE: 1, run_journal.STATUS_RUNNING: 2}
+
+
+def test_claim_respects_shards(journal):
+    assert journal.claim_next('w', shard_index=1, num_shards=2) == (1, 'b')
+    assert journal.claim_next('w', shard_index=1, num_shards=2) is None
+    assert journal.claim_next('w', shard_index=0, num_shards=2) == (0, 'a')
+
+
+def test_fail_retries_with_backoff_then_gives_up(journal):
+    assert journal.claim_next('w', num_shards=3) == (0, 'a')
+    assert journal.fail('a', 'w', 'boom') == run_journal.STATUS_RETRY
+    # 退避期间不可领取
+    assert journal.claim_next('w', num_shards=3) is None
+    wait = journal.seconds_until_retry(num_shards=3)
+    assert 0 < wait <= 0.2
+    time.sleep(wait + 0.01)
+    assert journal.claim_next('w', num_shards=3) == (0, 'a')
+    assert journal.fail('a', 'w', 'boom again') == run_journal.STATUS_FAILED
+    assert journal.claim_next('w', num_shards=3) is None
+    assert journal.seconds_until_retry(num_shards=3) is None
+
+
+def test_recover_worker_and_stage_outputs(journal):
+    journal.claim_next('w1')
+    journal.record_stage('a', 'log', {'lines': 3})
+    assert journal.recover_worker('w1') == 1
+    assert journal.claim_next('w2') == (0, 'a')
+    assert journal.get_stage('a', 'log') == (True, {'lines': 3})
+    assert journal.get_stage('a', 'trace') == (False, None)
+
+
+def test_expired_lease_can_be_reclaimed(tmp_path):
+    journal = RunJournal(str(tmp_path / 'run_journal.sqlite'), lease_seconds=0.1)
+    journal.register_faults([(0, 'a')])
+    assert journal.claim_next('w1') == (0, 'a')
+    assert journal.claim_next('w2') is None
+    time.sleep(0.15)
+    assert journal.claim_next('w2') == (0, 'a')
+    journal.close()
+
+
+def test_only_lease_holder_can_finish(tmp_path):
+    journal = RunJournal(str(tmp_path / 'run_journal.sqlite'), lease_seconds=0.1)
+    journal.register_faults([(0, 'a')])
+    assert journal.claim_next('w1') == (0, 'a')
+    time.sleep(0.15)
+    assert journal.claim_next('w2') == (0, 'a')
+    # w1的租约已过期并被w2接管，w1的结果和失败记录都不写入
+    assert not journal.complete('a', 'w1', {'uuid': 'a', 'by': 'w1'})
+    assert journal.fail('a', 'w1', 'late failure') is None
+    assert not journal.renew_lease('a', 'w1')
+    assert journal.complete('a', 'w2', {'uuid': 'a', 'by': 'w2'})
+    assert journal.summary() == {run_journal.STATUS_DONE: 1}
+    journal.close()
+
+
+def test_record_stage_renews_lease(tmp_path):
+    journal = RunJournal(str(tmp_path / 'run_journal.sqlite'), lease_seconds=0.2)
+    journal.register_faults([(0, 'a')])
+    journal.claim_next('w1')
+    for stage in ('logs', 'traces', 'metrics'):
+        time.sleep(0.12)
+        journal.record_stage('a', stage, stage, 'w1')
+        # 每个阶段都续约，总耗时超过租约时长也不会被其他worker领取
+        assert journal.claim_next('w2') is None
+    assert journal.complete('a', 'w1', {'uuid': 'a'})
+    journal.close()
+
+
+def test_stale_worker_cannot_overwrite_stage(tmp_path):
+    journal = RunJournal(str(tmp_path / 'run_journal.sqlite'), lease_seconds=0.1)
+    journal.register_faults([(0, 'a')])
+    assert journal.claim_next('w1') == (0, 'a')
+    time.sleep(0.15)
+    assert journal.claim_next('w2') == (0, 'a')
+    assert journal.record_stage('a', 'logs', 'by w2', 'w2')
+    # w1的租约已被w2接管，w1的阶段产出不写入，也不续约
+    assert not journal.record_stage('a', 'logs', 'by w1', 'w1')
+    assert not journal.record_stage('a', 'traces', 'by w1', 'w1')
+    assert journal.get_stage('a', 'logs') == (True, 'by w2')
+    assert journal.get_stage('a', 'traces') == (False, None)
+    journal.close()
+
+
+def test_export_results(journal, tmp_path):
+    journal.claim_next('w')
+    journal.complete('a', 'w', {'uuid': 'a', 'reason': 'x'})
+    output_path = str(tmp_path / 'out' / 'result.jsonl')
+    assert journal.export_results(output_path) == 1
+    with open(output_path, encoding='utf-8') as f:
+        assert f.read() == '{"uuid": "a", "reason": "x"}\n'
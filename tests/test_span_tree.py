@@ -0,0 +1,87 @@
+"""
+dataRefinement/span_tree.py 与逐span暴力计算结果的对比
+"""
+import numpy as np
+import pandas as pd
+
+from benchmarks.bench_trace import _preprocess_traces
+from benchmarks.workspace import load_faults
+from dataRefinement import trace_refinement
+from dataRefinement.span_tree import annotate_span_tree
+from dataRefinement.window_reader import read_window
+
+
+def _reference(df: pd.DataFrame):
+    """
+    逐span求自身耗时和关键路径：子区间裁剪到父span区间后求并集，关键路径从最晚结束的子span往回走
+    """
+    rows = df.to_dict('records')
+    position = {}
+    for i, row in enumerate(rows):
+        position.setdefault((row['traceID'], row['spanID']), i)
+    parents = [position.get((row['traceID'], row['parent_spanID']), -1) for row in rows]
+    parents = [-1 if p == i else p for i, p in enumerate(parents)]
+    children = {}
+    for i, p in enumerate(parents):
+        if p >= 0:
+            children.setdefault(p, []).append(i)
+
+    self_times, selected = [], [False] * len(rows)
+    for i, row in enumerate(rows):
+        start, end = row['startTime'], row['startTime'] + row['duration']
+        intervals = sorted((min(max(rows[c]['startTime'], start), end),
+                            min(max(rows[c]['startTime'] + rows[c]['duration'], start), end), c)
+                           for c in children.get(i, []))
+        covered, until = 0, None
+        for a, b, _ in intervals:
+            if until is None or a > until:
+                covered, until = covered + b - a, b
+            elif b > until:
+                covered, until = covered + b - until, b
+        self_times.append(max(row['duration'] - covered, 0))
+
+        by_end = sorted(intervals, key=lambda interval: (interval[1], interval[0]))
+        current = len(by_end) - 1
+        while current >= 0:
+            selected[by_end[current][2]] = True
+            earlier = [k for k in range(current) if by_end[k][1] <= by_end[current][0]]
+            current = earlier[-1] if earlier else -1
+
+    on_path = []
+    for i in range(len(rows)):
+        ok, j = True, i
+        while parents[j] >= 0:
+            ok, j = ok and selected[j], parents[j]
+        on_path.append(ok)
+    return np.array(self_times), np.array(on_path)
+
+
+def _assert_matches_reference(df: pd.DataFrame) -> None:
+    annotate_span_tree(df)
+    self_times, on_path = _reference(df)
+    np.testing.assert_array_equal(df['self_time'].to_numpy(), self_times)
+    np.testing.assert_array_equal(df['on_critical_path'].to_numpy(), on_path)
+
+
+def test_small_tree():
+    # a的子调用b、c串行，d与c重叠；e是b的子调用；f的父span不在数据中，视为根
+    df = pd.DataFrame({
+        'traceID': ['t'] * 6,
+        'spanID': list('abcdef'),
+        'parent_spanID': [None, 'a', 'a', 'a', 'b', 'x'],
+        'startTime': [0, 10, 50, 55, 12, 0],
+        'duration': [100, 30, 40, 10, 5, 3],
+    })
+    annotate_span_tree(df)
+    assert df['child_time'].tolist() == [70, 5, 0, 0, 0, 0]
+    assert df['self_time'].tolist() == [30, 25, 40, 10, 5, 3]
+    assert df['on_critical_path'].tolist() == [True, True, True, False, True, True]
+    _assert_matches_reference(df)
+
+
+def test_workspace_traces(workspace):
+    for _, fault in load_faults(workspace).head(2).iterrows():
+        start, end = int(fault['start_timestamp']), int(fault['end_timestamp'])
+        df = _preprocess_traces(trace_refinement._filter_traces_by_timerange(start, end, read_window('trace', start, end)))
+        assert len(df) > 0
+        _assert_matches_reference(df)
@@ -0,0 +1,85 @@
+"""
+dataRefinement/trace_refinement.py 中向量化实现与逐行/逐窗口参考实现的对比
+"""
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from dataRefinement import trace_refinement
+from dataRefinement.call_edge_registry import EDGE_COLUMNS
+
+
+@pytest.fixture(scope='module')
+def merged_traces(workspace) -> pd.DataFrame:
+    return pd.read_parquet(os.path.join(workspace, 'dataRefinement', 'IsolationForest', 'merged_traces.parquet'))
+
+
+def _reference_normal_traces(sampled_df: pd.DataFrame, merged_df: pd.DataFrame, minutes_after: int):
+    """
+    逐样本筛选正常时段的数据并按调用边分组（向量化之前的实现）
+    """
+    groups = {}
+    for end_timestamp in sampled_df['end_timestamp']:
+        normal_df = merged_df[(merged_df['timestamp_ns'] >= end_timestamp) &
+                              (merged_df['timestamp_ns'] <= end_timestamp + minutes_after * 60 * 1000000000)]
+        for edge, call_df in normal_df.groupby(EDGE_COLUMNS):
+            groups.setdefault(edge, []).append(call_df)
+    return groups
+
+
+def _reference_windows(df: pd.DataFrame, win_size: int):
+    """
+    逐窗口筛选数据计算窗口特征（向量化之前的_slide_window，另加分位数和出错比例）
+    """
+    starts, features = [], []
+    errors = trace_refinement._error_flags(df)
+    i, time_max = df['timestamp_ns'].min(), df['timestamp_ns'].max()
+    while i < time_max:
+        mask = ((df['timestamp_ns'] >= i) & (df['timestamp_ns'] <= i + win_size)).to_numpy()
+        if mask.any():
+            durations = df['duration'].to_numpy(dtype=float)[mask]
+            starts.append(i)
+            features.append([mask.sum(), durations.mean(), np.quantile(durations, 0.5), np.quantile(durations, 0.99),
+                             errors[mask].mean()])
+        i += win_size
+    return np.array(starts, dtype=np.int64), np.array(features).reshape(-1, len(trace_refinement.WINDOW_FEATURES))
+
+
+def test_extract_normal_traces_matches_reference(merged_traces):
+    sampled = trace_refinement._sample_timestamp_data(trace_refinement.SAMPLE_SIZE, trace_refinement.RANDOM_SEED)
+    # 加入一个与第一个时段重叠的时段，并打乱输入的行顺序
+    overlapping = sampled.iloc[:1].assign(end_timestamp=sampled['end_timestamp'].iloc[0] + 10 * 60 * 1000000000)
+    sampled = pd.concat([sampled, overlapping], ignore_index=True)
+    merged = merged_traces.sample(frac=1.0, random_state=0)
+
+    normal_traces = trace_refinement._extract_normal_traces(sampled, merged, trace_refinement.MINUTES_AFTER)
+    reference = _reference_normal_traces(sampled, merged, trace_refinement.MINUTES_AFTER)
+
+    edges = [tuple(frames[0][EDGE_COLUMNS].iloc[0]) for frames in normal_traces.values()]
+    assert len(edges) > 0
+    assert edges == list(reference)
+    for edge, frames in zip(edges, normal_traces.values()):
+        expected = reference[edge]
+        assert [frame['spanID'].tolist() for frame in frames] == [frame['spanID'].tolist() for frame in expected]
+        for frame, expected_frame in zip(frames, expected):
+            np.testing.assert_array_equal(frame['is_error'].to_numpy(), trace_refinement._error_flags(expected_frame))
+
+
+def test_window_features_match_reference(merged_traces):
+    groups = [call_df for _, call_df in merged_traces.groupby(EDGE_COLUMNS)]
+    assert len(groups) > 0
+    for call_df in groups[:20]:
+        for seconds in trace_refinement.WINDOW_RESOLUTIONS_SECONDS:
+            win_size = seconds * 1000000000
+            starts, features = trace_refinement._window_features(call_df, win_size)
+            expected_starts, expected_features = _reference_windows(call_df, win_size)
+            np.testing.assert_array_equal(starts, expected_starts)
+            np.testing.assert_allclose(features, expected_features, rtol=1e-9, atol=1e-9)
+
+        # _slide_window保持原来的返回值：窗口开始时间和窗口平均duration
+        mean_starts, means = trace_refinement._slide_window(call_df, trace_refinement.WIN_SIZE_NS)
+        expected_starts, expected_features = _reference_windows(call_df, trace_refinement.WIN_SIZE_NS)
+        np.testing.assert_array_equal(mean_starts, expected_starts)
+        np.testing.assert_allclose(means, expected_features[:, trace_refinement.MEAN_FEATURE], rtol=1e-9, atol=1e-9)
@@ -0,0 +1,181 @@
+"""
+分级、限流的结构化日志
+
+替代热点循环中的逐条print：
+    - 分级：DEBUG/INFO/WARNING/ERROR，低于当前级别的调用只做一次整数比较就返回，
+      消息模板在真正输出时才格式化；构造参数本身有开销的地方用 logger.debug_enabled 判断后再调用
+    - 按调用点（消息模板）采样和限流：sample_every=N时每N次输出1次，另有每个调用点的令牌桶限流，
+      被丢弃的条数记入汇总
+    - 汇总计数：循环中用 count() 累加计数，循环结束后 summary() 一次性输出计数和各调用点被抑制的条数
+输出格式由 LOG_FORMAT 控制：'text' 与原来的print输出一致，'json' 每条一行JSON，便于日志采集
+"""
+import os
+import sys
+import json
+import time
+import threading
+from collections import Counter
+from typing import Any, Dict, Optional, Union
+
+# ========== 日志配置 ==========
+DEBUG, INFO, WARNING, ERROR = 10, 20, 30, 40
+LOG_LEVEL = os.environ.get('LOG_LEVEL', 'INFO')  # 默认级别，可用环境变量覆盖
+LOG_FORMAT = os.environ.get('LOG_FORMAT', 'text')  # 'text' 或 'json'
+LOG_RATE_PER_SITE = 5.0  # 每个调用点每秒最多输出条数
+LOG_BURST_PER_SITE = 20  # 每个调用点允许的突发条数
+
+_LEVEL_NAMES = {DEBUG: 'DEBUG', INFO: 'INFO', WARNING: 'WARNING', ERROR: 'ERROR'}
+_LEVEL_VALUES = {name: value for value, name in _LEVEL_NAMES.items()}
+
+
+def _parse_level(level: Union[int, str]) -> int:
+    if isinstance(level, int):
+        return level
+    return _LEVEL_VALUES.get(level.upper(), INFO)
+
+
+class _Site:
+    """
+    一个调用点的采样与限流状态
+    """
+    __slots__ = ('sample_every', 'calls', 'tokens', 'updated', 'suppressed')
+
+    def __init__(self, sample_every: int):
+        self.sample_every = max(1, int(sample_every))
+        self.calls = 0
+        self.tokens = float(LOG_BURST_PER_SITE)
+        self.updated = time.monotonic()
+        self.suppressed = 0
+
+    def allow(self) -> bool:
+        self.calls += 1
+        if self.sample_every > 1 and (self.calls - 1) % self.sample_every:
+            self.suppressed += 1
+            return False
+        now = time.monotonic()
+        self.tokens = min(float(LOG_BURST_PER_SITE), self.tokens + (now - self.updated) * LOG_RATE_PER_SITE)
+        self.updated = now
+        if self.tokens < 1.0:
+            self.suppressed += 1
+            return False
+        self.tokens -= 1.0
+        return True
+
+
+class StructuredLogger:
+    """
+    带级别、按调用点采样限流和汇总计数的日志器
+    """
+
+    def __init__(self, name: str, level: Union[int, str, None] = None):
+        self.name = name
+        self.counters: Counter = Counter()
+        self._sites: Dict[str, _Site] = {}
+        self._lock = threading.Lock()
+        self.set_level(LOG_LEVEL if level is None else level)
+
+    def set_level(self, level: Union[int, str]) -> None:
+        self.level = _parse_level(level)
+        self.debug_enabled = self.level <= DEBUG
+        self.info_enabled = self.level <= INFO
+
+    def is_enabled(self, level: int) -> bool:
+        return level >= self.level
+
+    def log(self, level: int, message: str, sample_every: int = 1, **fields: Any) -> None:
+        """
+        输出一条日志
+
+        参数:
+            level: 级别
+            message: 消息模板，用 {字段名} 引用fields；同一模板视为同一调用点
+            sample_every: 该调用点每N次输出1次（首次调用时确定）
+            fields: 结构化字段
+        """
+        if level < self.level:
+            return
+        with self._lock:
+            site = self._sites.get(message)
+            if site is None:
+                site = self._sites[message] = _Site(sample_every)
+            if not site.allow():
+                return
+        self._emit(level, message, fields)
+
+    def debug(self, message: str, sample_every: int = 1, **fields: Any) -> None:
+        if self.level <= DEBUG:
+            self.log(DEBUG, message, sample_every, **fields)
+
+    def info(self, message: str, sample_every: int = 1, **fields: Any) -> None:
+        if self.level <= INFO:
+            self.log(INFO, message, sample_every, **fields)
+
+    def warning(self, message: str, sample_every: int = 1, **fields: Any) -> None:
+        if self.level <= WARNING:
+            self.log(WARNING, message, sample_every, **fields)
+
+    def error(self, message: str, sample_every: int = 1, **fields: Any) -> None:
+        if self.level <= ERROR:
+            self.log(ERROR, message, sample_every, **fields)
+
+    def count(self, key: str, n: int = 1) -> None:
+        """
+        累加汇总计数，与级别无关
+        """
+        self.counters[key] += n
+
+    def summary(self, title: str, level: int = INFO, reset: bool = True) -> Dict[str, int]:
+        """
+        输出汇总计数和各调用点被采样/限流丢弃的条数
+
+        参数:
+            title: 汇总标题
+            level: 汇总的输出级别
+            reset: 输出后是否清空计数
+
+        返回:
+            Dict[str, int]: 汇总计数
+        """
+        with self._lock:
+            counters = dict(self.counters)
+            suppressed = {message: site.suppressed for message, site in self._sites.items() if site.suppressed}
+            if reset:
+                self.counters.clear()
+                self._sites.clear()
+        if level >= self.level and (counters or suppressed):
+            text = '，'.join(f"{key}: {value}" for key, value in counters.items())
+            self._emit(level, f"{title} {text}" if text else title, {'counters': counters, 'suppressed': suppressed}, formatted=True)
+            for message, n in suppressed.items():
+                self._emit(level, f"  已抑制 {n} 条: {message}", {}, formatted=True)
+        return counters
+
+    def _emit(self, level: int, message: str, fields: Dict[str, Any], formatted: bool = False) -> None:
+        text = message if formatted or not fields else message.format(**fields)
+        if LOG_FORMAT == 'json':
+            record = {'ts': round(time.time(), 3), 'level': _LEVEL_NAMES.get(level, str(level)),
+                      'logger': self.name, 'msg': text}
+            if not formatted:
+                record['event'] = message
+            record.update(fields)
+            sys.stdout.write(json.dumps(record, ensure_ascii=False, default=str) + '\n')
+        else:
+            sys.stdout.write(text + '\n')
+
+
+_loggers: Dict[str, StructuredLogger] = {}
+
+
+def get_logger(name: str, level: Optional[Union[int, str]] = None) -> StructuredLogger:
+    """
+    获取（或创建）指定名称的日志器
+
+    参数:
+        name: 日志器名称，通常为模块名
+        level: 级别，None表示使用LOG_LEVEL
+    """
+    logger = _loggers.get(name)
+    if logger is None:
+        logger = _loggers[name] = StructuredLogger(name, level)
+    elif level is not None:
+        logger.set_level(level)
+    return logger
@@ -0,0 +1,326 @@
+"""
+批处理运行日志（run journal）
+
+用SQLite记录每个故障（uuid）及其各阶段（日志/trace/指标提炼、诊断）的状态和产出，支持：
+    - 进程崩溃后自动续跑：已完成的故障跳过，已完成的阶段直接复用产出
+    - 失败重试：按指数退避安排下次尝试，超过最大尝试次数后标记为最终失败
+    - 原子写结果：结果先写入日志，再以临时文件+fsync+rename的方式整体导出
+    - 分片：按 fault_index % num_shards 把故障分给多个worker进程，多个进程可共享同一个日志文件
+"""
+import os
+import json
+import time
+import random
+import socket
+import sqlite3
+from typing import Any, Dict, Iterable, Optional, Tuple
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ========== 运行日志配置 ==========
+RUN_JOURNAL_PATH = os.path.join(project_root, 'output', 'run_journal.sqlite')
+MAX_ATTEMPTS = 3  # 每个故障最多尝试次数
+RETRY_BASE_DELAY = 30.0  # 重试退避基数（秒）
+RETRY_MAX_DELAY = 600.0  # 重试退避上限（秒）
+LEASE_SECONDS = 3600.0  # 故障被领取后的租约时长，每完成一个阶段续约一次，超时未续约视为worker已崩溃，可被重新领取
+
+# 故障状态
+STATUS_PENDING = 'pending'
+STATUS_RUNNING = 'running'
+STATUS_RETRY = 'retry'
+STATUS_DONE = 'done'
+STATUS_FAILED = 'failed'
+
+
+def default_worker_id(shard_index: int = 0) -> str:
+    """
+    生成worker标识：主机名+分片号，同一分片重启后可以认领自己崩溃前未完成的故障
+    """
+    return f"{socket.gethostname()}-shard{shard_index}"
+
+
+class RunJournal:
+    """
+    基于SQLite的运行日志，多进程共享时依赖SQLite的文件锁保证领取故障的原子性
+    """
+
+    def __init__(self, db_path: str = RUN_JOURNAL_PATH, max_attempts: int = MAX_ATTEMPTS,
+                 retry_base_delay: float = RETRY_BASE_DELAY, retry_max_delay: float = RETRY_MAX_DELAY,
+                 lease_seconds: float = LEASE_SECONDS):
+        """
+        参数:
+            db_path: SQLite文件路径
+            max_attempts: 每个故障最多尝试次数
+            retry_base_delay: 重试退避基数（秒）
+            retry_max_delay: 重试退避上限（秒）
+            lease_seconds: 领取租约时长（秒）
+        """
+        self.db_path = db_path
+        self.max_attempts = max_attempts
+        self.retry_base_delay = retry_base_delay
+        self.retry_max_delay = retry_max_delay
+        self.lease_seconds = lease_seconds
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+        self._conn = sqlite3.connect(db_path, timeout=60, isolation_level=None)
+        self._conn.execute('PRAGMA journal_mode=WAL')
+        self._conn.execute('PRAGMA synchronous=FULL')
+        self._conn.executescript("""
+            CREATE TABLE IF NOT EXISTS faults (
+                uuid TEXT PRIMARY KEY,
+                fault_index INTEGER NOT NULL,
+                status TEXT NOT NULL,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                next_attempt_at REAL NOT NULL DEFAULT 0,
+                lease_expires_at REAL NOT NULL DEFAULT 0,
+                worker TEXT,
+                last_error TEXT,
+                result TEXT,
+                updated_at REAL NOT NULL
+            );
+            CREATE INDEX IF NOT EXISTS idx_faults_status ON faults(status, fault_index);
+            CREATE TABLE IF NOT EXISTS stages (
+                uuid TEXT NOT NULL,
+                stage TEXT NOT NULL,
+                output TEXT,
+                finished_at REAL NOT NULL,
+                PRIMARY KEY (uuid, stage)
+            );
+        """)
+
+    def close(self) -> None:
+        self._conn.close()
+
+    def register_faults(self, faults: Iterable[Tuple[int, str]]) -> None:
+        """
+        登记故障，已登记的故障保持原状态
+
+        参数:
+            faults: (fault_index, uuid) 序列
+        """
+        now = time.time()
+        with self._conn:
+            self._conn.executemany(
+                "INSERT OR IGNORE INTO faults (uuid, fault_index, status, updated_at) VALUES (?, ?, ?, ?)",
+                [(uuid, int(fault_index), STATUS_PENDING, now) for fault_index, uuid in faults]
+            )
+
+    def recover_worker(self, worker: str) -> int:
+        """
+        worker重启时，把它崩溃前处于running状态的故障放回待处理队列（不计入失败次数）
+
+        返回:
+            int: 恢复的故障数
+        """
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE faults SET status = ?, attempts = MAX(attempts - 1, 0), worker = NULL, updated_at = ? "
+                "WHERE status = ? AND worker = ?",
+                (STATUS_PENDING, time.time(), STATUS_RUNNING, worker)
+            )
+        return cursor.rowcount
+
+    def claim_next(self, worker: str, shard_index: int = 0, num_shards: int = 1) -> Optional[Tuple[int, str]]:
+        """
+        原子地领取本分片中下一个可处理的故障：待处理、已到重试时间、或租约已过期的running故障
+
+        参数:
+            worker: worker标识
+            shard_index: 分片号
+            num_shards: 分片总数
+
+        返回:
+            Optional[Tuple[int, str]]: (fault_index, uuid)，当前没有可领取的故障时返回None
+        """
+        now = time.time()
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = self._conn.execute(
+                "SELECT fault_index, uuid FROM faults "
+                "WHERE fault_index % ? = ? AND ("
+                "  status = ? OR (status = ? AND next_attempt_at <= ?) OR (status = ? AND lease_expires_at <= ?)"
+                ") ORDER BY fault_index LIMIT 1",
+                (num_shards, shard_index, STATUS_PENDING, STATUS_RETRY, now, STATUS_RUNNING, now)
+            ).fetchone()
+            if row is not None:
+                self._conn.execute(
+                    "UPDATE faults SET status = ?, attempts = attempts + 1, worker = ?, lease_expires_at = ?, updated_at = ? "
+                    "WHERE uuid = ?",
+                    (STATUS_RUNNING, worker, now + self.lease_seconds, now, row[1])
+                )
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return row
+
+    def seconds_until_retry(self, shard_index: int = 0, num_shards: int = 1) -> Optional[float]:
+        """
+        本分片中最早一个等待重试（或被其他worker占用）的故障还需等待的秒数
+
+        返回:
+            Optional[float]: 等待秒数，本分片没有未完成的故障时返回None
+        """
+        row = self._conn.execute(
+            "SELECT MIN(CASE WHEN status = ? THEN next_attempt_at ELSE lease_expires_at END) FROM faults "
+            "WHERE fault_index % ? = ? AND status IN (?, ?)",
+            (STATUS_RETRY, num_shards, shard_index, STATUS_RETRY, STATUS_RUNNING)
+        ).fetchone()
+        if row[0] is None:
+            return None
+        return max(row[0] - time.time(), 0.0)
+
+    def get_stage(self, uuid: str, stage: str) -> Tuple[bool, Any]:
+        """
+        读取已完成阶段的产出
+
+        返回:
+            Tuple[bool, Any]: (是否已完成, 产出)，产出可以为None
+        """
+        row = self._conn.execute("SELECT output FROM stages WHERE uuid = ? AND stage = ?", (uuid, stage)).fetchone()
+        if row is None:
+            return False, None
+        return True, json.loads(row[0])
+
+    def renew_lease(self, uuid: str, worker: str) -> bool:
+        """
+        延长worker持有的故障租约（从现在起再延长lease_seconds），长时间运行的故障在每个阶段完成时续约
+
+        返回:
+            bool: 是否仍由该worker持有；租约已过期并被其他worker领取时返回False
+        """
+        now = time.time()
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE faults SET lease_expires_at = ?, updated_at = ? WHERE uuid = ? AND status = ? AND worker = ?",
+                (now + self.lease_seconds, now, uuid, STATUS_RUNNING, worker)
+            )
+        return cursor.rowcount > 0
+
+    def record_stage(self, uuid: str, stage: str, output: Any, worker: Optional[str] = None) -> bool:
+        """
+        记录阶段产出（需可JSON序列化），续跑时直接复用。传入worker时只有仍持有该故障的worker可以写入，
+        持有权检查、写入和续约在同一个事务中完成
+
+        返回:
+            bool: 是否写入；租约已过期并被其他worker领取时返回False，已记录的产出不会被覆盖
+        """
+        now = time.time()
+        output_json = json.dumps(output, ensure_ascii=False)
+        if worker is None:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO stages (uuid, stage, output, finished_at) VALUES (?, ?, ?, ?)",
+                (uuid, stage, output_json, now)
+            )
+            return True
+
+        self._conn.execute('BEGIN IMMEDIATE')
+        try:
+            cursor = self._conn.execute(
+                "INSERT OR REPLACE INTO stages (uuid, stage, output, finished_at) SELECT ?, ?, ?, ? "
+                "WHERE EXISTS (SELECT 1 FROM faults WHERE uuid = ? AND status = ? AND worker = ?)",
+                (uuid, stage, output_json, now, uuid, STATUS_RUNNING, worker)
+            )
+            recorded = cursor.rowcount > 0
+            if recorded:
+                self._conn.execute(
+                    "UPDATE faults SET lease_expires_at = ?, updated_at = ? WHERE uuid = ?",
+                    (now + self.lease_seconds, now, uuid)
+                )
+            self._conn.execute('COMMIT')
+        except BaseException:
+            self._conn.execute('ROLLBACK')
+            raise
+        return recorded
+
+    def complete(self, uuid: str, worker: str, result: Dict[str, Any]) -> bool:
+        """
+        标记故障完成并保存结果，只有仍持有该故障的worker可以写入
+
+        返回:
+            bool: 是否写入；租约已过期并被其他worker领取时返回False
+        """
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE faults SET status = ?, result = ?, last_error = NULL, updated_at = ? WHERE uuid = ? AND worker = ?",
+                (STATUS_DONE, json.dumps(result, ensure_ascii=False), time.time(), uuid, worker)
+            )
+        return cursor.rowcount > 0
+
+    def fail(self, uuid: str, worker: str, error: str) -> Optional[str]:
+        """
+        记录故障失败：未超过最大尝试次数时按指数退避（带抖动）安排重试，否则标记为最终失败。
+        只有仍持有该故障的worker可以写入
+
+        返回:
+            Optional[str]: 更新后的状态（retry或failed），故障已被其他worker领取时返回None
+        """
+        row = self._conn.execute("SELECT attempts FROM faults WHERE uuid = ? AND worker = ?", (uuid, worker)).fetchone()
+        if row is None:
+            return None
+        attempts = row[0]
+        now = time.time()
+        if attempts >= self.max_attempts:
+            status, next_attempt_at = STATUS_FAILED, 0.0
+        else:
+            delay = min(self.retry_base_delay * (2 ** (attempts - 1)), self.retry_max_delay)
+            status, next_attempt_at = STATUS_RETRY, now + random.uniform(delay / 2, delay)
+        with self._conn:
+            cursor = self._conn.execute(
+                "UPDATE faults SET status = ?, next_attempt_at = ?, last_error = ?, worker = NULL, updated_at = ? "
+                "WHERE uuid = ? AND worker = ?",
+                (status, next_attempt_at, error, now, uuid, worker)
+            )
+        return status if cursor.rowcount > 0 else None
+
+    def import_results(self, output_path: str) -> int:
+        """
+        把已有结果文件中的故障标记为完成，用于从旧的追加写结果文件迁移到运行日志
+
+        返回:
+            int: 新标记为完成的故障数
+        """
+        if not os.path.exists(output_path):
+            return 0
+        imported = 0
+        with open(output_path, 'r', encoding='utf-8') as f:
+            lines = [line for line in f if line.strip()]
+        with self._conn:
+            for line in lines:
+                try:
+                    result = json.loads(line)
+                except json.JSONDecodeError:
+                    continue
+                cursor = self._conn.execute(
+                    "UPDATE faults SET status = ?, result = ?, updated_at = ? WHERE uuid = ? AND status != ?",
+                    (STATUS_DONE, json.dumps(result, ensure_ascii=False), time.time(), result.get('uuid'), STATUS_DONE)
+                )
+                imported += cursor.rowcount
+        return imported
+
+    def export_results(self, output_path: str) -> int:
+        """
+        把所有已完成故障的结果按故障顺序导出为JSON Lines，先写临时文件并fsync，再原子替换目标文件，
+        多个worker并发导出时目标文件始终是某一次完整导出的内容
+
+        返回:
+            int: 导出的结果条数
+        """
+        rows = self._conn.execute(
+            "SELECT result FROM faults WHERE status = ? ORDER BY fault_index", (STATUS_DONE,)
+        ).fetchall()
+        os.makedirs(os.path.dirname(output_path), exist_ok=True)
+        tmp_path = f"{output_path}.{os.getpid()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            for (result,) in rows:
+                json.dump(json.loads(result), f)
+                f.write('\n')
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, output_path)
+        return len(rows)
+
+    def summary(self) -> Dict[str, int]:
+        """
+        各状态的故障数
+        """
+        return dict(self._conn.execute("SELECT status, COUNT(*) FROM faults GROUP BY status").fetchall())
@@ -0,0 +1,298 @@
+"""
+流水线各阶段的耗时与数据量追踪（span）
+
+用上下文管理器 span() 或装饰器 traced() 包住一个阶段（文件定位、parquet读取、过滤、字段提取、Drain、
+IsolationForest、各指标分析器、每次智能体调用、GraphFlow诊断等），记录墙钟时间、CPU时间、
+输入/输出行数和读取字节数，父子关系通过contextvars传递（asyncio任务和绑定了上下文的线程池任务都能正确嵌套）。
+
+每个故障用 span_report() 收集一份报告：结束时按阶段汇总并追加到JSONL文件，可选导出Chrome trace格式
+（chrome://tracing 或 https://ui.perfetto.dev 打开即为火焰图视图）。没有活动报告时span为空操作，开销可忽略。
+CPU时间取当前线程的thread_time，协程中的span会包含同一事件循环上其他任务的CPU时间
+"""
+import os
+import json
+import time
+import inspect
+import functools
+import threading
+import contextvars
+from contextlib import contextmanager
+from dataclasses import asdict, dataclass, field
+from typing import Any, Callable, Dict, Iterator, List, Optional
+
+project_root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# ========== 阶段追踪配置 ==========
+SPAN_TRACING_ENABLED = True
+SPAN_REPORT_PATH = os.path.join(project_root, 'output', 'span_reports.jsonl')  # 每个故障一行
+CHROME_TRACE_DIR = os.path.join(project_root, 'output', 'chrome_traces')
+EXPORT_CHROME_TRACE = False  # 是否为每个故障额外导出Chrome trace文件
+
+
+@dataclass
+class Span:
+    """
+    一个阶段的追踪记录，时间单位为毫秒，start_ms相对报告开始时间
+    """
+    name: str
+    span_id: int
+    parent_id: Optional[int] = None
+    start_ms: float = 0.0
+    wall_ms: float = 0.0
+    cpu_ms: float = 0.0
+    rows_in: Optional[int] = None
+    rows_out: Optional[int] = None
+    bytes_read: Optional[int] = None
+    thread_id: int = 0
+    error: Optional[str] = None
+    attrs: Dict[str, Any] = field(default_factory=dict)
+
+    def set(self, **values: Any) -> None:
+        """
+        设置rows_in/rows_out/bytes_read或其他自定义属性
+        """
+        for key, value in values.items():
+            if key in ('rows_in', 'rows_out', 'bytes_read'):
+                setattr(self, key, None if value is None else int(value))
+            else:
+                self.attrs[key] = value
+
+
+class _NullSpan(Span):
+    """
+    未启用追踪时返回的空span，忽略所有设置
+    """
+
+    def set(self, **values: Any) -> None:
+        pass
+
+
+_NULL_SPAN = _NullSpan(name='', span_id=0)
+
+
+class SpanReport:
+    """
+    一个故障（或一次运行）的全部span
+    """
+
+    def __init__(self, report_id: str):
+        self.report_id = report_id
+        self.started_at = time.time()
+        self.start_ns = time.perf_counter_ns()
+        self.spans: List[Span] = []
+        self._next_id = 1
+        self._lock = threading.Lock()
+
+    def _new_span(self, name: str, parent: Optional[Span], attrs: Dict[str, Any]) -> Span:
+        with self._lock:
+            span_id = self._next_id
+            self._next_id += 1
+        return Span(name=name, span_id=span_id, parent_id=parent.span_id if parent else None,
+                    start_ms=(time.perf_counter_ns() - self.start_ns) / 1e6,
+                    thread_id=threading.get_ident(), attrs=dict(attrs))
+
+    def _finish(self, span: Span) -> None:
+        with self._lock:
+            self.spans.append(span)
+
+    def summary(self) -> Dict[str, Dict[str, float]]:
+        """
+        按阶段名汇总：次数、墙钟/CPU时间、行数和字节数之和
+        """
+        result: Dict[str, Dict[str, float]] = {}
+        for span in sorted(self.spans, key=lambda s: s.start_ms):
+            item = result.setdefault(span.name, {'count': 0, 'wall_ms': 0.0, 'cpu_ms': 0.0,
+                                                 'rows_in': 0, 'rows_out': 0, 'bytes_read': 0})
+            item['count'] += 1
+            item['wall_ms'] += span.wall_ms
+            item['cpu_ms'] += span.cpu_ms
+            for key in ('rows_in', 'rows_out', 'bytes_read'):
+                item[key] += getattr(span, key) or 0
+        for item in result.values():
+            item['wall_ms'] = round(item['wall_ms'], 3)
+            item['cpu_ms'] = round(item['cpu_ms'], 3)
+        return result
+
+    def to_record(self) -> Dict[str, Any]:
+        return {
+            'report_id': self.report_id,
+            'started_at': self.started_at,
+            'wall_ms': round((time.perf_counter_ns() - self.start_ns) / 1e6, 3),
+            'summary': self.summary(),
+            'spans': [asdict(span) for span in sorted(self.spans, key=lambda s: s.start_ms)],
+        }
+
+    def write_jsonl(self, path: str = SPAN_REPORT_PATH) -> None:
+        """
+        把报告追加为JSONL文件中的一行
+        """
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'a', encoding='utf-8') as f:
+            f.write(json.dumps(self.to_record(), ensure_ascii=False, default=str) + '\n')
+
+    def export_chrome_trace(self, path: Optional[str] = None) -> str:
+        """
+        导出Chrome trace事件格式（完整事件"X"，时间单位为微秒）
+
+        返回:
+            str: 导出的文件路径
+        """
+        path = path or os.path.join(CHROME_TRACE_DIR, f'{self.report_id}.json')
+        threads = {thread_id: i for i, thread_id in enumerate(sorted({s.thread_id for s in self.spans}))}
+        events = []
+        for span in self.spans:
+            args = {key: getattr(span, key) for key in ('rows_in', 'rows_out', 'bytes_read', 'error') if getattr(span, key) is not None}
+            args.update(span.attrs)
+            args['cpu_ms'] = round(span.cpu_ms, 3)
+            events.append({'name': span.name, 'cat': span.name.split('.', 1)[0], 'ph': 'X',
+                           'ts': round(span.start_ms * 1000, 3), 'dur': round(span.wall_ms * 1000, 3),
+                           'pid': 1, 'tid': threads[span.thread_id], 'args': args})
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump({'traceEvents': events, 'displayTimeUnit': 'ms',
+                       'otherData': {'report_id': self.report_id}}, f, ensure_ascii=False, default=str)
+        return path
+
+
+_current_report: contextvars.ContextVar[Optional[SpanReport]] = contextvars.ContextVar('span_report', default=None)
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+def current_report() -> Optional[SpanReport]:
+    return _current_report.get()
+
+
+@contextmanager
+def span(name: str, **attrs: Any) -> Iterator[Span]:
+    """
+    追踪一个阶段
+
+    参数:
+        name: 阶段名，按"模块.阶段"命名，如 'log.drain'、'data.read_parquet'
+        attrs: 自定义属性，也可以直接传入rows_in/rows_out/bytes_read
+
+    返回:
+        Span: 可在阶段内通过set()补充行数、字节数等信息；没有活动报告时为空span
+    """
+    report = _current_report.get()
+    if report is None or not SPAN_TRACING_ENABLED:
+        yield _NULL_SPAN
+        return
+    record = report._new_span(name, _current_span.get(), {})
+    record.set(**attrs)
+    token = _current_span.set(record)
+    wall_start, cpu_start = time.perf_counter_ns(), time.thread_time_ns()
+    try:
+        yield record
+    except BaseException as e:
+        record.error = type(e).__name__
+        raise
+    finally:
+        record.cpu_ms = (time.thread_time_ns() - cpu_start) / 1e6
+        record.wall_ms = (time.perf_counter_ns() - wall_start) / 1e6
+        _current_span.reset(token)
+        report._finish(record)
+
+
+def _count_rows(value: Any) -> Optional[int]:
+    """
+    DataFrame/Arrow表的行数，其他类型返回None
+    """
+    num_rows = getattr(value, 'num_rows', None)
+    if isinstance(num_rows, int):
+        return num_rows
+    if hasattr(value, 'columns') and hasattr(value, '__len__'):
+        return len(value)
+    return None
+
+
+def _first_rows(args: tuple, kwargs: Dict[str, Any]) -> Optional[int]:
+    for value in list(args) + list(kwargs.values()):
+        rows = _count_rows(value)
+        if rows is not None:
+            return rows
+    return None
+
+
+def traced(name: Optional[str] = None) -> Callable:
+    """
+    把函数（同步或async）作为一个阶段追踪的装饰器：rows_in取第一个DataFrame/Arrow表参数的行数，
+    rows_out取返回值的行数
+
+    参数:
+        name: 阶段名，默认为 模块名.函数名
+    """
+    def decorator(func: Callable) -> Callable:
+        span_name = name or f"{func.__module__.rsplit('.', 1)[-1]}.{func.__name__}"
+
+        if inspect.iscoroutinefunction(func):
+            @functools.wraps(func)
+            async def async_wrapper(*args, **kwargs):
+                if _current_report.get() is None:
+                    return await func(*args, **kwargs)
+                with span(span_name, rows_in=_first_rows(args, kwargs)) as record:
+                    result = await func(*args, **kwargs)
+                    record.set(rows_out=_count_rows(result))
+                    return result
+            return async_wrapper
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            if _current_report.get() is None:
+                return func(*args, **kwargs)
+            with span(span_name, rows_in=_first_rows(args, kwargs)) as record:
+                result = func(*args, **kwargs)
+                record.set(rows_out=_count_rows(result))
+                return result
+        return wrapper
+    return decorator
+
+
+def bind_context(func: Callable) -> Callable:
+    """
+    让提交到线程池的函数在调用方的上下文中执行，线程中的span挂到调用方的span下。
+    每次调用复制一份上下文，同一个包装函数可以被多个线程并发调用
+    """
+    context = contextvars.copy_context()
+
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        return context.copy().run(func, *args, **kwargs)
+    return wrapper
+
+
+@contextmanager
+def span_report(report_id: str, path: Optional[str] = SPAN_REPORT_PATH,
+                chrome_trace: Optional[bool] = None) -> Iterator[SpanReport]:
+    """
+    收集一个故障的全部span，结束时写入JSONL，按配置导出Chrome trace
+
+    参数:
+        report_id: 报告标识，如故障uuid
+        path: JSONL文件路径，None表示不写入
+        chrome_trace: 是否导出Chrome trace，None表示使用EXPORT_CHROME_TRACE
+    """
+    report = SpanReport(report_id)
+    token = _current_report.set(report)
+    try:
+        with span('fault.total', report_id=report_id):
+            yield report
+    finally:
+        _current_report.reset(token)
+        if SPAN_TRACING_ENABLED:
+            if path:
+                report.write_jsonl(path)
+            if EXPORT_CHROME_TRACE if chrome_trace is None else chrome_trace:
+                print(f"Chrome trace已导出至: {report.export_chrome_trace()}")
+
+
+def format_summary(report: SpanReport, top_n: int = 15) -> str:
+    """
+    按墙钟时间降序格式化阶段汇总，便于在控制台查看
+    """
+    lines = [f"{'阶段':<36}{'次数':>6}{'墙钟(ms)':>12}{'CPU(ms)':>12}{'输入行':>10}{'输出行':>10}{'读取MB':>9}"]
+    items = sorted(report.summary().items(), key=lambda item: item[1]['wall_ms'], reverse=True)[:top_n]
+    for name, item in items:
+        lines.append(f"{name:<36}{item['count']:>6}{item['wall_ms']:>12.1f}{item['cpu_ms']:>12.1f}"
+                     f"{item['rows_in']:>10}{item['rows_out']:>10}{item['bytes_read'] / 1024 / 1024:>9.2f}")
+    return '\n'.join(lines)